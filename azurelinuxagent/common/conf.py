@@ -148,7 +148,12 @@ __SWITCH_OPTIONS__ = {
     "Debug.EnableFastTrack": True,
     "Debug.EnableGAVersioning": True,
     "Debug.EnableCgroupV2ResourceLimiting": False,
-    "Debug.EnableExtensionPolicy": False
+    "Debug.EnableExtensionPolicy": False,
+    "Debug.EnableHttpKeepAlive": True,
+    "Debug.EnableExtensionPackageStore": False,
+    "Debug.SkipUnchangedExtensions": False,
+    "Debug.EnableAsyncGoalStateHistory": False,
+    "Debug.EnableEventSpool": False
 }
 
 
@@ -202,7 +207,13 @@ __INTEGER_OPTIONS__ = {
     "Debug.AutoUpdateHotfixFrequency": 14400,
     "Debug.AutoUpdateNormalFrequency": 86400,
     "Debug.FirewallRulesLogPeriod": 86400,
-    "Debug.LogCollectorInitialDelay": 5 * 60
+    "Debug.LogCollectorInitialDelay": 5 * 60,
+    "Debug.ExtensionPackagePrefetchConcurrency": 4,
+    "Debug.ExtensionProcessingConcurrency": 1,
+    "Debug.ArtifactDownloadHedgeDelay": 5,
+    "Debug.StatusUploadHeartbeatPeriod": 60,
+    "Debug.MaxGoalStatePeriod": 30,
+    "Debug.MaxTelemetryQueueMemory": 16 * 1024 ** 2
 }
 
 
@@ -692,3 +703,114 @@ def get_log_collector_initial_delay(conf=__conf__):
     NOTE: This option is experimental and may be removed in later versions of the Agent.
     """
     return conf.get_int("Debug.LogCollectorInitialDelay", 5 * 60)
+
+
+def get_enable_http_keep_alive(conf=__conf__):
+    """
+    If True, HTTP connections to the WireServer, HostGAPlugin, IMDS and other endpoints are kept open and reused across requests.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_switch("Debug.EnableHttpKeepAlive", True)
+
+
+def get_enable_extension_package_store(conf=__conf__):
+    """
+    If True, the files in extension packages are kept in a content-addressed store and hard-linked into the handler directories, so that
+    files shared by several packages (e.g. by 2 versions of an extension) are extracted only once.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_switch("Debug.EnableExtensionPackageStore", False)
+
+
+def get_extension_package_prefetch_concurrency(conf=__conf__):
+    """
+    Maximum number of extension packages downloaded concurrently when a new goal state is received. The packages are downloaded before the
+    extensions are processed; 0 disables the prefetch (each package is then downloaded when its extension is processed).
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.ExtensionPackagePrefetchConcurrency", 4)
+
+
+def get_extension_processing_concurrency(conf=__conf__):
+    """
+    Maximum number of extensions processed concurrently. Only extensions of different handlers within the same dependency level are
+    processed concurrently; 1 processes all the extensions sequentially.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.ExtensionProcessingConcurrency", 1)
+
+
+def get_artifact_download_hedge_delay(conf=__conf__):
+    """
+    Time (in seconds) to wait for the download of a manifest before requesting it also from the next alternate URI (the first response is used);
+    0 disables these hedged requests.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.ArtifactDownloadHedgeDelay", 5)
+
+
+def get_status_upload_heartbeat_period(conf=__conf__):
+    """
+    If the status of the VM has not changed (other than its timestamps) since it was last uploaded, the upload is skipped until this
+    period (in seconds) elapses; 0 uploads the status on every iteration of the main loop.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.StatusUploadHeartbeatPeriod", 60)
+
+
+def get_max_goal_state_period(conf=__conf__):
+    """
+    Upper limit (in seconds) for the period used to check for new goal states when the goal state has been stable for a while. The agent
+    uses the goal state period while the goal state is changing (and for a few minutes afterwards) and then backs off toward this value.
+    A value smaller than the goal state period disables the back off.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.MaxGoalStatePeriod", 30)
+
+
+def get_skip_unchanged_extensions(conf=__conf__):
+    """
+    If True, when a new goal state is received the agent skips the extensions that did not change with respect to the previous goal state
+    (provided they completed successfully); otherwise all the extensions in the goal state are processed again (and enabled again, even if
+    their settings did not change).
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_switch("Debug.SkipUnchangedExtensions", False)
+
+
+def get_enable_async_goal_state_history(conf=__conf__):
+    """
+    If True, the goal state history (the files under the history directory) is saved, purged and archived by a background thread running
+    at low priority, instead of by the thread that processes the goal state.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_switch("Debug.EnableAsyncGoalStateHistory", False)
+
+
+def get_enable_event_spool(conf=__conf__):
+    """
+    If True, the agent saves its telemetry events to an append-only spool (see azurelinuxagent.common.event_spool) instead of creating
+    one file per event in the events directory. The events in the spool are always collected, whether this option is set or not.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_switch("Debug.EnableEventSpool", False)
+
+
+def get_max_telemetry_queue_memory(conf=__conf__):
+    """
+    Approximate memory limit (in bytes) for the events waiting to be sent to the telemetry pipeline. When the limit is reached the oldest
+    events with the lowest priority (log events first, then metrics) are dropped.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.MaxTelemetryQueueMemory", 16 * 1024 ** 2)
@@ -32,6 +32,7 @@ from azurelinuxagent.common.AgentGlobals import AgentGlobals
 from azurelinuxagent.common.exception import EventError, OSUtilError
 from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.datacontract import get_properties, set_properties
+from azurelinuxagent.common.event_spool import get_event_spool
 from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.telemetryevent import TelemetryEventParam, TelemetryEvent, CommonTelemetryEventSchema, \
     GuestAgentGenericLogsSchema, GuestAgentExtensionEventsSchema, GuestAgentPerfCounterEventsSchema
@@ -81,6 +82,7 @@ class WALAEventOperation:
     ConfigurationChange = "ConfigurationChange"
     CustomData = "CustomData"
     DefaultChannelChange = "DefaultChannelChange"
+    DroppedTelemetryEvents = "DroppedTelemetryEvents"
     Deploy = "Deploy"
     Disable = "Disable"
     Downgrade = "Downgrade"
@@ -447,6 +449,13 @@ class EventLogger(object):
             logger.warn("Cannot save event -- Event reporter is not initialized.")
             return
 
+        if conf.get_enable_event_spool():
+            try:
+                get_event_spool().append(data.encode("utf-8"))
+            except (IOError, OSError) as e:
+                raise EventError("Failed to write event to the event spool: {0}".format(ustr(e)))
+            return
+
         try:
             fileutil.mkdir(self.event_dir, mode=0o700)
         except (IOError, OSError) as e:
@@ -0,0 +1,276 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import contextlib
+import fcntl
+import json
+import os
+import re
+import struct
+import threading
+import zlib
+
+from azurelinuxagent.common import conf
+from azurelinuxagent.common import logger
+from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.utils import fileutil
+
+EVENT_SPOOL_DIRECTORY = "event_spool"
+
+MAX_SEGMENT_SIZE = 1024 * 1024  # a new segment is started when the current one reaches this size
+MAX_NUMBER_OF_SEGMENTS = 16  # when there are more segments, the oldest ones are removed (and their events are lost)
+
+_SEGMENT_FILE_REGEX = re.compile(r'^(\d+)\.segment$')
+_CURSOR_FILE_NAME = "cursor.json"
+_LOCK_FILE_NAME = "lock"
+
+# Each record is its length and the CRC32 of its data (as big-endian unsigned ints) followed by the data
+_RECORD_HEADER = struct.Struct(">II")
+
+
+class SpoolPosition(object):
+    """
+    A position in the spool: the sequence number of a segment and an offset within the segment. The generation identifies the read
+    pass that produced the position (see EventSpool.rewind()) and is not part of comparisons.
+    """
+    def __init__(self, segment, offset, generation=0):
+        self.segment = segment
+        self.offset = offset
+        self.generation = generation
+
+    def __eq__(self, other):
+        return self.segment == other.segment and self.offset == other.offset
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __lt__(self, other):
+        return (self.segment, self.offset) < (other.segment, other.offset)
+
+    def __repr__(self):
+        return "{0}:{1}".format(self.segment, self.offset)
+
+
+class SpoolRecord(object):
+    def __init__(self, data, position):
+        self.data = data
+        self.position = position  # the position after the record, i.e. the position to commit once the record has been processed
+
+
+class EventSpool(object):
+    """
+    Append-only spool for telemetry events, shared by all the processes of the agent.
+
+    The events are appended to segment files (<sequence number>.segment) as length-prefixed records with a checksum; when a segment reaches
+    MAX_SEGMENT_SIZE writers continue on a new segment and, if there are more than MAX_NUMBER_OF_SEGMENTS, the oldest are removed. Appending
+    an event does not need to list the directory (except when starting a new segment).
+
+    The reader keeps a cursor (the position of the first event not yet processed) that is saved with commit(); the segments before the
+    cursor are removed. Consecutive calls to read() return consecutive events, but the events read and not committed are read again
+    after a restart or after rewind(). Records that are incomplete or do not match their checksum (e.g. because a writer stopped while
+    appending them) are skipped, along with the rest of their segment.
+
+    Writers and the reader synchronize using a file lock, so the spool can be used by several processes; it is also thread-safe.
+    """
+    def __init__(self, directory):
+        self._directory = directory
+        self._lock = threading.RLock()
+        self._segment = None  # the segment this process is appending to
+        self._read_position = None  # the position after the last record returned by read(); None to start at the cursor
+        self._generation = 0
+
+    @property
+    def generation(self):
+        """
+        The number of times the spool has been rewound; the positions returned by read() carry the generation at the time they were read
+        """
+        with self._lock:
+            return self._generation
+
+    def append(self, data):
+        """
+        Appends the given data (bytes) to the spool. Raises IOError/OSError on errors.
+        """
+        record = _RECORD_HEADER.pack(len(data), zlib.crc32(data) & 0xffffffff) + data
+        with self._locked():
+            # Another process may have started a new segment, or removed the segment this process was appending to (segments are removed
+            # oldest first, so the segment is the newest one as long as it exists and the next one does not). Appending to a segment
+            # that was removed would re-create it behind the cursor and its events would be lost.
+            if self._segment is None or not os.path.exists(self._get_segment_path(self._segment)) or os.path.exists(self._get_segment_path(self._segment + 1)):
+                segments = self._list_segments()
+                self._segment = segments[-1] if len(segments) > 0 else max(1, self._load_cursor().segment)
+            with open(self._get_segment_path(self._segment), "ab") as segment:
+                segment.write(record)
+                size = segment.tell()
+            if size >= MAX_SEGMENT_SIZE:
+                self._start_new_segment()
+
+    def read(self, max_records=None):
+        """
+        Returns a list of SpoolRecords with the events after the last record returned by the previous call (or after the cursor), up to
+        'max_records' records. The data of a record is None when it marks a segment that was skipped because it is corrupt; these records
+        should be committed like any other record.
+        """
+        records = []
+        with self._locked():
+            position = self._read_position if self._read_position is not None else self._load_cursor()
+            segments = [s for s in self._list_segments() if s >= position.segment]
+            for segment in segments:
+                if segment > position.segment:
+                    position = SpoolPosition(segment, 0)
+                with open(self._get_segment_path(segment), "rb") as segment_file:
+                    segment_file.seek(position.offset)
+                    while max_records is None or len(records) < max_records:
+                        header = segment_file.read(_RECORD_HEADER.size)
+                        if len(header) == 0:
+                            break
+                        data = None
+                        if len(header) == _RECORD_HEADER.size:
+                            length, checksum = _RECORD_HEADER.unpack(header)
+                            if length <= MAX_SEGMENT_SIZE:
+                                data = segment_file.read(length)
+                                if len(data) != length or zlib.crc32(data) & 0xffffffff != checksum:
+                                    data = None
+                        if data is None:
+                            logger.warn("Found an invalid record in the event spool (segment {0}, offset {1}); skipping the rest of the segment", segment, position.offset)
+                            if segment == segments[-1]:
+                                self._start_new_segment()
+                            position = SpoolPosition(segment + 1, 0, self._generation)
+                            records.append(SpoolRecord(None, position))
+                            break
+                        position = SpoolPosition(segment, segment_file.tell(), self._generation)
+                        records.append(SpoolRecord(data, position))
+                if max_records is not None and len(records) >= max_records:
+                    break
+            if len(records) > 0:
+                self._read_position = records[-1].position
+        return records
+
+    def tell(self):
+        """
+        Returns the position where the next call to read() starts
+        """
+        with self._locked():
+            if self._read_position is not None:
+                return self._read_position
+            cursor = self._load_cursor()
+            return SpoolPosition(cursor.segment, cursor.offset, self._generation)
+
+    def seek(self, position):
+        """
+        Makes the next call to read() start at the given position (returned by tell() or read()), so that the records after it are read
+        again; e.g. when the records read could not be processed yet. If the spool was rewound after the position was read, the spool is
+        rewound again instead (the records read since the previous rewind may be after the position).
+        """
+        with self._lock:
+            if position.generation == self._generation:
+                self._read_position = position
+            else:
+                self.rewind()
+
+    def rewind(self):
+        """
+        Makes the next call to read() start at the cursor, so that the events that were read but not committed are read again. Positions
+        returned by previous calls to read() can no longer be committed.
+        """
+        with self._lock:
+            self._read_position = None
+            self._generation += 1
+
+    def commit(self, position):
+        """
+        Saves the given position as the read cursor (flushing it to disk) and removes the segments before it. Returns False, without
+        saving the position, if the spool was rewound after the position was read.
+        """
+        with self._locked():
+            if position.generation != self._generation:
+                return False
+            cursor_file = self._get_path(_CURSOR_FILE_NAME)
+            with open(cursor_file + ".tmp", "w") as cursor:
+                cursor.write(json.dumps({"segment": position.segment, "offset": position.offset}))
+                cursor.flush()
+                os.fsync(cursor.fileno())
+            os.rename(cursor_file + ".tmp", cursor_file)
+            for segment in self._list_segments():
+                if segment >= position.segment:
+                    break
+                os.remove(self._get_segment_path(segment))
+        return True
+
+    def _start_new_segment(self):
+        segments = self._list_segments()
+        self._segment = (segments[-1] if len(segments) > 0 else 0) + 1
+        fileutil.write_file(self._get_segment_path(self._segment), "")
+        segments.append(self._segment)
+        if len(segments) > MAX_NUMBER_OF_SEGMENTS:
+            logger.periodic_warn(logger.EVERY_HOUR, "[PERIODIC] The event spool {0} is full; removing the oldest events", self._directory)
+            for segment in segments[0:len(segments) - MAX_NUMBER_OF_SEGMENTS]:
+                os.remove(self._get_segment_path(segment))
+
+    def _load_cursor(self):
+        cursor_file = self._get_path(_CURSOR_FILE_NAME)
+        if os.path.exists(cursor_file):
+            try:
+                cursor = json.loads(fileutil.read_file(cursor_file))
+                return SpoolPosition(int(cursor["segment"]), int(cursor["offset"]))
+            except Exception as e:
+                logger.warn("Invalid cursor in the event spool {0}; starting at the oldest event: {1}", self._directory, ustr(e))
+        return SpoolPosition(0, 0)
+
+    def _list_segments(self):
+        segments = []
+        for item in os.listdir(self._directory):
+            match = _SEGMENT_FILE_REGEX.match(item)
+            if match is not None:
+                segments.append(int(match.group(1)))
+        segments.sort()
+        return segments
+
+    def _get_segment_path(self, segment):
+        return self._get_path("{0:010d}.segment".format(segment))
+
+    def _get_path(self, name):
+        return os.path.join(self._directory, name)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            if not os.path.isdir(self._directory):
+                fileutil.mkdir(self._directory, mode=0o700)
+            with open(self._get_path(_LOCK_FILE_NAME), "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+_spools = {}
+_spools_lock = threading.Lock()
+
+
+def get_event_spool():
+    """
+    Returns the process-wide EventSpool (under the agent's lib directory)
+    """
+    directory = os.path.join(conf.get_lib_dir(), EVENT_SPOOL_DIRECTORY)
+    with _spools_lock:
+        spool = _spools.get(directory)
+        if spool is None:
+            spool = _spools[directory] = EventSpool(directory)
+        return spool
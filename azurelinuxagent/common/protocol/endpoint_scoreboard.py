@@ -0,0 +1,88 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+import random
+import threading
+import time
+
+from azurelinuxagent.common.future import urlparse
+
+# Weight of the most recent sample in the moving average of the latency of an endpoint
+_LATENCY_SMOOTHING_FACTOR = 0.3
+# A failure is accounted in the latency of the endpoint as a request that took this long
+_FAILURE_PENALTY_IN_SECONDS = 60.0
+# URIs that failed are not tried again for this period (unless all the alternatives are also failing)
+NEGATIVE_CACHE_PERIOD_IN_SECONDS = 5 * 60
+
+
+class EndpointScoreboard(object):
+    """
+    Keeps track of the latency and failures of the endpoints (hosts) used to download artifacts (manifests and packages) in order to rank the
+    alternate URIs for an artifact, trying the fastest mirrors first.
+
+    The latency of each endpoint is an exponential moving average of its requests; failures count as very slow requests. Additionally, URIs
+    that failed are kept in a negative cache and are skipped for NEGATIVE_CACHE_PERIOD_IN_SECONDS. The scoreboard is thread-safe.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}  # host -> average latency in seconds
+        self._failed_uris = {}  # uri -> time when the URI can be used again
+
+    def rank(self, uris):
+        """
+        Returns a copy of the given list of URIs in the order they should be tried: first the URIs that are not in the negative cache,
+        fastest endpoint first, then the URIs in the negative cache (which are included only if all the URIs are in the cache).
+        Endpoints with no data are tried before the endpoints with data, in random order, so that the load is spread across them.
+        """
+        now = time.time()
+        shuffled = list(uris)
+        random.shuffle(shuffled)
+        with self._lock:
+            for uri in [u for u, expiration in self._failed_uris.items() if expiration <= now]:
+                del self._failed_uris[uri]
+            ranked = sorted(shuffled, key=lambda u: self._latencies.get(EndpointScoreboard._get_host(u), 0.0))
+            available = [u for u in ranked if u not in self._failed_uris]
+        return available if len(available) > 0 else ranked
+
+    def record_success(self, uri, elapsed_seconds):
+        with self._lock:
+            self._failed_uris.pop(uri, None)
+            self._add_sample(uri, elapsed_seconds)
+
+    def record_failure(self, uri):
+        with self._lock:
+            self._failed_uris[uri] = time.time() + NEGATIVE_CACHE_PERIOD_IN_SECONDS
+            self._add_sample(uri, _FAILURE_PENALTY_IN_SECONDS)
+
+    def get_latency(self, uri):
+        """
+        Returns the average latency (in seconds) of the endpoint for the given URI, or None if there is no data for the endpoint.
+        """
+        with self._lock:
+            return self._latencies.get(EndpointScoreboard._get_host(uri))
+
+    def _add_sample(self, uri, seconds):
+        host = EndpointScoreboard._get_host(uri)
+        average = self._latencies.get(host)
+        self._latencies[host] = seconds if average is None else (_LATENCY_SMOOTHING_FACTOR * seconds + (1 - _LATENCY_SMOOTHING_FACTOR) * average)
+
+    @staticmethod
+    def _get_host(uri):
+        try:
+            return urlparse(uri).netloc
+        except Exception:
+            return uri
@@ -0,0 +1,111 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+
+
+class ExtensionChange(object):
+    """
+    Classification of a handler (or one of its extensions) when comparing two consecutive extensions goal states
+    """
+    Unchanged = "Unchanged"
+    Added = "Added"
+    Removed = "Removed"
+    VersionChanged = "VersionChanged"
+    StateChanged = "StateChanged"
+    SettingsChanged = "SettingsChanged"
+
+
+# Properties of the handler (restapi.Extension) and its extensions (restapi.ExtensionSettings) that are compared to
+# detect changes in the settings; the version and state are compared separately
+_HANDLER_PROPERTIES = ["manifest_uris", "supports_multi_config", "encoded_signature", "invalid_setting_reason"]
+_EXTENSION_PROPERTIES = ["sequenceNumber", "publicSettings", "protectedSettings", "certificateThumbprint", "dependencyLevel"]
+
+
+class ExtensionsGoalStateDiff(object):
+    """
+    Structural diff between the extensions of two consecutive extensions goal states (lists of restapi.Extension, as
+    returned by ExtensionsGoalState.extensions). 'previous' can be None, in which case all the handlers are classified
+    as Added.
+
+    Each handler is classified as Added, Removed, VersionChanged, StateChanged, SettingsChanged (which includes changes
+    in any of its extensions) or Unchanged; each extension is classified as Added, Removed, StateChanged,
+    SettingsChanged or Unchanged.
+    """
+    def __init__(self, previous, current):
+        self._handlers = {}    # handler name -> ExtensionChange
+        self._extensions = {}  # (handler name, extension name) -> ExtensionChange
+
+        previous_handlers = dict((h.name, h) for h in previous) if previous is not None else {}
+        current_handlers = dict((h.name, h) for h in current)
+
+        for name, handler in current_handlers.items():
+            self._handlers[name] = self._compare_handlers(previous_handlers.get(name), handler)
+        for name, handler in previous_handlers.items():
+            if name not in current_handlers:
+                self._handlers[name] = ExtensionChange.Removed
+                for extension in handler.settings:
+                    self._extensions[(name, extension.name)] = ExtensionChange.Removed
+
+    def get_handler_change(self, handler_name):
+        return self._handlers.get(handler_name, ExtensionChange.Added)
+
+    def get_extension_change(self, handler_name, extension_name):
+        return self._extensions.get((handler_name, extension_name), ExtensionChange.Added)
+
+    def is_unchanged(self, handler_name):
+        return self.get_handler_change(handler_name) == ExtensionChange.Unchanged
+
+    @property
+    def has_changes(self):
+        return any(change != ExtensionChange.Unchanged for change in self._handlers.values())
+
+    def _compare_handlers(self, previous, current):
+        previous_extensions = dict((e.name, e) for e in previous.settings) if previous is not None else {}
+        current_extensions = dict((e.name, e) for e in current.settings)
+
+        extensions_changed = False
+        for name, extension in current_extensions.items():
+            change = ExtensionsGoalStateDiff._compare_extensions(previous_extensions.get(name), extension)
+            self._extensions[(current.name, name)] = change
+            extensions_changed = extensions_changed or change != ExtensionChange.Unchanged
+        for name in previous_extensions:
+            if name not in current_extensions:
+                self._extensions[(current.name, name)] = ExtensionChange.Removed
+                extensions_changed = True
+
+        if previous is None:
+            return ExtensionChange.Added
+        if previous.version != current.version:
+            return ExtensionChange.VersionChanged
+        if previous.state != current.state:
+            return ExtensionChange.StateChanged
+        if extensions_changed or any(getattr(previous, p) != getattr(current, p) for p in _HANDLER_PROPERTIES):
+            return ExtensionChange.SettingsChanged
+        return ExtensionChange.Unchanged
+
+    @staticmethod
+    def _compare_extensions(previous, current):
+        if previous is None:
+            return ExtensionChange.Added
+        if previous.state != current.state:
+            return ExtensionChange.StateChanged
+        if any(getattr(previous, p) != getattr(current, p) for p in _EXTENSION_PROPERTIES):
+            return ExtensionChange.SettingsChanged
+        return ExtensionChange.Unchanged
+
+    def __str__(self):
+        return ", ".join("{0}: {1}".format(name, self._handlers[name]) for name in sorted(self._handlers))
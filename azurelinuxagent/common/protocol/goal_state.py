@@ -16,8 +16,8 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 import datetime
+import hashlib
 import os
-import re
 import time
 import json
 
@@ -34,7 +34,8 @@ from azurelinuxagent.common.protocol.hostplugin import VmSettingsNotSupported, V
 from azurelinuxagent.common.protocol.restapi import Cert, CertList, RemoteAccessUser, RemoteAccessUsersList, ExtHandlerPackage, ExtHandlerPackageList
 from azurelinuxagent.common.utils import fileutil
 from azurelinuxagent.common.utils.archive import GoalStateHistory, SHARED_CONF_FILE_NAME
-from azurelinuxagent.common.utils.cryptutil import CryptUtil
+from azurelinuxagent.common.utils.cryptutil import CryptUtil, split_pem
+from azurelinuxagent.common.utils.threadutil import run_concurrently
 from azurelinuxagent.common.utils.textutil import parse_doc, findall, find, findtext, getattrib, gettext
 
 
@@ -42,11 +43,15 @@ GOAL_STATE_URI = "http://{0}/machine/?comp=goalstate"
 CERTS_FILE_NAME = "Certificates.xml"
 P7M_FILE_NAME = "Certificates.p7m"
 PEM_FILE_NAME = "Certificates.pem"
+CERTS_SUMMARY_FILE_NAME = "Certificates.summary.json"
 TRANSPORT_CERT_FILE_NAME = "TransportCert.pem"
 TRANSPORT_PRV_FILE_NAME = "TransportPrivate.pem"
 
 _GET_GOAL_STATE_MAX_ATTEMPTS = 6
 
+# Maximum number of concurrent requests used to fetch the documents referenced by the WireServer goal state
+_MAX_CONCURRENT_GOAL_STATE_REQUESTS = 5
+
 
 class GoalStateProperties(object):
     """
@@ -181,7 +186,8 @@ class GoalState(object):
             xml_text = self._wire_client.fetch_manifest(manifest_type, uris, use_verify_header=is_fast_track)
             if self._save_to_history:
                 self._history.save_manifest(name, xml_text)
-            return ExtensionManifest(xml_text)
+            # manifests are frequently byte-identical to the ones fetched for previous goal states; use the response cache to avoid parsing them again
+            return self._wire_client.response_cache.parse(xml_text, ExtensionManifest)
         except Exception as e:
             raise ProtocolError("Failed to retrieve {0} manifest. Error: {1}".format(manifest_type, ustr(e)))
 
@@ -353,7 +359,7 @@ class GoalState(object):
         incarnation = "unknown"
         for _ in range(0, _GET_GOAL_STATE_MAX_ATTEMPTS):
             xml_text = wire_client.fetch_config(uri, wire_client.get_header())
-            xml_doc = parse_doc(xml_text)
+            xml_doc = wire_client.response_cache.parse(xml_text, parse_doc)
             incarnation = findtext(xml_doc, "Incarnation")
 
             role_instance = find(xml_doc, "RoleInstance")
@@ -428,51 +434,83 @@ class GoalState(object):
                 container = find(xml_doc, "Container")
                 container_id = findtext(container, "ContainerId")
 
-            extensions_config_uri = findtext(xml_doc, "ExtensionsConfig")
-            if not (GoalStateProperties.ExtensionsGoalState & self._goal_state_properties) or extensions_config_uri is None:
-                extensions_config = ExtensionsGoalStateFactory.create_empty(incarnation)
-            else:
+            #
+            # The documents referenced by the goal state are independent of each other, so they are fetched concurrently. Each operation returns a tuple
+            # with the parsed document and its text; the text is saved to the history (in the same order the documents were fetched before) once
+            # all the operations complete.
+            #
+            def fetch_extensions_config():
+                extensions_config_uri = findtext(xml_doc, "ExtensionsConfig")
+                if not (GoalStateProperties.ExtensionsGoalState & self._goal_state_properties) or extensions_config_uri is None:
+                    return ExtensionsGoalStateFactory.create_empty(incarnation), None
                 xml_text = self._wire_client.fetch_config(extensions_config_uri, self._wire_client.get_header())
-                extensions_config = ExtensionsGoalStateFactory.create_from_extensions_config(incarnation, xml_text, self._wire_client)
-                if self._save_to_history:
-                    self._history.save_extensions_config(extensions_config.get_redacted_text())
+                return ExtensionsGoalStateFactory.create_from_extensions_config(incarnation, xml_text, self._wire_client), xml_text
 
-            hosting_env = None
-            if GoalStateProperties.HostingEnv & self._goal_state_properties:
+            def fetch_hosting_env():
+                if not GoalStateProperties.HostingEnv & self._goal_state_properties:
+                    return None, None
                 hosting_env_uri = findtext(xml_doc, "HostingEnvironmentConfig")
                 xml_text = self._wire_client.fetch_config(hosting_env_uri, self._wire_client.get_header())
-                hosting_env = HostingEnv(xml_text)
-                if self._save_to_history:
-                    self._history.save_hosting_env(xml_text)
+                return HostingEnv(xml_text), xml_text
 
-            shared_config = None
-            if GoalStateProperties.SharedConfig & self._goal_state_properties:
+            def fetch_shared_config():
+                if not GoalStateProperties.SharedConfig & self._goal_state_properties:
+                    return None, None
                 shared_conf_uri = findtext(xml_doc, "SharedConfig")
                 xml_text = self._wire_client.fetch_config(shared_conf_uri, self._wire_client.get_header())
-                shared_config = SharedConfig(xml_text)
-                if self._save_to_history:
-                    self._history.save_shared_conf(xml_text)
+                return SharedConfig(xml_text), xml_text
+
+            certs_uri = findtext(xml_doc, "Certificates")
+
+            def fetch_certificates():
+                if (GoalStateProperties.Certificates & self._goal_state_properties) and certs_uri is not None:
+                    return self._download_certificates(certs_uri), None
+                return EmptyCertificates(), None
+
+            def fetch_remote_access():
+                if not GoalStateProperties.RemoteAccessInfo & self._goal_state_properties:
+                    return None, None
+                remote_access_uri = findtext(container, "RemoteAccessInfo")
+                if remote_access_uri is None:
+                    return None, None
+                xml_text = self._wire_client.fetch_config(remote_access_uri, self._wire_client.get_header_for_remote_access())
+                return RemoteAccess(xml_text), xml_text
+
+            # once a request fails the goal state cannot be used, so the requests that have not started are not issued
+            results = run_concurrently(
+                [fetch_extensions_config, fetch_hosting_env, fetch_shared_config, fetch_certificates, fetch_remote_access],
+                _MAX_CONCURRENT_GOAL_STATE_REQUESTS,
+                thread_name="GoalStateFetch",
+                stop_on_error=True)
+
+            for result in results:
+                if result is not None and result.exception is not None:
+                    raise result.exception
+
+            extensions_config, extensions_config_text = results[0].result
+            hosting_env, hosting_env_text = results[1].result
+            shared_config, shared_config_text = results[2].result
+            certs = results[3].result[0]
+            remote_access, remote_access_text = results[4].result
+
+            if self._save_to_history:
+                if extensions_config_text is not None:
+                    self._history.save_extensions_config(extensions_config.get_redacted_text())
+                if hosting_env_text is not None:
+                    self._history.save_hosting_env(hosting_env_text)
+                if shared_config_text is not None:
+                    self._history.save_shared_conf(shared_config_text)
+                if remote_access_text is not None:
+                    self._history.save_remote_access(remote_access_text)
+
+            if shared_config_text is not None:
                 # SharedConfig.xml is used by other components (Azsec and Singularity/HPC Infiniband), so save it to the agent's root directory as well
                 shared_config_file = os.path.join(conf.get_lib_dir(), SHARED_CONF_FILE_NAME)
                 try:
-                    fileutil.write_file(shared_config_file, xml_text)
+                    fileutil.write_file(shared_config_file, shared_config_text)
                 except Exception as e:
                     logger.warn("Failed to save {0}: {1}".format(shared_config, e))
 
-            certs = EmptyCertificates()
-            certs_uri = findtext(xml_doc, "Certificates")
-            if (GoalStateProperties.Certificates & self._goal_state_properties) and certs_uri is not None:
-                certs = self._download_certificates(certs_uri)
-
-            remote_access = None
-            if GoalStateProperties.RemoteAccessInfo & self._goal_state_properties:
-                remote_access_uri = findtext(container, "RemoteAccessInfo")
-                if remote_access_uri is not None:
-                    xml_text = self._wire_client.fetch_config(remote_access_uri, self._wire_client.get_header_for_remote_access())
-                    remote_access = RemoteAccess(xml_text)
-                    if self._save_to_history:
-                        self._history.save_remote_access(xml_text)
-
             self._incarnation = incarnation
             self._role_instance_id = role_instance_id
             self._role_config_name = role_config_name
@@ -535,6 +573,12 @@ class Certificates(object):
             add_event(op=WALAEventOperation.GoalState, message=message)
             return
 
+        # If the certificates did not change since the last time they were processed there is no need to decrypt them again
+        data_hash = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        if self._load_summary(data_hash):
+            my_logger.info("The certificates did not change; using the certificates already on disk")
+            return
+
         cryptutil = CryptUtil(conf.get_openssl_cmd())
         p7m_file = os.path.join(conf.get_lib_dir(), P7M_FILE_NAME)
         p7m = ("MIME-Version:1.0\n"  # pylint: disable=W1308
@@ -552,46 +596,35 @@ class Certificates(object):
         # decrypt certificates
         cryptutil.decrypt_p7m(p7m_file, trans_prv_file, trans_cert_file, pem_file)
 
-        # The parsing process use public key to match prv and crt.
-        buf = []
+        # Ensure pem_file exists before read the certs data since decrypt_p7m may clear the pem_file wen decryption fails
+        if not os.path.exists(pem_file):
+            return
+
+        # The parsing process use public key to match prv and crt. The certificates and keys are parsed in-process (see CryptUtil) and
+        # only the files that changed are written.
         prvs = {}
         thumbprints = {}
-        index = 0
         v1_cert_list = []
 
-        # Ensure pem_file exists before read the certs data since decrypt_p7m may clear the pem_file wen decryption fails
-        if os.path.exists(pem_file):
-            with open(pem_file) as pem:
-                for line in pem.readlines():
-                    buf.append(line)
-                    if re.match(r'[-]+END.*KEY[-]+', line):
-                        tmp_file = Certificates._write_to_tmp_file(index, 'prv', buf)
-                        pub = cryptutil.get_pubkey_from_prv(tmp_file)
-                        prvs[pub] = tmp_file
-                        buf = []
-                        index += 1
-                    elif re.match(r'[-]+END.*CERTIFICATE[-]+', line):
-                        tmp_file = Certificates._write_to_tmp_file(index, 'crt', buf)
-                        pub = cryptutil.get_pubkey_from_crt(tmp_file)
-                        thumbprint = cryptutil.get_thumbprint_from_crt(tmp_file)
-                        thumbprints[pub] = thumbprint
-                        # Rename crt with thumbprint as the file name
-                        crt = "{0}.crt".format(thumbprint)
-                        v1_cert_list.append({
-                            "name": None,
-                            "thumbprint": thumbprint
-                        })
-                        os.rename(tmp_file, os.path.join(conf.get_lib_dir(), crt))
-                        buf = []
-                        index += 1
-
-        # Rename prv key with thumbprint as the file name
-        for pubkey in prvs:
-            thumbprint = thumbprints[pubkey]
+        for item_type, text in split_pem(fileutil.read_file(pem_file)):
+            if item_type == 'prv':
+                prvs[cryptutil.get_pubkey_from_prv_pem(text)] = text
+            else:
+                pub = cryptutil.get_pubkey_from_crt_pem(text)
+                thumbprint = cryptutil.get_thumbprint_from_crt_pem(text)
+                thumbprints[pub] = thumbprint
+                v1_cert_list.append({
+                    "name": None,
+                    "thumbprint": thumbprint
+                })
+                # Save crt with thumbprint as the file name
+                Certificates._write_if_changed("{0}.crt".format(thumbprint), text)
+
+        # Save prv key with thumbprint as the file name
+        for pubkey, text in prvs.items():
+            thumbprint = thumbprints.get(pubkey)
             if thumbprint:
-                tmp_file = prvs[pubkey]
-                prv = "{0}.prv".format(thumbprint)
-                os.rename(tmp_file, os.path.join(conf.get_lib_dir(), prv))
+                Certificates._write_if_changed("{0}.prv".format(thumbprint), text)
             else:
                 # Since private key has *no* matching certificate,
                 # it will not be named correctly
@@ -606,11 +639,55 @@ class Certificates(object):
             set_properties("certs", cert, v1_cert)
             self.cert_list.certificates.append(cert)
 
+        self._save_summary(data_hash, [c["thumbprint"] for c in v1_cert_list])
+
     @staticmethod
-    def _write_to_tmp_file(index, suffix, buf):
-        file_name = os.path.join(conf.get_lib_dir(), "{0}.{1}".format(index, suffix))
-        fileutil.write_file(file_name, "".join(buf))
-        return file_name
+    def _write_if_changed(file_name, text):
+        path = os.path.join(conf.get_lib_dir(), file_name)
+        if os.path.isfile(path) and fileutil.read_file(path) == text:
+            return
+        tmp_file = path + ".tmp"
+        fileutil.write_file(tmp_file, text)
+        os.rename(tmp_file, path)
+
+    def _save_summary(self, data_hash, thumbprints):
+        """
+        Saves the result of processing the certificates, so that it can be reused if the same certificates are received again
+        """
+        summary = {"dataHash": data_hash, "thumbprints": thumbprints, "summary": self.summary, "warnings": self.warnings}
+        try:
+            fileutil.write_file(os.path.join(conf.get_lib_dir(), CERTS_SUMMARY_FILE_NAME), json.dumps(summary))
+        except Exception as e:
+            logger.warn("Failed to save the summary of the certificates: {0}", ustr(e))
+
+    def _load_summary(self, data_hash):
+        """
+        Loads the result of processing the certificates with the given hash; returns False if those were not the certificates most recently
+        processed, or if any of their files is no longer on disk.
+        """
+        summary_file = os.path.join(conf.get_lib_dir(), CERTS_SUMMARY_FILE_NAME)
+        try:
+            if not os.path.isfile(summary_file):
+                return False
+            summary = json.loads(fileutil.read_file(summary_file))
+            if summary.get("dataHash") != data_hash:
+                return False
+            for c in summary["summary"]:
+                required = ["{0}.crt".format(c["thumbprint"])] + (["{0}.prv".format(c["thumbprint"])] if c["hasPrivateKey"] else [])
+                if any(not os.path.isfile(os.path.join(conf.get_lib_dir(), f)) for f in required):
+                    return False
+        except Exception as e:
+            logger.warn("Failed to load the summary of the certificates: {0}", ustr(e))
+            return False
+
+        self.summary = summary["summary"]
+        self.warnings = summary["warnings"]
+        for thumbprint in summary["thumbprints"]:
+            cert = Cert()
+            set_properties("certs", cert, {"name": None, "thumbprint": thumbprint})
+            self.cert_list.certificates.append(cert)
+        return True
+
 
 class EmptyCertificates:
     def __init__(self):
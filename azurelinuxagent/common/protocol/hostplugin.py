@@ -319,6 +319,7 @@ class HostPluginProtocol(object):
         else:
             self.report_status_health(is_healthy=True)
             logger.verbose("HostGAPlugin: Put BlockBlob status succeeded")
+            status_blob.on_upload_completed(sas_url)
 
     def _put_page_blob_status(self, sas_url, status_blob):
         url = URI_FORMAT_PUT_VM_STATUS.format(self.endpoint, HOST_PLUGIN_PORT)
@@ -328,6 +329,14 @@ class HostPluginProtocol(object):
         status_size = int((len(status) + 511) / 512) * 512
         status = bytearray(status_blob.data.ljust(status_size), encoding='utf-8')
 
+        # If the blob already exists with the same size, update only the pages that changed since the last upload
+        page_ranges = status_blob.get_page_ranges_to_upload(sas_url, status)
+        status_blob.on_upload_started()
+        if page_ranges is not None:
+            self._put_page_ranges(url, sas_url, status_blob, status, page_ranges)
+            status_blob.on_upload_completed(sas_url, status)
+            return
+
         # First, initialize an empty blob
         response = restutil.http_put(url,
                                      data=self._build_status_data(
@@ -346,6 +355,7 @@ class HostPluginProtocol(object):
             logger.verbose("HostGAPlugin: PageBlob clean-up succeeded")
         
         # Then, upload the blob in pages
+        blob_url = sas_url
         if sas_url.count("?") <= 0:
             sas_url = "{0}?comp=page".format(sas_url)
         else:
@@ -378,6 +388,28 @@ class HostPluginProtocol(object):
 
             # Advance to the next page (if any)
             start = end
+
+        status_blob.on_upload_completed(blob_url, status)
+
+    def _put_page_ranges(self, url, sas_url, status_blob, status, page_ranges):
+        logger.verbose("HostGAPlugin: Updating {0} page range(s) of the PageBlob status", len(page_ranges))
+        sas_url = "{0}?comp=page".format(sas_url) if sas_url.count("?") <= 0 else "{0}&comp=page".format(sas_url)
+        for start, end in page_ranges:
+            response = restutil.http_put(url,
+                                         data=self._build_status_data(
+                                             sas_url,
+                                             status_blob.get_page_blob_page_headers(start, end),
+                                             status[start:end]),
+                                         headers=self._build_status_headers())
+
+            if restutil.request_failed(response):
+                error_response = restutil.read_response_error(response)
+                is_healthy = not restutil.request_failed_at_hostplugin(response)
+                self.report_status_health(is_healthy=is_healthy, response=error_response)
+                raise HttpError(
+                    "HostGAPlugin Error: Put PageBlob bytes "
+                    "[{0},{1}]: {2}".format(start, end, error_response))
+        self.report_status_health(is_healthy=True)
         
     def _build_status_data(self, sas_url, blob_headers, content=None):
         headers = []
@@ -2,6 +2,8 @@
 # Licensed under the Apache License, Version 2.0 (the "License");
 import json
 import re
+import threading
+import time
 from collections import namedtuple
 
 import azurelinuxagent.common.utils.restutil as restutil
@@ -26,11 +28,87 @@ IMDS_RESPONSE_ERROR = 1
 IMDS_CONNECTION_ERROR = 2
 IMDS_INTERNAL_SERVER_ERROR = 3
 
+# The compute metadata is cached for this period; the cache is shared by all the instances of ImdsClient
+IMDS_COMPUTE_METADATA_TTL_IN_SECONDS = 10 * 60
+# If IMDS cannot be reached, cached compute metadata up to this old is returned instead of the error
+IMDS_COMPUTE_METADATA_MAX_STALENESS_IN_SECONDS = 6 * 60 * 60
+
 
 def get_imds_client():
     return ImdsClient()
 
 
+class _MetadataCache(object):
+    """
+    Thread-safe cache of IMDS metadata, with a TTL.
+
+    Concurrent requests for the same entry are coalesced: only one of them (the "leader") calls IMDS, and the rest wait for
+    its result. If the request fails and there is an entry in the cache that is not older than the given maximum staleness,
+    the cached entry is returned instead of the error.
+    """
+    class _Request(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.value = None
+            self.exception = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (timestamp, value)
+        self._requests = {}  # key -> _Request in progress
+
+    def get(self, key, fetch, ttl, max_staleness):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] < ttl:
+                return entry[1]
+            request = self._requests.get(key)
+            is_leader = request is None
+            if is_leader:
+                request = self._requests[key] = _MetadataCache._Request()
+
+        if not is_leader:
+            request.done.wait()
+            if request.exception is not None:
+                raise request.exception
+            return request.value
+
+        try:
+            try:
+                request.value = fetch()
+                self.set(key, request.value)
+            except Exception as exception:
+                age = None if entry is None else time.time() - entry[0]
+                if age is None or age >= max_staleness:
+                    request.exception = exception
+                    raise
+                logger.periodic_warn(logger.EVERY_FIFTEEN_MINUTES,
+                                     "[PERIODIC] Failed to refresh {0} from IMDS; using cached data ({1} seconds old). Error: {2}",
+                                     key, int(age), ustr(exception))
+                request.value = entry[1]
+        finally:
+            with self._lock:
+                del self._requests[key]
+            request.done.set()
+
+        return request.value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_metadata_cache = _MetadataCache()
+
+
+def clear_metadata_cache():
+    _metadata_cache.clear()
+
+
 # A *slightly* future proof list of endorsed distros.
 #  -> e.g. I have predicted the future and said that 20.04-LTS will exist
 #     and is endored.
@@ -333,20 +411,26 @@ class ImdsClient(object):
         # else it's a client-side error, e.g. IMDS_CONNECTION_ERROR
         return MetadataResult(False, False, resp)
 
-    def get_compute(self):
-        """
-        Fetch compute information.
-
-        :return: instance of a ComputeInfo
-        :rtype: ComputeInfo
-        """
+    def _get_compute_cache_key(self):
+        return "instance/compute?api-version={0}".format(self._api_version)
 
+    def _fetch_compute(self):
         # ensure we get a 200
         result = self.get_metadata('instance/compute', is_health=False)
         if not result.success:
             raise HttpError(result.response)
 
-        data = json.loads(ustr(result.response, encoding="utf-8"))
+        return json.loads(ustr(result.response, encoding="utf-8"))
+
+    def get_compute(self):
+        """
+        Fetch compute information. The information is cached for IMDS_COMPUTE_METADATA_TTL_IN_SECONDS (and also refreshed
+        by validate()).
+
+        :return: instance of a ComputeInfo
+        :rtype: ComputeInfo
+        """
+        data = _metadata_cache.get(self._get_compute_cache_key(), self._fetch_compute, IMDS_COMPUTE_METADATA_TTL_IN_SECONDS, IMDS_COMPUTE_METADATA_MAX_STALENESS_IN_SECONDS)
 
         compute_info = ComputeInfo()
         set_properties('compute', compute_info, data)
@@ -389,6 +473,10 @@ class ImdsClient(object):
         except ValueError as v:
             return False, ustr(v)
 
+        # the response includes the compute metadata; use it to refresh the cache for get_compute()
+        if isinstance(json_data.get('compute'), dict):
+            _metadata_cache.set(self._get_compute_cache_key(), json_data['compute'])
+
         return True, ''
 
     @staticmethod
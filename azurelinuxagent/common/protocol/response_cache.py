@@ -0,0 +1,133 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+import hashlib
+import threading
+
+from azurelinuxagent.common.future import OrderedDict, ustr
+
+
+class _CacheEntry(object):
+    def __init__(self, content, etag, last_modified):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ResponseCache(object):
+    """
+    Cache for the responses to the HTTP requests for the goal state, its documents (ExtensionsConfig, etc) and the manifests.
+
+    The cache keeps two kinds of items:
+
+        * The content of the most recent response for each URI, along with its ETag and Last-Modified validators. These are used
+          to issue conditional requests (If-None-Match/If-Modified-Since); when the server responds with NOT_MODIFIED (304) the
+          cached content is used instead.
+        * The objects parsed from a given content (e.g. an ExtensionManifest), indexed by the hash of the content. This avoids
+          parsing again documents that are byte-identical to a previous download, even if they were fetched from a different URI
+          or if the server does not support conditional requests.
+
+    Both collections are bounded; the least recently used items are evicted first. The cache is thread-safe.
+
+    NOTE: Parsed objects are shared by all the callers that request them, so they must not be modified.
+    """
+    def __init__(self, max_responses=64, max_parsed_objects=64):
+        self._lock = threading.RLock()
+        self._max_responses = max_responses
+        self._max_parsed_objects = max_parsed_objects
+        self._responses = OrderedDict()
+        self._parsed_objects = OrderedDict()
+
+    def get_conditional_headers(self, uri):
+        """
+        Returns a dictionary with the headers needed to issue a conditional request for the given URI (the dictionary is empty if there
+        is no cached response for the URI).
+        """
+        headers = {}
+        with self._lock:
+            entry = self._responses.get(uri)
+            if entry is not None:
+                if entry.etag is not None:
+                    headers['If-None-Match'] = entry.etag
+                if entry.last_modified is not None:
+                    headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def get_content(self, uri):
+        """
+        Returns the cached content for the given URI, or None if there is none.
+        """
+        with self._lock:
+            entry = self._responses.pop(uri, None)
+            if entry is None:
+                return None
+            self._responses[uri] = entry  # move to the end of the LRU order
+            return entry.content
+
+    def set_content(self, uri, content, response_headers):
+        """
+        Caches the content of a response, along with its validators. The response is cached only if it includes an ETag or Last-Modified header.
+        """
+        etag, last_modified = None, None
+        for name, value in response_headers or []:
+            name = name.lower()
+            if name == 'etag':
+                etag = value
+            elif name == 'last-modified':
+                last_modified = value
+
+        with self._lock:
+            self._responses.pop(uri, None)
+            if etag is None and last_modified is None:
+                return
+            self._responses[uri] = _CacheEntry(content, etag, last_modified)
+            while len(self._responses) > self._max_responses:
+                self._responses.popitem(last=False)
+
+    def parse(self, content, parser):
+        """
+        Returns the result of invoking 'parser' on 'content'. If the same parser was already invoked on a byte-identical content,
+        returns the cached result instead.
+        """
+        key = (parser, ResponseCache._get_hash(content))
+
+        with self._lock:
+            parsed = self._parsed_objects.pop(key, None)
+            if parsed is not None:
+                self._parsed_objects[key] = parsed  # move to the end of the LRU order
+                return parsed
+
+        # parse outside the lock; if 2 threads parse the same content concurrently, the result of the last one is kept
+        parsed = parser(content)
+
+        with self._lock:
+            self._parsed_objects[key] = parsed
+            while len(self._parsed_objects) > self._max_parsed_objects:
+                self._parsed_objects.popitem(last=False)
+
+        return parsed
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+            self._parsed_objects.clear()
+
+    @staticmethod
+    def _get_hash(content):
+        if not isinstance(content, bytes):
+            content = ustr(content).encode('utf-8')
+        return hashlib.sha256(content).hexdigest()
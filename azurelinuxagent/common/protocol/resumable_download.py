@@ -0,0 +1,247 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+import json
+import os
+import threading
+
+from azurelinuxagent.common import logger
+from azurelinuxagent.common.exception import HttpError, ProtocolError
+from azurelinuxagent.common.future import httpclient, ustr
+from azurelinuxagent.common.utils import restutil
+from azurelinuxagent.common.utils.threadutil import run_concurrently
+
+# Partial downloads are written to "<destination>.partial"; the journal tracking their progress is "<destination>.partial.json"
+PARTIAL_DOWNLOAD_SUFFIX = ".partial"
+_JOURNAL_SUFFIX = ".json"
+
+_CHUNK_SIZE = 1024 * 1024  # 1MB
+# Number of times a segment is resumed after a failure before the download is considered failed
+_MAX_RESUME_ATTEMPTS = 3
+# Packages of at least this size are downloaded using multiple concurrent range requests
+_PARALLEL_DOWNLOAD_MIN_SIZE = 64 * 1024 * 1024
+_PARALLEL_DOWNLOAD_SEGMENTS = 4
+
+# RETRY_CODES include PARTIAL_CONTENT, which is the expected response for a range request
+_RANGE_REQUEST_RETRY_CODES = [c for c in restutil.RETRY_CODES if c != httpclient.PARTIAL_CONTENT]
+
+
+class DownloadJournal(object):
+    """
+    Tracks the progress of a partial download so that it can be resumed (possibly by a different process) using range requests.
+
+    The journal records the validator (ETag or Last-Modified) of the resource, which is sent in an If-Range header when resuming, and
+    a list of segments, each of them a [first byte, last byte, next byte to download] triplet.
+    """
+    def __init__(self, path, validator, size, segments):
+        self.path = path
+        self.validator = validator
+        self.size = size
+        self.segments = segments
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def create(path, validator, size, number_of_segments):
+        segment_size = (size + number_of_segments - 1) // number_of_segments
+        segments = []
+        for start in range(0, size, segment_size):
+            end = min(start + segment_size, size) - 1
+            segments.append([start, end, start])
+        return DownloadJournal(path, validator, size, segments)
+
+    @staticmethod
+    def load(path):
+        """
+        Returns the journal saved at the given path, or None if the journal does not exist or is not valid
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as file_:
+                data = json.load(file_)
+            return DownloadJournal(path, data["validator"], int(data["size"]), [[int(s[0]), int(s[1]), int(s[2])] for s in data["segments"]])
+        except Exception as exception:
+            logger.warn("Ignoring invalid download journal {0}: {1}", path, ustr(exception))
+            return None
+
+    @property
+    def downloaded(self):
+        with self._lock:
+            return sum(next_ - start for start, _, next_ in self.segments)
+
+    def update(self, segment, bytes_written):
+        with self._lock:
+            segment[2] += bytes_written
+            self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as file_:
+            json.dump({"validator": self.validator, "size": self.size, "segments": self.segments}, file_)
+        os.rename(temp_file, self.path)
+
+
+class _EntireResourceReceived(Exception):
+    """
+    Raised when the server responds to a range request with the entire resource (200 instead of 206); 'response' is that response.
+    """
+    def __init__(self, response):
+        super(_EntireResourceReceived, self).__init__("The server returned the entire resource for a range request")
+        self.response = response
+
+
+class ResumableDownload(object):
+    """
+    Downloads a resource to a file, resuming from where a previous attempt stopped when possible.
+
+    The data is written to '<destination>.partial' and the file is renamed to 'destination' once the download completes. If the server
+    supports range requests (i.e. it returns Accept-Ranges: bytes, a Content-Length and a validator), a journal tracks the progress of the
+    download and the partial file is kept when the download fails; subsequent attempts, including attempts over a different channel,
+    request only the missing ranges (using If-Range so that a modified resource is downloaded again from the beginning). If the server
+    responds to a range request with the entire resource (e.g. the HostGAPlugin may ignore the Range header), the partial file is
+    truncated and the response is written from the beginning. Failures while reading the response are resumed immediately up to
+    _MAX_RESUME_ATTEMPTS times. Large resources are downloaded as several segments requested concurrently.
+
+    'fetch_response' is the function used to issue the HTTP requests; it takes the URI, the request headers, the retry codes, and the
+    status codes that indicate success, and returns the response (raising on failure).
+    """
+    def __init__(self, uri, destination, headers, fetch_response):
+        self._uri = uri
+        self._destination = destination
+        self._headers = {} if headers is None else headers
+        self._fetch_response = fetch_response
+        self._partial_file = destination + PARTIAL_DOWNLOAD_SUFFIX
+        self._journal_file = self._partial_file + _JOURNAL_SUFFIX
+
+    @staticmethod
+    def cleanup(destination):
+        """
+        Removes the partial file and journal (if any) for the given destination
+        """
+        for path in [destination + PARTIAL_DOWNLOAD_SUFFIX, destination + PARTIAL_DOWNLOAD_SUFFIX + _JOURNAL_SUFFIX]:
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except Exception as exception:
+                    logger.warn("Can't delete {0}: {1}", path, ustr(exception))
+
+    def run(self):
+        journal = DownloadJournal.load(self._journal_file) if os.path.exists(self._partial_file) else None
+        try:
+            try:
+                if journal is not None:
+                    logger.info("Resuming download of {0} [{1}/{2} bytes]", self._destination, journal.downloaded, journal.size)
+                    self._download_segments(journal)
+                else:
+                    ResumableDownload.cleanup(self._destination)
+                    response = self._fetch_response(self._uri, self._headers, None, None)
+                    journal = self._create_journal(response)
+                    if journal is None:
+                        self._download_without_journal(response)
+                    elif len(journal.segments) == 1:
+                        self._download_segment(journal, journal.segments[0], response)
+                    else:
+                        # the segments are requested separately; the initial response is discarded without reading its content
+                        response.close()
+                        self._download_segments(journal)
+            except _EntireResourceReceived as entire_resource:
+                # the server ignored the Range header or the resource was modified since the download started
+                logger.info("Received the entire resource for a range request; downloading {0} from the beginning", self._destination)
+                journal = None
+                ResumableDownload.cleanup(self._destination)
+                self._download_without_journal(entire_resource.response)
+
+            os.rename(self._partial_file, self._destination)
+            ResumableDownload.cleanup(self._destination)
+        except Exception:
+            if journal is None:  # the download cannot be resumed
+                ResumableDownload.cleanup(self._destination)
+            raise
+
+    def _create_journal(self, response):
+        """
+        Creates the journal for the download (and the partial file) if the server supports range requests for the resource; returns None otherwise.
+        """
+        size = restutil.get_response_header(response, "Content-Length")
+        accept_ranges = restutil.get_response_header(response, "Accept-Ranges")
+        validator = restutil.get_response_header(response, "ETag") or restutil.get_response_header(response, "Last-Modified")
+
+        if size is None or validator is None or accept_ranges is None or accept_ranges.lower() != "bytes":
+            return None
+
+        size = int(size)
+        if size == 0:
+            return None
+        segments = _PARALLEL_DOWNLOAD_SEGMENTS if size >= _PARALLEL_DOWNLOAD_MIN_SIZE else 1
+        journal = DownloadJournal.create(self._journal_file, validator, size, segments)
+        with open(self._partial_file, "wb") as file_:
+            file_.truncate(size)
+        journal.save()
+        return journal
+
+    def _download_without_journal(self, response):
+        with open(self._partial_file, "wb", _CHUNK_SIZE) as file_:
+            complete = False
+            while not complete:
+                chunk = response.read(_CHUNK_SIZE)
+                file_.write(chunk)
+                complete = len(chunk) < _CHUNK_SIZE
+
+    def _download_segments(self, journal):
+        pending = [s for s in journal.segments if s[2] <= s[1]]
+        results = run_concurrently([lambda s=s: self._download_segment(journal, s) for s in pending], _PARALLEL_DOWNLOAD_SEGMENTS, thread_name="DownloadSegment")
+        exceptions = [r.exception for r in results if r.exception is not None]
+        # an entire resource received by any of the segments completes the download, so it takes precedence over the errors of the others
+        exceptions.sort(key=lambda e: not isinstance(e, _EntireResourceReceived))
+        for exception in exceptions[1:]:
+            if isinstance(exception, _EntireResourceReceived):
+                exception.response.close()
+        if len(exceptions) > 0:
+            raise exceptions[0]
+
+    def _download_segment(self, journal, segment, response=None):
+        start, end = segment[0], segment[1]
+        attempt = 0
+        while segment[2] <= end:
+            try:
+                if response is None:
+                    headers = self._headers.copy()
+                    headers["Range"] = "bytes={0}-{1}".format(segment[2], end)
+                    headers["If-Range"] = journal.validator
+                    response = self._fetch_response(self._uri, headers, _RANGE_REQUEST_RETRY_CODES, [httpclient.OK, httpclient.PARTIAL_CONTENT])
+                    if response.status != httpclient.PARTIAL_CONTENT:
+                        raise _EntireResourceReceived(response)
+
+                with open(self._partial_file, "r+b") as file_:
+                    file_.seek(segment[2])
+                    while segment[2] <= end:
+                        chunk = response.read(min(_CHUNK_SIZE, end - segment[2] + 1))
+                        if len(chunk) == 0:
+                            raise IOError("The connection was closed after downloading {0} of {1} bytes of range {2}-{3}".format(segment[2] - start, end - start + 1, start, end))
+                        file_.write(chunk)
+                        journal.update(segment, len(chunk))
+            except (IOError, HttpError, ProtocolError, httpclient.HTTPException) as exception:
+                attempt += 1
+                if attempt > _MAX_RESUME_ATTEMPTS:
+                    raise
+                logger.info("Download of {0} interrupted at byte {1}; resuming: {2}", self._destination, segment[2], ustr(exception))
+            finally:
+                response = None
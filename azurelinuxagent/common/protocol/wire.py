@@ -16,14 +16,14 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 
+import hashlib
 import json
 import os
-import random
 import shutil
+import threading
 import time
 import zipfile
 
-from collections import defaultdict
 from datetime import datetime, timedelta
 from xml.sax import saxutils
 
@@ -36,13 +36,17 @@ from azurelinuxagent.common.event import add_event, WALAEventOperation, report_e
     CollectOrReportEventDebugInfo, add_periodic
 from azurelinuxagent.common.exception import ProtocolNotFoundError, \
     ResourceGoneError, ExtensionDownloadError, InvalidContainerError, ProtocolError, HttpError, ExtensionErrorCodes
-from azurelinuxagent.common.future import httpclient, bytebuffer, ustr
+from azurelinuxagent.common.future import httpclient, bytebuffer, ustr, Queue, Empty
+from azurelinuxagent.common.protocol.endpoint_scoreboard import EndpointScoreboard
 from azurelinuxagent.common.protocol.goal_state import GoalState, TRANSPORT_CERT_FILE_NAME, TRANSPORT_PRV_FILE_NAME, GoalStateProperties
 from azurelinuxagent.common.protocol.hostplugin import HostPluginProtocol
+from azurelinuxagent.common.protocol.response_cache import ResponseCache
+from azurelinuxagent.common.protocol.resumable_download import ResumableDownload
 from azurelinuxagent.common.protocol.restapi import DataContract, ProvisionStatus, VMInfo, VMStatus
 from azurelinuxagent.common.telemetryevent import GuestAgentExtensionEventsSchema
 from azurelinuxagent.common.utils import fileutil, restutil
 from azurelinuxagent.common.utils.cryptutil import CryptUtil
+from azurelinuxagent.common.utils.threadutil import run_concurrently
 from azurelinuxagent.common.utils.restutil import TELEMETRY_THROTTLE_DELAY_IN_SECONDS, \
     TELEMETRY_FLUSH_THROTTLE_DELAY_IN_SECONDS, TELEMETRY_DATA
 from azurelinuxagent.common.utils.textutil import parse_doc, findall, find, \
@@ -63,6 +67,11 @@ MAX_EVENT_BUFFER_SIZE = 2 ** 16 - 2 ** 10
 
 _DOWNLOAD_TIMEOUT = timedelta(minutes=5)
 
+_MAX_PENDING_EVENT_BATCHES = 4  # batches of events queued for each provider while they are sent
+
+_PAGE_SIZE = 512  # page blobs are updated in multiples of 512 bytes
+_MAXIMUM_PAGE_RANGE_SIZE = 4 * 1024 * 1024  # maximum size of a page blob update
+
 
 class UploadError(HttpError):
     pass
@@ -281,10 +290,10 @@ def ext_substatus_to_v1(sub_status_list):
     return status_list
 
 
-def ext_status_to_v1(ext_status):
+def ext_status_to_v1(ext_status, timestamp=None):
     if ext_status is None:
         return None
-    timestamp = _get_utc_timestamp_for_status_reporting()
+    timestamp = _get_utc_timestamp_for_status_reporting() if timestamp is None else timestamp
     v1_sub_status = ext_substatus_to_v1(ext_status.substatusList)
     v1_ext_status = {
         "status": {
@@ -303,7 +312,7 @@ def ext_status_to_v1(ext_status):
     return v1_ext_status
 
 
-def ext_handler_status_to_v1(ext_handler_status):
+def ext_handler_status_to_v1(ext_handler_status, timestamp=None):
     v1_handler_status = {
         'handlerVersion': ext_handler_status.version,
         'handlerName': ext_handler_status.name,
@@ -314,7 +323,7 @@ def ext_handler_status_to_v1(ext_handler_status):
     if ext_handler_status.message is not None:
         v1_handler_status["formattedMessage"] = __get_formatted_msg_for_status_reporting(ext_handler_status.message)
 
-    v1_ext_status = ext_status_to_v1(ext_handler_status.extension_status)
+    v1_ext_status = ext_status_to_v1(ext_handler_status.extension_status, timestamp=timestamp)
     if ext_handler_status.extension_status is not None and v1_ext_status is not None:
         v1_handler_status["runtimeSettingsStatus"] = {
             'settingsStatus': v1_ext_status,
@@ -347,7 +356,10 @@ def vm_artifacts_aggregate_status_to_v1(vm_artifacts_aggregate_status):
     return v1_artifact_aggregate_status
 
 
-def vm_status_to_v1(vm_status):
+def vm_status_to_v1(vm_status, ext_status_timestamp=None, handler_status_to_v1=None):
+    """
+    'handler_status_to_v1', if given, is invoked instead of ext_handler_status_to_v1() to produce the status of each handler.
+    """
     timestamp = _get_utc_timestamp_for_status_reporting()
 
     v1_ga_guest_info = ga_status_to_guest_info(vm_status.vmAgent)
@@ -356,7 +368,10 @@ def vm_status_to_v1(vm_status):
         vm_status.vmAgent.vm_artifacts_aggregate_status)
     v1_handler_status_list = []
     for handler_status in vm_status.vmAgent.extensionHandlers:
-        v1_handler_status_list.append(ext_handler_status_to_v1(handler_status))
+        if handler_status_to_v1 is not None:
+            v1_handler_status_list.append(handler_status_to_v1(handler_status))
+        else:
+            v1_handler_status_list.append(ext_handler_status_to_v1(handler_status, timestamp=ext_status_timestamp))
 
     v1_agg_status = {
         'guestAgentStatus': v1_ga_status,
@@ -394,28 +409,199 @@ def vm_status_to_v1(vm_status):
     return v1_vm_status
 
 
+# Placeholder for the timestamps in the status report while it is serialized (see _StatusSerializer)
+_STATUS_TIMESTAMP = object()
+
+
+class _JsonFragment(object):
+    """
+    The serialized status of a handler; 'pieces' is a list of strings and _STATUS_TIMESTAMP placeholders, and 'digest' is the hash
+    of the fragment without its timestamps
+    """
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.digest = hashlib.sha256("".join(p for p in pieces if p is not _STATUS_TIMESTAMP).encode('utf-8')).hexdigest()
+
+
+def _serialize_json(value, out):
+    """
+    Appends to 'out' the pieces of the JSON text of 'value' (the same text produced by json.dumps() with its default options); the
+    timestamp placeholders and the fragments in 'value' are appended as is.
+    """
+    if value is _STATUS_TIMESTAMP or isinstance(value, _JsonFragment):
+        out.append(value)
+    elif isinstance(value, dict):
+        out.append("{")
+        for i, (key, item) in enumerate(value.items()):
+            out.append(", " + json.dumps(key) + ": " if i > 0 else json.dumps(key) + ": ")
+            _serialize_json(item, out)
+        out.append("}")
+    elif isinstance(value, list):
+        out.append("[")
+        for i, item in enumerate(value):
+            if i > 0:
+                out.append(", ")
+            _serialize_json(item, out)
+        out.append("]")
+    else:
+        out.append(json.dumps(value))
+
+
+class _StatusSerializer(object):
+    """
+    Serializes the status report (the output of vm_status_to_v1) into JSON. The status of each handler is serialized only when it
+    changes; the serialized fragments of the handlers that did not change since the previous report are reused, and the report is
+    assembled from them with a single join. Whether a handler changed is decided by comparing the fields of its ExtHandlerStatus,
+    so the v1 status of the handlers that did not change is not created.
+
+    serialize() also returns a hash of the report that excludes the volatile fields, i.e. the timestamps of the report and of the
+    extension statuses, which are set to the current time every time the report is created.
+    """
+    def __init__(self):
+        self._fragments = {}  # key of the handler status (see _get_key()) -> _JsonFragment
+
+    def serialize(self, vm_status):
+        fragments = {}
+
+        def handler_status_to_fragment(handler_status):
+            key = _StatusSerializer._get_key(handler_status)
+            fragment = self._fragments.get(key)
+            if fragment is None:
+                fragment = _StatusSerializer._create_fragment(ext_handler_status_to_v1(handler_status, timestamp=_STATUS_TIMESTAMP))
+            fragments[key] = fragment
+            return fragment
+
+        report = vm_status_to_v1(vm_status, handler_status_to_v1=handler_status_to_fragment)
+        timestamp = json.dumps(report['timestampUTC'])
+        report['timestampUTC'] = _STATUS_TIMESTAMP
+        self._fragments = fragments
+
+        out = []
+        _serialize_json(report, out)
+
+        data = []
+        report_hash = hashlib.sha256()
+        for piece in out:
+            if piece is _STATUS_TIMESTAMP:
+                data.append(timestamp)
+            elif isinstance(piece, _JsonFragment):
+                data.extend(timestamp if p is _STATUS_TIMESTAMP else p for p in piece.pieces)
+                report_hash.update(piece.digest.encode('utf-8'))
+            else:
+                data.append(piece)
+                report_hash.update(piece.encode('utf-8'))
+
+        return "".join(data), report_hash.hexdigest()
+
+    @staticmethod
+    def _get_key(handler_status):
+        """
+        Returns a tuple with the fields of the given ExtHandlerStatus that are included in its v1 status
+        """
+        extension_status = handler_status.extension_status
+        extension_key = None
+        if extension_status is not None:
+            extension_key = (
+                extension_status.name, extension_status.configurationAppliedTime, extension_status.operation, extension_status.status,
+                extension_status.sequenceNumber, extension_status.code, extension_status.message,
+                tuple((s.name, s.status, s.code, s.message) for s in extension_status.substatusList))
+        return (handler_status.name, handler_status.version, handler_status.status, handler_status.code, handler_status.message,
+                handler_status.supports_multi_config, extension_key)
+
+    @staticmethod
+    def _create_fragment(handler_status):
+        out = []
+        _serialize_json(handler_status, out)
+        # merge the consecutive strings, leaving only the timestamp placeholders in between
+        pieces = []
+        current = []
+        for piece in out:
+            if piece is _STATUS_TIMESTAMP:
+                pieces.append("".join(current))
+                pieces.append(piece)
+                current = []
+            else:
+                current.append(piece)
+        pieces.append("".join(current))
+        return _JsonFragment(pieces)
+
+
+class _StatusUpload(object):
+    def __init__(self, url, blob_type, data_hash, pages):
+        self.url = url
+        self.blob_type = blob_type
+        self.data_hash = data_hash
+        self.pages = pages  # for page blobs, the content of the blob
+        self.timestamp = time.time()
+
+
 class StatusBlob(object):
     def __init__(self, client):
         self.vm_status = None
         self.client = client
         self.type = None
         self.data = None
+        self.data_hash = None
+        self._serializer = _StatusSerializer()
+        self._last_upload = None  # _StatusUpload for the most recent successful upload, via either channel
 
     def set_vm_status(self, vm_status):
         validate_param("vmAgent", vm_status, VMStatus)
         self.vm_status = vm_status
 
     def to_json(self):
-        report = vm_status_to_v1(self.vm_status)
-        return json.dumps(report)
+        data, _ = self._serializer.serialize(self.vm_status)
+        return data
 
     __storage_version__ = "2014-02-14"
 
     def prepare(self, blob_type):
         logger.verbose("Prepare status blob")
-        self.data = self.to_json()
+        self.data, self.data_hash = self._serializer.serialize(self.vm_status)
         self.type = blob_type
 
+    def is_upload_needed(self, url, heartbeat_period):
+        """
+        Returns False if the prepared status is the same (other than its timestamps) as the status most recently uploaded to 'url' and that
+        upload happened less than 'heartbeat_period' seconds ago; returns True otherwise.
+        """
+        last = self._last_upload
+        if heartbeat_period <= 0 or last is None:
+            return True
+        return not (last.url == url and last.blob_type == self.type and last.data_hash == self.data_hash and time.time() - last.timestamp < heartbeat_period)
+
+    def on_upload_started(self):
+        # if the upload fails the content of the blob is unknown (e.g. only some of its pages may have been updated)
+        self._last_upload = None
+
+    def on_upload_completed(self, url, pages=None):
+        """
+        Records a successful upload of the prepared status to 'url'; for page blobs, 'pages' is the content of the blob (the status padded to a
+        multiple of 512 bytes).
+        """
+        self._last_upload = _StatusUpload(url, self.type, self.data_hash, pages)
+
+    def get_page_ranges_to_upload(self, url, pages):
+        """
+        Returns a list of [start, end) ranges with the pages of 'pages' (the new content of the page blob) that differ from the content
+        most recently uploaded to 'url'. Contiguous modified pages are coalesced into ranges of at most _MAXIMUM_PAGE_RANGE_SIZE bytes.
+        Returns None if the blob must be re-created (e.g. its content is unknown, or its size changed).
+        """
+        last = self._last_upload
+        if last is None or last.url != url or last.blob_type != "PageBlob" or last.pages is None or len(last.pages) != len(pages):
+            return None
+
+        ranges = []
+        for start in range(0, len(pages), _PAGE_SIZE):
+            end = start + _PAGE_SIZE
+            if pages[start:end] == last.pages[start:end]:
+                continue
+            if len(ranges) > 0 and ranges[-1][1] == start and end - ranges[-1][0] <= _MAXIMUM_PAGE_RANGE_SIZE:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
     def upload(self, url):
         try:
             if not self.type in ["BlockBlob", "PageBlob"]:
@@ -447,6 +633,7 @@ class StatusBlob(object):
         if resp.status != httpclient.CREATED:
             raise UploadError(
                 "Failed to upload block blob: {0}".format(resp.status))
+        self.on_upload_completed(url)
 
     def get_page_blob_create_headers(self, blob_size):
         return {
@@ -473,12 +660,22 @@ class StatusBlob(object):
         data = bytearray(data, encoding='utf-8')
         page_blob_size = int((len(data) + 511) / 512) * 512
 
+        pages = bytearray(page_blob_size)
+        pages[0:len(data)] = data
+        page_ranges = self.get_page_ranges_to_upload(url, pages)
+        self.on_upload_started()
+        if page_ranges is not None:
+            self._put_page_ranges(url, pages, page_ranges)
+            self.on_upload_completed(url, pages)
+            return
+
         headers = self.get_page_blob_create_headers(page_blob_size)
         resp = self.client.call_storage_service(restutil.http_put, url, "", headers)
         if resp.status != httpclient.CREATED:
             raise UploadError(
                 "Failed to clean up page blob: {0}".format(resp.status))
 
+        blob_url = url
         if url.count("?") <= 0:
             url = "{0}?comp=page".format(url)
         else:
@@ -507,6 +704,19 @@ class StatusBlob(object):
                     "Failed to upload page blob: {0}".format(resp.status))
             start = end
 
+        self.on_upload_completed(blob_url, pages)
+
+    def _put_page_ranges(self, url, pages, page_ranges):
+        """
+        Updates only the given ranges of an existing page blob
+        """
+        logger.verbose("Update {0} page range(s) of the page blob", len(page_ranges))
+        url = "{0}?comp=page".format(url) if url.count("?") <= 0 else "{0}&comp=page".format(url)
+        for start, end in page_ranges:
+            resp = self.client.call_storage_service(restutil.http_put, url, bytebuffer(pages[start:end]), self.get_page_blob_page_headers(start, end))
+            if resp is None or resp.status != httpclient.CREATED:
+                raise UploadError("Failed to upload page blob: {0}".format(None if resp is None else resp.status))
+
 
 def event_param_to_v1(param):
     param_format = ustr('<Param Name="{0}" Value={1} T="{2}" />')
@@ -528,13 +738,65 @@ def event_param_to_v1(param):
 
 
 def event_to_v1_encoded(event, encoding='utf-8'):
-    params = ""
-    for param in event.parameters:
-        params += event_param_to_v1(param)
+    params = u"".join([event_param_to_v1(param) for param in event.parameters])
     event_str = ustr('<Event id="{0}"><![CDATA[{1}]]></Event>').format(event.eventId, params)
     return event_str.encode(encoding)
 
 
+class _EventBatch(object):
+    """
+    Batch of encoded events for a single provider. The events are kept as a list of chunks (with a running size) and joined only once,
+    when the batch is sent, so building a batch is linear in its size.
+    """
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    @property
+    def count(self):
+        return len(self._chunks)
+
+    def add(self, event_str):
+        self._chunks.append(event_str)
+        self.size += len(event_str)
+
+    def get_data(self):
+        return b"".join(self._chunks)
+
+
+class _EventBatchSender(object):
+    """
+    Sends, in order, the batches of events of a single provider on a background thread, so that the batches of different providers are
+    sent concurrently (and concurrently with the encoding of the remaining events). At most _MAX_PENDING_EVENT_BATCHES are queued;
+    submit() blocks when the sender falls behind.
+    """
+    def __init__(self, provider_id, send):
+        self._provider_id = provider_id
+        self._send = send
+        self._queue = Queue(maxsize=_MAX_PENDING_EVENT_BATCHES)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.name = "TelemetrySender"
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, batch):
+        self._queue.put(batch)
+
+    def close(self):
+        """
+        Waits until all the submitted batches have been sent and stops the sender thread
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            self._send(self._provider_id, batch)
+
+
 class WireClient(object):
 
     def __init__(self, endpoint):
@@ -542,18 +804,25 @@ class WireClient(object):
         self._endpoint = endpoint
         self._goal_state = None
         self._host_plugin = None
+        self._response_cache = ResponseCache()
+        self._endpoint_scoreboard = EndpointScoreboard()
         self.status_blob = StatusBlob(self)
 
     def get_endpoint(self):
         return self._endpoint
 
+    @property
+    def response_cache(self):
+        return self._response_cache
+
     def call_wireserver(self, http_req, *args, **kwargs):
+        ok_codes = kwargs.pop('ok_codes', None)
         try:
             # Never use the HTTP proxy for wireserver
             kwargs['use_proxy'] = False
             resp = http_req(*args, **kwargs)
 
-            if restutil.request_failed(resp):
+            if restutil.request_failed(resp, ok_codes=ok_codes):
                 msg = "[Wireserver Failed] URI {0} ".format(args[0])
                 if resp is not None:
                     msg += " [HTTP Failed] Status Code {0}".format(resp.status)
@@ -576,8 +845,39 @@ class WireClient(object):
         return xml_text
 
     def fetch_config(self, uri, headers):
-        resp = self.call_wireserver(restutil.http_get, uri, headers=headers)
-        return self.decode_config(resp.read())
+        """
+        Issues a GET request to the WireServer and returns the response as text. If the content of a previous request to the same URI is
+        cached, the request is conditional and the cached content is returned when the WireServer responds with NOT_MODIFIED.
+        """
+        return self._fetch_with_response_cache(uri, headers, lambda h, ok_codes: self.call_wireserver(restutil.http_get, uri, headers=h, ok_codes=ok_codes))
+
+    def _fetch_with_response_cache(self, uri, headers, do_request):
+        """
+        Issues a conditional request for the given 'uri' if its content is in the response cache, and returns the content as text (the
+        cached content if the server responds with NOT_MODIFIED).
+
+        'do_request' is a function that takes the request headers and the HTTP status codes to consider successful, and issues the actual request.
+        """
+        request_headers, ok_codes = headers, None
+        conditional_headers = self._response_cache.get_conditional_headers(uri)
+        if len(conditional_headers) > 0:
+            request_headers = {} if headers is None else headers.copy()
+            request_headers.update(conditional_headers)
+            ok_codes = restutil.OK_CODES + restutil.NOT_MODIFIED_CODES
+
+        response = do_request(request_headers, ok_codes)
+
+        if restutil.request_not_modified(response):
+            content = self._response_cache.get_content(uri)
+            if content is not None:
+                logger.verbose("Content of {0} was not modified; using cached value", uri)
+                return content
+            # the content was evicted from the cache after the request was issued; request it again
+            response = do_request(headers, None)
+
+        content = self.decode_config(response.read())
+        self._response_cache.set_content(uri, content, response.getheaders())
+        return content
 
     @staticmethod
     def call_storage_service(http_req, *args, **kwargs):
@@ -604,25 +904,43 @@ class WireClient(object):
         """
         host_ga_plugin = self.get_host_plugin()
 
-        direct_download = lambda uri: self.fetch(uri)[0]
+        # The content is cached using the URI of the artifact (not the URI of the HostGAPlugin request), so it can be used by either channel
+        def direct_download(uri):
+            return self._fetch_with_response_cache(uri, None, lambda h, ok_codes: self._fetch_response(uri, h, ok_codes=ok_codes))
 
         def hgap_download(uri):
             request_uri, request_headers = host_ga_plugin.get_artifact_request(uri, use_verify_header=use_verify_header)
-            response, _ = self.fetch(request_uri, request_headers, use_proxy=False, retry_codes=restutil.HGAP_GET_EXTENSION_ARTIFACT_RETRY_CODES)
-            return response
+            return self._fetch_with_response_cache(uri, request_headers, lambda h, ok_codes: self._fetch_response(request_uri, h, use_proxy=False, retry_codes=restutil.HGAP_GET_EXTENSION_ARTIFACT_RETRY_CODES, ok_codes=ok_codes))
 
-        return self._download_with_fallback_channel(download_type, uris, direct_download=direct_download, hgap_download=hgap_download)
+        return self._download_with_fallback_channel(download_type, uris, direct_download=direct_download, hgap_download=hgap_download, hedge=True)
 
-    def download_zip_package(self, package_type, uris, target_file, target_directory, use_verify_header):
+    def download_zip_package(self, package_type, uris, target_file, target_directory, use_verify_header, extract_package=None):
         """
         Downloads the ZIP package specified in 'uris' (which is a list of alternate locations for the ZIP), saving it to 'target_file' and then expanding
         its contents to 'target_directory'. Deletes the target file after it has been expanded.
 
+        The package is expanded using 'extract_package', which takes the ZIP file and the target directory as arguments; if not given, the package is
+        expanded using ZipFile.extractall().
+
         The 'package_type' is only used in log messages and has no other semantics. It should specify the contents of the ZIP, e.g. "extension package"
         or "agent package"
 
         The 'use_verify_header' parameter indicates whether the verify header should be added when using the extensionArtifact API of the HostGAPlugin.
         """
+        on_downloaded = lambda: WireClient._try_expand_zip_package(package_type, target_file, target_directory, extract_package)
+
+        self._download_package(package_type, uris, target_file, use_verify_header, on_downloaded)
+
+    def download_package(self, package_type, uris, target_file, use_verify_header):
+        """
+        Downloads the ZIP package specified in 'uris' (which is a list of alternate locations for the ZIP) and saves it to 'target_file', without
+        expanding it. The parameters have the same semantics as in download_zip_package().
+        """
+        on_downloaded = lambda: WireClient._verify_zip_package(package_type, target_file)
+
+        self._download_package(package_type, uris, target_file, use_verify_header, on_downloaded)
+
+    def _download_package(self, package_type, uris, target_file, use_verify_header, on_downloaded):
         host_ga_plugin = self.get_host_plugin()
 
         direct_download = lambda uri: self.stream(uri, target_file, headers=None, use_proxy=True)
@@ -631,11 +949,9 @@ class WireClient(object):
             request_uri, request_headers = host_ga_plugin.get_artifact_request(uri, use_verify_header=use_verify_header, artifact_manifest_url=host_ga_plugin.manifest_uri)
             return self.stream(request_uri, target_file, headers=request_headers, use_proxy=False)
 
-        on_downloaded = lambda: WireClient._try_expand_zip_package(package_type, target_file, target_directory)
-
         self._download_with_fallback_channel(package_type, uris, direct_download=direct_download, hgap_download=hgap_download, on_downloaded=on_downloaded)
 
-    def _download_with_fallback_channel(self, download_type, uris, direct_download, hgap_download, on_downloaded=None):
+    def _download_with_fallback_channel(self, download_type, uris, direct_download, hgap_download, on_downloaded=None, hedge=False):
         """
         Walks the given list of 'uris' issuing HTTP GET requests, attempting to download the content of each URI. The download is done using both the default and
         the fallback channels, until one of them succeeds. The 'direct_download' and 'hgap_download' functions define the logic to do direct calls to the URI or
@@ -653,38 +969,161 @@ class WireClient(object):
         the response returned by the successful channel (i.e. one of direct_download and hgap_download).
 
         This method enforces a timeout (_DOWNLOAD_TIMEOUT) on the download and raises an exception if the limit is exceeded.
+
+        The URIs are tried in the order given by the EndpointScoreboard (fastest mirror first, skipping the mirrors that failed recently). If 'hedge'
+        is True and a download takes longer than the hedge delay (see conf.get_artifact_download_hedge_delay()), the download from the next URI is
+        started concurrently and the first one to succeed is used. Hedging should only be used for downloads that do not write to a shared
+        destination (e.g. manifests, which are downloaded to memory).
         """
         logger.info("Downloading {0}", download_type)
         start_time = datetime.now()
 
-        uris_shuffled = uris
-        random.shuffle(uris_shuffled)
+        ranked_uris = self._endpoint_scoreboard.rank(uris)
+
+        def download(uri):
+            download_start = time.time()
+            try:
+                # Disable W0640: OK to use uri in a lambda within the function's body
+                response = self._download_using_appropriate_channel(lambda: direct_download(uri), lambda: hgap_download(uri))  # pylint: disable=W0640
+                if on_downloaded is not None:
+                    on_downloaded()
+            except Exception:
+                self._endpoint_scoreboard.record_failure(uri)
+                raise
+            self._endpoint_scoreboard.record_success(uri, time.time() - download_start)
+            return response
+
+        hedge_delay = conf.get_artifact_download_hedge_delay() if hedge else 0
+        if hedge_delay > 0 and len(ranked_uris) > 1:
+            return self._download_hedged(download_type, ranked_uris, direct_download, hgap_download, on_downloaded, start_time, hedge_delay)
+
         most_recent_error = "None"
 
-        for index, uri in enumerate(uris_shuffled):
+        for index, uri in enumerate(ranked_uris):
             elapsed = datetime.now() - start_time
             if elapsed > _DOWNLOAD_TIMEOUT:
-                message = "Timeout downloading {0}. Elapsed: {1} URIs tried: {2}/{3}. Last error: {4}".format(download_type, elapsed, index, len(uris), ustr(most_recent_error))
+                message = "Timeout downloading {0}. Elapsed: {1} URIs tried: {2}/{3}. Last error: {4}".format(download_type, elapsed, index, len(ranked_uris), ustr(most_recent_error))
                 raise ExtensionDownloadError(message, code=ExtensionErrorCodes.PluginManifestDownloadError)
 
             try:
-                # Disable W0640: OK to use uri in a lambda within the loop's body
-                response = self._download_using_appropriate_channel(lambda: direct_download(uri), lambda: hgap_download(uri))  # pylint: disable=W0640
-
-                if on_downloaded is not None:
-                    on_downloaded()
-
-                return uri, response
+                return uri, download(uri)
             except Exception as exception:
                 most_recent_error = exception
 
         raise ExtensionDownloadError("Failed to download {0} from all URIs. Last error: {1}".format(download_type, ustr(most_recent_error)), code=ExtensionErrorCodes.PluginManifestDownloadError)
 
+    def _download_hedged(self, download_type, uris, direct_download, hgap_download, on_downloaded, start_time, hedge_delay):
+        """
+        Downloads the given URIs (which are in order of preference), each on its own thread. The download from the next URI starts when the
+        previous one fails, or when no download has completed within 'hedge_delay' seconds (so at most 2 downloads are in flight, unless they are
+        slower than the hedge delay). Returns a (uri, response) tuple for the first download that succeeds. The downloads still in flight at that
+        point (or when the download times out) are cancelled: they do not try any other channel, their results are discarded and they are not
+        recorded in the EndpointScoreboard.
+
+        The download threads do not change the channel state shared with other downloads: all of them use the default channel at the time
+        this method is invoked, and the calling thread switches the default channel if the download that succeeds used the fallback channel.
+        Likewise, when the HostGAPlugin reports a stale container, the calling thread refreshes the HostGAPlugin configuration and retries that
+        URI on the HostGAPlugin channel (see _call_hostplugin_with_container_check()).
+        """
+        results = Queue()
+        cancelled = threading.Event()
+        if HostPluginProtocol.is_default_channel:
+            channels = [(hgap_download, False), (direct_download, True)]  # (download function, is fallback channel)
+        else:
+            channels = [(direct_download, False), (hgap_download, True)]
+        hgap_channel = [c for c in channels if c[0] is hgap_download]
+
+        def run(uri, uri_channels):
+            download_start = time.time()
+            errors = []
+            stale_host_plugin = False
+            for channel, is_fallback in uri_channels:
+                if cancelled.is_set():
+                    return
+                try:
+                    response = channel(uri)
+                    if on_downloaded is not None:
+                        on_downloaded()
+                except Exception as exception:
+                    stale_host_plugin = stale_host_plugin or isinstance(exception, (ResourceGoneError, InvalidContainerError))
+                    errors.append(ustr(exception))
+                    continue
+                if not cancelled.is_set():
+                    self._endpoint_scoreboard.record_success(uri, time.time() - download_start)
+                results.put((uri, response, is_fallback, None, False))
+                return
+            if not cancelled.is_set() and not stale_host_plugin:
+                self._endpoint_scoreboard.record_failure(uri)
+            results.put((uri, None, False, HttpError("Download failed on the {0} channel(s): [{1}]".format(len(errors), "] [".join(errors))), stale_host_plugin))
+
+        def start_download(uri, uri_channels):
+            thread = threading.Thread(target=run, args=(uri, uri_channels))
+            thread.name = "HedgedDownload"
+            thread.daemon = True
+            thread.start()
+
+        pending = list(uris)
+        start_download(pending.pop(0), channels)
+        in_flight = 1
+        host_plugin_refreshed = False
+        most_recent_error = "None"
+
+        try:
+            while in_flight > 0:
+                elapsed = datetime.now() - start_time
+                if elapsed > _DOWNLOAD_TIMEOUT:
+                    message = "Timeout downloading {0}. Elapsed: {1} URIs tried: {2}/{3}. Last error: {4}".format(download_type, elapsed, len(uris) - len(pending), len(uris), ustr(most_recent_error))
+                    raise ExtensionDownloadError(message, code=ExtensionErrorCodes.PluginManifestDownloadError)
+
+                timeout = (_DOWNLOAD_TIMEOUT - elapsed).seconds + 1
+                if len(pending) > 0:
+                    timeout = min(timeout, hedge_delay)
+                try:
+                    uri, response, used_fallback_channel, error, stale_host_plugin = results.get(timeout=timeout)
+                except Empty:
+                    if len(pending) > 0:
+                        logger.info("The download of {0} is taking more than {1} seconds; requesting it also from {2}", download_type, hedge_delay, pending[0])
+                        start_download(pending.pop(0), channels)
+                        in_flight += 1
+                    continue
+
+                in_flight -= 1
+                if error is None:
+                    if used_fallback_channel:
+                        WireClient._switch_default_channel()
+                    return uri, response
+                most_recent_error = error
+                if stale_host_plugin and not host_plugin_refreshed:
+                    host_plugin_refreshed = True
+                    logger.info("The HostGAPlugin configuration is stale; fetching a new goal state and retrying the download of {0} from {1}", download_type, uri)
+                    self.update_host_plugin_from_goal_state()
+                    start_download(uri, hgap_channel)
+                    in_flight += 1
+                elif len(pending) > 0:
+                    start_download(pending.pop(0), channels)
+                    in_flight += 1
+        finally:
+            cancelled.set()
+
+        raise ExtensionDownloadError("Failed to download {0} from all URIs. Last error: {1}".format(download_type, ustr(most_recent_error)), code=ExtensionErrorCodes.PluginManifestDownloadError)
+
+    @staticmethod
+    def _verify_zip_package(package_type, target_file):
+        if not zipfile.is_zipfile(target_file):
+            try:
+                os.remove(target_file)
+            except Exception as exception:
+                logger.warn("Cannot delete {0}: {1}", target_file, ustr(exception))
+            raise ProtocolError("The downloaded {0} is not a valid ZIP file: {1}".format(package_type, target_file))
+
     @staticmethod
-    def _try_expand_zip_package(package_type, target_file, target_directory):
+    def _try_expand_zip_package(package_type, target_file, target_directory, extract_package=None):
         logger.info("Unzipping {0}: {1}", package_type, target_file)
         try:
-            zipfile.ZipFile(target_file).extractall(target_directory)
+            if extract_package is not None:
+                extract_package(target_file, target_directory)
+            else:
+                zipfile.ZipFile(target_file).extractall(target_directory)
         except Exception as exception:
             logger.error("Error while unzipping {0}: {1}", package_type, ustr(exception))
             if os.path.exists(target_directory):
@@ -702,27 +1141,17 @@ class WireClient(object):
     def stream(self, uri, destination, headers=None, use_proxy=None):
         """
         Downloads the content of the given 'uri' and saves it to the 'destination' file.
+
+        If the download fails after part of the content has been downloaded, the partial content is kept and the next call for the same
+        destination (even if done with a different URI, e.g. over the HostGAPlugin channel) resumes the download (see ResumableDownload).
         """
-        try:
-            logger.verbose("Fetch [{0}] with headers [{1}] to file [{2}]", uri, headers, destination)
-
-            response = self._fetch_response(uri, headers, use_proxy)
-            if response is not None and not restutil.request_failed(response):
-                chunk_size = 1024 * 1024  # 1MB buffer
-                with open(destination, 'wb', chunk_size) as destination_fh:
-                    complete = False
-                    while not complete:
-                        chunk = response.read(chunk_size)
-                        destination_fh.write(chunk)
-                        complete = len(chunk) < chunk_size
-            return ""
-        except:
-            if os.path.exists(destination):  # delete the destination file, in case we did a partial download
-                try:
-                    os.remove(destination)
-                except Exception as exception:
-                    logger.warn("Can't delete {0}: {1}", destination, ustr(exception))
-            raise
+        logger.verbose("Fetch [{0}] with headers [{1}] to file [{2}]", uri, headers, destination)
+
+        def fetch_response(request_uri, request_headers, retry_codes, ok_codes):
+            return self._fetch_response(request_uri, request_headers, use_proxy, retry_codes=retry_codes, ok_codes=ok_codes)
+
+        ResumableDownload(uri, destination, headers, fetch_response).run()
+        return ""
 
     def fetch(self, uri, headers=None, use_proxy=None, decode=True, retry_codes=None, ok_codes=None):
         """
@@ -930,15 +1359,19 @@ class WireClient(object):
             return_value = secondary_channel()
 
             # Since the secondary channel succeeded, flip the default channel
-            HostPluginProtocol.is_default_channel = not HostPluginProtocol.is_default_channel
-            message = "Default channel changed to {0} channel.".format("HostGAPlugin" if HostPluginProtocol.is_default_channel else "Direct")
-            logger.info(message)
-            add_event(AGENT_NAME, op=WALAEventOperation.DefaultChannelChange, version=CURRENT_VERSION, is_success=True, message=message, log_event=False)
+            WireClient._switch_default_channel()
 
             return return_value
         except Exception as exception:
             raise HttpError("Download failed both on the primary and fallback channels. Primary: [{0}] Fallback: [{1}]".format(ustr(primary_channel_error), ustr(exception)))
 
+    @staticmethod
+    def _switch_default_channel():
+        HostPluginProtocol.is_default_channel = not HostPluginProtocol.is_default_channel
+        message = "Default channel changed to {0} channel.".format("HostGAPlugin" if HostPluginProtocol.is_default_channel else "Direct")
+        logger.info(message)
+        add_event(AGENT_NAME, op=WALAEventOperation.DefaultChannelChange, version=CURRENT_VERSION, is_success=True, message=message, log_event=False)
+
     def upload_status_blob(self):
         extensions_goal_state = self.get_goal_state().extensions_goal_state
 
@@ -959,6 +1392,11 @@ class WireClient(object):
         except Exception as e:
             raise ProtocolError("Exception creating status blob: {0}".format(ustr(e)))
 
+        # Skip the upload if only the timestamps changed since the previous upload, unless the heartbeat period has elapsed
+        if not self.status_blob.is_upload_needed(extensions_goal_state.status_upload_blob, conf.get_status_upload_heartbeat_period()):
+            logger.verbose("The status has not changed since the last upload; skipping the upload")
+            return
+
         # Swap the order of use for the HostPlugin vs. the "direct" route.
         # Prefer the use of HostPlugin. If HostPlugin fails fall back to the
         # direct route.
@@ -1067,55 +1505,68 @@ class WireClient(object):
                 "Failed to send events:{0}".format(resp.status))
 
     def report_event(self, events_iterator, flush=False):
-        buf = {}
         debug_info = CollectOrReportEventDebugInfo(operation=CollectOrReportEventDebugInfo.OP_REPORT)
-        events_per_provider = defaultdict(int)
+        debug_info_lock = threading.Lock()  # batches are sent on multiple threads
+        batches = {}  # provider_id -> _EventBatch being built
+        senders = {}  # provider_id -> _EventBatchSender; created when the first batch of a provider is full
 
-        def _send_event(provider_id, debug_info, flush):
+        def _send_event(provider_id, batch):
+            logger.verbose("No of events this request = {0}".format(batch.count))
             try:
-                self._send_encoded_event(provider_id, buf[provider_id], flush)
+                self._send_encoded_event(provider_id, batch.get_data(), flush)
             except UnicodeError as uni_error:
-                debug_info.update_unicode_error(uni_error)
-            except Exception as error:
-                debug_info.update_op_error(error)
-
-        # Group events by providerId
-        for event in events_iterator:
-            try:
-                if event.providerId not in buf:
-                    buf[event.providerId] = b""
-                event_str = event_to_v1_encoded(event)
-
-                if len(event_str) >= MAX_EVENT_BUFFER_SIZE:
-                    # Ignore single events that are too large to send out
-                    details_of_event = [ustr(x.name) + ":" + ustr(x.value) for x in event.parameters if x.name in
-                                        [GuestAgentExtensionEventsSchema.Name, GuestAgentExtensionEventsSchema.Version,
-                                         GuestAgentExtensionEventsSchema.Operation,
-                                         GuestAgentExtensionEventsSchema.OperationSuccess]]
-                    logger.periodic_warn(logger.EVERY_HALF_HOUR,
-                                         "Single event too large: {0}, with the length: {1} more than the limit({2})"
-                                         .format(str(details_of_event), len(event_str), MAX_EVENT_BUFFER_SIZE))
-                    continue
-
-                # If buffer is full, send out the events in buffer and reset buffer
-                if len(buf[event.providerId] + event_str) >= MAX_EVENT_BUFFER_SIZE:
-                    logger.verbose("No of events this request = {0}".format(events_per_provider[event.providerId]))
-                    _send_event(event.providerId, debug_info, flush)
-                    buf[event.providerId] = b""
-                    events_per_provider[event.providerId] = 0
-
-                # Add encoded events to the buffer
-                buf[event.providerId] = buf[event.providerId] + event_str
-                events_per_provider[event.providerId] += 1
-
+                with debug_info_lock:
+                    debug_info.update_unicode_error(uni_error)
             except Exception as error:
-                logger.warn("Unexpected error when generating Events:{0}", textutil.format_exception(error))
+                with debug_info_lock:
+                    debug_info.update_op_error(error)
 
-        # Send out all events left in buffer.
-        for provider_id in list(buf.keys()):
-            if buf[provider_id]:
-                logger.verbose("No of events this request = {0}".format(events_per_provider[provider_id]))
-                _send_event(provider_id, debug_info, flush)
+        try:
+            # Group events by providerId
+            for event in events_iterator:
+                try:
+                    event_str = event_to_v1_encoded(event)
+
+                    if len(event_str) >= MAX_EVENT_BUFFER_SIZE:
+                        # Ignore single events that are too large to send out
+                        details_of_event = [ustr(x.name) + ":" + ustr(x.value) for x in event.parameters if x.name in
+                                            [GuestAgentExtensionEventsSchema.Name, GuestAgentExtensionEventsSchema.Version,
+                                             GuestAgentExtensionEventsSchema.Operation,
+                                             GuestAgentExtensionEventsSchema.OperationSuccess]]
+                        logger.periodic_warn(logger.EVERY_HALF_HOUR,
+                                             "Single event too large: {0}, with the length: {1} more than the limit({2})"
+                                             .format(str(details_of_event), len(event_str), MAX_EVENT_BUFFER_SIZE))
+                        continue
+
+                    batch = batches.get(event.providerId)
+                    if batch is None:
+                        batch = batches[event.providerId] = _EventBatch()
+
+                    # If the batch is full, send it (on the provider's sender thread) and start a new one
+                    if batch.size + len(event_str) >= MAX_EVENT_BUFFER_SIZE:
+                        sender = senders.get(event.providerId)
+                        if sender is None:
+                            sender = senders[event.providerId] = _EventBatchSender(event.providerId, _send_event)
+                        sender.submit(batch)
+                        batch = batches[event.providerId] = _EventBatch()
+
+                    batch.add(event_str)
+
+                except Exception as error:
+                    logger.warn("Unexpected error when generating Events:{0}", textutil.format_exception(error))
+
+            # Send out all events left in the batches; the providers with no sender thread are sent concurrently
+            pending = []
+            for provider_id, batch in batches.items():
+                if batch.count > 0:
+                    if provider_id in senders:
+                        senders[provider_id].submit(batch)
+                    else:
+                        pending.append(lambda p=provider_id, b=batch: _send_event(p, b))
+            run_concurrently(pending, len(pending), thread_name="TelemetrySender")
+        finally:
+            for sender in senders.values():
+                sender.close()
 
         debug_info.report_debug_info()
 
@@ -1,14 +1,16 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the Apache License.
 import errno
-import glob
 import os
 import re
 import shutil
+import threading
+import time as _time
 import zipfile
 
 from azurelinuxagent.common import conf
 from azurelinuxagent.common import logger
+from azurelinuxagent.common.future import Queue, Full, ustr
 from azurelinuxagent.common.utils import fileutil, timeutil
 
 # pylint: disable=W0105
@@ -45,6 +47,9 @@ _PLACEHOLDER_FILE_NAME = 'GoalState.1.xml'
 
 _MAX_ARCHIVED_STATES = 50
 
+_MAX_PENDING_HISTORY_OPERATIONS = 256  # operations queued by the goal state history writer; additional operations are dropped
+_DROPPED_HISTORY_OPERATIONS_REPORT_PERIOD = 60 * 60  # seconds; the number of dropped operations is reported at most once per period
+
 _CACHE_PATTERNS = [
     #
     # Note that SharedConfig.xml is not included here; this file is used by other components (Azsec and Singularity/HPC Infiniband)
@@ -208,22 +213,205 @@ class StateArchiver(object):
         return states
 
 
+class _HistoryIndex(object):
+    """
+    Index of the items (directories and .zip archives) in the history directory, sorted by creation time. The index is loaded from disk the
+    first time it is used (and again if the history directory changes) and is then updated as new items are created, so purging the history
+    does not need to list and sort the directory. Items are indexed by their path without the .zip extension, since archiving an item only
+    compresses it. The index is thread-safe.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._root = None
+        self._items = []  # oldest first
+
+    def _load(self, root):
+        if self._root == root:
+            return
+        self._root = root
+        self._items = []
+        if os.path.exists(root):
+            paths = [os.path.join(root, item) for item in os.listdir(root)]
+            paths.sort(key=os.path.getctime)
+            for path in paths:
+                path = _HistoryIndex._get_key(path)
+                if path not in self._items:
+                    self._items.append(path)
+
+    @staticmethod
+    def _get_key(path):
+        return path[0:-len(".zip")] if path.endswith(".zip") else path
+
+    def add(self, root, path):
+        with self._lock:
+            self._load(root)
+            path = _HistoryIndex._get_key(path)
+            if path not in self._items:
+                self._items.append(path)
+
+    def remove(self, root, path):
+        with self._lock:
+            self._load(root)
+            path = _HistoryIndex._get_key(path)
+            if path in self._items:
+                self._items.remove(path)
+
+    def remove_oldest(self, root, count):
+        """
+        Removes from the index all the items except the 'count' newest ones; returns the removed items.
+        """
+        with self._lock:
+            self._load(root)
+            if len(self._items) <= count:
+                return []
+            removed = self._items[0:len(self._items) - count]
+            self._items = self._items[len(self._items) - count:]
+            return removed
+
+    def contains_tag(self, root, tag):
+        suffix = "_{0}".format(tag)
+        with self._lock:
+            self._load(root)
+            return any(item.endswith(suffix) for item in self._items)
+
+
+_history_index = _HistoryIndex()
+
+
+class GoalStateHistoryWriter(object):
+    """
+    Runs the operations that save, purge and archive the goal state history. When Debug.EnableAsyncGoalStateHistory is set the operations are
+    queued and executed in order by a background thread running at low CPU priority (which also lowers its I/O priority), so the processing of
+    the goal state does not wait on the disk; otherwise (or if the thread cannot be started) they are executed immediately.
+
+    The queue is bounded; when it is full, new operations are dropped (the history is used only for debugging). The number of dropped
+    operations is reported periodically, and by flush(), which should be called on shutdown.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._dropped = 0
+        self._last_dropped_report = 0
+
+    def run(self, operation):
+        """
+        Runs (or queues) the given operation; returns False if the operation was dropped because the queue is full
+        """
+        if not conf.get_enable_async_goal_state_history():
+            operation()
+            return True
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                try:
+                    self._queue = Queue(maxsize=_MAX_PENDING_HISTORY_OPERATIONS)
+                    self._thread = threading.Thread(target=GoalStateHistoryWriter._process_operations, args=(self._queue,), name="GoalStateHistoryWriter")
+                    self._thread.daemon = True
+                    self._thread.start()
+                except Exception as e:
+                    self._thread = None
+                    logger.warn("Failed to start the goal state history writer; will save the history synchronously: {0}", ustr(e))
+            queue = self._queue if self._thread is not None else None
+
+        if queue is None:
+            operation()
+            return True
+
+        queued = True
+        try:
+            queue.put_nowait(operation)
+        except Full:
+            queued = False
+            with self._lock:
+                self._dropped += 1
+        self._report_dropped_operations(force=False)
+        return queued
+
+    def flush(self, timeout=None):
+        """
+        Waits for the queued operations to complete (for up to 'timeout' seconds, if given) and reports the operations that were dropped
+        """
+        with self._lock:
+            queue = self._queue if self._thread is not None else None
+        if queue is not None:
+            if timeout is None:
+                queue.join()
+            else:
+                end_time = _time.time() + timeout
+                with queue.all_tasks_done:
+                    while queue.unfinished_tasks > 0:
+                        remaining = end_time - _time.time()
+                        if remaining <= 0:
+                            logger.warn("Timeout waiting for the goal state history writer; {0} operation(s) are still pending", queue.unfinished_tasks)
+                            break
+                        queue.all_tasks_done.wait(remaining)
+        self._report_dropped_operations(force=True)
+
+    def _report_dropped_operations(self, force):
+        with self._lock:
+            if self._dropped == 0 or (not force and _time.time() < self._last_dropped_report + _DROPPED_HISTORY_OPERATIONS_REPORT_PERIOD):
+                return
+            dropped = self._dropped
+            self._dropped = 0
+            self._last_dropped_report = _time.time()
+        logger.warn("The goal state history writer is falling behind; dropped {0} goal state history operation(s)", dropped)
+
+    @staticmethod
+    def _process_operations(queue):
+        try:
+            # On Linux the nice value applies only to the calling thread; it also lowers its I/O priority under the CFQ/BFQ schedulers
+            os.nice(19)
+        except Exception as e:
+            logger.info("Failed to lower the priority of the goal state history writer: {0}", ustr(e))
+
+        while True:
+            operation = queue.get()
+            try:
+                operation()
+            except Exception as e:
+                logger.warn("Error updating the goal state history: {0}", ustr(e))
+            finally:
+                queue.task_done()
+
+
+_history_writer = GoalStateHistoryWriter()
+
+
+def get_goal_state_history_writer():
+    """
+    Returns the process-wide GoalStateHistoryWriter
+    """
+    return _history_writer
+
+
 class GoalStateHistory(object):
     def __init__(self, time, tag):
         self._errors = False
+        self._queued = False  # whether any file of this item was queued to be saved
         timestamp = timeutil.create_history_timestamp(time)
-        self._root = os.path.join(conf.get_lib_dir(), ARCHIVE_DIRECTORY_NAME, "{0}__{1}".format(timestamp, tag) if tag is not None else timestamp)
+        self._history_root = os.path.join(conf.get_lib_dir(), ARCHIVE_DIRECTORY_NAME)
+        self._root = os.path.join(self._history_root, "{0}__{1}".format(timestamp, tag) if tag is not None else timestamp)
 
-        GoalStateHistory._purge()
+        history_root = self._history_root
+        _history_writer.run(lambda: GoalStateHistory._purge(history_root))
 
     @staticmethod
     def tag_exists(tag):
         """
-        Returns True when an item with the given 'tag' already exists in the history directory
+        Returns True when an item with the given 'tag' already exists in the history directory (or is about to be created by the history writer)
         """
-        return len(glob.glob(os.path.join(conf.get_lib_dir(), ARCHIVE_DIRECTORY_NAME, "*_{0}".format(tag)))) > 0
+        return _history_index.contains_tag(os.path.join(conf.get_lib_dir(), ARCHIVE_DIRECTORY_NAME), tag)
 
     def save(self, data, file_name):
+        # the item is indexed before it is saved, so that tag_exists() includes the items that are queued to be saved
+        _history_index.add(self._history_root, self._root)
+        if _history_writer.run(lambda: self._save(data, file_name)):
+            self._queued = True
+        elif not self._queued:
+            _history_index.remove(self._history_root, self._root)
+
+    def _save(self, data, file_name):
         try:
             if not os.path.exists(self._root):
                 fileutil.mkdir(self._root, mode=0o700)
@@ -237,27 +425,20 @@ class GoalStateHistory(object):
     _purge_error_count = 0
 
     @staticmethod
-    def _purge():
+    def _purge(history_root):
         """
         Delete "old" history directories and .zip archives. Old is defined as any directories or files older than the X newest ones.
         """
         try:
-            history_root = os.path.join(conf.get_lib_dir(), ARCHIVE_DIRECTORY_NAME)
-
             if not os.path.exists(history_root):
                 return
 
-            items = []
-            for current_item in os.listdir(history_root):
-                full_path = os.path.join(history_root, current_item)
-                items.append(full_path)
-            items.sort(key=os.path.getctime, reverse=True)
-
-            for current_item in items[_MAX_ARCHIVED_STATES:]:
-                if os.path.isfile(current_item):
-                    os.remove(current_item)
-                else:
-                    shutil.rmtree(current_item)
+            for item in _history_index.remove_oldest(history_root, _MAX_ARCHIVED_STATES):
+                for current_item in [item, item + ".zip"]:
+                    if os.path.isdir(current_item):
+                        shutil.rmtree(current_item)
+                    elif os.path.exists(current_item):
+                        os.remove(current_item)
 
             if GoalStateHistory._purge_error_count > 0:
                 GoalStateHistory._purge_error_count = 0
@@ -287,7 +468,7 @@ class GoalStateHistory(object):
 
     def save_goal_state(self, text):
         self.save(text, _GOAL_STATE_FILE_NAME)
-        self._save_placeholder()
+        _history_writer.run(GoalStateHistory._save_placeholder)
 
     def save_extensions_config(self, text):
         self.save(text, _EXT_CONF_FILE_NAME)
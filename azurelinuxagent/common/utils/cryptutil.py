@@ -19,6 +19,8 @@
 
 import base64
 import errno
+import hashlib
+import re
 import struct
 import os.path
 import subprocess
@@ -32,6 +34,106 @@ import azurelinuxagent.common.utils.shellutil as shellutil
 
 DECRYPT_SECRET_CMD = "{0} cms -decrypt -inform DER -inkey {1} -in /dev/stdin"
 
+# DER encoding of the rsaEncryption OID (1.2.840.113549.1.1.1) and of the AlgorithmIdentifier used for RSA public keys
+_RSA_ENCRYPTION_OID = b"\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x01\x01"
+_RSA_ALGORITHM_IDENTIFIER = b"\x30\x0d" + _RSA_ENCRYPTION_OID + b"\x05\x00"
+
+
+def split_pem(text):
+    """
+    Splits the given PEM text (e.g. the output of 'openssl pkcs12') into its private keys and certificates. Returns a list of tuples
+    (type, text), where type is 'prv' or 'crt' and text includes all the lines since the end of the previous item (such as the
+    attributes that precede the item).
+    """
+    items = []
+    buf = []
+    for line in text.splitlines(True):
+        buf.append(line)
+        if re.match(r'[-]+END.*KEY[-]+', line):
+            items.append(('prv', "".join(buf)))
+            buf = []
+        elif re.match(r'[-]+END.*CERTIFICATE[-]+', line):
+            items.append(('crt', "".join(buf)))
+            buf = []
+    return items
+
+
+def _pem_to_der(text, label):
+    """
+    Returns the DER content of the first block in 'text' whose label (the text after BEGIN) matches the regular expression 'label', or None
+    """
+    match = re.search(r'-----BEGIN ({0})-----(.*?)-----END \1-----'.format(label), text, re.DOTALL)
+    if match is None:
+        return None
+    return bytearray(base64.b64decode("".join(match.group(2).split())))
+
+
+def _der_to_pem(der, label):
+    lines = ["-----BEGIN {0}-----".format(label)]
+    encoded = ustr(base64.b64encode(bytebuffer(der)), encoding='ascii')
+    for i in range(0, len(encoded), 64):
+        lines.append(encoded[i:i + 64])
+    lines.append("-----END {0}-----".format(label))
+    return "\n".join(lines) + "\n"
+
+
+def _read_der_item(der, offset):
+    """
+    Returns the tag of the DER item at 'offset' in 'der' (a bytearray), and the offsets of its value and of the end of the item
+    """
+    tag = der[offset]
+    length = der[offset + 1]
+    start = offset + 2
+    if length & 0x80:
+        count = length & 0x7f
+        length = 0
+        for i in range(count):
+            length = (length << 8) | der[start + i]
+        start += count
+    end = start + length
+    if end > len(der):
+        raise ValueError("Invalid DER encoding")
+    return tag, start, end
+
+
+def _read_der_sequence(der, offset=0):
+    """
+    Returns a list with the offsets (start, end) of the items in the DER sequence at 'offset' in 'der'
+    """
+    tag, start, end = _read_der_item(der, offset)
+    if tag != 0x30:
+        raise ValueError("Expected a DER sequence, found tag {0}".format(tag))
+    items = []
+    while start < end:
+        _, _, item_end = _read_der_item(der, start)
+        items.append((start, item_end))
+        start = item_end
+    return items
+
+
+def _encode_der_item(tag, value):
+    length = len(value)
+    if length < 0x80:
+        header = bytearray([tag, length])
+    else:
+        length_bytes = bytearray()
+        while length:
+            length_bytes.insert(0, length & 0xff)
+            length >>= 8
+        header = bytearray([tag, 0x80 | len(length_bytes)]) + length_bytes
+    return header + value
+
+
+def _get_rsa_public_key_info(rsa_private_key):
+    """
+    Returns the DER SubjectPublicKeyInfo for the given DER RSAPrivateKey (PKCS #1)
+    """
+    items = _read_der_sequence(rsa_private_key)
+    modulus = rsa_private_key[items[1][0]:items[1][1]]
+    public_exponent = rsa_private_key[items[2][0]:items[2][1]]
+    rsa_public_key = _encode_der_item(0x30, modulus + public_exponent)
+    return _encode_der_item(0x30, bytearray(_RSA_ALGORITHM_IDENTIFIER) + _encode_der_item(0x03, bytearray(b"\x00") + rsa_public_key))
+
 
 class CryptUtil(object):
     def __init__(self, openssl_cmd):
@@ -86,6 +188,55 @@ class CryptUtil(object):
             thumbprint = thumbprint.rstrip().split('=')[1].replace(':', '').upper()
             return thumbprint
 
+    @staticmethod
+    def get_thumbprint_from_crt_pem(crt):
+        """
+        Returns the thumbprint (the SHA1 hash of the DER encoding, same as 'openssl x509 -fingerprint') of the certificate in the given PEM text
+        """
+        der = _pem_to_der(crt, "CERTIFICATE")
+        if der is None:
+            raise CryptError("The PEM text does not contain a certificate")
+        return hashlib.sha1(bytebuffer(der)).hexdigest().upper()
+
+    def get_pubkey_from_crt_pem(self, crt):
+        """
+        Returns the public key (as PEM text, same as get_pubkey_from_crt) of the certificate in the given PEM text. The certificate is parsed
+        in-process; openssl is used only if the certificate cannot be parsed.
+        """
+        try:
+            der = _pem_to_der(crt, "CERTIFICATE")
+            tbs_certificate = _read_der_sequence(der)[0]
+            fields = _read_der_sequence(der, tbs_certificate[0])
+            if der[fields[0][0]] == 0xa0:  # skip the (optional) version
+                fields = fields[1:]
+            # serialNumber, signature, issuer, validity, subject, subjectPublicKeyInfo
+            start, end = fields[5]
+            return _der_to_pem(der[start:end], "PUBLIC KEY")
+        except Exception as e:
+            logger.verbose("Cannot parse the certificate; will use openssl to get its public key: {0}", ustr(e))
+        return shellutil.run_command([self.openssl_cmd, "x509", "-pubkey", "-noout"], input=crt, log_error=True)
+
+    def get_pubkey_from_prv_pem(self, prv):
+        """
+        Returns the public key (as PEM text, same as get_pubkey_from_prv) of the private key in the given PEM text. RSA keys (PKCS #1 or
+        unencrypted PKCS #8) are parsed in-process; openssl is used for any other keys.
+        """
+        try:
+            rsa_private_key = _pem_to_der(prv, "RSA PRIVATE KEY")
+            if rsa_private_key is None:
+                private_key_info = _pem_to_der(prv, "PRIVATE KEY")
+                if private_key_info is not None:
+                    items = _read_der_sequence(private_key_info)
+                    algorithm = _read_der_sequence(private_key_info, items[1][0])
+                    if bytes(private_key_info[algorithm[0][0]:algorithm[0][1]]) == _RSA_ENCRYPTION_OID:
+                        _, start, end = _read_der_item(private_key_info, items[2][0])
+                        rsa_private_key = private_key_info[start:end]
+            if rsa_private_key is not None:
+                return _der_to_pem(_get_rsa_public_key_info(rsa_private_key), "PUBLIC KEY")
+        except Exception as e:
+            logger.verbose("Cannot parse the private key; will use openssl to get its public key: {0}", ustr(e))
+        return shellutil.run_command([self.openssl_cmd, "pkey", "-pubout"], input=prv, log_error=True)
+
     def decrypt_p7m(self, p7m_file, trans_prv_file, trans_cert_file, pem_file):
 
         def _cleanup_files(files_to_cleanup):
@@ -0,0 +1,136 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import os
+import threading
+
+from azurelinuxagent.common.future import OrderedDict
+
+# Maximum total size (in bytes) of the files whose parsed values are cached; the memory used by the cache (the parsed values, plus the
+# raw text for the callers that keep it) is a small multiple of this size
+MAX_PARSED_FILE_CACHE_SIZE = 4 * 1024 * 1024
+
+
+class _CacheEntry(object):
+    def __init__(self, signature, value):
+        self.signature = signature
+        self.value = value
+        self.size = signature[2]
+        self.used = True
+
+
+class ParsedFileCache(object):
+    """
+    Caches the result of parsing files (e.g. the status files of extensions). An entry is invalidated when the inode, modification time
+    (in nanoseconds) or size of its file changes, so the file is parsed again only after it is modified or replaced.
+
+    The cache is bounded by the total size of the cached files ('max_size', in bytes); when it is full, the least recently used entries
+    are evicted first. Callers that look up the same files periodically should call remove_stale_entries() after each pass, to evict the
+    entries that are no longer needed (e.g. the status files of previous sequence numbers or of removed extensions). The entry for a
+    file that no longer exists is evicted when it is looked up.
+
+    The parsed values are shared by all callers, so they must be treated as read-only. Errors are not cached. The cache is thread-safe.
+    """
+    def __init__(self, max_size=MAX_PARSED_FILE_CACHE_SIZE):
+        self._max_size = max_size
+        self._size = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # path -> _CacheEntry, in LRU order
+
+    def get(self, path, parse):
+        """
+        Returns the value produced by parse(path), reusing the cached value if the file did not change since it was parsed. Raises
+        the same exceptions as os.stat() and parse().
+        """
+        try:
+            signature = get_file_signature(path)
+        except (IOError, OSError):
+            with self._lock:
+                self._remove(path)
+            raise
+
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                if entry.signature == signature:
+                    entry.used = True
+                    self._entries[path] = entry  # move to the end of the LRU order
+                    return entry.value
+                self._size -= entry.size
+
+        value = parse(path)
+
+        # if the file changed while it was being parsed, do not cache the value
+        if get_file_signature(path) == signature and signature[2] <= self._max_size:
+            with self._lock:
+                self._remove(path)  # the file may have been cached by another thread while it was being parsed
+                entry = _CacheEntry(signature, value)
+                self._entries[path] = entry
+                self._size += entry.size
+                while self._size > self._max_size:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._size -= evicted.size
+        return value
+
+    def remove_stale_entries(self):
+        """
+        Evicts the entries that were not looked up since the previous call to this method
+        """
+        with self._lock:
+            for path, entry in list(self._entries.items()):
+                if entry.used:
+                    entry.used = False
+                else:
+                    del self._entries[path]
+                    self._size -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._size -= entry.size
+
+
+def get_file_signature(path):
+    """
+    Returns the inode, modification time (in nanoseconds) and size of the given file; a change in any of them indicates that the file
+    was modified or replaced. Raises the same exceptions as os.stat().
+    """
+    stat = os.stat(path)
+    mtime_ns = getattr(stat, "st_mtime_ns", None)
+    if mtime_ns is None:  # Python 2 does not provide st_mtime_ns
+        mtime_ns = int(stat.st_mtime * 10 ** 9)
+    return stat.st_ino, mtime_ns, stat.st_size
+
+
+_parsed_file_cache = ParsedFileCache()
+
+
+def get_parsed_file_cache():
+    """
+    Returns the process-wide ParsedFileCache
+    """
+    return _parsed_file_cache
+
+
+def clear_parsed_file_cache():
+    _parsed_file_cache.clear()
@@ -0,0 +1,117 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import time
+
+from azurelinuxagent.common import logger
+from azurelinuxagent.common.future import ustr
+
+# Flags for inotify_init1() and inotify_add_watch() (see inotify(7))
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+_libc = None
+
+
+def _get_libc():
+    global _libc  # pylint: disable=W0603
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+class FileWatcher(object):
+    """
+    Waits for changes (files created, modified, renamed or deleted) in a set of directories. The watcher uses inotify when it is
+    available; otherwise (or if any of the directories cannot be watched) wait() simply sleeps for the given timeout, so callers
+    should always check the state they are waiting for after wait() returns.
+
+    FileWatcher is a context manager; the inotify instance is released on exit (or on close()).
+    """
+    def __init__(self, directories):
+        self._fd = None
+        try:
+            libc = _get_libc()
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            try:
+                for directory in directories:
+                    if libc.inotify_add_watch(fd, directory.encode("utf-8"), _WATCH_MASK) < 0:
+                        raise OSError(ctypes.get_errno(), "inotify_add_watch failed for {0}".format(directory))
+            except Exception:
+                os.close(fd)
+                raise
+            self._fd = fd
+        except Exception as exception:
+            logger.verbose("inotify is not available; will poll for changes in {0}: {1}", directories, ustr(exception))
+
+    @property
+    def is_event_driven(self):
+        return self._fd is not None
+
+    def wait(self, timeout):
+        """
+        Blocks until there is a change in the watched directories or until 'timeout' (in seconds) elapses. Returns True if a change was
+        detected, False otherwise (always False when polling).
+        """
+        if self._fd is None:
+            time.sleep(timeout)
+            return False
+        try:
+            readable, _, _ = select.select([self._fd], [], [], max(0, timeout))
+        except (select.error, OSError) as exception:
+            if exception.args[0] != errno.EINTR:
+                raise
+            return False
+        if len(readable) == 0:
+            return False
+        self._drain()
+        return True
+
+    def _drain(self):
+        while True:
+            try:
+                if len(os.read(self._fd, 4096)) == 0:
+                    return
+            except OSError as exception:
+                if exception.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,154 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import codecs
+import json
+
+_CHUNK_SIZE = 64 * 1024
+MAX_ITEM_SIZE = 1024 * 1024  # items larger than this (in characters) are considered invalid
+
+_WHITESPACE = u" \t\n\r"
+_NUMBER_CHARS = u"0123456789.eE+-"
+
+
+class _LimitReached(Exception):
+    pass
+
+
+def _raw_decode(decoder, s, idx):
+    """
+    Returns the JSON value starting at index 'idx' of 's' and the index where the value ends. The index is passed as the 'idx' keyword
+    argument of raw_decode(), when supported; otherwise a slice of 's' is decoded.
+    """
+    try:
+        return decoder.raw_decode(s, idx=idx)
+    except TypeError:
+        item, end = decoder.raw_decode(s[idx:])
+        return item, end + idx
+
+
+class JsonArrayReader(object):
+    """
+    Incremental parser for a JSON array read from a binary stream (encoded as UTF-8); iterating over the reader returns the items of the
+    array one at a time, so the stream is read only as far as the caller consumes items and memory usage is bounded by the size of the
+    largest item (rather than by the size of the stream). If the document is not an array, the document itself is returned as the only
+    item.
+
+    If 'max_bytes' is given, at most that many bytes are read from the stream; the items not complete at that point are ignored and
+    'truncated' is set to True when the iteration ends. Errors in the JSON document (including items larger than 'max_item_size'
+    characters) raise ValueError when they are reached, after the preceding items have been returned.
+    """
+    def __init__(self, stream, max_bytes=None, max_item_size=MAX_ITEM_SIZE, chunk_size=_CHUNK_SIZE):
+        self._stream = stream
+        self._max_bytes = max_bytes
+        self._max_item_size = max_item_size
+        self._chunk_size = chunk_size
+        self._json_decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = u""
+        self._position = 0
+        self._bytes_read = 0
+        self._eof = False
+        self._limit_reached = False
+        self.truncated = False
+
+    def __iter__(self):
+        try:
+            char = self._next_char()
+            if char != u"[":
+                item = self._decode_item()
+                self._expect_end()
+                yield item
+                return
+            self._position += 1
+            if self._next_char() == u"]":
+                self._position += 1
+                self._expect_end()
+                return
+            while True:
+                yield self._decode_item()
+                char = self._next_char()
+                if char == u"]":
+                    self._position += 1
+                    self._expect_end()
+                    return
+                if char != u",":
+                    raise ValueError("Expecting ',' delimiter or ']' in the JSON array, found {0}".format(repr(char)))
+                self._position += 1
+        except _LimitReached:
+            self.truncated = True
+
+    def _decode_item(self):
+        while True:
+            if self._next_char() is None:
+                raise ValueError("Expecting a JSON value, found the end of the document")
+            try:
+                item, end = _raw_decode(self._json_decoder, self._buffer, self._position)
+                # a number at the end of the buffer may continue in the next chunk (or beyond max_bytes)
+                if (end < len(self._buffer) and self._buffer[end] not in _NUMBER_CHARS) or (self._eof and not self._limit_reached):
+                    self._position = end
+                    return item
+                if self._eof:
+                    raise _LimitReached()
+            except ValueError:
+                if self._eof:
+                    if self._limit_reached:
+                        raise _LimitReached()
+                    raise
+            if len(self._buffer) - self._position > self._max_item_size:
+                raise ValueError("The JSON value exceeds the maximum size allowed ({0} characters)".format(self._max_item_size))
+            self._read()
+
+    def _next_char(self):
+        """
+        Skips any whitespace and returns the next character, or None at the end of the stream
+        """
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in _WHITESPACE:
+                self._position += 1
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if self._eof:
+                if self._limit_reached:
+                    raise _LimitReached()
+                return None
+            self._read()
+
+    def _expect_end(self):
+        if self._next_char() is not None:
+            raise ValueError("Extra data after the JSON document")
+
+    def _read(self):
+        # drop the data already parsed
+        self._buffer = self._buffer[self._position:]
+        self._position = 0
+
+        size = self._chunk_size
+        if self._max_bytes is not None:
+            size = min(size, self._max_bytes - self._bytes_read)
+        data = self._stream.read(size) if size > 0 else b""
+        self._bytes_read += len(data)
+
+        if len(data) == 0:
+            self._eof = True
+            if size <= 0:
+                # the read stopped at max_bytes; the limit was reached only if the stream has more data
+                self._limit_reached = len(self._stream.read(1)) > 0
+            self._buffer += self._text_decoder.decode(b"", final=not self._limit_reached)
+        else:
+            self._buffer += self._text_decoder.decode(data)
@@ -17,8 +17,12 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 
+import array
+import errno
+import json
 import os
 import re
+import select
 import threading
 import time
 import socket
@@ -115,6 +119,11 @@ HOST_PLUGIN_PORT = 32526
 
 TELEMETRY_DATA = "telemetrydata"
 
+# Idle keep-alive connections older than this are closed instead of being reused
+HTTP_KEEP_ALIVE_IDLE_TIMEOUT_IN_SECONDS = 60
+# Maximum number of connections kept for each (host, port, scheme, proxy)
+HTTP_KEEP_ALIVE_MAX_CONNECTIONS_PER_ENDPOINT = 4
+
 class IOErrorCounter(object):
     _lock = threading.RLock()
     _protocol_endpoint = KNOWN_WIRESERVER_IP
@@ -148,6 +157,412 @@ class IOErrorCounter(object):
         IOErrorCounter._protocol_endpoint = endpoint
 
 
+class HttpRequestStatistics(object):
+    """
+    Statistics of the requests issued by http_request(), grouped by endpoint (WireServer, HostGAPlugin, IMDS, other) and operation
+    (goal state, vmSettings, status, telemetry, artifacts, etc.).
+
+    Each attempt of a request is accounted separately (attempts after the first one are also counted as retries); the latency of
+    an attempt is the time until the response headers are received. Latencies are kept in histograms with fixed buckets (the
+    upper limits of the buckets are LATENCY_BUCKETS_IN_MILLISECONDS, plus a last bucket for larger values). The number of bytes
+    received is taken from the Content-Length of the responses.
+    """
+    LATENCY_BUCKETS_IN_MILLISECONDS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+    # Indexes of the counters in the statistics for each (endpoint, operation)
+    REQUESTS = 0
+    ERRORS = 1
+    RETRIES = 2
+    THROTTLED = 3
+    BYTES_SENT = 4
+    BYTES_RECEIVED = 5
+    _NUMBER_OF_COUNTERS = 6
+
+    _lock = threading.RLock()
+    _statistics = {}  # (endpoint, operation) -> [counters, latency histogram]
+    _period_start = time.time()
+
+    @staticmethod
+    def record(endpoint, operation, elapsed_seconds, bytes_sent, response=None, is_retry=False):
+        """
+        Records an attempt of a request; 'response' is None if the request failed without a response
+        """
+        bucket = HttpRequestStatistics._get_bucket(elapsed_seconds * 1000)
+        bytes_received = 0
+        if response is not None:
+            try:
+                bytes_received = int(get_response_header(response, "Content-Length") or 0)
+            except (ValueError, TypeError):
+                pass
+
+        with HttpRequestStatistics._lock:
+            statistics = HttpRequestStatistics._statistics.get((endpoint, operation))
+            if statistics is None:
+                statistics = HttpRequestStatistics._statistics[(endpoint, operation)] = [
+                    array.array('d', [0] * HttpRequestStatistics._NUMBER_OF_COUNTERS),
+                    array.array('l', [0] * (len(HttpRequestStatistics.LATENCY_BUCKETS_IN_MILLISECONDS) + 1))]
+            counters, histogram = statistics
+            counters[HttpRequestStatistics.REQUESTS] += 1
+            if response is None or request_failed(response):
+                counters[HttpRequestStatistics.ERRORS] += 1
+            if is_retry:
+                counters[HttpRequestStatistics.RETRIES] += 1
+            if response is not None and _is_throttle_status(response.status):
+                counters[HttpRequestStatistics.THROTTLED] += 1
+            counters[HttpRequestStatistics.BYTES_SENT] += bytes_sent
+            counters[HttpRequestStatistics.BYTES_RECEIVED] += bytes_received
+            histogram[bucket] += 1
+
+    @staticmethod
+    def get_and_reset():
+        """
+        Returns the statistics collected since the previous call, as a dictionary of (endpoint, operation) -> (counters, latency histogram)
+        """
+        with HttpRequestStatistics._lock:
+            statistics = HttpRequestStatistics.get()
+            HttpRequestStatistics.reset()
+            return statistics
+
+    @staticmethod
+    def get():
+        with HttpRequestStatistics._lock:
+            return dict((key, (list(counters), list(histogram))) for key, (counters, histogram) in HttpRequestStatistics._statistics.items())
+
+    @staticmethod
+    def reset():
+        with HttpRequestStatistics._lock:
+            HttpRequestStatistics._statistics = {}
+            HttpRequestStatistics._period_start = time.time()
+
+    @staticmethod
+    def get_latency_percentile(histogram, percentile):
+        """
+        Returns an estimate of the given percentile (0-100) of the latency, in milliseconds: the upper limit of the bucket that
+        contains the percentile (or the limit of the last bucket if the percentile falls in the bucket for larger values).
+        Returns None if the histogram is empty.
+        """
+        total = sum(histogram)
+        if total == 0:
+            return None
+        threshold = total * percentile / 100.0
+        accumulated = 0
+        for i, count in enumerate(histogram):
+            accumulated += count
+            if accumulated >= threshold:
+                break
+        buckets = HttpRequestStatistics.LATENCY_BUCKETS_IN_MILLISECONDS
+        return buckets[i] if i < len(buckets) else buckets[-1]  # pylint: disable=undefined-loop-variable
+
+    @staticmethod
+    def dump(path):
+        """
+        Writes the statistics collected in the current period to the given file, as JSON
+        """
+        buckets = ["<={0}ms".format(b) for b in HttpRequestStatistics.LATENCY_BUCKETS_IN_MILLISECONDS]
+        buckets.append(">{0}ms".format(HttpRequestStatistics.LATENCY_BUCKETS_IN_MILLISECONDS[-1]))
+        with HttpRequestStatistics._lock:
+            period_start = HttpRequestStatistics._period_start
+            statistics = HttpRequestStatistics.get()
+        requests = []
+        for (endpoint, operation), (counters, histogram) in sorted(statistics.items()):
+            requests.append({
+                "endpoint": endpoint,
+                "operation": operation,
+                "requests": int(counters[HttpRequestStatistics.REQUESTS]),
+                "errors": int(counters[HttpRequestStatistics.ERRORS]),
+                "retries": int(counters[HttpRequestStatistics.RETRIES]),
+                "throttled": int(counters[HttpRequestStatistics.THROTTLED]),
+                "bytesSent": int(counters[HttpRequestStatistics.BYTES_SENT]),
+                "bytesReceived": int(counters[HttpRequestStatistics.BYTES_RECEIVED]),
+                "latency": dict(zip(buckets, histogram))
+            })
+        data = {
+            "periodStart": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(period_start)),
+            "periodEnd": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "requests": requests
+        }
+        temp_file = path + ".tmp"
+        with open(temp_file, "w") as file_:
+            json.dump(data, file_, indent=2, sort_keys=True)
+        os.rename(temp_file, path)
+
+    @staticmethod
+    def _get_bucket(milliseconds):
+        for i, limit in enumerate(HttpRequestStatistics.LATENCY_BUCKETS_IN_MILLISECONDS):
+            if milliseconds <= limit:
+                return i
+        return len(HttpRequestStatistics.LATENCY_BUCKETS_IN_MILLISECONDS)
+
+
+class HttpEndpoint(object):
+    WireServer = "WireServer"
+    HostPlugin = "HostGAPlugin"
+    Imds = "IMDS"
+    Other = "Other"
+
+
+class HttpOperation(object):
+    Artifacts = "Artifacts"
+    GoalState = "GoalState"
+    Health = "Health"
+    Metadata = "Metadata"
+    Other = "Other"
+    Status = "Status"
+    Telemetry = "Telemetry"
+    VmSettings = "VmSettings"
+
+
+_IMDS_ENDPOINT = "169.254.169.254"
+
+
+def _get_endpoint(host, port):
+    if port == HOST_PLUGIN_PORT:
+        return HttpEndpoint.HostPlugin
+    if host in (KNOWN_WIRESERVER_IP, IOErrorCounter._protocol_endpoint):  # pylint: disable=protected-access
+        return HttpEndpoint.WireServer
+    if host == _IMDS_ENDPOINT:
+        return HttpEndpoint.Imds
+    return HttpEndpoint.Other
+
+
+def _get_operation(method, endpoint, rel_uri):
+    uri = rel_uri.lower()
+    if "comp=goalstate" in uri or "comp=config" in uri or "comp=certificates" in uri:
+        return HttpOperation.GoalState
+    if "/vmsettings" in uri:
+        return HttpOperation.VmSettings
+    if "comp={0}".format(TELEMETRY_DATA) in uri:
+        return HttpOperation.Telemetry
+    if "comp=health" in uri or "/health" in uri:
+        return HttpOperation.Health
+    if "/metadata/" in uri:
+        return HttpOperation.Metadata
+    if uri.startswith("/status") or (endpoint == HttpEndpoint.Other and method == "PUT"):
+        return HttpOperation.Status
+    if "/extensionartifact" in uri or (endpoint == HttpEndpoint.Other and method in ("GET", "HEAD")):
+        return HttpOperation.Artifacts
+    return HttpOperation.Other
+
+
+class RequestPriority(object):
+    High = 0  # goal state, status and any other request not listed below
+    Medium = 1  # health reports and heartbeats
+    Low = 2  # telemetry
+
+
+# Parameters of the budget for the requests to the WireServer and HostGAPlugin (see _RequestBudget)
+WIRESERVER_REQUEST_BUDGET_MAX_RATE = 10.0  # requests per second
+WIRESERVER_REQUEST_BUDGET_MIN_RATE = 0.1
+WIRESERVER_REQUEST_BUDGET_RATE_INCREASE = 0.1  # increase of the rate after each request that is not throttled
+WIRESERVER_REQUEST_BUDGET_BURST = 20
+# Tokens that must be left in the bucket for requests with higher priority, for each priority
+_REQUEST_BUDGET_RESERVED_TOKENS = {RequestPriority.High: 0, RequestPriority.Medium: 1, RequestPriority.Low: 5}
+# Upper limit for the delay requested by the server in the Retry-After header
+_MAX_RETRY_AFTER_IN_SECONDS = 5 * 60
+
+
+class _RequestBudget(object):
+    """
+    Token bucket shared by all the requests to an endpoint (the WireServer and the HostGAPlugin, which run on the same host).
+
+    The bucket holds up to 'burst' tokens and is refilled at an adaptive rate: each throttled response (429/503) to a request with
+    high or medium priority halves the rate (down to 'min_rate') and empties the bucket, while each successful response increases it by
+    'rate_increase' (up to 'max_rate'). Throttled telemetry requests do not change the rate, since the server limits telemetry on its own.
+    When the server is throttling, the requests with the same or lower priority than the throttled request wait for the delay indicated
+    by its Retry-After header (or the throttle delay of the request, if the header is not present) instead of each of them retrying on
+    its own schedule; requests with higher priority are never delayed by the throttling of requests with lower priority.
+
+    Requests with high priority wait only for that throttling delay; requests with lower priority also wait until the bucket has enough
+    tokens to leave _REQUEST_BUDGET_RESERVED_TOKENS for higher priority requests, so that bulk traffic (telemetry) is deferred when
+    the budget is tight. A request that needs to wait takes its token in advance (possibly leaving the bucket in debt), so concurrent
+    requests are spread out over time.
+    """
+    def __init__(self, max_rate=WIRESERVER_REQUEST_BUDGET_MAX_RATE, min_rate=WIRESERVER_REQUEST_BUDGET_MIN_RATE,
+                 rate_increase=WIRESERVER_REQUEST_BUDGET_RATE_INCREASE, burst=WIRESERVER_REQUEST_BUDGET_BURST):
+        self._lock = threading.Lock()
+        self._max_rate = max_rate
+        self._min_rate = min_rate
+        self._rate_increase = rate_increase
+        self._burst = float(burst)
+        self._rate = max_rate
+        self._tokens = float(burst)
+        self._last_refill = time.time()
+        self._throttled_until = dict((p, 0) for p in _REQUEST_BUDGET_RESERVED_TOKENS)
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def acquire(self, priority):
+        """
+        Waits until a request with the given priority can be sent; returns the time waited, in seconds
+        """
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            wait = max(0, self._throttled_until[priority] - now)
+            if priority != RequestPriority.High:
+                required = 1 + _REQUEST_BUDGET_RESERVED_TOKENS[priority]
+                if self._tokens < required:
+                    wait = max(wait, (required - self._tokens) / self._rate)
+            self._tokens -= 1
+
+        if wait > 0:
+            logger.verbose("Request budget: waiting {0:.2f} seconds [priority: {1}]", wait, priority)
+            time.sleep(wait)
+        return wait
+
+    def on_response(self, throttled, priority=RequestPriority.High, retry_after=None, throttle_delay=THROTTLE_DELAY_IN_SECONDS):
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            if throttled:
+                if priority != RequestPriority.Low:
+                    self._rate = max(self._min_rate, self._rate / 2)
+                    self._tokens = min(self._tokens, 0)
+                delay = throttle_delay if retry_after is None else min(retry_after, _MAX_RETRY_AFTER_IN_SECONDS)
+                for p in self._throttled_until:
+                    if p >= priority:
+                        self._throttled_until[p] = max(self._throttled_until[p], now + delay)
+                logger.verbose("Request budget: throttled by the server; rate: {0:.2f} requests/sec; delay: {1} seconds [priority: {2}]", self._rate, delay, priority)
+            else:
+                self._rate = min(self._max_rate, self._rate + self._rate_increase)
+
+    def _refill(self, now):
+        elapsed = max(0, now - self._last_refill)
+        self._tokens = min(self._burst, self._tokens + elapsed * self._rate)
+        self._last_refill = now
+
+
+_wireserver_request_budget = _RequestBudget()
+
+
+def get_wireserver_request_budget():
+    return _wireserver_request_budget
+
+
+def reset_wireserver_request_budget():
+    global _wireserver_request_budget  # pylint: disable=W0603
+    _wireserver_request_budget = _RequestBudget()
+
+
+def _get_priority(operation):
+    if operation == HttpOperation.Telemetry:
+        return RequestPriority.Low
+    if operation == HttpOperation.Health:
+        return RequestPriority.Medium
+    return RequestPriority.High
+
+
+def _get_retry_after(response):
+    """
+    Returns the value of the Retry-After header of the response, in seconds, or None if the header is not present or is not a
+    number of seconds (the HTTP-date format is not supported)
+    """
+    try:
+        value = get_response_header(response, "Retry-After")
+        if value is not None:
+            return max(0, int(value.strip()))
+    except Exception:
+        pass
+    return None
+
+
+class _HttpConnectionPool(object):
+    """
+    Keeps the persistent (keep-alive) connections used by _http_request, grouped by (scheme, host, port, proxy).
+
+    A connection is handed out again only after the response to its previous request has been fully read (http.client
+    does not allow issuing a new request before that), the connection has not been idle for longer than
+    HTTP_KEEP_ALIVE_IDLE_TIMEOUT_IN_SECONDS, and its socket does not have pending data (which on an idle connection
+    means that the server closed it or sent something unexpected).
+    """
+    def __init__(self, idle_timeout=HTTP_KEEP_ALIVE_IDLE_TIMEOUT_IN_SECONDS, max_connections=HTTP_KEEP_ALIVE_MAX_CONNECTIONS_PER_ENDPOINT):
+        self._lock = threading.Lock()
+        self._idle_timeout = idle_timeout
+        self._max_connections = max_connections
+        self._connections = {}  # key -> list of [connection, last response, time the connection was released]
+
+    def acquire(self, key):
+        """
+        Returns a connection available for the given key, or None if there are none.
+        """
+        now = time.time()
+        with self._lock:
+            entries = self._connections.get(key, [])
+            for entry in entries[:]:
+                connection, response, released = entry
+                if not _is_response_consumed(response):
+                    # the caller is still reading the response; drop the connection if it has been held for too long
+                    # (it is not closed since that would also close the response)
+                    if now - released > self._idle_timeout:
+                        entries.remove(entry)
+                    continue
+                entries.remove(entry)
+                if now - released > self._idle_timeout or not _is_connection_healthy(connection):
+                    _close_connection(connection)
+                    continue
+                return connection
+            return None
+
+    def release(self, key, connection, response):
+        """
+        Adds the connection to the pool, unless the server indicated that it will close it.
+        """
+        if getattr(response, "will_close", True) is not False:
+            return
+        with self._lock:
+            entries = self._connections.setdefault(key, [])
+            while len(entries) >= self._max_connections:
+                connection_to_drop, response_to_drop, _ = entries.pop(0)
+                if _is_response_consumed(response_to_drop):
+                    _close_connection(connection_to_drop)
+            entries.append([connection, response, time.time()])
+
+    def close_all(self):
+        with self._lock:
+            for entries in self._connections.values():
+                for connection, response, _ in entries:
+                    if _is_response_consumed(response):
+                        _close_connection(connection)
+            self._connections = {}
+
+
+def _is_response_consumed(response):
+    try:
+        return response.isclosed() is True
+    except Exception:
+        return False
+
+
+def _is_connection_healthy(connection):
+    sock = getattr(connection, "sock", None)
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return len(readable) == 0
+    except Exception:
+        return False
+
+
+def _close_connection(connection):
+    try:
+        connection.close()
+    except Exception as e:
+        logger.verbose("Error closing HTTP connection: {0}", ustr(e))
+
+
+_http_connection_pool = _HttpConnectionPool()
+
+
+def close_http_connections():
+    """
+    Closes all the idle keep-alive connections
+    """
+    _http_connection_pool.close_all()
+
+
 def _compute_delay(retry_attempt=1, delay=DELAY_IN_SECONDS):
     fib = (1, 1)
     for _ in range(retry_attempt):
@@ -165,6 +580,19 @@ def _is_retry_exception(e):
     return len([x for x in RETRY_EXCEPTIONS if isinstance(e, x)]) > 0
 
 
+def _is_closed_connection_error(e):
+    """
+    True if the error indicates that the connection was closed (or reset) by the remote end before any part of the response was
+    received
+    """
+    if isinstance(e, socket.timeout):
+        return False
+    if isinstance(e, httpclient.BadStatusLine):
+        # RemoteDisconnected (a subclass of BadStatusLine) on Python 3, an empty status line on Python 2
+        return e.__class__.__name__ == "RemoteDisconnected" or e.line in ("", "''")
+    return getattr(e, "errno", None) in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
 def _is_throttle_status(status):
     return status in THROTTLE_CODES
 
@@ -321,8 +749,10 @@ def redact_sas_tokens_in_urls(url):
 def _http_request(method, host, rel_uri, timeout, port=None, data=None, secure=False,
                   headers=None, proxy_host=None, proxy_port=None, redact_data=False):
 
+    keep_alive = conf.get_enable_http_keep_alive()
+
     headers = {} if headers is None else headers
-    headers['Connection'] = 'close'
+    headers['Connection'] = 'keep-alive' if keep_alive else 'close'
 
     use_proxy = proxy_host is not None and proxy_port is not None
 
@@ -340,16 +770,28 @@ def _http_request(method, host, rel_uri, timeout, port=None, data=None, secure=F
         conn_host, conn_port = host, port
         url = rel_uri
 
-    if secure:
-        conn = httpclient.HTTPSConnection(conn_host,
-                                          conn_port,
-                                          timeout=timeout)
-        if use_proxy:
-            conn.set_tunnel(host, port)
+    def create_connection():
+        if secure:
+            new_conn = httpclient.HTTPSConnection(conn_host,
+                                                  conn_port,
+                                                  timeout=timeout)
+            if use_proxy:
+                new_conn.set_tunnel(host, port)
+        else:
+            new_conn = httpclient.HTTPConnection(conn_host,
+                                                 conn_port,
+                                                 timeout=timeout)
+        return new_conn
+
+    pool_key = (secure, host, port, proxy_host, proxy_port)
+    conn = _http_connection_pool.acquire(pool_key) if keep_alive else None
+    reused = conn is not None
+    if reused:
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
     else:
-        conn = httpclient.HTTPConnection(conn_host,
-                                         conn_port,
-                                         timeout=timeout)
+        conn = create_connection()
 
     payload = data
     if redact_data:
@@ -362,8 +804,25 @@ def _http_request(method, host, rel_uri, timeout, port=None, data=None, secure=F
                    textutil.str_to_encoded_ustr(payload),
                    headers)
 
-    conn.request(method=method, url=url, body=data, headers=headers)
-    return conn.getresponse()
+    try:
+        conn.request(method=method, url=url, body=data, headers=headers)
+        resp = conn.getresponse()
+    except (IOError, httpclient.BadStatusLine) as e:
+        _close_connection(conn)
+        if not reused or not _is_closed_connection_error(e):
+            raise
+        # The server may close an idle keep-alive connection at any time; in that case the server closes the connection without
+        # sending any part of a response, so the request can be sent again on a new connection. Timeouts are never retried, since
+        # the server may still be processing the request.
+        logger.verbose("HTTP keep-alive connection to {0}:{1} was closed by the remote end ({2}); reconnecting", conn_host, conn_port, ustr(e))
+        conn = create_connection()
+        conn.request(method=method, url=url, body=data, headers=headers)
+        resp = conn.getresponse()
+
+    if keep_alive:
+        _http_connection_pool.release(pool_key, conn, resp)
+
+    return resp
 
 
 def http_request(method,
@@ -429,6 +888,13 @@ def http_request(method,
     attempt = 0
     delay = 0
     was_throttled = False
+    was_delayed_by_budget = False
+    endpoint = _get_endpoint(host, port)
+    operation = _get_operation(method, endpoint, rel_uri)
+    bytes_sent = len(data) if isinstance(data, (bytes, ustr, str)) else 0
+    # Requests to the WireServer and HostGAPlugin are paced by a shared budget, which also implements the delay on throttling
+    request_budget = get_wireserver_request_budget() if endpoint in (HttpEndpoint.WireServer, HttpEndpoint.HostPlugin) and not return_raw_response else None
+    priority = _get_priority(operation)
 
     while attempt < max_retry:
         if attempt > 0:
@@ -438,7 +904,8 @@ def http_request(method,
             # -- Otherwise, compute a delay that is the product of the next
             #    item in the Fibonacci series and the initial delay value
             if was_throttled:
-                delay = throttle_delay
+                # when the request is subject to the budget, the budget delays the request
+                delay = 0 if was_delayed_by_budget else throttle_delay
             else:
                 delay = _compute_delay(retry_attempt=attempt, delay=retry_delay)
 
@@ -449,22 +916,37 @@ def http_request(method,
                         delay, 
                         msg) 
 
-            time.sleep(delay)
+            if delay > 0:
+                time.sleep(delay)
 
         attempt += 1
 
         try:
-            resp = _http_request(method,
-                                 host,
-                                 rel_uri,
-                                 timeout,
-                                 port=port,
-                                 data=data,
-                                 secure=secure,
-                                 headers=headers,
-                                 proxy_host=proxy_host,
-                                 proxy_port=proxy_port,
-                                 redact_data=redact_data)
+            if request_budget is not None:
+                request_budget.acquire(priority)
+            request_start = time.time()
+            try:
+                resp = _http_request(method,
+                                     host,
+                                     rel_uri,
+                                     timeout,
+                                     port=port,
+                                     data=data,
+                                     secure=secure,
+                                     headers=headers,
+                                     proxy_host=proxy_host,
+                                     proxy_port=proxy_port,
+                                     redact_data=redact_data)
+            except Exception:
+                HttpRequestStatistics.record(endpoint, operation, time.time() - request_start, bytes_sent, is_retry=attempt > 1)
+                raise
+            HttpRequestStatistics.record(endpoint, operation, time.time() - request_start, bytes_sent, response=resp, is_retry=attempt > 1)
+            if request_budget is not None:
+                # 403 (Forbidden) is retried as a throttle, but it is specific to the request (e.g. an expired certificate), so it does
+                # not affect the budget
+                is_throttled = _is_throttle_status(resp.status) and resp.status != httpclient.FORBIDDEN
+                was_delayed_by_budget = is_throttled
+                request_budget.on_response(is_throttled, priority=priority, retry_after=_get_retry_after(resp) if is_throttled else None, throttle_delay=throttle_delay)
 
             logger.verbose("[HTTP Response] Status Code {0}", resp.status)
 
@@ -663,6 +1145,17 @@ def request_failed_at_hostplugin(resp, upstream_failure_codes=None):
     return resp is not None and resp.status >= 500 and resp.status not in upstream_failure_codes
 
 
+def get_response_header(resp, name):
+    """
+    Returns the value of the given header (case-insensitive), or None if the response does not include it
+    """
+    name = name.lower()
+    for header_name, header_value in resp.getheaders():
+        if header_name.lower() == name:
+            return header_value
+    return None
+
+
 def read_response_error(resp):
     result = ''
     if resp is not None:
@@ -0,0 +1,86 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import threading
+
+from azurelinuxagent.common.future import Queue, Empty
+
+
+class OperationResult(object):
+    """
+    Result of an operation executed by run_concurrently(); 'exception' is None if the operation succeeded.
+    """
+    def __init__(self, result=None, exception=None):
+        self.result = result
+        self.exception = exception
+
+
+def run_concurrently(operations, max_workers, thread_name="ConcurrentOperation", stop_on_error=False):
+    """
+    Invokes each of the given callables on a pool of at most 'max_workers' threads and waits for all of them to complete.
+
+    Returns a list of OperationResult in the same order as 'operations'. Exceptions raised by the operations are captured in
+    the corresponding OperationResult; it is up to the caller to decide how to handle them. If 'stop_on_error' is True, the
+    operations that have not started when an operation fails are not invoked; their entries in the list are None.
+
+    If there is only one operation, or if max_workers is 1 or less, the operations are invoked sequentially on the calling thread.
+    """
+    results = [None] * len(operations)
+    failed = threading.Event()
+
+    def invoke(index):
+        try:
+            results[index] = OperationResult(result=operations[index]())
+        except Exception as exception:
+            results[index] = OperationResult(exception=exception)
+            failed.set()
+
+    def should_stop():
+        return stop_on_error and failed.is_set()
+
+    if len(operations) <= 1 or max_workers <= 1:
+        for i in range(len(operations)):
+            if should_stop():
+                break
+            invoke(i)
+        return results
+
+    pending = Queue()
+    for i in range(len(operations)):
+        pending.put(i)
+
+    def worker():
+        while not should_stop():
+            try:
+                index = pending.get_nowait()
+            except Empty:
+                return
+            invoke(index)
+
+    threads = []
+    for i in range(min(max_workers, len(operations))):
+        thread = threading.Thread(target=worker)
+        thread.name = "{0}-{1}".format(thread_name, i)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    return results
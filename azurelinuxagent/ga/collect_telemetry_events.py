@@ -27,15 +27,18 @@ from collections import defaultdict
 import azurelinuxagent.common.logger as logger
 from azurelinuxagent.common import conf
 from azurelinuxagent.common.agent_supported_feature import get_supported_feature_by_name, SupportedFeatureNames
+from azurelinuxagent.common.datacontract import get_properties
 from azurelinuxagent.common.event import EVENTS_DIRECTORY, TELEMETRY_LOG_EVENT_ID, \
     TELEMETRY_LOG_PROVIDER_ID, add_event, WALAEventOperation, add_log_event, get_event_logger, \
     CollectOrReportEventDebugInfo, EVENT_FILE_REGEX, parse_event
+from azurelinuxagent.common.event_spool import EVENT_SPOOL_DIRECTORY, get_event_spool
 from azurelinuxagent.common.exception import InvalidExtensionEventError, ServiceStoppedError, EventError
 from azurelinuxagent.common.future import ustr, is_file_not_found_error
 from azurelinuxagent.ga.interfaces import ThreadHandlerInterface
 from azurelinuxagent.common.telemetryevent import TelemetryEvent, TelemetryEventParam, \
     GuestAgentGenericLogsSchema, GuestAgentExtensionEventsSchema
 from azurelinuxagent.common.utils import textutil
+from azurelinuxagent.common.utils.jsonutil import JsonArrayReader
 from azurelinuxagent.ga.exthandlers import HANDLER_NAME_PATTERN
 from azurelinuxagent.ga.periodic_operation import PeriodicOperation
 
@@ -86,7 +89,7 @@ class _ProcessExtensionEvents(PeriodicOperation):
 
     # Limits
     _MAX_NUMBER_OF_EVENTS_PER_EXTENSION_PER_PERIOD = 360
-    _EXTENSION_EVENT_FILE_MAX_SIZE = 4 * 1024 * 1024  # 4 MB = 4 * 1,048,576 Bytes
+    _EXTENSION_EVENT_FILE_MAX_SIZE = 4 * 1024 * 1024  # 4 MB = 4 * 1,048,576 Bytes. Only this much of larger files is processed.
     _EXTENSION_EVENT_MAX_SIZE = 1024 * 6  # 6Kb or 6144 characters. Limit for the whole event. Prevent oversized events.
     _EXTENSION_EVENT_MAX_MSG_LEN = 1024 * 3  # 3Kb or 3072 chars.
 
@@ -154,19 +157,6 @@ class _ProcessExtensionEvents(PeriodicOperation):
 
         return extension_handler_with_event_dirs
 
-    def _event_file_size_allowed(self, event_file_path):
-
-        event_file_size = os.stat(event_file_path).st_size
-        if event_file_size > self._EXTENSION_EVENT_FILE_MAX_SIZE:
-            convert_to_mb = lambda x: (1.0 * x) / (1000 * 1000)
-            msg = "Skipping file: {0} as its size is {1:.2f} Mb > Max size allowed {2:.1f} Mb".format(
-                event_file_path, convert_to_mb(event_file_size),
-                convert_to_mb(self._EXTENSION_EVENT_FILE_MAX_SIZE))
-            logger.warn(msg)
-            add_log_event(level=logger.LogLevel.WARNING, message=msg, forced=True)
-            return False
-        return True
-
     def _capture_extension_events(self, handler_name, handler_event_dir_path):
         """
         Capture Extension events and add them to the events_list
@@ -190,10 +180,7 @@ class _ProcessExtensionEvents(PeriodicOperation):
                 try:
                     logger.verbose("Processing event file: {0}", event_file_path)
 
-                    if not self._event_file_size_allowed(event_file_path):
-                        continue
-
-                    # We support multiple events in a file, read the file and parse events.
+                    # We support multiple events in a file; the events are parsed (and enqueued) as the file is read.
                     captured_extension_events_count = self._enqueue_events_and_get_count(handler_name, event_file_path,
                                                                                          captured_extension_events_count,
                                                                                          dropped_events_with_error_count)
@@ -218,7 +205,8 @@ class _ProcessExtensionEvents(PeriodicOperation):
                 finally:
                     # Todo: We should delete files after ensuring that we sent the data to Wireserver successfully
                     # from our end rather than deleting first and sending later. This is to ensure the data reliability
-                    # of the agent telemetry pipeline.
+                    # of the agent telemetry pipeline. (When the event spool is enabled, the events are already in the
+                    # spool at this point.)
                     os.remove(event_file_path)
 
         finally:
@@ -253,26 +241,41 @@ class _ProcessExtensionEvents(PeriodicOperation):
                                      ustr(error))
                         log_err = False
 
-    @staticmethod
-    def _read_event_file(event_file_path):
-        """
-        Read the event file and return the data.
-        :param event_file_path: Full path of the event file.
-        :return: Event data in list or string format.
-        """
-        # Retry for reading the event file in case file is modified while reading
-        # We except FileNotFoundError and ValueError to handle the case where the file is deleted or modified while reading
+    def _enqueue_events_and_get_count(self, handler_name, event_file_path, captured_events_count,
+                                      dropped_events_with_error_count):
+
+        event_file_time = datetime.datetime.fromtimestamp(os.path.getmtime(event_file_path))
+
+        # Retry reading the event file in case it is modified while reading. We except FileNotFoundError and ValueError to handle the
+        # case where the file is deleted or modified while reading; once some events of the file have been enqueued, it is not retried.
         error_count = 0
         while True:
+            events_in_file = 0
             try:
-                # Read event file and decode it properly
                 with open(event_file_path, "rb") as event_file_descriptor:
-                    event_data = event_file_descriptor.read().decode("utf-8")
+                    # We allow multiple events in a file but there can be an instance where the file only has a single
+                    # JSON event and not a list; the reader handles that condition too
+                    events = JsonArrayReader(event_file_descriptor, max_bytes=self._EXTENSION_EVENT_FILE_MAX_SIZE)
+
+                    for event in events:
+                        events_in_file += 1
+                        captured_events_count = self._enqueue_extension_event(handler_name, event, event_file_time, captured_events_count,
+                                                                              dropped_events_with_error_count)
+                        # stop reading the file as soon as the limit is reached
+                        if captured_events_count >= self._MAX_NUMBER_OF_EVENTS_PER_EXTENSION_PER_PERIOD:
+                            return captured_events_count
+
+                    if events.truncated:
+                        convert_to_mb = lambda x: (1.0 * x) / (1000 * 1000)
+                        msg = "Processed only the first {2:.1f} Mb of file: {0} as its size is {1:.2f} Mb > Max size allowed".format(
+                            event_file_path, convert_to_mb(os.path.getsize(event_file_path)),
+                            convert_to_mb(self._EXTENSION_EVENT_FILE_MAX_SIZE))
+                        logger.warn(msg)
+                        add_log_event(level=logger.LogLevel.WARNING, message=msg, forced=True)
 
-                # Parse the string and get the list of events
-                return json.loads(event_data)
+                return captured_events_count
             except Exception as e:
-                if is_file_not_found_error(e) or isinstance(e, ValueError):
+                if events_in_file == 0 and (is_file_not_found_error(e) or isinstance(e, ValueError)):
                     error_count += 1
                     if error_count >= NUM_OF_EVENT_FILE_RETRIES:
                         raise
@@ -280,43 +283,36 @@ class _ProcessExtensionEvents(PeriodicOperation):
                     raise
             time.sleep(EVENT_FILE_RETRY_DELAY)
 
-    def _enqueue_events_and_get_count(self, handler_name, event_file_path, captured_events_count,
-                                      dropped_events_with_error_count):
-
-        event_file_time = datetime.datetime.fromtimestamp(os.path.getmtime(event_file_path))
-
-        events = self._read_event_file(event_file_path)
-
-        # We allow multiple events in a file but there can be an instance where the file only has a single
-        # JSON event and not a list. Handling that condition too
-        if not isinstance(events, list):
-            events = [events]
-
-        for event in events:
-            try:
-                self._send_telemetry_events_handler.enqueue_event(
-                    self._parse_telemetry_event(handler_name, event, event_file_time)
-                )
-                captured_events_count += 1
-            except InvalidExtensionEventError as invalid_error:
-                # These are the errors thrown if there's an error parsing the event. We want to report these back to the
-                # extension publishers so that they are aware of the issues.
-                # The error messages are all static messages, we will use this to create a dict and emit an event at the
-                # end of each run to notify if there were any errors parsing events for the extension
-                dropped_events_with_error_count[ustr(invalid_error)] += 1
-            except ServiceStoppedError as stopped_error:
-                logger.error(
-                    "Unable to enqueue events as service stopped: {0}. Stopping collecting extension events".format(
-                        ustr(stopped_error)))
-                raise
-            except Exception as error:
-                logger.warn("Unable to parse and transmit event, error: {0}".format(error))
-
-            if captured_events_count >= self._MAX_NUMBER_OF_EVENTS_PER_EXTENSION_PER_PERIOD:
-                break
+    def _enqueue_extension_event(self, handler_name, event, event_file_time, captured_events_count, dropped_events_with_error_count):
+        try:
+            self._enqueue_event(self._parse_telemetry_event(handler_name, event, event_file_time))
+            captured_events_count += 1
+        except InvalidExtensionEventError as invalid_error:
+            # These are the errors thrown if there's an error parsing the event. We want to report these back to the
+            # extension publishers so that they are aware of the issues.
+            # The error messages are all static messages, we will use this to create a dict and emit an event at the
+            # end of each run to notify if there were any errors parsing events for the extension
+            dropped_events_with_error_count[ustr(invalid_error)] += 1
+        except ServiceStoppedError as stopped_error:
+            logger.error(
+                "Unable to enqueue events as service stopped: {0}. Stopping collecting extension events".format(
+                    ustr(stopped_error)))
+            raise
+        except Exception as error:
+            logger.warn("Unable to parse and transmit event, error: {0}".format(error))
 
         return captured_events_count
 
+    def _enqueue_event(self, event):
+        """
+        When the event spool is enabled, the event is appended to the spool (and it is sent, and acknowledged, along with the agent's
+        events), so that it is not lost if the agent stops before sending it; otherwise, it is enqueued directly.
+        """
+        if conf.get_enable_event_spool():
+            get_event_spool().append(json.dumps(get_properties(event)).encode("utf-8"))
+        else:
+            self._send_telemetry_events_handler.enqueue_event(event)
+
     def _parse_telemetry_event(self, handler_name, extension_unparsed_event, event_file_time):
         """
         Parse the Json event file and convert it to TelemetryEvent object with the required data.
@@ -419,6 +415,7 @@ class _CollectAndEnqueueEvents(PeriodicOperation):
     """
 
     _EVENT_COLLECTION_PERIOD = datetime.timedelta(minutes=1)
+    _MAX_SPOOLED_EVENTS_PER_READ = 100
 
     def __init__(self, send_telemetry_events_handler):
         super(_CollectAndEnqueueEvents, self).__init__(_CollectAndEnqueueEvents._EVENT_COLLECTION_PERIOD)
@@ -493,8 +490,44 @@ class _CollectAndEnqueueEvents(PeriodicOperation):
             except Exception as error:
                 debug_info.update_op_error(error)
 
+        self._process_spooled_events(debug_info)
+
         debug_info.report_debug_info()
 
+    def _process_spooled_events(self, debug_info):
+        """
+        Enqueues the events in the event spool that were not enqueued yet. The events are tagged with their position in the spool and
+        the sender advances the read cursor of the spool only after the events are sent; events that are not sent are read again after
+        a restart. When the telemetry queue is full, reading stops at the first event that is not queued and continues from that event
+        on the next iteration.
+        """
+        if not os.path.isdir(os.path.join(conf.get_lib_dir(), EVENT_SPOOL_DIRECTORY)):
+            return
+
+        spool = get_event_spool()
+        while True:
+            position = spool.tell()
+            records = spool.read(max_records=self._MAX_SPOOLED_EVENTS_PER_READ)
+            for record in records:
+                if record.data is not None:
+                    try:
+                        if not self._send_telemetry_events_handler.enqueue_event(parse_event(record.data.decode("utf-8")), spool_position=record.position):
+                            logger.verbose("The telemetry queue is full; will continue reading the event spool on the next iteration")
+                            spool.seek(position)
+                            return
+                    except ServiceStoppedError as stopped_error:
+                        logger.error("Unable to enqueue events as service stopped: {0}, skipping events collection".format(ustr(stopped_error)))
+                        # read the events that were not enqueued again on the next iteration
+                        spool.seek(position)
+                        return
+                    except UnicodeError as uni_err:
+                        debug_info.update_unicode_error(uni_err)
+                    except Exception as error:
+                        debug_info.update_op_error(error)
+                position = record.position
+            if len(records) < self._MAX_SPOOLED_EVENTS_PER_READ:
+                return
+
     @staticmethod
     def _read_and_parse_event_file(event_file_path):
         """
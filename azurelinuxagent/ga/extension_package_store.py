@@ -0,0 +1,231 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+
+from azurelinuxagent.common import conf, logger
+from azurelinuxagent.common.future import ustr
+
+PACKAGE_STORE_DIRECTORY_NAME = "ExtensionPackageStore"
+
+_OBJECTS_DIRECTORY_NAME = "objects"
+_PACKAGES_DIRECTORY_NAME = "packages"
+_TEMP_DIRECTORY_NAME = "tmp"
+_READ_BUFFER_SIZE = 64 * 1024
+
+
+class ExtensionPackageStore(object):
+    """
+    Content-addressed store for the files in extension packages.
+
+    Each file in a package is stored once, named after the SHA-256 of its content, under '<lib_dir>/ExtensionPackageStore/objects'; the
+    handler directories are populated with hard links to those objects (falling back to a copy if a link cannot be created). Files
+    that are identical across packages (e.g. across versions of the same extension) are written to disk only once. The store also
+    keeps an index of each package (keyed by the SHA-256 of the ZIP) so that a package that was already extracted can be materialized
+    again without decompressing it.
+
+    The reference count of an object is the link count of its inode: an object whose only link is the one in the store is not used by
+    any handler directory and is deleted by collect_garbage().
+
+    NOTE: Since the handler directories share inodes with the store, an extension that modifies its own files in place would modify
+    them for all the handler directories that share them.
+    """
+    # extraction and garbage collection must not run concurrently (a new object has a single link until it is linked into the handler directory)
+    _lock = threading.RLock()
+
+    def __init__(self, store_directory=None):
+        self._store_directory = store_directory if store_directory is not None else os.path.join(conf.get_lib_dir(), PACKAGE_STORE_DIRECTORY_NAME)
+        self._objects_directory = os.path.join(self._store_directory, _OBJECTS_DIRECTORY_NAME)
+        self._packages_directory = os.path.join(self._store_directory, _PACKAGES_DIRECTORY_NAME)
+        self._temp_directory = os.path.join(self._store_directory, _TEMP_DIRECTORY_NAME)
+
+    def extract(self, package_file, target_directory):
+        """
+        Expands the given ZIP package into 'target_directory', linking each of its files to the corresponding object in the store
+        """
+        with ExtensionPackageStore._lock:
+            for directory in [self._objects_directory, self._packages_directory, self._temp_directory]:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+
+            package_hash = ExtensionPackageStore._get_file_hash(package_file)
+            index = self._load_index(package_hash)
+            if index is None:
+                index = self._add_package(package_file, package_hash)
+            else:
+                logger.verbose("Package {0} is already in the store [{1}]", package_file, package_hash)
+
+            for name in index["directories"]:
+                path = ExtensionPackageStore._get_target_path(target_directory, name)
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            for name, object_hash in index["files"]:
+                self._link_object(object_hash, ExtensionPackageStore._get_target_path(target_directory, name))
+
+    def collect_garbage(self):
+        """
+        Deletes the objects that are not linked from any handler directory, as well as the indexes of the packages that use them.
+        Returns the number of objects deleted.
+        """
+        if not os.path.isdir(self._objects_directory):
+            return 0
+
+        with ExtensionPackageStore._lock:
+            deleted = set()
+            for root, _, files in os.walk(self._objects_directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        if os.stat(path).st_nlink <= 1:
+                            os.remove(path)
+                            deleted.add(name)
+                    except Exception as exception:
+                        logger.warn("Can't delete {0} from the extension package store: {1}", path, ustr(exception))
+
+            if len(deleted) > 0:
+                for name in os.listdir(self._packages_directory):
+                    path = os.path.join(self._packages_directory, name)
+                    index = ExtensionPackageStore._read_index(path)
+                    if index is None or any(object_hash in deleted for _, object_hash in index["files"]):
+                        try:
+                            os.remove(path)
+                        except Exception as exception:
+                            logger.warn("Can't delete {0} from the extension package store: {1}", path, ustr(exception))
+                logger.info("Removed {0} unused objects from the extension package store", len(deleted))
+
+            return len(deleted)
+
+    def _add_package(self, package_file, package_hash):
+        directories = []
+        files = []
+        zip_file = zipfile.ZipFile(package_file)
+        try:
+            for info in zip_file.infolist():
+                if info.filename.endswith('/'):
+                    directories.append(info.filename)
+                else:
+                    files.append([info.filename, self._add_object(zip_file, info)])
+        finally:
+            zip_file.close()
+
+        index = {"directories": directories, "files": files}
+        temp_file = os.path.join(self._temp_directory, package_hash + ".json")
+        with open(temp_file, "w") as file_:
+            json.dump(index, file_)
+        os.rename(temp_file, self._get_index_path(package_hash))
+        return index
+
+    def _add_object(self, zip_file, info):
+        """
+        Stores the given member of the ZIP in the store, unless an object with the same content already exists. Returns the hash of the member.
+        """
+        file_descriptor, temp_file = tempfile.mkstemp(dir=self._temp_directory)
+        try:
+            sha256 = hashlib.sha256()
+            with os.fdopen(file_descriptor, "wb") as output:
+                member = zip_file.open(info)
+                try:
+                    while True:
+                        buffer = member.read(_READ_BUFFER_SIZE)
+                        if len(buffer) == 0:
+                            break
+                        sha256.update(buffer)
+                        output.write(buffer)
+                finally:
+                    member.close()
+            object_hash = sha256.hexdigest()
+            object_path = self._get_object_path(object_hash)
+            if os.path.exists(object_path):
+                os.remove(temp_file)
+            else:
+                object_directory = os.path.dirname(object_path)
+                if not os.path.isdir(object_directory):
+                    os.makedirs(object_directory)
+                os.rename(temp_file, object_path)
+            return object_hash
+        except Exception:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    def _link_object(self, object_hash, target_path):
+        object_path = self._get_object_path(object_hash)
+        target_parent = os.path.dirname(target_path)
+        if not os.path.isdir(target_parent):
+            os.makedirs(target_parent)
+        if os.path.lexists(target_path):
+            os.remove(target_path)
+        try:
+            os.link(object_path, target_path)
+        except OSError as exception:
+            # e.g. the handler directory is on a different file system, or the file system does not support hard links
+            if exception.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP]:
+                raise
+            shutil.copyfile(object_path, target_path)
+
+    def _load_index(self, package_hash):
+        index = ExtensionPackageStore._read_index(self._get_index_path(package_hash))
+        if index is None:
+            return None
+        # the index is usable only if none of its objects has been garbage-collected
+        if not all(os.path.exists(self._get_object_path(object_hash)) for _, object_hash in index["files"]):
+            return None
+        return index
+
+    @staticmethod
+    def _read_index(path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as file_:
+                index = json.load(file_)
+            return {"directories": index["directories"], "files": index["files"]}
+        except Exception as exception:
+            logger.warn("Ignoring invalid package index {0}: {1}", path, ustr(exception))
+            return None
+
+    def _get_index_path(self, package_hash):
+        return os.path.join(self._packages_directory, package_hash + ".json")
+
+    def _get_object_path(self, object_hash):
+        return os.path.join(self._objects_directory, object_hash[0:2], object_hash)
+
+    @staticmethod
+    def _get_target_path(target_directory, name):
+        # same protection as ZipFile.extractall() against members with absolute paths or ".." components
+        components = [c for c in name.replace('\\', '/').split('/') if c not in ('', '.', '..')]
+        if len(components) == 0:
+            return target_directory
+        return os.path.join(target_directory, *components)
+
+    @staticmethod
+    def _get_file_hash(path):
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as file_:
+            while True:
+                buffer = file_.read(_READ_BUFFER_SIZE)
+                if len(buffer) == 0:
+                    break
+                sha256.update(buffer)
+        return sha256.hexdigest()
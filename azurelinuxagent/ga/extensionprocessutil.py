@@ -20,6 +20,8 @@
 import os
 import re
 import signal
+import subprocess
+import sys
 import time
 
 from azurelinuxagent.common import conf
@@ -39,22 +41,32 @@ def wait_for_process_completion_or_timeout(process, timeout, cpu_controller):
     :param timeout: Number of seconds to wait for the process to complete before killing it
     :return: Two parameters: boolean for if the process timed out and the return code of the process (None if timed out)
     """
-    while timeout > 0 and process.poll() is None:
-        time.sleep(1)
-        timeout -= 1
-
-    return_code = None
+    return_code = _wait_for_process(process, timeout)
     throttled_time = 0
+    timed_out = return_code is None
 
-    if timeout == 0:
+    if timed_out:
         throttled_time = get_cpu_throttled_time(cpu_controller)
         os.killpg(os.getpgid(process.pid), signal.SIGKILL)
-    else:
-        # process completed or forked; sleep 1 sec to give the child process (if any) a chance to start
-        time.sleep(1)
-        return_code = process.wait()
 
-    return timeout == 0, return_code, throttled_time
+    return timed_out, return_code, throttled_time
+
+
+def _wait_for_process(process, timeout):
+    """
+    Waits for the process to complete for at most 'timeout' seconds. Returns the return code of the process, or None if it did not complete.
+    On Python 3 this is a blocking wait; Python 2 does not support timeouts on Popen.wait(), so there the process is polled every second.
+    """
+    if sys.version_info[0] >= 3:
+        try:
+            return process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return None
+
+    while timeout > 0 and process.poll() is None:
+        time.sleep(1)
+        timeout -= 1
+    return process.poll()
 
 
 def handle_process_completion(process, command, timeout, stdout, stderr, error_code, cpu_controller=None):
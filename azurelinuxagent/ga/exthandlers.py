@@ -39,6 +39,8 @@ from azurelinuxagent.common import event
 from azurelinuxagent.common.agent_supported_feature import get_agent_supported_features_list_for_extensions, \
     SupportedFeatureNames, get_supported_feature_by_name, get_agent_supported_features_list_for_crp
 from azurelinuxagent.ga.cgroupconfigurator import CGroupConfigurator
+from azurelinuxagent.ga.extension_package_store import ExtensionPackageStore
+from azurelinuxagent.ga.handler_state_store import get_handler_state_store
 from azurelinuxagent.common.datacontract import get_properties, set_properties
 from azurelinuxagent.common.errorstate import ErrorState
 from azurelinuxagent.common.event import add_event, elapsed_milliseconds, WALAEventOperation, \
@@ -48,11 +50,16 @@ from azurelinuxagent.common.exception import ExtensionDownloadError, ExtensionEr
     GoalStateAggregateStatusCodes, MultiConfigExtensionEnableError
 from azurelinuxagent.common.future import ustr, is_file_not_found_error
 from azurelinuxagent.common.protocol.extensions_goal_state import GoalStateSource
+from azurelinuxagent.common.protocol.extensions_goal_state_diff import ExtensionsGoalStateDiff
+from azurelinuxagent.common.protocol.resumable_download import ResumableDownload
 from azurelinuxagent.common.protocol.restapi import ExtensionStatus, ExtensionSubStatus, Extension, ExtHandlerStatus, \
     VMStatus, GoalStateAggregateStatus, ExtensionState, ExtensionRequestedState, ExtensionSettings
-from azurelinuxagent.common.utils import textutil
+from azurelinuxagent.common.utils import textutil, timeutil
 from azurelinuxagent.common.utils.archive import ARCHIVE_DIRECTORY_NAME
+from azurelinuxagent.common.utils.filecache import get_parsed_file_cache
+from azurelinuxagent.common.utils.filewatcher import FileWatcher
 from azurelinuxagent.common.utils.flexible_version import FlexibleVersion
+from azurelinuxagent.common.utils.threadutil import run_concurrently
 from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION
 
 _HANDLER_NAME_PATTERN = r'^([^-]+)'
@@ -60,6 +67,8 @@ _HANDLER_VERSION_PATTERN = r'(\d+(?:\.\d+)*)'
 _HANDLER_PATTERN = _HANDLER_NAME_PATTERN + r"-" + _HANDLER_VERSION_PATTERN
 _HANDLER_PKG_PATTERN = re.compile(_HANDLER_PATTERN + r'\.zip$', re.IGNORECASE)
 _DEFAULT_EXT_TIMEOUT_MINUTES = 90
+# Period (in seconds) to check the status of an extension while waiting for it to complete (if the status directory cannot be watched for changes)
+_EXT_STATUS_POLL_PERIOD = 5
 
 _VALID_HANDLER_STATUS = ['Ready', 'NotReady', "Installing", "Unresponsive"]
 
@@ -282,9 +291,13 @@ class ExtHandlersHandler(object):
         self.__gs_aggregate_status = None
         # CRP Activity ID for the goal state that is being processed. Initialized once we start processing the goal state.
         self._gs_activity_id = '00000000-0000-0000-0000-000000000000'
+        # Extensions in the last goal state that was processed; used to find the handlers that did not change in a new goal state
+        self._last_processed_extensions = None
 
         self.report_status_error_state = ErrorState()
 
+        get_handler_state_store().recover()
+
     def __last_gs_unsupported(self):
 
         # Return if the last GoalState was unsupported
@@ -314,12 +327,19 @@ class ExtHandlersHandler(object):
             logger.info(message)
             add_event(op=WALAEventOperation.ExtensionProcessing, message=message)
 
+            extensions_diff = ExtensionsGoalStateDiff(self._last_processed_extensions, egs.extensions)
+            logger.info("Changes in the extensions goal state: [{0}]", extensions_diff)
+
             try:
-                self.__process_and_handle_extensions(egs.svd_sequence_number, egs.id)
-                self._cleanup_outdated_handlers()
+                # the changes to the state of the handlers are journaled as they are made and committed together once the goal state
+                # has been processed
+                with get_handler_state_store().transaction():
+                    self.__process_and_handle_extensions(egs.svd_sequence_number, egs.id, extensions_diff)
+                    self._cleanup_outdated_handlers()
             except Exception as e:
                 error = u"Error processing extensions:{0}".format(textutil.format_exception(e))
             finally:
+                self._last_processed_extensions = copy.deepcopy(egs.extensions)
                 duration = elapsed_milliseconds(utc_start)
                 if error is None:
                     message = 'ProcessExtensionsGoalState completed [{0} {1} ms]\n'.format(egs.id, duration)
@@ -339,7 +359,7 @@ class ExtHandlersHandler(object):
         supported_features = get_agent_supported_features_list_for_crp()
         return [feature for feature in required_features if feature not in supported_features]
 
-    def __process_and_handle_extensions(self, svd_sequence_number, goal_state_id):
+    def __process_and_handle_extensions(self, svd_sequence_number, goal_state_id, extensions_diff):
         try:
             # Verify we satisfy all required features, if any. If not, report failure here itself, no need to process anything further.
             unsupported_features = self.__get_unsupported_features()
@@ -354,7 +374,7 @@ class ExtHandlersHandler(object):
                           message=msg,
                           log_event=False)
             else:
-                self.handle_ext_handlers(goal_state_id)
+                self.handle_ext_handlers(goal_state_id, extensions_diff)
                 self.__gs_aggregate_status = GoalStateAggregateStatus(status=GoalStateStatus.Success, seq_no=svd_sequence_number,
                                                                       code=GoalStateAggregateStatusCodes.Success,
                                                                       message="GoalState executed successfully")
@@ -436,6 +456,15 @@ class ExtHandlersHandler(object):
                     logger.verbose("Removed extension package {0}".format(pkg))
                 except OSError as e:
                     logger.warn("Failed to remove extension package {0}: {1}".format(pkg, e.strerror))
+            # also remove any partial download of the package
+            ResumableDownload.cleanup(pkg)
+
+        # Remove the files in the package store that are no longer used by any handler directory
+        if conf.get_enable_extension_package_store():
+            try:
+                ExtensionPackageStore().collect_garbage()
+            except Exception as e:
+                logger.warn("Failed to clean up the extension package store: {0}", ustr(e))
 
     def _extensions_on_hold(self):
         if conf.get_enable_overprovisioning():
@@ -468,7 +497,15 @@ class ExtHandlersHandler(object):
 
         return all_extensions
 
-    def handle_ext_handlers(self, goal_state_id):
+    def handle_ext_handlers(self, goal_state_id, extensions_diff=None):
+        """
+        Processes the extensions in the goal state. If 'extensions_diff' (an ExtensionsGoalStateDiff with respect to the previous goal state)
+        is given, the handlers that did not change and that were processed successfully are skipped.
+
+        Extensions are processed by dependency level; the extensions of different handlers within the same level are independent of each other
+        and are processed concurrently (up to Debug.ExtensionProcessingConcurrency at a time). The extensions of a single handler are always
+        processed sequentially.
+        """
         if not self.ext_handlers:
             logger.info("No extension handlers found, not processing anything.")
             return
@@ -481,79 +518,218 @@ class ExtHandlersHandler(object):
 
         depends_on_err_msg = None
         extensions_enabled = conf.get_extensions_enabled()
+        max_workers = conf.get_extension_processing_concurrency()
 
-        for extension, ext_handler in all_extensions:
-
-            handler_i = ExtHandlerInstance(ext_handler, self.protocol, extension=extension)
-
-            # In case of extensions disabled, we skip processing extensions. But CRP is still waiting for some status
-            # back for the skipped extensions. In order to propagate the status back to CRP, we will report status back
-            # here with an error message.
-            if not extensions_enabled:
-                agent_conf_file_path = get_osutil().agent_conf_file_path
-                msg = "Extension will not be processed since extension processing is disabled. To enable extension " \
-                      "processing, set Extensions.Enabled=y in '{0}'".format(agent_conf_file_path)
-                ext_full_name = handler_i.get_extension_full_name(extension)
-                logger.info('')
-                logger.info("{0}: {1}".format(ext_full_name, msg))
-                add_event(op=WALAEventOperation.ExtensionProcessing, message="{0}: {1}".format(ext_full_name, msg))
-                handler_i.set_handler_status(status=ExtHandlerStatusValue.not_ready, message=msg, code=-1)
-                handler_i.create_status_file_if_not_exist(extension,
-                                                          status=ExtensionStatusValue.error,
-                                                          code=-1,
-                                                          operation=handler_i.operation,
-                                                          message=msg)
-                continue
+        unchanged_handlers = self.__get_unchanged_handlers(extensions_diff) if extensions_enabled else set()
 
-            # In case of depends-on errors, we skip processing extensions if there was an error processing dependent extensions.
-            # But CRP is still waiting for some status back for the skipped extensions. In order to propagate the status back to CRP,
-            # we will report status back here with the relevant error message for each of the dependent extension.
-            if depends_on_err_msg is not None:
+        prefetched_manifests = self.__prefetch_extension_packages(unchanged_handlers) if extensions_enabled else {}
 
-                # For MC extensions, report the HandlerStatus as is and create a new placeholder per extension if doesnt exist
-                if handler_i.should_perform_multi_config_op(extension):
-                    # Ensure some handler status exists for the Handler, if not, set it here
-                    if handler_i.get_handler_status() is None:
-                        handler_i.set_handler_status(message=depends_on_err_msg, code=-1)
+        def process_extensions(extensions, depends_on_err_msg):
+            for extension, ext_handler in extensions:
+                depends_on_err_msg = self.__process_extension(extension, ext_handler, goal_state_id, depends_on_err_msg, extensions_enabled, unchanged_handlers,
+                                                              prefetched_manifests, wait_until, max_dep_level)
+            return depends_on_err_msg
 
-                    handler_i.create_status_file_if_not_exist(extension, status=ExtensionStatusValue.error, code=-1,
-                                                              operation=WALAEventOperation.ExtensionProcessing,
-                                                              message=depends_on_err_msg)
+        for level_extensions in self.__group_by_dependency_level(all_extensions):
+            handler_groups = self.__group_by_handler(level_extensions)
 
-                # For SC extensions, overwrite the HandlerStatus with the relevant message
-                else:
+            if max_workers <= 1 or len(handler_groups) <= 1:
+                depends_on_err_msg = process_extensions(level_extensions, depends_on_err_msg)
+                continue
+
+            # Failures within the level are propagated only to the following levels, since the handlers in the same level do not depend
+            # on each other
+            level_depends_on_err_msg = depends_on_err_msg
+            results = run_concurrently([partial(process_extensions, group, level_depends_on_err_msg) for group in handler_groups], max_workers,
+                                       thread_name="ExtensionProcessing")
+            for result in results:
+                if result.exception is not None:
+                    raise result.exception
+                if depends_on_err_msg is None:
+                    depends_on_err_msg = result.result
+
+    def __process_extension(self, extension, ext_handler, goal_state_id, depends_on_err_msg, extensions_enabled, unchanged_handlers, prefetched_manifests,
+                            wait_until, max_dep_level):
+        """
+        Processes the given extension and, if other extensions depend on it, waits for it to complete. Returns the error message that should
+        be reported for the extensions that depend on it, if any, or None otherwise.
+        """
+        handler_i = ExtHandlerInstance(ext_handler, self.protocol, extension=extension, extension_manifest=prefetched_manifests.get(ext_handler.name))
+
+        # In case of extensions disabled, we skip processing extensions. But CRP is still waiting for some status
+        # back for the skipped extensions. In order to propagate the status back to CRP, we will report status back
+        # here with an error message.
+        if not extensions_enabled:
+            agent_conf_file_path = get_osutil().agent_conf_file_path
+            msg = "Extension will not be processed since extension processing is disabled. To enable extension " \
+                  "processing, set Extensions.Enabled=y in '{0}'".format(agent_conf_file_path)
+            ext_full_name = handler_i.get_extension_full_name(extension)
+            logger.info('')
+            logger.info("{0}: {1}".format(ext_full_name, msg))
+            add_event(op=WALAEventOperation.ExtensionProcessing, message="{0}: {1}".format(ext_full_name, msg))
+            handler_i.set_handler_status(status=ExtHandlerStatusValue.not_ready, message=msg, code=-1)
+            handler_i.create_status_file_if_not_exist(extension,
+                                                      status=ExtensionStatusValue.error,
+                                                      code=-1,
+                                                      operation=handler_i.operation,
+                                                      message=msg)
+            return depends_on_err_msg
+
+        # In case of depends-on errors, we skip processing extensions if there was an error processing dependent extensions.
+        # But CRP is still waiting for some status back for the skipped extensions. In order to propagate the status back to CRP,
+        # we will report status back here with the relevant error message for each of the dependent extension.
+        if depends_on_err_msg is not None:
+
+            # For MC extensions, report the HandlerStatus as is and create a new placeholder per extension if doesnt exist
+            if handler_i.should_perform_multi_config_op(extension):
+                # Ensure some handler status exists for the Handler, if not, set it here
+                if handler_i.get_handler_status() is None:
                     handler_i.set_handler_status(message=depends_on_err_msg, code=-1)
 
-                continue
+                handler_i.create_status_file_if_not_exist(extension, status=ExtensionStatusValue.error, code=-1,
+                                                          operation=WALAEventOperation.ExtensionProcessing,
+                                                          message=depends_on_err_msg)
+
+            # For SC extensions, overwrite the HandlerStatus with the relevant message
+            else:
+                handler_i.set_handler_status(message=depends_on_err_msg, code=-1)
 
+            return depends_on_err_msg
+
+        if ext_handler.name in unchanged_handlers:
+            handler_i.logger.verbose("The handler did not change in goal state {0}; skipping it", goal_state_id)
+            extension_success = True
+        else:
             # Process extensions and get if it was successfully executed or not
             extension_success = self.handle_ext_handler(handler_i, extension, goal_state_id)
 
-            dep_level = self.__get_dependency_level((extension, ext_handler))
-            if 0 <= dep_level < max_dep_level:
-                extension_full_name = handler_i.get_extension_full_name(extension)
-                try:
-                    # Do no wait for extension status if the handler failed
-                    if not extension_success:
-                        raise Exception("Skipping processing of extensions since execution of dependent extension {0} failed".format(
-                                extension_full_name))
-
-                    # Wait for the extension installation until it is handled.
-                    # This is done for the install and enable. Not for the uninstallation.
-                    # If handled successfully, proceed with the current handler.
-                    # Otherwise, skip the rest of the extension installation.
-                    self.wait_for_handler_completion(handler_i, wait_until, extension=extension)
-
-                except Exception as error:
-                    logger.warn(
-                        "Dependent extension {0} failed or timed out, will skip processing the rest of the extensions".format(
+        dep_level = self.__get_dependency_level((extension, ext_handler))
+        if 0 <= dep_level < max_dep_level:
+            extension_full_name = handler_i.get_extension_full_name(extension)
+            try:
+                # Do no wait for extension status if the handler failed
+                if not extension_success:
+                    raise Exception("Skipping processing of extensions since execution of dependent extension {0} failed".format(
                             extension_full_name))
-                    depends_on_err_msg = ustr(error)
-                    add_event(name=extension_full_name,
-                              version=handler_i.ext_handler.version,
-                              op=WALAEventOperation.ExtensionProcessing,
-                              is_success=False,
-                              message=depends_on_err_msg)
+
+                # Wait for the extension installation until it is handled.
+                # This is done for the install and enable. Not for the uninstallation.
+                # If handled successfully, proceed with the current handler.
+                # Otherwise, skip the rest of the extension installation.
+                self.wait_for_handler_completion(handler_i, wait_until, extension=extension)
+
+            except Exception as error:
+                logger.warn(
+                    "Dependent extension {0} failed or timed out, will skip processing the rest of the extensions".format(
+                        extension_full_name))
+                depends_on_err_msg = ustr(error)
+                add_event(name=extension_full_name,
+                          version=handler_i.ext_handler.version,
+                          op=WALAEventOperation.ExtensionProcessing,
+                          is_success=False,
+                          message=depends_on_err_msg)
+
+        return depends_on_err_msg
+
+    def __group_by_dependency_level(self, sorted_extensions):
+        """
+        Splits the given list of (extension, handler) tuples (which must be sorted by dependency level) into lists of tuples with the same level
+        """
+        levels = []
+        for item in sorted_extensions:
+            if len(levels) > 0 and self.__get_dependency_level(levels[-1][-1]) == self.__get_dependency_level(item):
+                levels[-1].append(item)
+            else:
+                levels.append([item])
+        return levels
+
+    @staticmethod
+    def __group_by_handler(extensions):
+        """
+        Splits the given list of (extension, handler) tuples into lists of tuples for the same handler, preserving their order
+        """
+        groups = []
+        index = {}
+        for item in extensions:
+            name = item[1].name
+            if name not in index:
+                index[name] = len(groups)
+                groups.append([])
+            groups[index[name]].append(item)
+        return groups
+
+    def __get_unchanged_handlers(self, extensions_diff):
+        """
+        Returns the names of the handlers that can be skipped when processing the goal state: the handlers that did not change with respect to
+        the previous goal state, are installed and enabled, and whose extensions completed successfully (otherwise the handler is processed
+        again, which will retry any failed operations).
+        """
+        unchanged_handlers = set()
+
+        if extensions_diff is None or not conf.get_skip_unchanged_extensions():
+            return unchanged_handlers
+
+        for handler in self.ext_handlers:
+            if not extensions_diff.is_unchanged(handler.name) or handler.state != ExtensionRequestedState.Enabled or handler.is_invalid_setting:
+                continue
+            try:
+                handler_i = ExtHandlerInstance(handler, self.protocol)
+                if handler_i.get_installed_version() != handler.version or handler_i.get_handler_state() != ExtHandlerState.Enabled:
+                    continue
+                handler_status = handler_i.get_handler_status()
+                if handler_status is None or handler_status.status != ExtHandlerStatusValue.ready:
+                    continue
+                if all(ExtHandlersHandler.__extension_completed_successfully(handler_i, e) for e in handler.settings):
+                    unchanged_handlers.add(handler.name)
+            except Exception as e:
+                logger.verbose("Cannot determine whether {0} needs to be processed; it will be processed: {1}", handler.name, ustr(e))
+
+        if len(unchanged_handlers) > 0:
+            logger.info("Skipping unchanged extensions: {0}", ', '.join(sorted(unchanged_handlers)))
+
+        return unchanged_handlers
+
+    @staticmethod
+    def __extension_completed_successfully(handler_i, extension):
+        if extension.state == ExtensionState.Disabled:
+            return handler_i.get_extension_state(extension) == ExtensionState.Disabled
+        if handler_i.should_perform_multi_config_op(extension) and handler_i.get_extension_state(extension) != ExtensionState.Enabled:
+            return False
+        return handler_i.get_ext_handling_status(extension) == ExtensionStatusValue.success
+
+    def __prefetch_extension_packages(self, skip_handlers):
+        """
+        Downloads concurrently the packages of the extensions that need to be installed or updated, so that the network time is not serialized
+        behind the commands of the extensions processed earlier. Errors are ignored; the package is downloaded again (and any errors reported)
+        when the extension is processed.
+
+        Returns a dictionary with the manifests fetched during the prefetch, indexed by handler name, so that they are not fetched again when
+        processing the extensions.
+        """
+        max_workers = conf.get_extension_package_prefetch_concurrency()
+        if max_workers <= 0:
+            return {}
+
+        handler_instances = [ExtHandlerInstance(h, self.protocol) for h in self.ext_handlers if h.state == ExtensionRequestedState.Enabled and not h.is_invalid_setting and h.name not in skip_handlers]
+        if len(handler_instances) == 0:
+            return {}
+
+        start_time = datetime.datetime.utcnow()
+        results = run_concurrently([h.prefetch_package for h in handler_instances], max_workers, thread_name="ExtensionPrefetch")
+
+        manifests = {}
+        downloaded = 0
+        for handler_i, result in zip(handler_instances, results):
+            if result.exception is not None:
+                logger.info("Failed to prefetch the package for {0}; it will be downloaded when the extension is processed: {1}", handler_i.ext_handler.name, ustr(result.exception))
+                continue
+            manifests[handler_i.ext_handler.name] = handler_i.extension_manifest
+            if result.result:
+                downloaded += 1
+        if downloaded > 0:
+            logger.info("Prefetched {0} extension package(s) in {1} ms", downloaded, elapsed_milliseconds(start_time))
+
+        return manifests
 
     @staticmethod
     def wait_for_handler_completion(handler_i, wait_until, extension=None):
@@ -571,12 +747,15 @@ class ExtHandlersHandler(object):
         try:
             ext_completed, status = False, None
 
-            # Keep polling for the extension status until it succeeds or times out
-            while datetime.datetime.utcnow() <= wait_until:
-                ext_completed, status = handler_i.is_ext_handling_complete(extension)
-                if ext_completed:
-                    break
-                time.sleep(5)
+            # Keep checking the extension status until it succeeds or times out; the status is checked again as soon as the
+            # status directory changes (or every _EXT_STATUS_POLL_PERIOD seconds if the directory cannot be watched).
+            with FileWatcher([handler_i.get_status_dir()]) as watcher:
+                while datetime.datetime.utcnow() <= wait_until:
+                    ext_completed, status = handler_i.is_ext_handling_complete(extension)
+                    if ext_completed:
+                        break
+                    remaining = timeutil.total_seconds(wait_until - datetime.datetime.utcnow())
+                    watcher.wait(min(_EXT_STATUS_POLL_PERIOD, max(remaining, 0)) if watcher.is_event_driven else _EXT_STATUS_POLL_PERIOD)
 
         except Exception as e:
             msg = "Failed to wait for Handler completion due to unknown error. Marking the dependent extension as failed: {0}, {1}".format(
@@ -927,6 +1106,10 @@ class ExtHandlersHandler(object):
                 except ExtensionError as error:
                     add_event(op=WALAEventOperation.ExtensionProcessing, is_success=False, message=ustr(error))
 
+            # the status of the extensions is collected on every iteration; evict the files that were not needed in this pass (e.g. the
+            # status files of previous sequence numbers or of removed extensions)
+            get_parsed_file_cache().remove_stale_entries()
+
             logger.verbose("Report vm agent status")
             try:
                 self.protocol.report_vm_status(vm_status)
@@ -1016,12 +1199,14 @@ class ExtHandlersHandler(object):
 
 class ExtHandlerInstance(object):
 
-    def __init__(self, ext_handler, protocol, execution_log_max_size=(10 * 1024 * 1024), extension=None):
+    def __init__(self, ext_handler, protocol, execution_log_max_size=(10 * 1024 * 1024), extension=None, extension_manifest=None):
         self.ext_handler = ext_handler
         self.protocol = protocol
         self.operation = None
         self.pkg = None
         self.pkg_file = None
+        # the manifest for the handler, if it was already fetched for the current goal state (e.g. by prefetch_package()); otherwise it is fetched by decide_version()
+        self.extension_manifest = extension_manifest
         self.logger = None
         self.set_logger(extension=extension, execution_log_max_size=execution_log_max_size)
 
@@ -1107,8 +1292,9 @@ class ExtHandlerInstance(object):
     def decide_version(self, target_state, extension, gs_activity_id):
         self.logger.verbose("Decide which version to use")
         try:
-            manifest = self.protocol.get_goal_state().fetch_extension_manifest(self.ext_handler.name, self.ext_handler.manifest_uris)
-            pkg_list = manifest.pkg_list
+            if self.extension_manifest is None:
+                self.extension_manifest = self.protocol.get_goal_state().fetch_extension_manifest(self.ext_handler.name, self.ext_handler.manifest_uris)
+            pkg_list = self.extension_manifest.pkg_list
         except ProtocolError as e:
             raise ExtensionError("Failed to get ext handler pkgs", e)
         except ExtensionDownloadError:
@@ -1120,19 +1306,7 @@ class ExtHandlerInstance(object):
         installed_version_string = self.get_installed_version()
         installed_version = requested_version if installed_version_string is None else FlexibleVersion(installed_version_string)
 
-        # Divide packages
-        # - Find the installed package (its version must exactly match)
-        # - Find the internal candidate (its version must exactly match)
-        # - Separate the public packages
-        selected_pkg = None
-        installed_pkg = None
-        pkg_list.versions.sort(key=lambda p: FlexibleVersion(p.version))
-        for pkg in pkg_list.versions:
-            pkg_version = FlexibleVersion(pkg.version)
-            if pkg_version == installed_version:
-                installed_pkg = pkg
-            if requested_version.matches(pkg_version):
-                selected_pkg = pkg
+        selected_pkg, installed_pkg = ExtHandlerInstance._select_packages(pkg_list, requested_version, installed_version)
 
         # Finally, update the version only if not downgrading
         # Note:
@@ -1165,6 +1339,24 @@ class ExtHandlerInstance(object):
 
         return self.pkg
 
+    @staticmethod
+    def _select_packages(pkg_list, requested_version, installed_version):
+        """
+        Returns a tuple with the package selected for the requested version (the newest package that matches it) and the package for the
+        installed version (its version must match exactly; 'installed_version' can be None); either item can be None. Used by both
+        decide_version() and prefetch_package(), so that the package prefetched is the package that is installed.
+        """
+        selected_pkg = None
+        installed_pkg = None
+        # NOTE: the manifest may be shared with other handlers (see ResponseCache), so sort a copy of the package list
+        for pkg in sorted(pkg_list.versions, key=lambda p: FlexibleVersion(p.version)):
+            pkg_version = FlexibleVersion(pkg.version)
+            if installed_version is not None and pkg_version == installed_version:
+                installed_pkg = pkg
+            if requested_version.matches(pkg_version):
+                selected_pkg = pkg
+        return selected_pkg, installed_pkg
+
     def set_logger(self, execution_log_max_size=(10 * 1024 * 1024), extension=None):
         prefix = "[{0}]".format(self.get_full_name(extension))
         self.logger = logger.Logger(logger.DEFAULT_LOGGER, prefix)
@@ -1198,10 +1390,9 @@ class ExtHandlerInstance(object):
 
             separator = path.rfind('-')
             version_from_path = FlexibleVersion(path[separator + 1:])
-            state_path = os.path.join(path, 'config', 'HandlerState')
+            state = get_handler_state_store().get(os.path.join(path, 'config', 'HandlerState'))
 
-            if not os.path.exists(state_path) or fileutil.read_file(state_path) == ExtHandlerState.NotInstalled \
-                    or fileutil.read_file(state_path) == ExtHandlerState.FailedUpgrade:
+            if state is None or state == ExtHandlerState.NotInstalled or state == ExtHandlerState.FailedUpgrade:
                 logger.verbose("Ignoring version of uninstalled or failed extension: {0}".format(path))
                 continue
 
@@ -1240,10 +1431,23 @@ class ExtHandlerInstance(object):
         add_event(name=name, version=ext_handler_version, message=message,
                   op=self.operation, is_success=is_success, duration=duration, log_event=log_event)
 
+    @staticmethod
+    def _get_package_extractor():
+        """
+        Returns the function used to expand extension packages, or None to use ZipFile.extractall()
+        """
+        if conf.get_enable_extension_package_store():
+            return ExtensionPackageStore().extract
+        return None
+
     def _unzip_extension_package(self, source_file, target_directory):
         self.logger.info("Unzipping extension package: {0}", source_file)
         try:
-            zipfile.ZipFile(source_file).extractall(target_directory)
+            extract_package = ExtHandlerInstance._get_package_extractor()
+            if extract_package is not None:
+                extract_package(source_file, target_directory)
+            else:
+                zipfile.ZipFile(source_file).extractall(target_directory)
         except Exception as exception:
             logger.info("Error while unzipping extension package: {0}", ustr(exception))
             os.remove(source_file)
@@ -1266,16 +1470,50 @@ class ExtHandlerInstance(object):
             self.logger.info("Using existing extension package: {0}", package_file)
             if self._unzip_extension_package(package_file, self.get_base_dir()):
                 package_exists = True
+                # same as download_zip_package(), the package is not needed once it has been expanded
+                try:
+                    os.remove(package_file)
+                except Exception as exception:
+                    self.logger.warn("Cannot delete {0}: {1}", package_file, ustr(exception))
             else:
                 self.logger.info("The existing extension package is invalid, will ignore it.")
 
         if not package_exists:
             is_fast_track_goal_state = self.protocol.get_goal_state().extensions_goal_state.source == GoalStateSource.FastTrack
-            self.protocol.client.download_zip_package("extension package", self.pkg.uris, package_file, self.get_base_dir(), use_verify_header=is_fast_track_goal_state)
+            self.protocol.client.download_zip_package("extension package", self.pkg.uris, package_file, self.get_base_dir(), use_verify_header=is_fast_track_goal_state,
+                                                      extract_package=ExtHandlerInstance._get_package_extractor())
             self.report_event(message="Download succeeded", duration=elapsed_milliseconds(begin_utc))
 
         self.pkg_file = package_file
 
+    def prefetch_package(self):
+        """
+        Downloads the package for the version requested by the goal state to the location where download() expects it, unless that version is
+        already installed or its package was already downloaded. Unlike download(), the package is not expanded and the handler is not modified.
+        Returns True if the package was downloaded.
+        """
+        begin_utc = datetime.datetime.utcnow()
+        self.set_operation(WALAEventOperation.Download)
+
+        self.extension_manifest = self.protocol.get_goal_state().fetch_extension_manifest(self.ext_handler.name, self.ext_handler.manifest_uris)
+
+        selected_pkg, _ = ExtHandlerInstance._select_packages(self.extension_manifest.pkg_list, FlexibleVersion(str(self.ext_handler.version)), None)
+        if selected_pkg is None or selected_pkg.uris is None or len(selected_pkg.uris) == 0:
+            return False
+
+        if os.path.isdir(os.path.join(conf.get_lib_dir(), "{0}-{1}".format(self.ext_handler.name, selected_pkg.version))):
+            return False
+
+        package_file = os.path.join(conf.get_lib_dir(), "{0}__{1}{2}".format(self.ext_handler.name, selected_pkg.version, HANDLER_PKG_EXT))
+        if os.path.exists(package_file):
+            return False
+
+        self.logger.info("Prefetching extension package for version {0}", selected_pkg.version)
+        is_fast_track_goal_state = self.protocol.get_goal_state().extensions_goal_state.source == GoalStateSource.FastTrack
+        self.protocol.client.download_package("extension package", selected_pkg.uris, package_file, use_verify_header=is_fast_track_goal_state)
+        self.report_event(message="Download succeeded", duration=elapsed_milliseconds(begin_utc))
+        return True
+
 
     def ensure_consistent_data_for_mc(self):
         # If CRP expects Handler to support MC, ensure the HandlerManifest also reflects that.
@@ -1490,6 +1728,7 @@ class ExtHandlerInstance(object):
                 self.logger.verbose("Deleted the extension zip at path {0}", zip_filename)
 
             base_dir = self.get_base_dir()
+            get_handler_state_store().discard(base_dir)
             if os.path.isdir(base_dir):
                 self.logger.info("Remove extension handler directory: {0}", base_dir)
 
@@ -1575,16 +1814,17 @@ class ExtHandlerInstance(object):
             conf_dir = self.get_conf_dir()
             for item in os.listdir(conf_dir):
                 item_path = os.path.join(conf_dir, item)
-                if not os.path.isfile(item_path):
-                    continue
                 try:
                     # Settings file for Multi Config look like - <extName>.<seqNo>.settings
                     # Settings file for Single Config look like - <seqNo>.settings
+                    # (match the name before checking the file, to avoid a stat() on each of the other files in the directory)
                     match = re.search("((?P<ext_name>\\w+)\\.)*(?P<seq_no>\\d+)\\.settings", item_path)
                     if match is not None:
                         ext_name = match.group('ext_name')
                         if self.supports_multi_config and extension.name != ext_name:
                             continue
+                        if not os.path.isfile(item_path):
+                            continue
                         curr_seq_no = int(match.group("seq_no"))
                         curr_modified_time = os.path.getmtime(item_path)
                         if curr_modified_time > largest_modified_time:
@@ -1830,9 +2070,8 @@ class ExtHandlerInstance(object):
                 "message": "Extension heartbeat is not responsive"
             }
         try:
-            heartbeat_json = fileutil.read_file(heartbeat_file)
-            heartbeat = json.loads(heartbeat_json)[0]['heartbeat']
-        except IOError as e:
+            heartbeat = get_parsed_file_cache().get(heartbeat_file, ExtHandlerInstance._parse_json_file)[0]['heartbeat']
+        except (IOError, OSError) as e:
             raise ExtensionError("Failed to get heartbeat file:{0}".format(e))
         except (ValueError, KeyError) as e:
             raise ExtensionError("Malformed heartbeat file: {0}".format(e))
@@ -1926,7 +2165,7 @@ class ExtHandlerInstance(object):
     def load_manifest(self):
         man_file = self.get_manifest_file()
         try:
-            data = json.loads(fileutil.read_file(man_file))
+            data = get_parsed_file_cache().get(man_file, ExtHandlerInstance._parse_json_file)
         except (IOError, OSError) as e:
             raise ExtensionError('Failed to load manifest file ({0}): {1}'.format(man_file, e.strerror),
                                  code=ExtensionErrorCodes.PluginHandlerManifestNotFound)
@@ -1936,6 +2175,10 @@ class ExtHandlerInstance(object):
 
         return HandlerManifest(data[0])
 
+    @staticmethod
+    def _parse_json_file(path):
+        return json.loads(fileutil.read_file(path))
+
     def update_settings_file(self, settings_file, settings):
         settings_file = os.path.join(self.get_conf_dir(), settings_file)
         try:
@@ -2013,24 +2256,16 @@ class ExtHandlerInstance(object):
         return self.__get_state(name=self.__get_handler_state_file_name(extension), default=ExtensionState.Disabled)
 
     def __set_state(self, name, value):
-        state_dir = self.get_conf_dir()
-        state_file = os.path.join(state_dir, name)
+        state_file = os.path.join(self.get_conf_dir(), name)
         try:
-            if not os.path.exists(state_dir):
-                fileutil.mkdir(state_dir, mode=0o700)
-            fileutil.write_file(state_file, value)
+            get_handler_state_store().set(state_file, value)
         except IOError as e:
-            fileutil.clean_ioerror(e, paths=[state_file])
             self.logger.error("Failed to set state: {0}", e)
 
     def __get_state(self, name, default=None):
-        state_dir = self.get_conf_dir()
-        state_file = os.path.join(state_dir, name)
-        if not os.path.isfile(state_file):
-            return default
-
+        state_file = os.path.join(self.get_conf_dir(), name)
         try:
-            return fileutil.read_file(state_file)
+            return get_handler_state_store().get(state_file, default)
         except IOError as e:
             self.logger.error("Failed to get state: {0}", e)
             return default
@@ -2045,6 +2280,7 @@ class ExtHandlerInstance(object):
                 os.path.join(self.get_conf_dir(), self.__get_handler_state_file_name(extension))
             ]
 
+            get_handler_state_store().discard(files_to_delete[-1])
             fileutil.rm_files(*files_to_delete)
 
         except Exception as error:
@@ -2054,8 +2290,6 @@ class ExtHandlerInstance(object):
             self.logger.warn(message)
 
     def set_handler_status(self, status=ExtHandlerStatusValue.not_ready, message="", code=0):
-        state_dir = self.get_conf_dir()
-
         handler_status = ExtHandlerStatus()
         handler_status.name = self.ext_handler.name
         handler_status.version = str(self.ext_handler.version)
@@ -2063,30 +2297,26 @@ class ExtHandlerInstance(object):
         handler_status.code = code
         handler_status.status = status
         handler_status.supports_multi_config = self.ext_handler.supports_multi_config
-        status_file = os.path.join(state_dir, "HandlerStatus")
+        status_file = os.path.join(self.get_conf_dir(), "HandlerStatus")
 
         try:
             handler_status_json = json.dumps(get_properties(handler_status))
             if handler_status_json is not None:
-                if not os.path.exists(state_dir):
-                    fileutil.mkdir(state_dir, mode=0o700)
-                fileutil.write_file(status_file, handler_status_json)
+                get_handler_state_store().set(status_file, handler_status_json)
             else:
                 self.logger.error("Failed to create JSON document of handler status for {0} version {1}".format(
                     self.ext_handler.name, self.ext_handler.version))
         except (IOError, ValueError, ProtocolError) as error:
-            fileutil.clean_ioerror(error, paths=[status_file])
             self.logger.error("Failed to save handler status: {0}", textutil.format_exception(error))
 
     def get_handler_status(self):
-        state_dir = self.get_conf_dir()
-        status_file = os.path.join(state_dir, "HandlerStatus")
-        if not os.path.isfile(status_file):
-            return None
+        status_file = os.path.join(self.get_conf_dir(), "HandlerStatus")
 
         handler_status_contents = ""
         try:
-            handler_status_contents = fileutil.read_file(status_file)
+            handler_status_contents = get_handler_state_store().get(status_file)
+            if handler_status_contents is None:
+                return None
             data = json.loads(handler_status_contents)
             handler_status = ExtHandlerStatus()
             set_properties("ExtHandlerStatus", handler_status, data)
@@ -2162,10 +2392,15 @@ class ExtHandlerInstance(object):
             raise ExtensionStatusError(msg="Status file {0} does not exist".format(ext_status_file),
                                        code=ExtensionStatusError.FileNotExists)
         try:
-            data_str = fileutil.read_file(ext_status_file)
-        except IOError as e:
+            # The status files are read on each iteration of the main loop, but they change only when the extension reports a new status
+            return get_parsed_file_cache().get(ext_status_file, ExtHandlerInstance._parse_json_status_file)
+        except (IOError, OSError) as e:
             raise ExtensionStatusError(msg=ustr(e), inner=e,
                                        code=ExtensionStatusError.CouldNotReadStatusFile)
+
+    @staticmethod
+    def _parse_json_status_file(ext_status_file):
+        data_str = fileutil.read_file(ext_status_file)
         try:
             data = json.loads(data_str)
         except (ValueError, TypeError) as e:
@@ -0,0 +1,58 @@
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import time
+
+from azurelinuxagent.common import logger
+
+# After a change in the goal state, the agent polls using the minimum period for this long
+FAST_POLLING_DURATION_IN_SECONDS = 5 * 60
+# Once the fast polling window elapses, the period is multiplied by this factor on each iteration (up to the maximum period)
+BACKOFF_FACTOR = 2
+
+
+class GoalStatePollingScheduler(object):
+    """
+    Computes the period between checks for new goal states in the main loop of the agent.
+
+    While the goal state is changing (a new incarnation or extensions goal state is received, or the extensions are transitioning), the agent
+    polls using the minimum period (i.e. the goal state period); when the goal state has been stable for FAST_POLLING_DURATION_IN_SECONDS,
+    the period backs off exponentially toward the maximum period.
+    """
+    def __init__(self, max_period):
+        self._max_period = max_period
+        self._period = None
+        self._fast_polling_until = time.time() + FAST_POLLING_DURATION_IN_SECONDS
+
+    def on_goal_state_activity(self):
+        """
+        Called when the goal state changes; the agent goes back to polling with the minimum period
+        """
+        self._fast_polling_until = time.time() + FAST_POLLING_DURATION_IN_SECONDS
+
+    def get_next_period(self, min_period):
+        """
+        Returns the time to wait (in seconds) before the next check for a new goal state; 'min_period' is the current goal state period
+        """
+        max_period = max(min_period, self._max_period)
+        if self._period is None or time.time() < self._fast_polling_until:
+            period = min_period
+        else:
+            period = min(max_period, max(min_period, self._period * BACKOFF_FACTOR))
+        if period != self._period and self._period is not None:
+            logger.verbose("Goal state polling period changed from {0} to {1} seconds", self._period, period)
+        self._period = period
+        return period
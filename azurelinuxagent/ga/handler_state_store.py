@@ -0,0 +1,258 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import contextlib
+import json
+import os
+import threading
+
+from azurelinuxagent.common import conf
+from azurelinuxagent.common import logger
+from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.common.utils.filecache import get_file_signature
+
+HANDLER_STATE_JOURNAL_FILE_NAME = "handler_state.journal"
+
+
+class HandlerStateStore(object):
+    """
+    Store for the state that the agent keeps for each handler and extension (the HandlerState, <extension>.HandlerState and HandlerStatus
+    files in the config directory of the handler).
+
+    The files remain the source of truth (and are still available to anyone who reads them), but the store keeps an index of their
+    contents so that they are not read on every iteration, and it does not write a file when its contents do not change.
+
+    Within a transaction (see transaction()) the changes are kept in memory (and are visible to get()) and the files are written when
+    the outermost transaction completes. Each change is also appended to a journal as soon as it is made; the journal is synced to disk
+    once per transaction, before the files are written, and it is removed after the files have been written. If the agent stops before
+    the transaction completes, recover() replays the journal on the next start, so the changes made for the handlers that were already
+    processed are not lost. The store is thread-safe.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        self._pending = {}  # path -> contents
+        self._pending_order = []
+        self._index = {}  # path -> (file signature, contents)
+        self._journal = None
+        self._journal_created = False
+
+    def get(self, path, default=None):
+        """
+        Returns the contents of the given state file, or 'default' if the file does not exist. Raises IOError if the file cannot be read.
+        """
+        with self._lock:
+            if path in self._pending:
+                return self._pending[path]
+            if not os.path.isfile(path):
+                return default
+            signature = get_file_signature(path)
+            entry = self._index.get(path)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+            contents = fileutil.read_file(path)
+            self._index[path] = (signature, contents)
+            return contents
+
+    def set(self, path, contents):
+        """
+        Sets the contents of the given state file; the file (and its parent directory) is created if needed. Within a transaction the change
+        is journaled and the file is written when the transaction completes; otherwise the file is written immediately. Raises IOError on
+        errors writing the file.
+        """
+        with self._lock:
+            if self._transaction_depth > 0:
+                if path not in self._pending:
+                    self._pending_order.append(path)
+                self._pending[path] = contents
+                self._append_to_journal(path, contents)
+                return
+            try:
+                if self.get(path) == contents:
+                    return
+            except IOError:
+                pass
+            self._write(path, contents)
+
+    def discard(self, path):
+        """
+        Discards any pending changes to the given file or, if 'path' is a directory, to the files under that directory. Must be called
+        before removing state files or the directory of a handler, so that the changes are not written (or replayed) after the removal.
+        """
+        with self._lock:
+            for p in [p for p in self._pending if HandlerStateStore._is_under(p, path)]:
+                del self._pending[p]
+            for p in [p for p in self._index if HandlerStateStore._is_under(p, path)]:
+                del self._index[p]
+            self._pending_order = [p for p in self._pending_order if p in self._pending]
+            if self._transaction_depth > 0:
+                self._append_to_journal(path, None)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Groups the changes made to the state files within the context; they are written when the outermost transaction exits (even if
+        an exception is raised, since the changes reflect operations that were already executed).
+        """
+        with self._lock:
+            self._transaction_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self._commit()
+
+    def recover(self):
+        """
+        Writes the changes recorded in the journal if the agent stopped before completing the last transaction
+        """
+        journal = HandlerStateStore._get_journal_path()
+        if not os.path.exists(journal):
+            return
+        try:
+            changes = HandlerStateStore._read_journal(journal)
+            logger.info("Recovering {0} handler state change(s) from {1}", len(changes), journal)
+            with self._lock:
+                self._apply(changes)
+        except Exception as e:
+            logger.warn("Failed to recover the handler state from {0}: {1}", journal, ustr(e))
+        HandlerStateStore._remove_journal(journal)
+
+    def _append_to_journal(self, path, contents):
+        """
+        Appends a change to the journal; 'contents' is None when the file (or the directory) is removed. The journal is flushed, but not
+        synced, on each change, so the change survives a crash of the agent.
+        """
+        journal = HandlerStateStore._get_journal_path()
+        try:
+            if self._journal is None:
+                if self._journal_created:  # the journal could not be written earlier in this transaction
+                    return
+                self._journal_created = True
+                self._journal = open(journal, "w")
+            self._journal.write(json.dumps([path, contents]) + "\n")
+            self._journal.flush()
+        except (IOError, OSError) as e:
+            logger.warn("Failed to write the handler state journal {0}: {1}", journal, ustr(e))
+            self._close_journal()
+
+    def _close_journal(self, sync=False):
+        journal, self._journal = self._journal, None
+        if journal is None:
+            return
+        try:
+            if sync:
+                os.fsync(journal.fileno())
+        except (IOError, OSError) as e:
+            logger.warn("Failed to sync the handler state journal: {0}", ustr(e))
+        finally:
+            journal.close()
+
+    def _commit(self):
+        pending, pending_order = self._pending, self._pending_order
+        self._pending = {}
+        self._pending_order = []
+
+        # sync the journal once, before writing the files, so that the changes can be replayed if the agent stops while writing them
+        self._close_journal(sync=True)
+
+        changes = []
+        for path in pending_order:
+            contents = pending[path]
+            try:
+                if self.get(path) == contents:
+                    continue
+            except IOError:
+                pass
+            changes.append([path, contents])
+
+        self._apply(changes)
+
+        if self._journal_created:
+            self._journal_created = False
+            HandlerStateStore._remove_journal(HandlerStateStore._get_journal_path())
+
+    def _apply(self, changes):
+        for path, contents in changes:
+            try:
+                self._write(path, contents)
+            except IOError as e:
+                logger.error("Failed to write handler state file {0}: {1}", path, ustr(e))
+
+    def _write(self, path, contents):
+        directory = os.path.dirname(path)
+        try:
+            if not os.path.exists(directory):
+                fileutil.mkdir(directory, mode=0o700)
+            fileutil.write_file(path, contents)
+            self._index[path] = (get_file_signature(path), contents)
+        except (IOError, OSError) as e:
+            self._index.pop(path, None)
+            fileutil.clean_ioerror(e, paths=[path])
+            raise IOError(e.errno, e.strerror, path)
+
+    @staticmethod
+    def _read_journal(journal):
+        """
+        Returns the changes recorded in the journal as a list of [path, contents], with the last contents of each file that was not removed
+        afterwards. The last record is incomplete if the agent stopped while writing it; it is ignored.
+        """
+        changes = {}
+        order = []
+        with open(journal, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    path, contents = json.loads(line)
+                except ValueError:
+                    break
+                if contents is None:
+                    for p in [p for p in changes if HandlerStateStore._is_under(p, path)]:
+                        del changes[p]
+                else:
+                    if path not in order:
+                        order.append(path)
+                    changes[path] = contents
+        return [[p, changes[p]] for p in order if p in changes]
+
+    @staticmethod
+    def _is_under(path, parent):
+        return path == parent or path.startswith(os.path.join(parent, ""))
+
+    @staticmethod
+    def _remove_journal(journal):
+        try:
+            os.remove(journal)
+        except OSError as e:
+            logger.warn("Failed to remove the handler state journal {0}: {1}", journal, ustr(e))
+
+    @staticmethod
+    def _get_journal_path():
+        return os.path.join(conf.get_lib_dir(), HANDLER_STATE_JOURNAL_FILE_NAME)
+
+
+_handler_state_store = HandlerStateStore()
+
+
+def get_handler_state_store():
+    """
+    Returns the process-wide HandlerStateStore
+    """
+    return _handler_state_store
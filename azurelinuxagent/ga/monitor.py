@@ -33,7 +33,7 @@ from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.protocol.healthservice import HealthService
 from azurelinuxagent.common.protocol.imds import get_imds_client
 from azurelinuxagent.common.protocol.util import get_protocol_util
-from azurelinuxagent.common.utils.restutil import IOErrorCounter
+from azurelinuxagent.common.utils.restutil import IOErrorCounter, HttpRequestStatistics
 from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION
 from azurelinuxagent.ga.periodic_operation import PeriodicOperation
 
@@ -114,6 +114,40 @@ class ReportNetworkErrors(PeriodicOperation):
             add_event(op=WALAEventOperation.HttpErrors, message=msg)
 
 
+class ReportHttpRequestStatistics(PeriodicOperation):
+    """
+    Periodic operation to report the statistics of the HTTP requests issued by the agent (see restutil.HttpRequestStatistics) as
+    performance counters. The instance of each counter is "<endpoint>/<operation>"; the latencies are estimated from the
+    histograms, as the upper limit of the bucket that contains the percentile.
+    """
+    CATEGORY = "HTTP"
+
+    _COUNTERS = [
+        (HttpRequestStatistics.REQUESTS, "Requests"),
+        (HttpRequestStatistics.ERRORS, "Errors"),
+        (HttpRequestStatistics.RETRIES, "Retries"),
+        (HttpRequestStatistics.THROTTLED, "Throttled"),
+        (HttpRequestStatistics.BYTES_SENT, "Bytes Sent"),
+        (HttpRequestStatistics.BYTES_RECEIVED, "Bytes Received"),
+    ]
+    _PERCENTILES = [(50, "Latency P50 (ms)"), (95, "Latency P95 (ms)"), (99, "Latency P99 (ms)")]
+
+    def __init__(self):
+        super(ReportHttpRequestStatistics, self).__init__(datetime.timedelta(minutes=30))
+
+    def _operation(self):
+        statistics = HttpRequestStatistics.get_and_reset()
+        for (endpoint, operation), (counters, histogram) in sorted(statistics.items()):
+            instance = "{0}/{1}".format(endpoint, operation)
+            for index, counter in ReportHttpRequestStatistics._COUNTERS:
+                if counters[index] > 0 or index == HttpRequestStatistics.REQUESTS:
+                    report_metric(ReportHttpRequestStatistics.CATEGORY, counter, instance, counters[index])
+            for percentile, counter in ReportHttpRequestStatistics._PERCENTILES:
+                latency = HttpRequestStatistics.get_latency_percentile(histogram, percentile)
+                if latency is not None:
+                    report_metric(ReportHttpRequestStatistics.CATEGORY, counter, instance, latency)
+
+
 class ReportNetworkConfigurationChanges(PeriodicOperation):
     """
     Periodic operation to check and log changes in network configuration.
@@ -294,6 +328,7 @@ class MonitorHandler(ThreadHandlerInterface):
             periodic_operations = [
                 ResetPeriodicLogMessages(),
                 ReportNetworkErrors(),
+                ReportHttpRequestStatistics(),
                 PollResourceUsage(),
                 PollSystemWideResourceUsage(),
                 SendHostPluginHeartbeat(protocol, health_service),
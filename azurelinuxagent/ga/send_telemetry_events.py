@@ -19,43 +19,184 @@
 import datetime
 import threading
 import time
+from collections import deque
 
+from azurelinuxagent.common import conf
 from azurelinuxagent.common import logger
-from azurelinuxagent.common.event import add_event, WALAEventOperation
+from azurelinuxagent.common.event import add_event, WALAEventOperation, TELEMETRY_EVENT_PROVIDER_ID, TELEMETRY_LOG_PROVIDER_ID, \
+    TELEMETRY_METRICS_EVENT_ID
+from azurelinuxagent.common.event_spool import get_event_spool
 from azurelinuxagent.common.exception import ServiceStoppedError
-from azurelinuxagent.common.future import ustr, Queue, Empty
+from azurelinuxagent.common.future import ustr
 from azurelinuxagent.ga.interfaces import ThreadHandlerInterface
-from azurelinuxagent.common.utils import textutil
+from azurelinuxagent.common.utils import textutil, timeutil
+
+# Priorities of the events in the telemetry queue (lower values are sent first and dropped last)
+_PRIORITY_HIGH = 0  # events for the operations of the agent (including errors) and the results of extension operations
+_PRIORITY_METRICS = 1
+_PRIORITY_LOGS = 2  # log events, including the events produced by extensions
+_PRIORITY_NAMES = ["High", "Metrics", "Logs"]
+
+_EVENT_SIZE_OVERHEAD = 256  # approximate memory used by an event, in addition to the names and values of its parameters
 
 
 def get_send_telemetry_events_handler(protocol_util):
     return SendTelemetryEventsHandler(protocol_util)
 
 
+def _get_event_priority(event):
+    if event.providerId == TELEMETRY_LOG_PROVIDER_ID:
+        return _PRIORITY_LOGS
+    if event.providerId == TELEMETRY_EVENT_PROVIDER_ID and event.eventId == TELEMETRY_METRICS_EVENT_ID:
+        return _PRIORITY_METRICS
+    return _PRIORITY_HIGH
+
+
+def _get_event_size(event):
+    size = _EVENT_SIZE_OVERHEAD
+    for param in event.parameters:
+        size += len(param.name) + len(ustr(param.value))
+    return size
+
+
+class _TelemetryEventQueue(object):
+    """
+    Queue of the events waiting to be sent, with one FIFO per priority. get_nowait() returns the events with the highest priority first.
+
+    The memory used by the queued events is limited to approximately 'max_memory' bytes: when a new event would exceed the limit, the oldest
+    events with the lowest priority are dropped to make room for it (or the new event itself is dropped, if all the queued events have a
+    higher priority). The number of dropped events is tracked per priority.
+
+    Events from the event spool (the events with a spool position) are never dropped, since the sender commits the spool past them: they
+    can use up to half of 'max_memory' and, when that is exceeded, put() rejects them so that they stay in the spool (the caller should
+    stop reading the spool until the queue is drained).
+    """
+    def __init__(self, max_memory):
+        self._max_memory = max_memory
+        self._condition = threading.Condition()
+        # each item is (sequence number, event, spool position, size); the events from the spool are kept apart since they are not dropped
+        self._levels = [deque() for _ in _PRIORITY_NAMES]
+        self._spooled_levels = [deque() for _ in _PRIORITY_NAMES]
+        self._sequence = 0
+        self._count = 0
+        self._memory = 0
+        self._spooled_memory = 0
+        self._dropped = [0] * len(_PRIORITY_NAMES)
+
+    def put(self, event, spool_position):
+        """
+        Adds the event to the queue; returns False if the event was not queued
+        """
+        priority = _get_event_priority(event)
+        size = _get_event_size(event)
+        with self._condition:
+            if spool_position is not None:
+                if self._spooled_memory > 0 and self._spooled_memory + size > self._max_memory / 2:
+                    return False
+                self._spooled_memory += size
+                self._append(self._spooled_levels[priority], event, spool_position, size)
+                return True
+            while self._memory + size > self._max_memory:
+                queued = [p for p in range(len(self._levels)) if len(self._levels[p]) > 0]
+                if len(queued) == 0:
+                    break
+                lowest = max(queued)
+                if lowest < priority:
+                    self._dropped[priority] += 1
+                    return False
+                _, _, _, dropped_size = self._levels[lowest].popleft()
+                self._count -= 1
+                self._memory -= dropped_size
+                self._dropped[lowest] += 1
+            self._append(self._levels[priority], event, spool_position, size)
+            return True
+
+    def _append(self, level, event, spool_position, size):
+        self._sequence += 1
+        level.append((self._sequence, event, spool_position, size))
+        self._count += 1
+        self._memory += size
+        self._condition.notify_all()
+
+    def get_nowait(self):
+        """
+        Returns the oldest (event, spool position) with the highest priority, or None if the queue is empty
+        """
+        with self._condition:
+            for level, spooled_level in zip(self._levels, self._spooled_levels):
+                if len(spooled_level) > 0 and (len(level) == 0 or spooled_level[0][0] < level[0][0]):
+                    _, event, spool_position, size = spooled_level.popleft()
+                    self._spooled_memory -= size
+                elif len(level) > 0:
+                    _, event, spool_position, size = level.popleft()
+                else:
+                    continue
+                self._count -= 1
+                self._memory -= size
+                return event, spool_position
+        return None
+
+    def wait(self, min_count, timeout, stop_requested):
+        """
+        Blocks until the queue has at least 'min_count' events, 'timeout' seconds elapse, or stop_requested() returns True (wake() must be
+        called after a stop is requested). Returns the number of events in the queue.
+        """
+        end_time = time.time() + timeout
+        with self._condition:
+            while self._count < min_count and not stop_requested():
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self._count
+
+    def wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def empty(self):
+        with self._condition:
+            return self._count == 0
+
+    def get_and_reset_dropped_counts(self):
+        with self._condition:
+            dropped = self._dropped
+            self._dropped = [0] * len(_PRIORITY_NAMES)
+            return dropped
+
+
 class SendTelemetryEventsHandler(ThreadHandlerInterface):
     """
     This Handler takes care of sending all telemetry out of the agent to Wireserver. It sends out data as soon as
     there's any data available in the queue to send.
+
+    The queue is bounded (see conf.get_max_telemetry_queue_memory()) and it is prioritized: the events for the operations of the agent and
+    extensions are sent first, then metrics, then log events; when the queue is full, log events are dropped first. The number of
+    dropped events is reported periodically. Events from the event spool are never dropped; instead, they are rejected when the queue
+    is full and stay in the spool until there is room for them.
+
+    Events that come from the event spool are enqueued along with their position in the spool; once a batch is sent successfully,
+    the position of its last spooled event is committed to the spool (a single write for the whole batch). If the batch is not sent,
+    the spool is rewound, so that the events are read (and sent) again; the spooled events that were already in the queue at that point
+    are skipped, since they are read again, too. After _MAX_SPOOLED_BATCH_FAILURES consecutive failures the spooled events of the batch
+    are committed anyway (and reported as dropped), so that a batch that cannot be sent is not retried forever.
     """
 
     _THREAD_NAME = "SendTelemetryHandler"
     _MAX_TIMEOUT = datetime.timedelta(seconds=5).seconds
     _MIN_EVENTS_TO_BATCH = 30
     _MIN_BATCH_WAIT_TIME = datetime.timedelta(seconds=5)
+    _DROPPED_EVENTS_REPORT_PERIOD = datetime.timedelta(minutes=30)
+    _MAX_SPOOLED_BATCH_FAILURES = 5
 
     def __init__(self, protocol_util):
         self._protocol = protocol_util.get_protocol()
         self.should_run = True
         self._thread = None
-
-        # We're using a Queue for handling the communication between threads. We plan to remove any dependency on the
-        # filesystem in the future and use add_event to directly queue events into the queue rather than writing to
-        # a file and then parsing it later.
-
-        # Once we move add_event to directly queue events, we need to add a maxsize here to ensure some limitations are
-        # being set (currently our limits are enforced by collector_threads but that would become obsolete once we
-        # start enqueuing events directly).
-        self._queue = Queue()
+        self._queue = _TelemetryEventQueue(conf.get_max_telemetry_queue_memory())
+        self._dropped_events = [0] * len(_PRIORITY_NAMES)
+        self._last_dropped_events_report = datetime.datetime.min
+        self._spooled_batch_failures = 0
 
     @staticmethod
     def get_thread_name():
@@ -79,47 +220,24 @@ class SendTelemetryEventsHandler(ThreadHandlerInterface):
         Stop server communication and join the thread to main thread.
         """
         self.should_run = False
+        self._queue.wake()
         if self.is_alive():
             self.join()
 
     def join(self):
-        self._queue.join()
         self._thread.join()
 
     def stopped(self):
         return not self.should_run
 
-    def enqueue_event(self, event):
-        # Add event to queue and set event
+    def enqueue_event(self, event, spool_position=None):
+        # Add event to queue and set event; spool_position is the SpoolPosition to commit once the event is sent (for spooled events).
+        # Returns False if the event was not queued.
         if self.stopped():
             raise ServiceStoppedError("{0} is stopped, not accepting anymore events".format(self.get_thread_name()))
 
-        # Queue.put() can block if the queue is full which can be an uninterruptible wait. Blocking for a max of
-        # SendTelemetryEventsHandler._MAX_TIMEOUT seconds and raising a ServiceStoppedError to retry later.
-
-        # Todo: Queue.put() will only raise a Full exception if a maxsize is set for the Queue. Once some size
-        # limitations are set for the Queue, ensure to handle that correctly here.
-        try:
-            self._queue.put(event, timeout=SendTelemetryEventsHandler._MAX_TIMEOUT)
-        except Exception as error:
-            raise ServiceStoppedError(
-                "Unable to enqueue due to: {0}, stopping any more enqueuing until the next run".format(ustr(error)))
-
-    def _wait_for_event_in_queue(self):
-        """
-        Wait for atleast one event in Queue or timeout after SendTelemetryEventsHandler._MAX_TIMEOUT seconds.
-        In case of a timeout, set the event to None.
-        :return: event if an event is added to the Queue or None to signify no events were added in queue.
-        This would raise in case of an error.
-        """
-        try:
-            event = self._queue.get(timeout=SendTelemetryEventsHandler._MAX_TIMEOUT)
-            self._queue.task_done()
-        except Empty:
-            # No elements in Queue, return None
-            event = None
-
-        return event
+        # The queue never blocks: when it is full, it drops the events with the lowest priority (or rejects spooled events)
+        return self._queue.put(event, spool_position)
 
     def _process_telemetry_thread(self):
         logger.info("Successfully started the {0} thread".format(self.get_thread_name()))
@@ -128,37 +246,77 @@ class SendTelemetryEventsHandler(ThreadHandlerInterface):
             # also keep checking every SendTelemetryEventsHandler._MAX_TIMEOUT secs to avoid uninterruptible waits.
             # Incase the service is stopped but we have events in queue, ensure we send them out before killing the thread.
             while not self.stopped() or not self._queue.empty():
-                first_event = self._wait_for_event_in_queue()
-                if first_event:
-                    # Start processing queue only if first event is not None (i.e. Queue has atleast 1 event),
-                    # else do nothing
-                    self._send_events_in_queue(first_event)
+                if self._queue.wait(1, SendTelemetryEventsHandler._MAX_TIMEOUT, self.stopped) > 0:
+                    self._send_events_in_queue()
+                self._report_dropped_events()
 
         except Exception as error:
             err_msg = "An unknown error occurred in the {0} thread main loop, stopping thread.{1}".format(
                 self.get_thread_name(), textutil.format_exception(error))
             add_event(op=WALAEventOperation.UnhandledError, message=err_msg, is_success=False)
 
-    def _send_events_in_queue(self, first_event):
-        # Process everything in Queue
-        start_time = datetime.datetime.utcnow()
-        while not self.stopped() and (self._queue.qsize() + 1) < self._MIN_EVENTS_TO_BATCH and (
-                start_time + self._MIN_BATCH_WAIT_TIME) > datetime.datetime.utcnow():
-            # To promote batching, we either wait for atleast _MIN_EVENTS_TO_BATCH events or _MIN_BATCH_WAIT_TIME secs
-            # before sending out the first request to wireserver.
-            # If the thread is requested to stop midway, we skip batching and send whatever we have in the queue.
-            logger.verbose("Waiting for events to batch. Total events so far: {0}, Time elapsed: {1} secs",
-                           self._queue.qsize()+1, (datetime.datetime.utcnow() - start_time).seconds)
-            time.sleep(1)
-        # Delete files after sending the data rather than deleting and sending
-        self._protocol.report_event(self._get_events_in_queue(first_event))
-
-    def _get_events_in_queue(self, first_event):
-        yield first_event
-        while not self._queue.empty():
-            try:
-                event = self._queue.get_nowait()
-                self._queue.task_done()
-                yield event
-            except Exception as error:
-                logger.error("Some exception when fetching event from queue: {0}".format(textutil.format_exception(error)))
\ No newline at end of file
+    def _send_events_in_queue(self):
+        # To promote batching, we either wait for atleast _MIN_EVENTS_TO_BATCH events or _MIN_BATCH_WAIT_TIME secs
+        # before sending out the first request to wireserver.
+        # If the thread is requested to stop midway, we skip batching and send whatever we have in the queue.
+        count = self._queue.wait(self._MIN_EVENTS_TO_BATCH, timeutil.total_seconds(self._MIN_BATCH_WAIT_TIME), self.stopped)
+        logger.verbose("Sending telemetry events. Total events in queue: {0}", count)
+
+        # Acknowledge the spooled events only after sending them
+        spool_positions = []
+        success = False
+        try:
+            success = self._protocol.report_event(self._get_events_in_queue(spool_positions))
+        finally:
+            if len(spool_positions) > 0:
+                # the events are sent by priority, so take the largest position (of the latest read of the spool); the batch includes all
+                # the spooled events enqueued before it (spooled events are never dropped from the queue)
+                last_position = max(spool_positions, key=lambda p: (p.generation, p.segment, p.offset))
+                self._checkpoint_spool(last_position, len(spool_positions), success)
+
+    def _checkpoint_spool(self, last_position, count, success):
+        spool = get_event_spool()
+        try:
+            if success:
+                self._spooled_batch_failures = 0
+                spool.commit(last_position)
+                return
+            self._spooled_batch_failures += 1
+            if self._spooled_batch_failures < self._MAX_SPOOLED_BATCH_FAILURES:
+                spool.rewind()
+                return
+            self._spooled_batch_failures = 0
+            msg = "Failed to send a batch of spooled telemetry events {0} times; dropping {1} events".format(self._MAX_SPOOLED_BATCH_FAILURES, count)
+            logger.warn(msg)
+            add_event(op=WALAEventOperation.DroppedTelemetryEvents, message=msg, is_success=False, log_event=False)
+            spool.commit(last_position)
+        except Exception as error:
+            logger.warn("Failed to update the event spool: {0}".format(textutil.format_exception(error)))
+
+    def _get_events_in_queue(self, spool_positions):
+        while True:
+            item = self._queue.get_nowait()
+            if item is None:
+                break
+            event, spool_position = item
+            if spool_position is not None:
+                # events read before the spool was rewound are read (and enqueued) again, so skip them to avoid sending them twice
+                if spool_position.generation != get_event_spool().generation:
+                    continue
+                spool_positions.append(spool_position)
+            yield event
+
+    def _report_dropped_events(self):
+        dropped = self._queue.get_and_reset_dropped_counts()
+        for priority, count in enumerate(dropped):
+            self._dropped_events[priority] += count
+
+        if sum(self._dropped_events) == 0 or datetime.datetime.utcnow() < self._last_dropped_events_report + self._DROPPED_EVENTS_REPORT_PERIOD:
+            return
+
+        msg = "The telemetry queue is full; dropped events: {0}".format(
+            ", ".join(["{0}: {1}".format(_PRIORITY_NAMES[p], c) for p, c in enumerate(self._dropped_events) if c > 0]))
+        logger.warn(msg)
+        add_event(op=WALAEventOperation.DroppedTelemetryEvents, message=msg, is_success=False, log_event=False)
+        self._dropped_events = [0] * len(_PRIORITY_NAMES)
+        self._last_dropped_events_report = datetime.datetime.utcnow()
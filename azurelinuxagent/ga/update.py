@@ -16,10 +16,12 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 #
+import fcntl
 import glob
 import os
 import platform
 import re
+import select
 import shutil
 import signal
 import stat
@@ -48,8 +50,9 @@ from azurelinuxagent.common.protocol.hostplugin import HostPluginProtocol, VmSet
 from azurelinuxagent.common.protocol.restapi import VERSION_0
 from azurelinuxagent.common.protocol.util import get_protocol_util
 from azurelinuxagent.common.utils import shellutil
-from azurelinuxagent.common.utils.archive import StateArchiver, AGENT_STATUS_FILE
+from azurelinuxagent.common.utils.archive import StateArchiver, AGENT_STATUS_FILE, get_goal_state_history_writer
 from azurelinuxagent.common.utils.flexible_version import FlexibleVersion
+from azurelinuxagent.common.utils.restutil import HttpRequestStatistics
 from azurelinuxagent.common.version import AGENT_LONG_NAME, AGENT_NAME, AGENT_DIR_PATTERN, CURRENT_AGENT, AGENT_VERSION, \
     CURRENT_VERSION, DISTRO_NAME, DISTRO_VERSION, get_lis_version, \
     has_logrotate, PY_VERSION_MAJOR, PY_VERSION_MINOR, PY_VERSION_MICRO, get_daemon_version
@@ -59,6 +62,7 @@ from azurelinuxagent.ga.collect_telemetry_events import get_collect_telemetry_ev
 from azurelinuxagent.ga.env import get_env_handler
 from azurelinuxagent.ga.exthandlers import ExtHandlersHandler, list_agent_lib_directory, \
     ExtensionStatusValue, ExtHandlerStatusValue
+from azurelinuxagent.ga.goal_state_polling import GoalStatePollingScheduler
 from azurelinuxagent.ga.guestagent import GuestAgent
 from azurelinuxagent.ga.monitor import get_monitor_handler
 from azurelinuxagent.ga.send_telemetry_events import get_send_telemetry_events_handler
@@ -80,6 +84,11 @@ AGENT_SENTINEL_FILE = "current_version"
 # the goal state.
 INITIAL_GOAL_STATE_FILE = "initial_goal_state"
 
+# Sending SIGUSR2 to the extension handler process writes the statistics of the HTTP requests issued by the agent to this file
+HTTP_REQUEST_STATISTICS_FILE = "http_request_statistics.json"
+
+GOAL_STATE_HISTORY_FLUSH_TIMEOUT = 30  # seconds to wait on shutdown for the pending updates to the goal state history
+
 READONLY_FILE_GLOBS = [
     "*.crt",
     "*.p7m",
@@ -120,6 +129,57 @@ def get_update_handler():
     return UpdateHandler()
 
 
+class _GoalStateRefreshRequest(object):
+    """
+    Request to start the next iteration of the main loop, made by the handler for SIGUSR1. The handler only sets a flag and writes a byte to
+    a pipe; it cannot use a lock (e.g. threading.Event.set()), since the signal may be delivered while the main thread holds that same lock.
+    The main loop waits for the next iteration by selecting on the pipe, which is created by open(); until then, wait() just sleeps.
+    """
+    def __init__(self):
+        self._requested = False
+        self._read_fd = None
+        self._write_fd = None
+
+    def open(self):
+        if self._read_fd is not None:
+            return
+        read_fd, write_fd = os.pipe()
+        for fd in (read_fd, write_fd):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self._read_fd, self._write_fd = read_fd, write_fd
+
+    def set(self):
+        self._requested = True
+        if self._write_fd is not None:
+            try:
+                os.write(self._write_fd, b"\0")
+            except OSError:
+                pass  # the pipe is full, so the main loop will wake up anyway
+
+    def wait(self, timeout):
+        """
+        Waits for up to 'timeout' seconds, or until set() is called (returns immediately if set() was called after the previous wait).
+        Returns True if set() was called; the request is then cleared.
+        """
+        if not self._requested:
+            if self._read_fd is None:
+                time.sleep(timeout)
+            else:
+                try:
+                    select.select([self._read_fd], [], [], timeout)
+                except select.error:  # on Python 2, select() is interrupted by the signal
+                    pass
+        requested, self._requested = self._requested, False
+        if self._read_fd is not None:
+            try:
+                while len(os.read(self._read_fd, 64)) > 0:
+                    pass
+            except OSError:
+                pass  # the pipe is empty
+        return requested
+
+
 class UpdateHandler(object):
     TELEMETRY_HEARTBEAT_PERIOD = timedelta(minutes=30)
     CHECK_MEMORY_USAGE_PERIOD = timedelta(seconds=conf.get_cgroup_check_period())
@@ -181,6 +241,11 @@ class UpdateHandler(object):
             else:
                 self._goal_state_period = conf.get_goal_state_period()
 
+        # The main loop waits for the period computed by the polling scheduler; the wait can be interrupted by SIGUSR1
+        self._goal_state_polling_scheduler = GoalStatePollingScheduler(conf.get_max_goal_state_period())
+        self._goal_state_changed = False
+        self._goal_state_refresh_requested = _GoalStateRefreshRequest()
+
     def run_latest(self, child_args=None):
         """
         This method is called from the daemon to find and launch the most
@@ -386,10 +451,14 @@ class UpdateHandler(object):
             if is_log_collection_allowed():
                 all_thread_handlers.append(get_collect_logs_handler())
 
+            self._register_http_request_statistics_handler()
+            self._register_goal_state_refresh_handler()
+
             # Launch all monitoring threads
             self._start_threads(all_thread_handlers)
 
-            logger.info("Goal State Period: {0} sec. This indicates how often the agent checks for new goal states and reports status.", self._goal_state_period)
+            logger.info("Goal State Period: {0} sec. This indicates how often the agent checks for new goal states and reports status. "
+                        "When the goal state is stable the period backs off up to {1} sec.", self._goal_state_period, max(self._goal_state_period, conf.get_max_goal_state_period()))
 
             while self.is_running:
                 self._check_daemon_running(debug)
@@ -397,7 +466,7 @@ class UpdateHandler(object):
                 self._process_goal_state(exthandlers_handler, remote_access_handler, agent_update_handler)
                 self._send_heartbeat_telemetry(agent_update_handler)
                 self._check_agent_memory_usage()
-                time.sleep(self._goal_state_period)
+                self._wait_for_next_iteration()
 
         except AgentUpgradeExitException as exitException:
             add_event(op=WALAEventOperation.AgentUpgrade, message=exitException.reason, log_event=False)
@@ -416,6 +485,44 @@ class UpdateHandler(object):
         self._shutdown()
         sys.exit(0)
 
+    def _register_goal_state_refresh_handler(self):
+        try:
+            self._goal_state_refresh_requested.open()
+            signal.signal(signal.SIGUSR1, self._on_goal_state_refresh_requested)
+        except Exception as e:
+            logger.warn("Failed to set the handler for SIGUSR1; the goal state can be refreshed only periodically: {0}", ustr(e))
+
+    def _on_goal_state_refresh_requested(self, *_):
+        """
+        Handler for SIGUSR1: starts the next iteration of the main loop immediately (or, if an iteration is in progress, as soon as it completes)
+        """
+        self._goal_state_refresh_requested.set()
+
+    def _wait_for_next_iteration(self):
+        if self._goal_state_changed or not self._extensions_summary.converged:
+            self._goal_state_polling_scheduler.on_goal_state_activity()
+        self._goal_state_changed = False
+
+        # the wait ends as soon as _on_goal_state_refresh_requested() is invoked (or immediately, if it was invoked during the iteration)
+        if self._goal_state_refresh_requested.wait(self._goal_state_polling_scheduler.get_next_period(self._goal_state_period)):
+            logger.info("A goal state refresh was requested")
+            self._goal_state_polling_scheduler.on_goal_state_activity()
+
+    @staticmethod
+    def _register_http_request_statistics_handler():
+        def dump_http_request_statistics(*_):
+            path = os.path.join(conf.get_lib_dir(), HTTP_REQUEST_STATISTICS_FILE)
+            try:
+                HttpRequestStatistics.dump(path)
+                logger.info("Wrote the statistics of the HTTP requests to {0}", path)
+            except Exception as e:
+                logger.warn("Failed to write the statistics of the HTTP requests to {0}: {1}", path, ustr(e))
+
+        try:
+            signal.signal(signal.SIGUSR2, dump_http_request_statistics)
+        except Exception as e:
+            logger.warn("Failed to set the handler for SIGUSR2; the HTTP request statistics won't be available on demand: {0}", ustr(e))
+
     @staticmethod
     def _log_openssl_info():
         try:
@@ -639,17 +746,22 @@ class UpdateHandler(object):
                 UpdateHandler._archive_goal_state_history()
 
         finally:
+            if self._processing_new_incarnation() or self._processing_new_extensions_goal_state():
+                self._goal_state_changed = True
             if self._goal_state is not None:
                 self._last_incarnation = self._goal_state.incarnation
                 self._last_extensions_gs_id = self._goal_state.extensions_goal_state.id
 
     @staticmethod
     def _archive_goal_state_history():
-        try:
-            archiver = StateArchiver(conf.get_lib_dir())
-            archiver.archive()
-        except Exception as exception:
-            logger.warn("Error cleaning up the goal state history: {0}", ustr(exception))
+        def archive():
+            try:
+                archiver = StateArchiver(conf.get_lib_dir())
+                archiver.archive()
+            except Exception as exception:
+                logger.warn("Error cleaning up the goal state history: {0}", ustr(exception))
+
+        get_goal_state_history_writer().run(archive)
 
     @staticmethod
     def _cleanup_legacy_goal_state_history():
@@ -1010,6 +1122,8 @@ class UpdateHandler(object):
         # all threads is clean.
         self.is_running = False
 
+        get_goal_state_history_writer().flush(timeout=GOAL_STATE_HISTORY_FLUSH_TIMEOUT)
+
         if not os.path.isfile(self._sentinel_file_path()):
             return
 
@@ -0,0 +1,52 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+from azurelinuxagent.common.protocol import endpoint_scoreboard
+from azurelinuxagent.common.protocol.endpoint_scoreboard import EndpointScoreboard
+from tests.lib.tools import AgentTestCase, patch
+
+
+class TestEndpointScoreboard(AgentTestCase):
+    URIS = ["https://mirror{0}.blob.core.windows.net/container/package.zip".format(i) for i in range(3)]
+
+    def test_rank_should_try_the_fastest_endpoints_first(self):
+        scoreboard = EndpointScoreboard()
+        scoreboard.record_success(self.URIS[0], 3.0)
+        scoreboard.record_success(self.URIS[1], 1.0)
+        scoreboard.record_success(self.URIS[2], 2.0)
+
+        self.assertEqual([self.URIS[1], self.URIS[2], self.URIS[0]], scoreboard.rank(self.URIS))
+
+    def test_rank_should_try_endpoints_with_no_data_first(self):
+        scoreboard = EndpointScoreboard()
+        scoreboard.record_success(self.URIS[0], 1.0)
+
+        ranked = scoreboard.rank(self.URIS)
+
+        self.assertEqual(self.URIS[0], ranked[-1])
+        self.assertEqual(sorted(self.URIS[1:]), sorted(ranked[:-1]))
+
+    def test_rank_should_skip_the_uris_that_failed_recently(self):
+        scoreboard = EndpointScoreboard()
+        scoreboard.record_failure(self.URIS[1])
+
+        self.assertNotIn(self.URIS[1], scoreboard.rank(self.URIS))
+
+        with patch("azurelinuxagent.common.protocol.endpoint_scoreboard.time.time", return_value=endpoint_scoreboard.time.time() + endpoint_scoreboard.NEGATIVE_CACHE_PERIOD_IN_SECONDS + 1):
+            ranked = scoreboard.rank(self.URIS)
+
+        self.assertEqual(self.URIS[1], ranked[-1], "After the cooldown period, the URI should be tried again (but after the other URIs)")
+
+    def test_rank_should_return_all_the_uris_when_all_of_them_failed_recently(self):
+        scoreboard = EndpointScoreboard()
+        for uri in self.URIS:
+            scoreboard.record_failure(uri)
+
+        self.assertEqual(sorted(self.URIS), sorted(scoreboard.rank(self.URIS)))
+
+    def test_record_success_should_update_the_average_latency_of_the_endpoint(self):
+        scoreboard = EndpointScoreboard()
+        scoreboard.record_success(self.URIS[0], 1.0)
+        scoreboard.record_success(self.URIS[0].replace("package.zip", "manifest.xml"), 2.0)
+
+        self.assertAlmostEqual(1.3, scoreboard.get_latency(self.URIS[0]))
+        self.assertIsNone(scoreboard.get_latency(self.URIS[1]))
@@ -0,0 +1,85 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import copy
+
+from azurelinuxagent.common.protocol.extensions_goal_state_diff import ExtensionChange, ExtensionsGoalStateDiff
+from azurelinuxagent.common.protocol.restapi import Extension, ExtensionSettings, ExtensionState
+from tests.lib.tools import AgentTestCase
+
+
+class TestExtensionsGoalStateDiff(AgentTestCase):
+    @staticmethod
+    def _create_handler(name, version="1.0.0", state="enabled", extensions=None):
+        handler = Extension(name=name)
+        handler.version = version
+        handler.state = state
+        handler.manifest_uris = ["https://mirror.blob.core.windows.net/{0}_manifest.xml".format(name)]
+        for extension_name in extensions if extensions is not None else [name]:
+            handler.settings.append(ExtensionSettings(name=extension_name, sequenceNumber=0, publicSettings={"key": "value"}))
+        return handler
+
+    def _create_goal_state(self):
+        return [
+            self._create_handler("Microsoft.CPlat.Core.RunCommandLinux"),
+            self._create_handler("Microsoft.CPlat.Core.RunCommandHandlerLinux", extensions=["first", "second"]),
+            self._create_handler("Microsoft.Azure.Monitor.AzureMonitorLinuxAgent"),
+        ]
+
+    def test_all_handlers_should_be_added_when_there_is_no_previous_goal_state(self):
+        diff = ExtensionsGoalStateDiff(None, self._create_goal_state())
+
+        self.assertTrue(diff.has_changes)
+        for handler in self._create_goal_state():
+            self.assertEqual(ExtensionChange.Added, diff.get_handler_change(handler.name))
+            for extension in handler.settings:
+                self.assertEqual(ExtensionChange.Added, diff.get_extension_change(handler.name, extension.name))
+
+    def test_identical_goal_states_should_have_no_changes(self):
+        diff = ExtensionsGoalStateDiff(self._create_goal_state(), self._create_goal_state())
+
+        self.assertFalse(diff.has_changes)
+        self.assertTrue(diff.is_unchanged("Microsoft.CPlat.Core.RunCommandLinux"))
+        self.assertEqual(ExtensionChange.Unchanged, diff.get_extension_change("Microsoft.CPlat.Core.RunCommandHandlerLinux", "second"))
+
+    def test_it_should_classify_the_changes_in_each_handler(self):
+        previous = self._create_goal_state()
+        current = copy.deepcopy(previous)
+        current[0].version = "1.1.0"
+        current[1].settings[1].publicSettings = {"key": "new value"}
+        del current[2]
+        current.append(self._create_handler("Microsoft.OSTCExtensions.VMAccessForLinux", state="uninstall"))
+
+        diff = ExtensionsGoalStateDiff(previous, current)
+
+        self.assertEqual(ExtensionChange.VersionChanged, diff.get_handler_change("Microsoft.CPlat.Core.RunCommandLinux"))
+        self.assertEqual(ExtensionChange.SettingsChanged, diff.get_handler_change("Microsoft.CPlat.Core.RunCommandHandlerLinux"))
+        self.assertEqual(ExtensionChange.Unchanged, diff.get_extension_change("Microsoft.CPlat.Core.RunCommandHandlerLinux", "first"))
+        self.assertEqual(ExtensionChange.SettingsChanged, diff.get_extension_change("Microsoft.CPlat.Core.RunCommandHandlerLinux", "second"))
+        self.assertEqual(ExtensionChange.Removed, diff.get_handler_change("Microsoft.Azure.Monitor.AzureMonitorLinuxAgent"))
+        self.assertEqual(ExtensionChange.Removed, diff.get_extension_change("Microsoft.Azure.Monitor.AzureMonitorLinuxAgent", "Microsoft.Azure.Monitor.AzureMonitorLinuxAgent"))
+        self.assertEqual(ExtensionChange.Added, diff.get_handler_change("Microsoft.OSTCExtensions.VMAccessForLinux"))
+
+    def test_it_should_classify_changes_in_the_state_of_handlers_and_extensions(self):
+        previous = self._create_goal_state()
+        current = copy.deepcopy(previous)
+        current[0].state = "uninstall"
+        current[1].settings[0].state = ExtensionState.Disabled
+
+        diff = ExtensionsGoalStateDiff(previous, current)
+
+        self.assertEqual(ExtensionChange.StateChanged, diff.get_handler_change("Microsoft.CPlat.Core.RunCommandLinux"))
+        self.assertEqual(ExtensionChange.SettingsChanged, diff.get_handler_change("Microsoft.CPlat.Core.RunCommandHandlerLinux"))
+        self.assertEqual(ExtensionChange.StateChanged, diff.get_extension_change("Microsoft.CPlat.Core.RunCommandHandlerLinux", "first"))
+
+    def test_added_or_removed_extensions_should_change_the_settings_of_the_handler(self):
+        previous = self._create_goal_state()
+        current = copy.deepcopy(previous)
+        del current[1].settings[0]
+        current[2].settings.append(ExtensionSettings(name="other", sequenceNumber=0))
+
+        diff = ExtensionsGoalStateDiff(previous, current)
+
+        self.assertEqual(ExtensionChange.SettingsChanged, diff.get_handler_change("Microsoft.CPlat.Core.RunCommandHandlerLinux"))
+        self.assertEqual(ExtensionChange.Removed, diff.get_extension_change("Microsoft.CPlat.Core.RunCommandHandlerLinux", "first"))
+        self.assertEqual(ExtensionChange.SettingsChanged, diff.get_handler_change("Microsoft.Azure.Monitor.AzureMonitorLinuxAgent"))
+        self.assertEqual(ExtensionChange.Added, diff.get_extension_change("Microsoft.Azure.Monitor.AzureMonitorLinuxAgent", "other"))
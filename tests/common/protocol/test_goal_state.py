@@ -7,10 +7,11 @@ import glob
 import os
 import re
 import shutil
+import threading
 import time
 
 from azurelinuxagent.common import conf
-from azurelinuxagent.common.future import httpclient, urlparse
+from azurelinuxagent.common.future import httpclient, urlparse, ustr
 from azurelinuxagent.common.protocol.extensions_goal_state import GoalStateSource, GoalStateChannel
 from azurelinuxagent.common.protocol.extensions_goal_state_from_extensions_config import ExtensionsGoalStateFromExtensionsConfig
 from azurelinuxagent.common.protocol.extensions_goal_state_from_vm_settings import ExtensionsGoalStateFromVmSettings
@@ -118,6 +119,40 @@ class GoalStateTestCase(AgentTestCase, HttpRequestPredicates):
                 self._find_history_subdirectory("999-888"),
                 ["GoalState.xml", "ExtensionsConfig.xml", "VmSettings.json", "Certificates.json", "SharedConfig.xml", "HostingEnvironmentConfig.xml"])
 
+    def test_fetching_the_goal_state_should_fetch_the_wire_server_documents_concurrently(self):
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+            protocol.mock_wire_data.set_incarnation(2)
+
+            threads = {}
+            original_fetch_config = protocol.client.fetch_config
+
+            def fetch_config(uri, headers):
+                threads[uri] = threading.current_thread().name
+                return original_fetch_config(uri, headers)
+
+            with patch.object(protocol.client, "fetch_config", side_effect=fetch_config):
+                GoalState(protocol.client)
+
+            document_threads = [name for uri, name in threads.items() if "comp=goalstate" not in uri]
+            self.assertTrue(len(document_threads) > 1, "Expected to fetch several documents. Requests: {0}".format(threads))
+            self.assertTrue(all(name.startswith("GoalStateFetch") for name in document_threads), "The documents should have been fetched by the worker threads. Requests: {0}".format(threads))
+
+    def test_fetching_the_goal_state_should_raise_when_one_of_the_documents_cannot_be_fetched(self):
+        def http_get_handler(url, *_, **__):
+            if HttpRequestPredicates.is_hosting_environment_config_request(url):
+                return MockHttpResponse(httpclient.INTERNAL_SERVER_ERROR)
+            return None
+
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+            protocol.mock_wire_data.set_incarnation(2)
+            protocol.set_http_handlers(http_get_handler=http_get_handler)
+
+            with patch('time.sleep'):
+                with self.assertRaises(ProtocolError) as context:
+                    GoalState(protocol.client)
+
+            self.assertIn("Error fetching goal state", ustr(context.exception))
+
     @staticmethod
     def _get_history_directory():
         return os.path.join(conf.get_lib_dir(), ARCHIVE_DIRECTORY_NAME)
@@ -472,6 +507,28 @@ class GoalStateTestCase(AgentTestCase, HttpRequestPredicates):
             goal_state.update()
             self.assertTrue(os.path.isfile(crt_path))
 
+    def test_it_should_not_decrypt_the_certificates_when_they_did_not_change(self):
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+            goal_state = GoalState(protocol.client)
+            summary = goal_state.certs.summary
+            thumbprints = [c.thumbprint for c in goal_state.certs.cert_list.certificates]
+            self.assertTrue(len(summary) > 0, "The goal state should include certificates")
+
+            with patch("azurelinuxagent.common.protocol.goal_state.CryptUtil.decrypt_p7m") as decrypt_p7m:
+                protocol.mock_wire_data.set_incarnation(2)
+                goal_state.update()
+                self.assertEqual(0, decrypt_p7m.call_count, "The certificates should not have been decrypted")
+                self.assertEqual(summary, goal_state.certs.summary)
+                self.assertEqual(thumbprints, [c.thumbprint for c in goal_state.certs.cert_list.certificates])
+
+            # if a certificate is removed from disk, the certificates are processed again
+            crt_path = os.path.join(self.tmp_dir, summary[0]["thumbprint"] + ".crt")
+            os.remove(crt_path)
+            protocol.mock_wire_data.set_incarnation(3)
+            goal_state.update()
+            self.assertTrue(os.path.isfile(crt_path), "{0} should have been created".format(crt_path))
+            self.assertEqual(summary, goal_state.certs.summary)
+
     def test_goal_state_should_contain_empty_certs_when_it_is_fails_to_decrypt_certs(self):
         #  This test simulates that scenario by mocking the goal state request is fabric, and it contains incorrect certs(incorrect-certs.xml)
 
@@ -527,6 +527,37 @@ class TestHostPlugin(HttpRequestPredicates, AgentTestCase):
                         test_goal_state,
                         exp_method, exp_url, exp_data)
 
+    def test_put_vm_status_should_update_only_the_modified_pages_of_a_page_blob(self):
+        with mock_wire_protocol(DATA_FILE) as protocol:
+            host_client = protocol.client.get_host_plugin()
+            status_blob = protocol.client.status_blob
+            status_blob.type = page_blob_type
+            status_blob.vm_status = restapi.VMStatus(message="Ready", status="Ready")
+            status_blob.data = "a" * 1500
+
+            with patch.object(restutil, "http_request", return_value=MockResponse('', httpclient.OK)) as patch_http:
+                with patch.object(wire.HostPluginProtocol, "get_api_versions", return_value=api_versions):
+                    host_client.put_vm_status(status_blob, sas_url)
+                    patch_http.reset_mock()
+
+                    status_blob.data = "a" * 700 + "b" + "a" * 799
+                    host_client.put_vm_status(status_blob, sas_url)
+
+                    status_puts = [json.loads(c[0][2]) for c in patch_http.call_args_list if c[0][0] == 'PUT' and c[0][1] == hostplugin_status_url]
+                    self.assertEqual(1, len(status_puts), "Only 1 page should have been updated")
+                    headers = dict((h['headerName'], h['headerValue']) for h in status_puts[0]['headers'])
+                    self.assertEqual("bytes=512-1023", headers["x-ms-range"])
+                    self.assertEqual(sas_url + "?comp=page", status_puts[0]['requestUri'])
+                    self.assertEqual(b"a" * 188 + b"b" + b"a" * 323, base64.b64decode(status_puts[0]['content']))
+
+                    # a status with a different size re-creates the blob
+                    patch_http.reset_mock()
+                    status_blob.data = "a" * 2000
+                    host_client.put_vm_status(status_blob, sas_url)
+
+                    status_puts = [json.loads(c[0][2]) for c in patch_http.call_args_list if c[0][0] == 'PUT' and c[0][1] == hostplugin_status_url]
+                    self.assertEqual(2, len(status_puts), "The blob should have been re-created and then uploaded")
+
     def test_validate_http_request_for_put_vm_log(self):
         def http_put_handler(url, *args, **kwargs):  # pylint: disable=inconsistent-return-statements
             if self.is_host_plugin_put_logs_request(url):
@@ -18,6 +18,8 @@
 
 import json
 import os
+import threading
+import time
 import unittest
 
 from azurelinuxagent.common.protocol import imds
@@ -67,6 +69,67 @@ class TestImds(AgentTestCase):
         self.assertTrue('Metadata' in kw_args['headers'])
         self.assertEqual(True, kw_args['headers']['Metadata'])
 
+    @patch("azurelinuxagent.common.protocol.imds.restutil.http_get")
+    def test_get_compute_should_cache_the_compute_metadata(self, mock_http_get):
+        mock_http_get.side_effect = lambda *_, **__: get_mock_compute_response()
+
+        imds.ImdsClient().get_compute()
+        compute_info = imds.ImdsClient().get_compute()
+
+        self.assertEqual(1, mock_http_get.call_count, "The second call should have been served from the cache")
+        self.assertEqual("westcentralus", compute_info.location)
+
+        with patch("azurelinuxagent.common.protocol.imds.time.time", return_value=time.time() + imds.IMDS_COMPUTE_METADATA_TTL_IN_SECONDS + 1):
+            imds.ImdsClient().get_compute()
+
+        self.assertEqual(2, mock_http_get.call_count, "The cache should have been refreshed after the TTL")
+
+    @patch("azurelinuxagent.common.protocol.imds.restutil.http_get")
+    def test_get_compute_should_return_stale_metadata_when_imds_fails(self, mock_http_get):
+        mock_http_get.return_value = get_mock_compute_response()
+        imds.ImdsClient().get_compute()
+
+        mock_http_get.return_value = MockHttpResponse(status=restutil.httpclient.INTERNAL_SERVER_ERROR)
+        now = time.time()
+        with patch("azurelinuxagent.common.protocol.imds.time.time", return_value=now + imds.IMDS_COMPUTE_METADATA_TTL_IN_SECONDS + 1):
+            compute_info = imds.ImdsClient().get_compute()
+        self.assertEqual(2, mock_http_get.call_count)
+        self.assertEqual("westcentralus", compute_info.location, "The stale data should have been returned")
+
+        with patch("azurelinuxagent.common.protocol.imds.time.time", return_value=now + imds.IMDS_COMPUTE_METADATA_MAX_STALENESS_IN_SECONDS + 1):
+            self.assertRaises(HttpError, imds.ImdsClient().get_compute)
+
+    @patch("azurelinuxagent.common.protocol.imds.restutil.http_get")
+    def test_get_compute_should_coalesce_concurrent_requests(self, mock_http_get):
+        release_response = threading.Event()
+
+        def http_get(*_, **__):
+            release_response.wait()
+            return get_mock_compute_response()
+        mock_http_get.side_effect = http_get
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(imds.ImdsClient().get_compute().vmId)) for _ in range(5)]
+        for t in threads:
+            t.start()
+        time.sleep(0.5)  # give the threads time to issue their requests
+        release_response.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(1, mock_http_get.call_count, "Only one request should have been sent to IMDS")
+        self.assertEqual(["f62f23fb-69e2-4df0-a20b-cb5c201a3e7a"] * 5, results)
+
+    def test_validate_should_refresh_the_compute_metadata(self):
+        with patch("azurelinuxagent.common.utils.restutil.http_get") as mock_http_get:
+            mock_http_get.return_value = MockHttpResponse(status=httpclient.OK, body=TestImds._imds_response('valid'))
+            is_healthy, _ = imds.ImdsClient().validate()
+            self.assertTrue(is_healthy)
+
+            imds.ImdsClient().get_compute()
+
+        self.assertEqual(1, mock_http_get.call_count, "get_compute() should have used the metadata returned by validate()")
+
     @patch("azurelinuxagent.common.protocol.imds.restutil.http_get")
     def test_get_bad_request(self, mock_http_get):
         mock_http_get.return_value = MockHttpResponse(status=restutil.httpclient.BAD_REQUEST)
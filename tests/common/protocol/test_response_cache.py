@@ -0,0 +1,45 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+from azurelinuxagent.common.protocol.response_cache import ResponseCache
+from tests.lib.tools import AgentTestCase, Mock
+
+
+class ResponseCacheTestCase(AgentTestCase):
+    def test_get_conditional_headers_should_return_the_validators_of_the_cached_response(self):
+        cache = ResponseCache()
+        cache.set_content("http://uri", "content", [("ETag", "etag-value"), ("Last-Modified", "last-modified-value"), ("Content-Type", "text/xml")])
+
+        self.assertEqual({'If-None-Match': 'etag-value', 'If-Modified-Since': 'last-modified-value'}, cache.get_conditional_headers("http://uri"))
+        self.assertEqual({}, cache.get_conditional_headers("http://other-uri"))
+        self.assertEqual("content", cache.get_content("http://uri"))
+
+    def test_set_content_should_not_cache_responses_without_validators(self):
+        cache = ResponseCache()
+        cache.set_content("http://uri", "content", [("ETag", "etag-value")])
+        cache.set_content("http://uri", "new content", [("Content-Type", "text/xml")])
+
+        self.assertEqual({}, cache.get_conditional_headers("http://uri"))
+        self.assertIsNone(cache.get_content("http://uri"), "The previous response should have been removed from the cache")
+
+    def test_set_content_should_evict_the_least_recently_used_responses(self):
+        cache = ResponseCache(max_responses=2)
+        cache.set_content("http://uri-1", "content-1", [("ETag", "1")])
+        cache.set_content("http://uri-2", "content-2", [("ETag", "2")])
+        cache.get_content("http://uri-1")
+        cache.set_content("http://uri-3", "content-3", [("ETag", "3")])
+
+        self.assertEqual("content-1", cache.get_content("http://uri-1"))
+        self.assertIsNone(cache.get_content("http://uri-2"))
+        self.assertEqual("content-3", cache.get_content("http://uri-3"))
+
+    def test_parse_should_return_the_cached_object_when_the_content_is_unchanged(self):
+        cache = ResponseCache()
+        parser = Mock(side_effect=lambda content: [content])
+
+        first = cache.parse("<Manifest/>", parser)
+        second = cache.parse("<Manifest/>", parser)
+        third = cache.parse("<Manifest version='2'/>", parser)
+
+        self.assertIs(first, second, "The parsed object should have been reused")
+        self.assertEqual(["<Manifest version='2'/>"], third)
+        self.assertEqual(2, parser.call_count, "The parser should have been invoked only for new content")
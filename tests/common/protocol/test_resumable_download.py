@@ -0,0 +1,168 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import os
+import re
+
+from azurelinuxagent.common.future import httpclient
+from azurelinuxagent.common.protocol import resumable_download
+from azurelinuxagent.common.protocol.resumable_download import ResumableDownload, DownloadJournal, PARTIAL_DOWNLOAD_SUFFIX
+from tests.lib.tools import AgentTestCase, patch
+
+
+class _MockResponse(object):
+    def __init__(self, status, body, headers, fail_after=None):
+        self.status = status
+        self._body = body
+        self._headers = headers
+        self._position = 0
+        self._fail_after = fail_after
+
+    def read(self, size):
+        if self._fail_after is not None and self._position >= self._fail_after:
+            raise IOError("Connection reset by peer")
+        chunk = self._body[self._position:self._position + size]
+        self._position += len(chunk)
+        return chunk
+
+    def getheaders(self):
+        return self._headers
+
+    def close(self):
+        pass
+
+
+class _MockServer(object):
+    """
+    Serves 'content' supporting range requests (unless 'ignore_ranges' is True, in which case the entire content is returned for range
+    requests); 'failures' is a list of byte counts after which the corresponding response fails
+    """
+    def __init__(self, content, etag='"etag-1"', failures=None, ignore_ranges=False):
+        self.content = content
+        self.etag = etag
+        self.failures = [] if failures is None else failures
+        self.ignore_ranges = ignore_ranges
+        self.requests = []
+
+    def fetch_response(self, _uri, headers, _retry_codes, _ok_codes):
+        self.requests.append(dict(headers))
+        fail_after = self.failures.pop(0) if len(self.failures) > 0 else None
+        range_header = headers.get("Range")
+        if range_header is not None and headers.get("If-Range") == self.etag and not self.ignore_ranges:
+            start, end = [int(v) for v in re.match(r"bytes=(\d+)-(\d+)", range_header).groups()]
+            body = self.content[start:end + 1]
+            return _MockResponse(httpclient.PARTIAL_CONTENT, body, [("ETag", self.etag), ("Content-Length", str(len(body)))], fail_after)
+        return _MockResponse(httpclient.OK, self.content, [("ETag", self.etag), ("Content-Length", str(len(self.content))), ("Accept-Ranges", "bytes")], fail_after)
+
+
+class ResumableDownloadTestCase(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.destination = os.path.join(self.tmp_dir, "package.zip")
+        self.content = os.urandom(100 * 1024)
+
+    def _read_destination(self):
+        with open(self.destination, "rb") as file_:
+            return file_.read()
+
+    def test_it_should_download_the_content_with_a_single_request(self):
+        server = _MockServer(self.content)
+
+        ResumableDownload("http://uri", self.destination, None, server.fetch_response).run()
+
+        self.assertEqual(self.content, self._read_destination())
+        self.assertEqual(1, len(server.requests))
+        self.assertFalse(os.path.exists(self.destination + PARTIAL_DOWNLOAD_SUFFIX), "The partial file should have been removed")
+
+    def test_it_should_resume_an_interrupted_download(self):
+        server = _MockServer(self.content, failures=[40 * 1024])
+
+        with patch.object(resumable_download, "_CHUNK_SIZE", 8 * 1024):
+            ResumableDownload("http://uri", self.destination, {"x-header": "value"}, server.fetch_response).run()
+
+        self.assertEqual(self.content, self._read_destination())
+        self.assertEqual(2, len(server.requests))
+        self.assertEqual("bytes={0}-{1}".format(40 * 1024, len(self.content) - 1), server.requests[1]["Range"])
+        self.assertEqual(server.etag, server.requests[1]["If-Range"])
+        self.assertEqual("value", server.requests[1]["x-header"], "The original headers should be included in the range request")
+
+    def test_it_should_keep_the_partial_download_and_resume_it_on_the_next_attempt(self):
+        server = _MockServer(self.content, failures=[16 * 1024] * (resumable_download._MAX_RESUME_ATTEMPTS + 1))
+
+        with patch.object(resumable_download, "_CHUNK_SIZE", 16 * 1024):
+            with self.assertRaises(IOError):
+                ResumableDownload("http://uri", self.destination, None, server.fetch_response).run()
+            self.assertTrue(os.path.exists(self.destination + PARTIAL_DOWNLOAD_SUFFIX), "The partial file should have been kept")
+            self.assertFalse(os.path.exists(self.destination))
+
+            # the next attempt may use a different URI (e.g. the HostGAPlugin)
+            ResumableDownload("http://other-uri", self.destination, None, server.fetch_response).run()
+
+        self.assertEqual(self.content, self._read_destination())
+        journal_file = self.destination + PARTIAL_DOWNLOAD_SUFFIX + ".json"
+        self.assertFalse(os.path.exists(journal_file), "The journal should have been removed")
+
+    def test_it_should_restart_the_download_when_the_resource_changes(self):
+        server = _MockServer(self.content, failures=[16 * 1024] * (resumable_download._MAX_RESUME_ATTEMPTS + 1))
+
+        with patch.object(resumable_download, "_CHUNK_SIZE", 16 * 1024):
+            with self.assertRaises(IOError):
+                ResumableDownload("http://uri", self.destination, None, server.fetch_response).run()
+
+            server.content = os.urandom(50 * 1024)
+            server.etag = '"etag-2"'
+            ResumableDownload("http://uri", self.destination, None, server.fetch_response).run()
+
+        self.assertEqual(server.content, self._read_destination())
+        self.assertFalse(os.path.exists(self.destination + PARTIAL_DOWNLOAD_SUFFIX + ".json"), "The journal should have been removed")
+
+    def test_it_should_download_the_entire_resource_when_the_server_ignores_the_range_header(self):
+        server = _MockServer(self.content, failures=[16 * 1024] * (resumable_download._MAX_RESUME_ATTEMPTS + 1))
+
+        with patch.object(resumable_download, "_CHUNK_SIZE", 16 * 1024):
+            with self.assertRaises(IOError):
+                ResumableDownload("http://uri", self.destination, None, server.fetch_response).run()
+
+            # the next attempt uses a channel that ignores the Range header (e.g. the HostGAPlugin)
+            server.ignore_ranges = True
+            ResumableDownload("http://other-uri", self.destination, None, server.fetch_response).run()
+
+        self.assertEqual(self.content, self._read_destination())
+        self.assertIn("Range", server.requests[-1], "The last request should have been a range request")
+        self.assertFalse(os.path.exists(self.destination + PARTIAL_DOWNLOAD_SUFFIX + ".json"), "The journal should have been removed")
+
+    def test_it_should_download_the_entire_resource_when_the_server_ignores_the_range_header_for_concurrent_segments(self):
+        server = _MockServer(self.content, ignore_ranges=True)
+
+        with patch.object(resumable_download, "_PARALLEL_DOWNLOAD_MIN_SIZE", 1024):
+            ResumableDownload("http://uri", self.destination, None, server.fetch_response).run()
+
+        self.assertEqual(self.content, self._read_destination())
+
+    def test_it_should_download_large_resources_using_concurrent_segments(self):
+        server = _MockServer(self.content)
+
+        with patch.object(resumable_download, "_PARALLEL_DOWNLOAD_MIN_SIZE", 1024):
+            ResumableDownload("http://uri", self.destination, None, server.fetch_response).run()
+
+        self.assertEqual(self.content, self._read_destination())
+        ranges = sorted(r["Range"] for r in server.requests if "Range" in r)
+        self.assertEqual(resumable_download._PARALLEL_DOWNLOAD_SEGMENTS, len(ranges), "Expected one request per segment. Requests: {0}".format(server.requests))
+
+    def test_it_should_not_keep_partial_downloads_when_the_server_does_not_support_ranges(self):
+        def fetch_response(*_):
+            return _MockResponse(httpclient.OK, self.content, [("Content-Length", str(len(self.content)))], fail_after=0)
+
+        with self.assertRaises(IOError):
+            ResumableDownload("http://uri", self.destination, None, fetch_response).run()
+
+        self.assertFalse(os.path.exists(self.destination + PARTIAL_DOWNLOAD_SUFFIX), "The partial file should have been removed")
+
+    def test_journal_should_split_the_resource_in_segments(self):
+        journal = DownloadJournal.create(os.path.join(self.tmp_dir, "journal.json"), "etag", 10, 3)
+
+        self.assertEqual([[0, 3, 0], [4, 7, 4], [8, 9, 8]], journal.segments)
+
+        journal.update(journal.segments[1], 2)
+        loaded = DownloadJournal.load(journal.path)
+        self.assertEqual([[0, 3, 0], [4, 7, 6], [8, 9, 8]], loaded.segments)
+        self.assertEqual(2, loaded.downloaded)
@@ -19,11 +19,15 @@
 import contextlib
 import json
 import os
+import re
 import socket
+import threading
 import time
 import unittest
 import uuid
+import zipfile
 
+from azurelinuxagent.common import conf
 from azurelinuxagent.common.agent_supported_feature import SupportedFeatureNames, get_supported_feature_by_name, \
     get_agent_supported_features_list_for_crp
 from azurelinuxagent.common.event import WALAEventOperation
@@ -32,8 +36,10 @@ from azurelinuxagent.common.exception import ResourceGoneError, ProtocolError, \
 from azurelinuxagent.common.protocol.extensions_goal_state_from_extensions_config import ExtensionsGoalStateFromExtensionsConfig
 from azurelinuxagent.common.protocol.goal_state import GoalStateProperties
 from azurelinuxagent.common.protocol.hostplugin import HostPluginProtocol
+from azurelinuxagent.common.future import httpclient
+from azurelinuxagent.common.protocol.restapi import ExtHandlerStatus, ExtensionStatus, ExtensionSubStatus
 from azurelinuxagent.common.protocol.wire import WireProtocol, WireClient, \
-    StatusBlob, VMStatus
+    StatusBlob, VMStatus, UploadError, MAX_EVENT_BUFFER_SIZE, vm_status_to_v1, _StatusSerializer
 from azurelinuxagent.common.telemetryevent import GuestAgentExtensionEventsSchema, \
     TelemetryEventParam, TelemetryEvent
 from azurelinuxagent.common.utils import restutil
@@ -45,7 +51,7 @@ from tests.lib.mock_wire_protocol import mock_wire_protocol, MockHttpResponse
 from tests.lib.http_request_predicates import HttpRequestPredicates
 from tests.lib.wire_protocol_data import DATA_FILE_NO_EXT, DATA_FILE
 from tests.lib.wire_protocol_data import WireProtocolData
-from tests.lib.tools import patch, AgentTestCase, load_bin_data
+from tests.lib.tools import patch, AgentTestCase, load_bin_data, Mock
 
 data_with_bom = b'\xef\xbb\xbfhehe'
 testurl = 'http://foo'
@@ -232,6 +238,55 @@ class TestWireProtocol(AgentTestCase, HttpRequestPredicates):
             urls = protocol.get_tracked_urls()
             self.assertEqual(len(urls), 1, 'Expected one post request to the host: [{0}]'.format(urls))
 
+    def test_upload_status_blob_should_skip_the_upload_when_the_status_has_not_changed(self, *_):
+        def http_put_handler(url, *_, **__):  # pylint: disable=inconsistent-return-statements
+            if protocol.get_endpoint() in url and url.endswith('/status'):
+                return MockHttpResponse(200)
+
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE, http_put_handler=http_put_handler) as protocol:
+            HostPluginProtocol.is_default_channel = False
+            protocol.client.status_blob.vm_status = VMStatus(message="Ready", status="Ready")
+
+            protocol.client.upload_status_blob()
+            # the timestamp of the status changes, but that should not trigger an upload
+            with patch("azurelinuxagent.common.protocol.wire._get_utc_timestamp_for_status_reporting", return_value="2030-01-01T00:00:00Z"):
+                protocol.client.upload_status_blob()
+            self.assertEqual(1, len(protocol.get_tracked_urls()), "The second upload should have been skipped")
+
+            protocol.client.status_blob.vm_status = VMStatus(message="Not Ready", status="NotReady")
+            protocol.client.upload_status_blob()
+            self.assertEqual(2, len(protocol.get_tracked_urls()), "The status changed, so it should have been uploaded")
+
+            with patch("azurelinuxagent.common.protocol.wire.time.time", return_value=time.time() + conf.get_status_upload_heartbeat_period()):
+                protocol.client.upload_status_blob()
+            self.assertEqual(3, len(protocol.get_tracked_urls()), "The status should have been uploaded after the heartbeat period")
+
+    def test_put_page_blob_should_update_only_the_modified_pages(self, *_):
+        client = Mock()
+        client.call_storage_service = Mock(return_value=MockHttpResponse(httpclient.CREATED))
+        status_blob = StatusBlob(client)
+        status_blob.type = "PageBlob"
+
+        status_blob.put_page_blob(testurl, "a" * 1500)
+        self.assertEqual(2, client.call_storage_service.call_count, "Expected a request to create the blob and a request to upload its content")
+
+        client.call_storage_service.reset_mock()
+        status_blob.put_page_blob(testurl, "a" * 100 + "b" + "a" * 1000 + "b" + "a" * 398)
+
+        calls = client.call_storage_service.call_args_list
+        self.assertEqual(2, len(calls), "Expected a request for each of the modified pages")
+        self.assertEqual(["bytes=0-511", "bytes=1024-1535"], [c[0][3]["x-ms-range"] for c in calls])
+        self.assertTrue(all(c[0][1] == testurl + "?comp=page" for c in calls), "Unexpected URLs: {0}".format([c[0][1] for c in calls]))
+
+        client.call_storage_service.reset_mock()
+        client.call_storage_service.return_value = MockHttpResponse(httpclient.INTERNAL_SERVER_ERROR)
+        self.assertRaises(UploadError, status_blob.put_page_blob, testurl, "c" * 1500)
+
+        client.call_storage_service.reset_mock()
+        client.call_storage_service.return_value = MockHttpResponse(httpclient.CREATED)
+        status_blob.put_page_blob(testurl, "c" * 1500)
+        self.assertEqual(2, client.call_storage_service.call_count, "After a failed upload, the blob should have been re-created")
+
     def test_upload_status_blob_host_ga_plugin(self, *_):
         with create_mock_protocol() as protocol:
             protocol.client.status_blob.vm_status = VMStatus(message="Ready", status="Ready")
@@ -347,6 +402,56 @@ class TestWireProtocol(AgentTestCase, HttpRequestPredicates):
         }
         self.assertEqual(json.dumps(v1_vm_status), actual.to_json())
 
+    @staticmethod
+    def _create_vm_status_with_handlers(handler_count, substatus_message="substatus message"):
+        vm_status = VMStatus(status="Ready", message="Guest Agent is running")
+        for i in range(handler_count):
+            handler_status = ExtHandlerStatus(name="Microsoft.Azure.Extension{0}".format(i), version="1.0.0", status="Ready", message="Plugin enabled")
+            handler_status.extension_status = ExtensionStatus(name="Extension{0}".format(i), operation="Enable", status="success", seq_no=i, code=0, message="Enabled")
+            handler_status.extension_status.substatusList.append(ExtensionSubStatus(name="StdOut", status="success", code=0, message=substatus_message))
+            vm_status.vmAgent.extensionHandlers.append(handler_status)
+        return vm_status
+
+    @patch("time.gmtime", return_value=time.localtime(1485543256))
+    def test_status_blob_should_serialize_the_vm_status_as_json(self, *_):
+        vm_status = self._create_vm_status_with_handlers(3)
+        status_blob = StatusBlob(client=WireProtocol(WIRESERVER_URL).client)
+        status_blob.set_vm_status(vm_status)
+
+        status_blob.prepare("BlockBlob")
+
+        self.assertEqual(json.dumps(vm_status_to_v1(vm_status)), status_blob.data)
+        self.assertEqual(status_blob.data, status_blob.to_json())
+
+    def test_status_blob_should_serialize_only_the_handler_statuses_that_changed(self, *_):
+        vm_status = self._create_vm_status_with_handlers(3)
+        status_blob = StatusBlob(client=WireProtocol(WIRESERVER_URL).client)
+        status_blob.set_vm_status(vm_status)
+        status_blob.prepare("BlockBlob")
+        original_hash = status_blob.data_hash
+
+        create_fragment = _StatusSerializer._create_fragment
+        with patch("azurelinuxagent.common.protocol.wire._StatusSerializer._create_fragment", side_effect=create_fragment) as patcher:
+            with patch("time.gmtime", return_value=time.localtime(time.time() + 3600)):
+                with patch("azurelinuxagent.common.protocol.wire.ext_handler_status_to_v1") as ext_handler_status_to_v1:
+                    status_blob.set_vm_status(self._create_vm_status_with_handlers(3))
+                    status_blob.prepare("BlockBlob")
+                    self.assertEqual(0, ext_handler_status_to_v1.call_count, "The v1 status of the handlers should not have been created")
+            self.assertEqual(0, patcher.call_count, "None of the handler statuses should have been serialized")
+            self.assertEqual(original_hash, status_blob.data_hash, "The hash should not depend on the timestamps of the report")
+            self.assertEqual(json.loads(status_blob.data)["timestampUTC"],
+                             json.loads(status_blob.data)["aggregateStatus"]["handlerAggregateStatus"][2]["runtimeSettingsStatus"]["settingsStatus"]["timestampUTC"],
+                             "The timestamps of the extension statuses should have been updated")
+
+            vm_status = self._create_vm_status_with_handlers(3)
+            vm_status.vmAgent.extensionHandlers[1].extension_status.substatusList[0].message = "new substatus message"
+            status_blob.set_vm_status(vm_status)
+            status_blob.prepare("BlockBlob")
+            self.assertEqual(1, patcher.call_count, "Only the status of the modified handler should have been serialized")
+            self.assertNotEqual(original_hash, status_blob.data_hash, "The hash should have changed")
+            self.assertEqual("new substatus message",
+                             json.loads(status_blob.data)["aggregateStatus"]["handlerAggregateStatus"][1]["runtimeSettingsStatus"]["settingsStatus"]["status"]["substatus"][0]["formattedMessage"]["message"])
+
     def test_it_should_report_supported_features_in_status_blob_if_supported(self, *_):
         with mock_wire_protocol(DATA_FILE) as protocol:
 
@@ -478,7 +583,58 @@ class TestWireProtocol(AgentTestCase, HttpRequestPredicates):
         client.report_event(self._get_telemetry_events_generator(event_list))
 
         self.assertEqual(patch_send_event.call_count, 0)
-        
+
+    def test_report_event_should_batch_a_large_number_of_events_in_linear_time(self, *_):
+        providers = ["69B669B9-4AF8-4C50-BDC4-6006FA76E975", "FFF0196F-EE4C-4EAF-9AA5-776F622DEB4F"]
+        number_of_events = 100000
+
+        def get_events():
+            for i in range(number_of_events):
+                event = get_event(message="Synthetic event {0}".format(i), eventId=i)
+                event.providerId = providers[i % len(providers)]
+                yield event
+
+        batches = dict((p, []) for p in providers)
+        lock = threading.Lock()
+
+        def send_encoded_event(provider_id, event_str, *_, **__):
+            with lock:
+                batches[provider_id].append(event_str)
+
+        client = WireProtocol(WIRESERVER_URL).client
+        with patch("azurelinuxagent.common.protocol.wire.WireClient._send_encoded_event", side_effect=send_encoded_event):
+            start_time = time.time()
+            success = client.report_event(get_events())
+            elapsed = time.time() - start_time
+
+        self.assertTrue(success, "No errors should have been reported")
+        for provider_id in providers:
+            self.assertTrue(all(len(b) < MAX_EVENT_BUFFER_SIZE for b in batches[provider_id]), "All the batches should be smaller than the limit")
+            data = b"".join(batches[provider_id]).decode("utf-8")
+            messages = re.findall(r'Name="Message" Value="Synthetic event (\d+)"', data)
+            self.assertEqual(list(range(providers.index(provider_id), number_of_events, len(providers))), [int(m) for m in messages], "The events were not sent in order")
+        # the bound is generous, since the test machines may be slow; the point is to catch a regression to a non-linear batch builder
+        self.assertLess(elapsed, 60, "Reporting {0} events took too long: {1:.2f} secs".format(number_of_events, elapsed))
+
+    def test_report_event_should_report_failures_of_the_concurrent_sends(self, *_):
+        def get_events():
+            for i in range(1000):
+                event = get_event(message=random_generator(1024), eventId=i)
+                event.providerId = "provider-{0}".format(i % 4)
+                yield event
+
+        def send_encoded_event(provider_id, *_, **__):
+            if provider_id == "provider-2":
+                raise ProtocolError("Simulated failure")
+
+        client = WireProtocol(WIRESERVER_URL).client
+        with patch("azurelinuxagent.common.protocol.wire.WireClient._send_encoded_event", side_effect=send_encoded_event) as patch_send_event:
+            success = client.report_event(get_events())
+
+        self.assertFalse(success, "The failures should have been reported")
+        sent = [args[0] for args, _ in patch_send_event.call_args_list]
+        self.assertEqual(sorted(set(sent)), ["provider-{0}".format(i) for i in range(4)], "All the providers should have been sent")
+
     @patch("azurelinuxagent.common.utils.restutil._http_request")
     def test_report_event_http_req_should_do_max_retries_on_throttling_error(self, mock_http_request, *args):  # pylint: disable=unused-argument
         mock_http_request.return_value = MockHttpResponse(429)
@@ -563,6 +719,28 @@ class TestWireClient(HttpRequestPredicates, AgentTestCase):
             self.assertTrue(os.path.exists(target_directory), "The extension package was not downloaded")
             self.assertFalse(os.path.exists(target_file), "The extension package was not deleted")
 
+    def test_download_package_should_not_expand_the_package(self):
+        invalid_url = 'https://fake_host_1/fake_extension.zip'
+        extension_url = 'https://fake_host_2/fake_extension.zip'
+        target_file = os.path.join(self.tmp_dir, 'fake_extension.zip')
+
+        def http_get_handler(url, *_, **__):
+            if url == invalid_url:
+                return MockHttpResponse(200, body=b"An invalid ZIP file")
+            if url == extension_url:
+                return MockHttpResponse(200, body=load_bin_data("ga/fake_extension.zip"))
+            if self.is_host_plugin_extension_artifact_request(url):
+                return MockHttpResponse(500)
+            return None
+
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE, http_get_handler=http_get_handler) as protocol:
+            # the URIs are tried in random order; the invalid package must be discarded and the valid one downloaded
+            with patch("azurelinuxagent.common.protocol.endpoint_scoreboard.random.shuffle", side_effect=lambda uris: uris.sort()):
+                protocol.client.download_package("extension package", [invalid_url, extension_url], target_file, use_verify_header=False)
+
+            self.assertTrue(zipfile.is_zipfile(target_file), "The extension package was not downloaded")
+            self.assertEqual(["fake_extension.zip"], [f for f in os.listdir(self.tmp_dir) if f.startswith("fake_extension")], "The package should not have been expanded")
+
     def test_download_zip_package_should_not_invoke_host_channel_when_direct_channel_succeeds(self):
         extension_url = 'https://fake_host/fake_extension.zip'
         target_file = os.path.join(self.tmp_dir, 'fake_extension.zip')
@@ -722,6 +900,148 @@ class TestWireClient(HttpRequestPredicates, AgentTestCase):
             self.assertEqual(urls[0], manifest_url, "The manifest should have been downloaded over the direct channel")
             self.assertFalse(HostPluginProtocol.is_default_channel, "The default channel should not have changed")
 
+    def test_fetch_manifest_should_hedge_the_request_when_the_first_uri_is_slow(self):
+        slow_url = 'https://slow_host/fake_manifest.xml'
+        fast_url = 'https://fast_host/fake_manifest.xml'
+        manifest_xml = '<?xml version="1.0" encoding="utf-8"?><PluginVersionManifest/>'
+        release_slow_request = threading.Event()
+        requested_urls = []
+
+        def http_get_handler(url, *_, **__):
+            if url in (slow_url, fast_url):
+                requested_urls.append(url)
+            if url == slow_url:
+                release_slow_request.wait(30)
+                return MockHttpResponse(200, manifest_xml.encode('utf-8'))
+            if url == fast_url:
+                return MockHttpResponse(200, manifest_xml.encode('utf-8'))
+            return None
+
+        try:
+            with mock_wire_protocol(wire_protocol_data.DATA_FILE, http_get_handler=http_get_handler) as protocol:
+                HostPluginProtocol.is_default_channel = False
+
+                with patch("azurelinuxagent.common.conf.get_artifact_download_hedge_delay", return_value=1):
+                    with patch("azurelinuxagent.common.protocol.endpoint_scoreboard.random.shuffle", side_effect=lambda uris: uris.sort(reverse=True)):  # try slow_host first
+                        manifest = protocol.client.fetch_manifest("test", [fast_url, slow_url], use_verify_header=False)
+
+                self.assertEqual(manifest, manifest_xml, 'The expected manifest was not downloaded')
+                self.assertEqual([slow_url, fast_url], requested_urls, "The request should have been hedged to the second URI")
+                self.assertIsNotNone(protocol.client._endpoint_scoreboard.get_latency(fast_url), "The latency of the fast URI should have been recorded")
+        finally:
+            release_slow_request.set()
+
+    def test_fetch_manifest_should_cancel_the_hedged_requests_that_are_still_in_flight(self):
+        slow_url = 'https://slow_host/fake_manifest.xml'
+        fast_url = 'https://fast_host/fake_manifest.xml'
+        manifest_xml = '<?xml version="1.0" encoding="utf-8"?><PluginVersionManifest/>'
+        release_slow_request = threading.Event()
+        slow_request_completed = threading.Event()
+        hgap_requests = []
+
+        def http_get_handler(url, *_, **__):
+            if url == slow_url:
+                release_slow_request.wait(30)
+                slow_request_completed.set()
+                return MockHttpResponse(500)
+            if url == fast_url:
+                return MockHttpResponse(200, manifest_xml.encode('utf-8'))
+            if url.endswith('/extensionArtifact'):
+                hgap_requests.append(url)
+            return None
+
+        try:
+            with mock_wire_protocol(wire_protocol_data.DATA_FILE, http_get_handler=http_get_handler) as protocol:
+                HostPluginProtocol.is_default_channel = False
+
+                with patch("azurelinuxagent.common.conf.get_artifact_download_hedge_delay", return_value=1):
+                    with patch("azurelinuxagent.common.protocol.endpoint_scoreboard.random.shuffle", side_effect=lambda uris: uris.sort(reverse=True)):  # try slow_host first
+                        manifest = protocol.client.fetch_manifest("test", [fast_url, slow_url], use_verify_header=False)
+                        self.assertEqual(manifest, manifest_xml, 'The expected manifest was not downloaded')
+
+                        release_slow_request.set()
+                        self.assertTrue(slow_request_completed.wait(30), "The slow request should have completed")
+                        for thread in [t for t in threading.enumerate() if t.name == "HedgedDownload"]:
+                            thread.join(30)
+
+                self.assertEqual([], hgap_requests, "The cancelled download should not have tried the HostGAPlugin channel")
+                self.assertFalse(HostPluginProtocol.is_default_channel, "The default channel should not have changed")
+                self.assertIsNone(protocol.client._endpoint_scoreboard.get_latency(slow_url), "The cancelled download should not have been recorded")
+        finally:
+            release_slow_request.set()
+
+    def test_fetch_manifest_should_skip_the_uris_that_failed_recently(self):
+        failing_url = 'https://failing_host/fake_manifest.xml'
+        good_url = 'https://good_host/fake_manifest.xml'
+        manifest_xml = '<?xml version="1.0" encoding="utf-8"?><PluginVersionManifest/>'
+
+        def http_get_handler(url, *_, **__):
+            if url == failing_url or self.is_host_plugin_extension_artifact_request(url):
+                return MockHttpResponse(500)
+            if url == good_url:
+                return MockHttpResponse(200, manifest_xml.encode('utf-8'))
+            return None
+
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE, http_get_handler=http_get_handler) as protocol:
+            HostPluginProtocol.is_default_channel = False
+
+            with patch("azurelinuxagent.common.protocol.endpoint_scoreboard.random.shuffle", side_effect=lambda uris: uris.sort()):  # try failing_host first
+                protocol.client.fetch_manifest("test", [failing_url, good_url], use_verify_header=False)
+                self.assertIn(failing_url, protocol.get_tracked_urls(), "The failing URI should have been tried on the first download")
+
+                protocol.set_http_handlers(http_get_handler=http_get_handler)  # resets the tracked URLs
+                manifest = protocol.client.fetch_manifest("test", [failing_url, good_url], use_verify_header=False)
+
+            self.assertEqual(manifest, manifest_xml, 'The expected manifest was not downloaded')
+            self.assertEqual([good_url], protocol.get_tracked_urls(), "The failing URI should have been skipped")
+
+    def test_fetch_manifest_should_use_the_cached_manifest_when_it_is_not_modified(self):
+        manifest_url = 'https://fake_host/fake_manifest.xml'
+        manifest_xml = '<?xml version="1.0" encoding="utf-8"?><PluginVersionManifest/>'
+        request_headers = []
+
+        def http_get_handler(url, *_, **kwargs):
+            if url == manifest_url:
+                request_headers.append(kwargs.get("headers"))
+                if len(request_headers) == 1:
+                    return MockHttpResponse(200, manifest_xml.encode('utf-8'), headers=[("ETag", '"0x8D9"')])
+                return MockHttpResponse(304)
+            return None
+
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE, http_get_handler=http_get_handler) as protocol:
+            HostPluginProtocol.is_default_channel = False
+
+            first = protocol.client.fetch_manifest("test", [manifest_url], use_verify_header=False)
+            second = protocol.client.fetch_manifest("test", [manifest_url], use_verify_header=False)
+
+            self.assertEqual(manifest_xml, first, 'The expected manifest was not downloaded')
+            self.assertEqual(manifest_xml, second, 'The cached manifest should have been returned')
+            self.assertEqual(2, len(request_headers), "Unexpected number of requests for the manifest")
+            self.assertTrue(request_headers[0] is None or 'If-None-Match' not in request_headers[0], "The first request should not be conditional")
+            self.assertEqual('"0x8D9"', request_headers[1].get('If-None-Match'), "The second request should be conditional")
+
+    def test_fetch_config_should_use_the_cached_content_when_it_is_not_modified(self):
+        config_url = 'http://168.63.129.16/machine/?comp=config&type=test'
+        config_xml = '<?xml version="1.0" encoding="utf-8"?><Test/>'
+        request_headers = []
+
+        def http_get_handler(url, *_, **kwargs):
+            if url == config_url:
+                request_headers.append(kwargs.get("headers"))
+                if len(request_headers) == 1:
+                    return MockHttpResponse(200, config_xml.encode('utf-8'), headers=[("Last-Modified", "Wed, 21 Oct 2015 07:28:00 GMT")])
+                return MockHttpResponse(304)
+            return None
+
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE, http_get_handler=http_get_handler) as protocol:
+            first = protocol.client.fetch_config(config_url, {"x-ms-version": "2012-11-30"})
+            second = protocol.client.fetch_config(config_url, {"x-ms-version": "2012-11-30"})
+
+            self.assertEqual(config_xml, first)
+            self.assertEqual(config_xml, second, 'The cached content should have been returned')
+            self.assertEqual("Wed, 21 Oct 2015 07:28:00 GMT", request_headers[1].get('If-Modified-Since'), "The second request should be conditional")
+            self.assertEqual("2012-11-30", request_headers[1].get('x-ms-version'), "The original headers should have been preserved")
+
     def test_fetch_manifest_should_use_host_channel_when_direct_channel_fails_and_set_it_to_default(self):
         manifest_url = 'https://fake_host/fake_manifest.xml'
         manifest_xml = '<?xml version="1.0" encoding="utf-8"?><PluginVersionManifest/>'
@@ -104,13 +104,14 @@ class TestEvent(HttpRequestPredicates, AgentTestCase):
 
     @staticmethod
     def _collect_events():
-        def append_event(e):
+        def append_event(e, **_):
             for p in e.parameters:
                 if p.name == 'Operation' and p.value == TestEvent._Operation \
                     or p.name == 'Category' and p.value == TestEvent._Category \
                     or p.name == 'Message' and p.value == TestEvent._Message \
                     or p.name == 'Context1' and p.value == TestEvent._Message:
                     event_list.append(e)
+            return True
         event_list = []
         send_telemetry_events = MagicMock()
         send_telemetry_events.enqueue_event = MagicMock(wraps=append_event)
@@ -390,6 +391,19 @@ class TestEvent(HttpRequestPredicates, AgentTestCase):
         self.assertEqual(len(event_list), 3, "Did not collect all the events that were created")
         self.assertEqual(len(event_files), 0, "The event files were not deleted")
 
+    def test_collect_events_should_process_the_events_in_the_event_spool(self):
+        with patch("azurelinuxagent.common.conf.get_enable_event_spool", return_value=True):
+            add_event(name='Event1', op=TestEvent._Operation)
+            add_event(name='Event2', op=TestEvent._Operation)
+            add_event(name='Event3', op=TestEvent._Operation)
+
+        self.assertEqual(0, len(self._collect_event_files()), "The events should not have been saved to individual files")
+
+        event_list = self._collect_events()
+        self.assertEqual(['Event1', 'Event2', 'Event3'], [[p.value for p in e.parameters if p.name == 'TaskName' or p.name == 'Name'][0] for e in event_list])
+
+        self.assertEqual(0, len(self._collect_events()), "The events should not have been collected again")
+
     def test_save_event(self):
         add_event('test', message='test event', op=TestEvent._Operation)
         self.assertTrue(len(self._collect_event_files()) == 1)
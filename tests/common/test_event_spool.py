@@ -0,0 +1,126 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import os
+
+from azurelinuxagent.common import event_spool
+from azurelinuxagent.common.event_spool import EventSpool
+from tests.lib.tools import AgentTestCase, patch
+
+
+class TestEventSpool(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.spool_dir = os.path.join(self.tmp_dir, "event_spool")
+
+    def _list_segments(self):
+        return sorted([f for f in os.listdir(self.spool_dir) if f.endswith(".segment")])
+
+    def test_read_should_return_the_appended_events(self):
+        spool = EventSpool(self.spool_dir)
+        for i in range(3):
+            spool.append("event {0}".format(i).encode("utf-8"))
+
+        records = spool.read()
+
+        self.assertEqual([b"event 0", b"event 1", b"event 2"], [r.data for r in records])
+        self.assertEqual([], spool.read(), "The events should not have been read again")
+
+        spool.rewind()
+        self.assertEqual([b"event 0", b"event 1"], [r.data for r in spool.read(max_records=2)], "The events should have been read again after rewinding")
+
+    def test_read_should_start_at_the_committed_position(self):
+        spool = EventSpool(self.spool_dir)
+        for i in range(3):
+            spool.append("event {0}".format(i).encode("utf-8"))
+
+        spool.commit(spool.read(max_records=2)[-1].position)
+
+        self.assertEqual([b"event 2"], [r.data for r in spool.read()])
+        self.assertEqual([b"event 2"], [r.data for r in EventSpool(self.spool_dir).read()], "The cursor should have been persisted")
+
+    def test_commit_should_ignore_positions_read_before_rewinding(self):
+        spool = EventSpool(self.spool_dir)
+        spool.append(b"event 0")
+        position = spool.read()[-1].position
+
+        spool.rewind()
+
+        self.assertFalse(spool.commit(position), "The position should not have been committed")
+        records = spool.read()
+        self.assertEqual([b"event 0"], [r.data for r in records])
+        self.assertTrue(spool.commit(records[-1].position), "The position read after rewinding should have been committed")
+
+    def test_append_should_start_a_new_segment_when_the_current_one_is_full(self):
+        spool = EventSpool(self.spool_dir)
+        with patch("azurelinuxagent.common.event_spool.MAX_SEGMENT_SIZE", 10):
+            for i in range(3):
+                spool.append("event {0}".format(i).encode("utf-8"))
+
+        self.assertEqual(4, len(self._list_segments()), "Each event should have filled a segment")
+        self.assertEqual([b"event 0", b"event 1", b"event 2"], [r.data for r in spool.read()])
+
+    def test_append_should_not_list_the_spool_directory_on_each_event(self):
+        spool = EventSpool(self.spool_dir)
+        spool.append(b"event 0")
+
+        with patch("azurelinuxagent.common.event_spool.os.listdir") as listdir:
+            spool.append(b"event 1")
+            self.assertEqual(0, listdir.call_count, "The directory should not have been listed")
+
+    def test_append_should_not_recreate_a_segment_removed_by_another_process(self):
+        writer = EventSpool(self.spool_dir)
+        writer.append(b"event 0")
+
+        # another process fills the spool, removing the segment the writer is appending to, and the reader commits past it
+        other = EventSpool(self.spool_dir)
+        with patch("azurelinuxagent.common.event_spool.MAX_SEGMENT_SIZE", 10):
+            with patch("azurelinuxagent.common.event_spool.MAX_NUMBER_OF_SEGMENTS", 2):
+                for i in range(1, 4):
+                    other.append("event {0}".format(i).encode("utf-8"))
+        reader = EventSpool(self.spool_dir)
+        reader.commit(reader.read()[-1].position)
+        segments = self._list_segments()
+
+        writer.append(b"event 4")
+
+        self.assertEqual(segments, self._list_segments(), "The writer should have appended to the newest segment")
+        self.assertEqual([b"event 4"], [r.data for r in reader.read()])
+
+    def test_commit_should_remove_the_segments_that_were_processed(self):
+        spool = EventSpool(self.spool_dir)
+        with patch("azurelinuxagent.common.event_spool.MAX_SEGMENT_SIZE", 10):
+            for i in range(3):
+                spool.append("event {0}".format(i).encode("utf-8"))
+
+        spool.commit(spool.read(max_records=2)[-1].position)
+
+        self.assertEqual(3, len(self._list_segments()), "The first segment should have been removed")
+
+    def test_append_should_remove_the_oldest_segments_when_the_spool_is_full(self):
+        spool = EventSpool(self.spool_dir)
+        with patch("azurelinuxagent.common.event_spool.MAX_SEGMENT_SIZE", 10):
+            with patch("azurelinuxagent.common.event_spool.MAX_NUMBER_OF_SEGMENTS", 3):
+                for i in range(5):
+                    spool.append("event {0}".format(i).encode("utf-8"))
+
+        self.assertEqual(3, len(self._list_segments()))
+        self.assertEqual([b"event 3", b"event 4"], [r.data for r in spool.read()])
+
+    def test_read_should_skip_the_rest_of_a_segment_with_an_invalid_record(self):
+        spool = EventSpool(self.spool_dir)
+        spool.append(b"event 0")
+        spool.append(b"event 1")
+        segment = os.path.join(self.spool_dir, self._list_segments()[0])
+        with open(segment, "r+b") as segment_file:  # truncate the last record
+            segment_file.truncate(os.path.getsize(segment) - 1)
+
+        records = spool.read()
+
+        self.assertEqual([b"event 0", None], [r.data for r in records])
+
+        spool.commit(records[-1].position)
+        spool.append(b"event 2")
+        self.assertEqual([b"event 2"], [r.data for r in spool.read()], "New events should have been appended to a new segment")
+
+    def test_get_event_spool_should_return_the_same_spool_for_the_same_directory(self):
+        self.assertIs(event_spool.get_event_spool(), event_spool.get_event_spool())
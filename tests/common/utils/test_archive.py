@@ -2,13 +2,15 @@
 # Licensed under the Apache License.
 import os
 import tempfile
+import threading
 import zipfile
 from datetime import datetime, timedelta
 
 import azurelinuxagent.common.logger as logger
 from azurelinuxagent.common import conf
 from azurelinuxagent.common.utils import fileutil, timeutil
-from azurelinuxagent.common.utils.archive import GoalStateHistory, StateArchiver, _MAX_ARCHIVED_STATES, ARCHIVE_DIRECTORY_NAME
+from azurelinuxagent.common.utils.archive import GoalStateHistory, GoalStateHistoryWriter, StateArchiver, _MAX_ARCHIVED_STATES, \
+    ARCHIVE_DIRECTORY_NAME, get_goal_state_history_writer
 from tests.lib.tools import AgentTestCase, patch
 
 debug = False
@@ -131,6 +133,116 @@ class TestArchive(AgentTestCase):
                 filename = "{0}_0.zip".format(timestamp)
             self.assertTrue(filename in archived_entries, "'{0}' is not in the list of unpurged entires".format(filename))
 
+    def test_goal_state_history_should_purge_old_items_without_listing_the_history_directory(self):
+        for i in range(0, _MAX_ARCHIVED_STATES):
+            GoalStateHistory(datetime.utcnow() + timedelta(seconds=i), 'test_{0}'.format(i)).save_goal_state("<GoalState/>")
+        self.assertEqual(_MAX_ARCHIVED_STATES, len(os.listdir(self.history_dir)))
+
+        with patch("azurelinuxagent.common.utils.archive.os.listdir", side_effect=os.listdir) as listdir:
+            history = GoalStateHistory(datetime.utcnow() + timedelta(minutes=1), 'test_new')
+            history.save_goal_state("<GoalState/>")
+            GoalStateHistory(datetime.utcnow() + timedelta(minutes=2), 'test_newest')
+
+        self.assertEqual(0, listdir.call_count, "The history directory should not have been listed")
+        items = os.listdir(self.history_dir)
+        self.assertEqual(_MAX_ARCHIVED_STATES, len(items))
+        self.assertFalse(any(item.endswith("_test_0") for item in items), "The oldest item should have been purged: {0}".format(items))
+        self.assertTrue(GoalStateHistory.tag_exists('test_new'), "The new item should be in the history")
+
+    def test_goal_state_history_should_be_saved_by_a_background_thread_when_async_history_is_enabled(self):
+        threads = []
+        with patch("azurelinuxagent.common.conf.get_enable_async_goal_state_history", return_value=True):
+            with patch("azurelinuxagent.common.utils.archive.GoalStateHistory._save_placeholder", side_effect=lambda: threads.append(threading.current_thread())):
+                history = GoalStateHistory(datetime.utcnow(), 'async')
+                history.save_goal_state("<GoalState/>")
+                self.assertTrue(GoalStateHistory.tag_exists('async'), "The pending item should be in the history")
+
+                get_goal_state_history_writer().flush()
+
+        self.assertEqual(1, len(threads), "The placeholder should have been saved once")
+        self.assertNotEqual(threading.current_thread(), threads[0], "The history should have been saved by a background thread")
+        with open(os.path.join(self.history_dir, [item for item in os.listdir(self.history_dir) if item.endswith("__async")][0], "GoalState.xml")) as goal_state:
+            self.assertEqual("<GoalState/>", goal_state.read())
+
+    def test_goal_state_history_writer_should_drop_operations_when_its_queue_is_full(self):
+        blocked = threading.Event()
+        release = threading.Event()
+        executed = []
+
+        def block():
+            blocked.set()
+            release.wait()
+
+        with patch("azurelinuxagent.common.conf.get_enable_async_goal_state_history", return_value=True):
+            with patch("azurelinuxagent.common.utils.archive._MAX_PENDING_HISTORY_OPERATIONS", 2):
+                writer = GoalStateHistoryWriter()
+                writer.run(block)
+                blocked.wait(5)
+                for i in range(0, 4):
+                    writer.run(lambda i=i: executed.append(i))
+                release.set()
+                writer.flush()
+
+        self.assertEqual([0, 1], executed, "Only the operations that fit in the queue should have been executed")
+
+    def test_goal_state_history_writer_should_report_the_dropped_operations(self):
+        blocked = threading.Event()
+        release = threading.Event()
+
+        def block():
+            blocked.set()
+            release.wait()
+
+        try:
+            with patch("azurelinuxagent.common.conf.get_enable_async_goal_state_history", return_value=True):
+                with patch("azurelinuxagent.common.utils.archive._MAX_PENDING_HISTORY_OPERATIONS", 1):
+                    with patch("azurelinuxagent.common.logger.warn") as warn:
+                        writer = GoalStateHistoryWriter()
+                        writer.run(block)
+                        blocked.wait(5)
+                        for _ in range(0, 3):
+                            writer.run(lambda: None)
+
+                        dropped_reports = [args for args, _ in warn.call_args_list if "dropped" in args[0]]
+                        self.assertEqual([1], [args[1] for args in dropped_reports], "Only the first dropped operation should have been reported within the report period")
+
+                        writer.flush(timeout=0.1)
+
+                        dropped_reports = [args for args, _ in warn.call_args_list if "dropped" in args[0]]
+                        self.assertEqual([1, 1], [args[1] for args in dropped_reports], "flush() should have reported the remaining dropped operations")
+                        self.assertTrue(any("Timeout waiting for the goal state history writer" in args[0] for args, _ in warn.call_args_list), "flush() should have timed out")
+        finally:
+            release.set()
+
+    def test_tag_exists_should_not_include_the_items_whose_save_was_dropped(self):
+        blocked = threading.Event()
+        release = threading.Event()
+
+        def block():
+            blocked.set()
+            release.wait()
+
+        writer = GoalStateHistoryWriter()
+        try:
+            with patch("azurelinuxagent.common.conf.get_lib_dir", return_value=self.tmp_dir):
+                with patch("azurelinuxagent.common.conf.get_enable_async_goal_state_history", return_value=True):
+                    with patch("azurelinuxagent.common.utils.archive._MAX_PENDING_HISTORY_OPERATIONS", 2):
+                        with patch("azurelinuxagent.common.utils.archive._history_writer", writer):
+                            writer.run(block)
+                            blocked.wait(5)
+
+                            GoalStateHistory(datetime.utcnow(), 'queued').save_goal_state("<GoalState/>")  # the purge and the save fill the queue
+                            GoalStateHistory(datetime.utcnow(), 'dropped').save_goal_state("<GoalState/>")
+
+                            self.assertTrue(GoalStateHistory.tag_exists('queued'), "The item queued to be saved should be in the index")
+                            self.assertFalse(GoalStateHistory.tag_exists('dropped'), "The item whose save was dropped should not be in the index")
+
+                            release.set()
+                            writer.flush()
+                            self.assertTrue(GoalStateHistory.tag_exists('queued'))
+        finally:
+            release.set()
+
     def test_purge_legacy_goal_state_history(self):
         with patch("azurelinuxagent.common.conf.get_lib_dir", return_value=self.tmp_dir):
             # SharedConfig.xml is used by other components (Azsec and Singularity/HPC Infiniband); verify that we do not delete it
@@ -20,8 +20,9 @@ import unittest
 
 import azurelinuxagent.common.conf as conf
 from azurelinuxagent.common.exception import CryptError
-from azurelinuxagent.common.utils.cryptutil import CryptUtil
-from tests.lib.tools import AgentTestCase, data_dir, load_data, is_python_version_26, skip_if_predicate_true
+from azurelinuxagent.common.utils import shellutil
+from azurelinuxagent.common.utils.cryptutil import CryptUtil, split_pem, _pem_to_der, _der_to_pem, _read_der_item, _read_der_sequence
+from tests.lib.tools import AgentTestCase, data_dir, load_data, is_python_version_26, skip_if_predicate_true, patch
 
 
 class TestCryptoUtilOperations(AgentTestCase):
@@ -80,6 +81,46 @@ class TestCryptoUtilOperations(AgentTestCase):
         do_test("rsa-key.pem", "rsa-key.pub.pem")
         do_test("ec-key.pem", "ec-key.pub.pem")
 
+    def test_get_pubkey_from_prv_pem_should_return_the_same_key_as_openssl(self):
+        crypto = CryptUtil(conf.get_openssl_cmd())
+
+        def do_test(prv_key):
+            prv_key = os.path.join(data_dir, "wire", prv_key)
+            self.assertEqual(crypto.get_pubkey_from_prv(prv_key), crypto.get_pubkey_from_prv_pem(load_data(prv_key)))
+
+        with patch("azurelinuxagent.common.utils.cryptutil.shellutil.run_command", side_effect=shellutil.run_command) as run_command:
+            do_test("rsa-key.pem")
+            do_test("trans_prv")
+            self.assertEqual(0, len([c for c in run_command.call_args_list if "pkey" in c[0][0]]), "RSA keys should be parsed in-process")
+            do_test("ec-key.pem")
+
+    def test_get_pubkey_from_prv_pem_should_parse_pkcs1_rsa_keys(self):
+        crypto = CryptUtil(conf.get_openssl_cmd())
+        rsa_key = os.path.join(data_dir, "wire", "rsa-key.pem")
+        # the PKCS #8 key wraps the PKCS #1 key in an OCTET STRING (the third item of the sequence)
+        private_key_info = _pem_to_der(load_data(rsa_key), "PRIVATE KEY")
+        _, start, end = _read_der_item(private_key_info, _read_der_sequence(private_key_info)[2][0])
+        pkcs1 = _der_to_pem(private_key_info[start:end], "RSA PRIVATE KEY")
+
+        self.assertEqual(crypto.get_pubkey_from_prv(rsa_key), crypto.get_pubkey_from_prv_pem(pkcs1))
+
+    def test_get_pubkey_and_thumbprint_from_crt_pem_should_return_the_same_values_as_openssl(self):
+        crypto = CryptUtil(conf.get_openssl_cmd())
+        crt = os.path.join(data_dir, "wire", "trans_cert")
+
+        self.assertEqual(crypto.get_pubkey_from_crt(crt), crypto.get_pubkey_from_crt_pem(load_data(crt)))
+        self.assertEqual(crypto.get_thumbprint_from_crt(crt), CryptUtil.get_thumbprint_from_crt_pem(load_data(crt)))
+
+    def test_split_pem_should_return_the_keys_and_certificates(self):
+        prv = load_data(os.path.join(data_dir, "wire", "rsa-key.pem"))
+        crt = load_data(os.path.join(data_dir, "wire", "trans_cert"))
+
+        items = split_pem("Bag Attributes\n" + crt + prv + crt)
+
+        self.assertEqual(['crt', 'prv', 'crt'], [item_type for item_type, _ in items])
+        self.assertEqual("Bag Attributes\n" + crt, items[0][1])
+        self.assertEqual(prv, items[1][1])
+
     def test_get_pubkey_from_crt_invalid_file(self):
         crypto = CryptUtil(conf.get_openssl_cmd())
         prv_key = os.path.join(data_dir, "wire", "trans_prv_does_not_exist")
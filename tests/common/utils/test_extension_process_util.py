@@ -18,6 +18,7 @@ import os
 import shutil
 import subprocess
 import tempfile
+import time
 
 from azurelinuxagent.common.exception import ExtensionError, ExtensionErrorCodes
 from azurelinuxagent.common.future import ustr
@@ -56,8 +57,25 @@ class TestProcessUtils(AgentTestCase):
         self.assertEqual(timed_out, False) 
         self.assertEqual(ret, 0) 
 
+    def test_wait_for_process_completion_or_timeout_should_return_as_soon_as_the_process_completes(self):
+        process = subprocess.Popen(
+            "sleep 0.1",
+            shell=True,
+            cwd=self.tmp_dir,
+            env={},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+
+        start = time.time()
+        timed_out, ret, _ = wait_for_process_completion_or_timeout(process=process, timeout=60, cpu_controller=None)
+        elapsed = time.time() - start
+
+        self.assertEqual(timed_out, False)
+        self.assertEqual(ret, 0)
+        self.assertTrue(elapsed < 1, "The wait should have completed right after the process; it took {0} seconds".format(elapsed))
+
     def test_wait_for_process_completion_or_timeout_should_kill_process_on_timeout(self):
-        timeout = 5
+        timeout = 2
         process = subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
             "sleep 1m",
             shell=True,
@@ -69,17 +87,17 @@ class TestProcessUtils(AgentTestCase):
 
         # We don't actually mock the kill, just wrap it so we can assert its call count
         with patch('azurelinuxagent.ga.extensionprocessutil.os.killpg', wraps=os.killpg) as patch_kill:
-            with patch('time.sleep') as mock_sleep:
-                timed_out, ret, _ = wait_for_process_completion_or_timeout(process=process, timeout=timeout,
-                                                                           cpu_controller=None)
+            start = time.time()
+            timed_out, ret, _ = wait_for_process_completion_or_timeout(process=process, timeout=timeout,
+                                                                       cpu_controller=None)
+            elapsed = time.time() - start
 
-                # We're mocking sleep to avoid prolonging the test execution time, but we still want to make sure
-                # we're "waiting" the correct amount of time before killing the process
-                self.assertEqual(mock_sleep.call_count, timeout) 
+            # make sure we waited the correct amount of time before killing the process
+            self.assertTrue(timeout <= elapsed < timeout + 5, "Expected to wait {0} seconds; waited {1}".format(timeout, elapsed))
 
-                self.assertEqual(patch_kill.call_count, 1) 
-                self.assertEqual(timed_out, True) 
-                self.assertEqual(ret, None) 
+            self.assertEqual(patch_kill.call_count, 1) 
+            self.assertEqual(timed_out, True) 
+            self.assertEqual(ret, None) 
 
     def test_handle_process_completion_should_return_nonzero_when_process_fails(self):
         process = subprocess.Popen(
@@ -114,65 +132,63 @@ class TestProcessUtils(AgentTestCase):
 
     def test_handle_process_completion_should_raise_on_timeout(self):
         command = "sleep 1m"
-        timeout = 20
+        timeout = 1
         with tempfile.TemporaryFile(dir=self.tmp_dir, mode="w+b") as stdout:
             with tempfile.TemporaryFile(dir=self.tmp_dir, mode="w+b") as stderr:
-                with patch('time.sleep') as mock_sleep:
-                    with self.assertRaises(ExtensionError) as context_manager:
-                        process = subprocess.Popen(command,  # pylint: disable=subprocess-popen-preexec-fn
-                                                   shell=True,
-                                                   cwd=self.tmp_dir,
-                                                   env={},
-                                                   stdout=stdout,
-                                                   stderr=stderr,
-                                                   preexec_fn=os.setsid)
+                with self.assertRaises(ExtensionError) as context_manager:
+                    process = subprocess.Popen(command,  # pylint: disable=subprocess-popen-preexec-fn
+                                               shell=True,
+                                               cwd=self.tmp_dir,
+                                               env={},
+                                               stdout=stdout,
+                                               stderr=stderr,
+                                               preexec_fn=os.setsid)
 
+                    start = time.time()
+                    try:
                         handle_process_completion(process=process, command=command, timeout=timeout, stdout=stdout,
                                                   stderr=stderr, error_code=42)
+                    finally:
+                        elapsed = time.time() - start
 
-                    # We're mocking sleep to avoid prolonging the test execution time, but we still want to make sure
-                    # we're "waiting" the correct amount of time before killing the process and raising an exception
-                    # Due to an extra call to sleep at some point in the call stack which only happens sometimes,
-                    # we are relaxing this assertion to allow +/- 2 sleep calls.
-                    self.assertTrue(abs(mock_sleep.call_count - timeout) <= 2)
-
-                    self.assertEqual(context_manager.exception.code, ExtensionErrorCodes.PluginHandlerScriptTimedout)
-                    self.assertIn("Timeout({0})".format(timeout), ustr(context_manager.exception))
-                    self.assertNotIn("CPUThrottledTime({0}secs)".format(timeout), ustr(context_manager.exception)) #Extension not started in cpuCgroup
+                # make sure we waited the correct amount of time before killing the process and raising an exception
+                self.assertTrue(timeout <= elapsed < timeout + 5, "Expected to wait {0} seconds; waited {1}".format(timeout, elapsed))
+                self.assertEqual(context_manager.exception.code, ExtensionErrorCodes.PluginHandlerScriptTimedout)
+                self.assertIn("Timeout({0})".format(timeout), ustr(context_manager.exception))
+                self.assertNotIn("CPUThrottledTime({0}secs)".format(timeout), ustr(context_manager.exception)) #Extension not started in cpuCgroup
 
 
     def test_handle_process_completion_should_log_throttled_time_on_timeout(self):
         command = "sleep 1m"
-        timeout = 20
+        timeout = 1
         with tempfile.TemporaryFile(dir=self.tmp_dir, mode="w+b") as stdout:
             with tempfile.TemporaryFile(dir=self.tmp_dir, mode="w+b") as stderr:
-                with patch('time.sleep') as mock_sleep:
-                    with self.assertRaises(ExtensionError) as context_manager:
-                        test_file = os.path.join(self.tmp_dir, "cpu.stat")
-                        shutil.copyfile(os.path.join(data_dir, "cgroups", "v1", "cpu.stat_t0"),
-                                        test_file)  # throttled_time = 50
-                        cpu_controller = CpuControllerV1("test", self.tmp_dir)
-                        process = subprocess.Popen(command,  # pylint: disable=subprocess-popen-preexec-fn
-                                                   shell=True,
-                                                   cwd=self.tmp_dir,
-                                                   env={},
-                                                   stdout=stdout,
-                                                   stderr=stderr,
-                                                   preexec_fn=os.setsid)
+                with self.assertRaises(ExtensionError) as context_manager:
+                    test_file = os.path.join(self.tmp_dir, "cpu.stat")
+                    shutil.copyfile(os.path.join(data_dir, "cgroups", "v1", "cpu.stat_t0"),
+                                    test_file)  # throttled_time = 50
+                    cpu_controller = CpuControllerV1("test", self.tmp_dir)
+                    process = subprocess.Popen(command,  # pylint: disable=subprocess-popen-preexec-fn
+                                               shell=True,
+                                               cwd=self.tmp_dir,
+                                               env={},
+                                               stdout=stdout,
+                                               stderr=stderr,
+                                               preexec_fn=os.setsid)
 
+                    start = time.time()
+                    try:
                         handle_process_completion(process=process, command=command, timeout=timeout, stdout=stdout,
                                                   stderr=stderr, error_code=42, cpu_controller=cpu_controller)
-
-                    # We're mocking sleep to avoid prolonging the test execution time, but we still want to make sure
-                    # we're "waiting" the correct amount of time before killing the process and raising an exception
-                    # Due to an extra call to sleep at some point in the call stack which only happens sometimes,
-                    # we are relaxing this assertion to allow +/- 2 sleep calls.
-                    self.assertTrue(abs(mock_sleep.call_count - timeout) <= 2)
-
-                    self.assertEqual(context_manager.exception.code, ExtensionErrorCodes.PluginHandlerScriptTimedout)
-                    self.assertIn("Timeout({0})".format(timeout), ustr(context_manager.exception))
-                    throttled_time = float(50 / 1E9)
-                    self.assertIn("CPUThrottledTime({0}secs)".format(throttled_time), ustr(context_manager.exception))
+                    finally:
+                        elapsed = time.time() - start
+
+                # make sure we waited the correct amount of time before killing the process and raising an exception
+                self.assertTrue(timeout <= elapsed < timeout + 5, "Expected to wait {0} seconds; waited {1}".format(timeout, elapsed))
+                self.assertEqual(context_manager.exception.code, ExtensionErrorCodes.PluginHandlerScriptTimedout)
+                self.assertIn("Timeout({0})".format(timeout), ustr(context_manager.exception))
+                throttled_time = float(50 / 1E9)
+                self.assertIn("CPUThrottledTime({0}secs)".format(throttled_time), ustr(context_manager.exception))
 
     def test_handle_process_completion_should_raise_on_nonzero_exit_code(self):
         command = "ls folder_does_not_exist"
@@ -0,0 +1,111 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import os
+
+from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.common.utils.filecache import ParsedFileCache
+from tests.lib.tools import AgentTestCase, Mock
+
+
+class TestParsedFileCache(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.path = os.path.join(self.tmp_dir, "0.status")
+        fileutil.write_file(self.path, "first")
+        self.parse = Mock(side_effect=fileutil.read_file)
+
+    def test_get_should_parse_the_file_only_once_while_it_does_not_change(self):
+        cache = ParsedFileCache()
+
+        self.assertEqual("first", cache.get(self.path, self.parse))
+        self.assertEqual("first", cache.get(self.path, self.parse))
+        self.assertEqual(1, self.parse.call_count)
+
+    def test_get_should_parse_the_file_again_when_it_changes(self):
+        cache = ParsedFileCache()
+        cache.get(self.path, self.parse)
+
+        fileutil.write_file(self.path, "second")
+        self.assertEqual("second", cache.get(self.path, self.parse), "The file was modified")
+
+        os.utime(self.path, (0, 0))
+        self.assertEqual("second", cache.get(self.path, self.parse), "The modification time changed")
+
+        new_file = os.path.join(self.tmp_dir, "new")
+        fileutil.write_file(new_file, "third!")
+        os.rename(new_file, self.path)
+        os.utime(self.path, (0, 0))
+        self.assertEqual("third!", cache.get(self.path, self.parse), "The file was replaced")
+
+        self.assertEqual(4, self.parse.call_count)
+
+    def test_get_should_not_cache_errors(self):
+        cache = ParsedFileCache()
+        self.parse.side_effect = [ValueError("invalid JSON"), "first"]
+
+        self.assertRaises(ValueError, cache.get, self.path, self.parse)
+        self.assertEqual("first", cache.get(self.path, self.parse))
+
+    def test_get_should_raise_when_the_file_does_not_exist(self):
+        cache = ParsedFileCache()
+        cache.get(self.path, self.parse)
+        os.remove(self.path)
+
+        self.assertRaises(OSError, cache.get, self.path, self.parse)
+
+    def _create_status_files(self, count, size):
+        paths = [os.path.join(self.tmp_dir, "{0}.status".format(i)) for i in range(count)]
+        for i, path in enumerate(paths):
+            fileutil.write_file(path, str(i) * size)
+        return paths
+
+    def test_the_least_recently_used_entries_should_be_evicted_when_the_cache_is_full(self):
+        cache = ParsedFileCache(max_size=30)
+        paths = self._create_status_files(4, 10)
+        for path in paths[0:3]:
+            cache.get(path, self.parse)
+        cache.get(paths[0], self.parse)
+
+        cache.get(paths[3], self.parse)
+        self.assertEqual(4, self.parse.call_count)
+
+        cache.get(paths[0], self.parse)
+        cache.get(paths[2], self.parse)
+        self.assertEqual(4, self.parse.call_count, "The most recently used entries should have been kept")
+        cache.get(paths[1], self.parse)
+        self.assertEqual(5, self.parse.call_count, "The least recently used entry should have been evicted")
+
+    def test_files_larger_than_the_cache_should_not_be_cached(self):
+        cache = ParsedFileCache(max_size=30)
+        small, large = self._create_status_files(2, 20)
+        fileutil.write_file(large, "x" * 31)
+        cache.get(small, self.parse)
+
+        cache.get(large, self.parse)
+        cache.get(large, self.parse)
+        cache.get(small, self.parse)
+
+        self.assertEqual(3, self.parse.call_count, "The large file should not have been cached, nor should it have evicted the small one")
+
+    def test_remove_stale_entries_should_evict_the_entries_not_looked_up_since_the_previous_call(self):
+        cache = ParsedFileCache()
+        paths = self._create_status_files(2, 10)
+        for path in paths:
+            cache.get(path, self.parse)
+        cache.remove_stale_entries()
+
+        cache.get(paths[0], self.parse)
+        cache.remove_stale_entries()
+
+        cache.get(paths[0], self.parse)
+        self.assertEqual(2, self.parse.call_count, "The entry that was looked up should have been kept")
+        cache.get(paths[1], self.parse)
+        self.assertEqual(3, self.parse.call_count, "The entry that was not looked up should have been evicted")
+
+    def test_the_entry_for_a_file_that_no_longer_exists_should_be_evicted(self):
+        cache = ParsedFileCache()
+        cache.get(self.path, self.parse)
+        os.remove(self.path)
+
+        self.assertRaises(OSError, cache.get, self.path, self.parse)
+        self.assertEqual(0, len(cache._entries), "The entry should have been evicted")  # pylint: disable=protected-access
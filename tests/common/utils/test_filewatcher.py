@@ -0,0 +1,43 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import os
+import threading
+import time
+
+from azurelinuxagent.common.utils.filewatcher import FileWatcher
+from tests.lib.tools import AgentTestCase, patch
+
+
+class TestFileWatcher(AgentTestCase):
+    def test_wait_should_return_when_a_file_is_written_to_the_directory(self):
+        with FileWatcher([self.tmp_dir]) as watcher:
+            if not watcher.is_event_driven:
+                self.skipTest("inotify is not available")
+
+            def write_file():
+                with open(os.path.join(self.tmp_dir, "0.status"), "w") as file_:
+                    file_.write("[]")
+            timer = threading.Timer(0.1, write_file)
+            timer.start()
+            try:
+                start = time.time()
+                changed = watcher.wait(30)
+                elapsed = time.time() - start
+            finally:
+                timer.join()
+
+        self.assertTrue(changed, "The change in the directory should have been detected")
+        self.assertTrue(elapsed < 10, "The wait should have returned as soon as the file was written; it took {0} seconds".format(elapsed))
+
+    def test_wait_should_time_out_when_there_are_no_changes(self):
+        with FileWatcher([self.tmp_dir]) as watcher:
+            if not watcher.is_event_driven:
+                self.skipTest("inotify is not available")
+            self.assertFalse(watcher.wait(0.1), "No changes should have been detected")
+
+    def test_it_should_poll_when_the_directory_cannot_be_watched(self):
+        with FileWatcher([os.path.join(self.tmp_dir, "does-not-exist")]) as watcher:
+            self.assertFalse(watcher.is_event_driven)
+            with patch("azurelinuxagent.common.utils.filewatcher.time.sleep") as mock_sleep:
+                self.assertFalse(watcher.wait(5))
+            mock_sleep.assert_called_once_with(5)
@@ -0,0 +1,66 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import io
+import json
+
+from azurelinuxagent.common.utils.jsonutil import JsonArrayReader
+from tests.lib.tools import AgentTestCase, Mock, patch
+
+
+class TestJsonArrayReader(AgentTestCase):
+    _ITEMS = [{"Message": u"café", "EventPid": 123}, 1.5e-3, -7, True, None, "a string", [1, [2]]]
+
+    def _read(self, data, **kwargs):
+        reader = JsonArrayReader(io.BytesIO(data.encode("utf-8")), **kwargs)
+        return list(reader), reader.truncated
+
+    def test_it_should_return_the_items_of_the_array(self):
+        data = json.dumps(TestJsonArrayReader._ITEMS, indent=4)
+
+        # use chunk sizes that split the items (and the UTF-8 characters) at different points
+        for chunk_size in range(1, 16):
+            self.assertEqual((TestJsonArrayReader._ITEMS, False), self._read(data, chunk_size=chunk_size), "Chunk size: {0}".format(chunk_size))
+
+    def test_it_should_return_a_document_that_is_not_an_array_as_a_single_item(self):
+        self.assertEqual(([{"Message": "Hello"}], False), self._read('  {"Message": "Hello"}\n', chunk_size=4))
+        self.assertEqual(([], False), self._read(' [ ] '))
+
+    def test_it_should_return_the_items_before_an_error(self):
+        items = []
+        with self.assertRaises(ValueError):
+            for item in JsonArrayReader(io.BytesIO(b'[1, {"a": 2}, {"a": ]'), chunk_size=4):
+                items.append(item)
+        self.assertEqual([1, {"a": 2}], items)
+
+        for invalid in ['', '[1, 2', '[1 2]', '[1, 2] 3']:
+            with self.assertRaises(ValueError):
+                self._read(invalid)
+
+    def test_it_should_stop_reading_at_max_bytes(self):
+        self.assertEqual(([11, 22], True), self._read('[11, 22, 333, 4444]', max_bytes=12), "333 could continue after max_bytes")
+        self.assertEqual(([11, 22, 333], True), self._read('[11, 22, 333, 4444]', max_bytes=13))
+        self.assertEqual(([11, 22, 333, 4444], False), self._read('[11, 22, 333, 4444]', max_bytes=100))
+
+    def test_it_should_read_the_stream_only_as_far_as_the_items_are_consumed(self):
+        stream = io.BytesIO(json.dumps(list(range(1000))).encode("utf-8"))
+        stream.read = Mock(wraps=stream.read)
+
+        for item in JsonArrayReader(stream, chunk_size=16):
+            if item == 10:
+                break
+
+        self.assertLessEqual(stream.read.call_count, 3, "The stream should not have been read past the items that were consumed")
+
+    def test_it_should_raise_when_an_item_exceeds_the_maximum_size(self):
+        with self.assertRaises(ValueError):
+            self._read(json.dumps([1, "x" * 100]), max_item_size=50, chunk_size=10)
+
+    def test_it_should_return_the_items_when_raw_decode_does_not_accept_an_index(self):
+        # the raw_decode() of some versions of Python does not accept the index of the value
+        class _JSONDecoder(json.JSONDecoder):
+            def raw_decode(self, s):  # pylint: disable=arguments-differ
+                return super(_JSONDecoder, self).raw_decode(s)
+
+        with patch("azurelinuxagent.common.utils.jsonutil.json.JSONDecoder", _JSONDecoder):
+            data = json.dumps(TestJsonArrayReader._ITEMS, indent=4)
+            self.assertEqual((TestJsonArrayReader._ITEMS, False), self._read(data, chunk_size=7))
@@ -15,13 +15,18 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 
+import errno
+import json
 import os
+import socket
+import time
 import unittest
 
 from azurelinuxagent.common.exception import HttpError, ResourceGoneError, InvalidContainerError
 import azurelinuxagent.common.utils.restutil as restutil
 from azurelinuxagent.common.utils.restutil import HTTP_USER_AGENT
 from azurelinuxagent.common.future import httpclient, ustr
+from tests.lib.mock_wire_protocol import MockHttpResponse
 from tests.lib.tools import AgentTestCase, call, Mock, MagicMock, patch
 
 
@@ -86,7 +91,178 @@ class TestIOErrorCounter(AgentTestCase):
             restutil.IOErrorCounter._counts)
 
 
+class TestHttpRequestStatistics(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        restutil.HttpRequestStatistics.reset()
+
+    @patch("time.sleep")
+    @patch("azurelinuxagent.common.utils.restutil._http_request")
+    def test_http_request_should_record_the_statistics_of_each_attempt(self, _http_request, _):
+        _http_request.side_effect = [
+            MockHttpResponse(status=httpclient.SERVICE_UNAVAILABLE),
+            MockHttpResponse(status=httpclient.OK, body=b"<GoalState/>", headers=[("Content-Length", "12")])
+        ]
+        restutil.http_get("http://{0}/machine/?comp=goalstate".format(restutil.KNOWN_WIRESERVER_IP))
+
+        _http_request.side_effect = IOError("Simulated connection error")
+        self.assertRaises(HttpError, restutil.http_put, "http://{0}:{1}/status".format(restutil.KNOWN_WIRESERVER_IP, restutil.HOST_PLUGIN_PORT), "0123456789", max_retry=1)
+
+        statistics = restutil.HttpRequestStatistics.get_and_reset()
+
+        self.assertEqual([(restutil.HttpEndpoint.HostPlugin, restutil.HttpOperation.Status), (restutil.HttpEndpoint.WireServer, restutil.HttpOperation.GoalState)], sorted(statistics.keys()))
+
+        counters, histogram = statistics[(restutil.HttpEndpoint.WireServer, restutil.HttpOperation.GoalState)]
+        self.assertEqual([2, 1, 1, 1, 0, 12], counters, "Expected 2 requests, 1 error, 1 retry, 1 throttled, 0 bytes sent and 12 bytes received")
+        self.assertEqual(2, sum(histogram))
+
+        counters, _ = statistics[(restutil.HttpEndpoint.HostPlugin, restutil.HttpOperation.Status)]
+        self.assertEqual([1, 1, 0, 0, 10, 0], counters, "Expected 1 failed request and 10 bytes sent")
+
+        self.assertEqual({}, restutil.HttpRequestStatistics.get(), "The statistics should have been reset")
+
+    def test_get_operation_should_classify_the_requests(self):
+        test_cases = [
+            ("GET", restutil.KNOWN_WIRESERVER_IP, 80, "/machine/?comp=goalstate", restutil.HttpOperation.GoalState),
+            ("GET", restutil.KNOWN_WIRESERVER_IP, 80, "/machine/abc?comp=config&type=extensionsConfig", restutil.HttpOperation.GoalState),
+            ("GET", restutil.KNOWN_WIRESERVER_IP, restutil.HOST_PLUGIN_PORT, "/vmSettings", restutil.HttpOperation.VmSettings),
+            ("POST", restutil.KNOWN_WIRESERVER_IP, 80, "/machine?comp=telemetrydata", restutil.HttpOperation.Telemetry),
+            ("PUT", restutil.KNOWN_WIRESERVER_IP, restutil.HOST_PLUGIN_PORT, "/status", restutil.HttpOperation.Status),
+            ("PUT", "storage.blob.core.windows.net", None, "/container/status.blob?sig=abc", restutil.HttpOperation.Status),
+            ("GET", restutil.KNOWN_WIRESERVER_IP, restutil.HOST_PLUGIN_PORT, "/extensionArtifact", restutil.HttpOperation.Artifacts),
+            ("GET", "storage.blob.core.windows.net", None, "/container/package.zip", restutil.HttpOperation.Artifacts),
+            ("GET", "169.254.169.254", None, "/metadata/instance/compute?api-version=2018-02-01", restutil.HttpOperation.Metadata),
+            ("GET", restutil.KNOWN_WIRESERVER_IP, 80, "/?comp=versions", restutil.HttpOperation.Other),
+        ]
+        for method, host, port, rel_uri, expected in test_cases:
+            endpoint = restutil._get_endpoint(host, port)
+            self.assertEqual(expected, restutil._get_operation(method, endpoint, rel_uri), "Incorrect operation for {0} {1}:{2}{3}".format(method, host, port, rel_uri))
+
+    def test_get_latency_percentile_should_return_the_upper_limit_of_the_bucket(self):
+        for milliseconds in [5] * 90 + [300] * 9 + [60000]:
+            restutil.HttpRequestStatistics.record(restutil.HttpEndpoint.Other, restutil.HttpOperation.Other, milliseconds / 1000.0, 0)
+        _, histogram = restutil.HttpRequestStatistics.get()[(restutil.HttpEndpoint.Other, restutil.HttpOperation.Other)]
+
+        self.assertEqual(10, restutil.HttpRequestStatistics.get_latency_percentile(histogram, 50))
+        self.assertEqual(500, restutil.HttpRequestStatistics.get_latency_percentile(histogram, 95))
+        self.assertEqual(restutil.HttpRequestStatistics.LATENCY_BUCKETS_IN_MILLISECONDS[-1], restutil.HttpRequestStatistics.get_latency_percentile(histogram, 100))
+        self.assertIsNone(restutil.HttpRequestStatistics.get_latency_percentile([0] * len(histogram), 50))
+
+    def test_dump_should_write_the_statistics_to_a_file(self):
+        restutil.HttpRequestStatistics.record(restutil.HttpEndpoint.WireServer, restutil.HttpOperation.GoalState, 0.02, 0, response=MockHttpResponse(status=httpclient.OK))
+        path = os.path.join(self.tmp_dir, "statistics.json")
+
+        restutil.HttpRequestStatistics.dump(path)
+
+        with open(path, "r") as file_:
+            data = json.load(file_)
+        self.assertEqual(1, len(data["requests"]))
+        self.assertEqual(restutil.HttpEndpoint.WireServer, data["requests"][0]["endpoint"])
+        self.assertEqual(1, data["requests"][0]["requests"])
+        self.assertEqual(1, data["requests"][0]["latency"]["<=25ms"])
+        self.assertEqual(1, len(restutil.HttpRequestStatistics.get()), "Dumping the statistics should not reset them")
+
+
+class TestRequestBudget(AgentTestCase):
+    @patch("time.sleep")
+    @patch("azurelinuxagent.common.utils.restutil._http_request")
+    def test_http_request_should_wait_for_the_retry_after_delay_when_the_wireserver_throttles(self, _http_request, _sleep):
+        _http_request.side_effect = [
+            MockHttpResponse(status=429, headers=[("Retry-After", "7")]),
+            MockHttpResponse(status=httpclient.OK)
+        ]
+
+        restutil.http_get("http://{0}/machine/?comp=goalstate".format(restutil.KNOWN_WIRESERVER_IP))
+
+        self.assertEqual(2, _http_request.call_count)
+        self.assertEqual(1, _sleep.call_count, "The request should have been delayed only by the budget")
+        self.assertAlmostEqual(7, _sleep.call_args[0][0], delta=1)
+
+        # the delay also applies to other requests to the WireServer or HostGAPlugin
+        budget = restutil.get_wireserver_request_budget()
+        budget.on_response(True, retry_after=30)
+        _http_request.side_effect = None
+        _http_request.return_value = MockHttpResponse(status=httpclient.OK)
+        restutil.http_put("http://{0}:{1}/status".format(restutil.KNOWN_WIRESERVER_IP, restutil.HOST_PLUGIN_PORT), "data")
+        self.assertAlmostEqual(30, _sleep.call_args[0][0], delta=1)
+
+    @patch("time.sleep")
+    @patch("azurelinuxagent.common.utils.restutil._http_request")
+    def test_http_request_should_not_use_the_budget_for_other_endpoints(self, _http_request, _sleep):
+        restutil.get_wireserver_request_budget().on_response(True, retry_after=30)
+        _http_request.return_value = MockHttpResponse(status=httpclient.OK)
+
+        restutil.http_get("https://storage.blob.core.windows.net/container/package.zip")
+
+        self.assertEqual(0, _sleep.call_count)
+
+    @patch("time.sleep")
+    def test_acquire_should_defer_low_priority_requests_when_the_budget_is_low(self, _):
+        budget = restutil._RequestBudget(max_rate=1, burst=10)
+        with patch("azurelinuxagent.common.utils.restutil.time.time", return_value=1000.0):
+            budget._last_refill = 1000.0
+            waits = [budget.acquire(restutil.RequestPriority.Low) for _ in range(6)]
+            self.assertEqual([0, 0, 0, 0, 0], waits[:5], "The first requests should not wait")
+            self.assertAlmostEqual(1, waits[5], msg="Low priority requests should leave tokens for higher priority requests")
+
+            # 4 tokens left
+            self.assertEqual(0, budget.acquire(restutil.RequestPriority.High), "High priority requests should use the reserved tokens")
+            self.assertEqual(0, budget.acquire(restutil.RequestPriority.Medium), "Medium priority requests should use the reserved tokens")
+            self.assertEqual(0, budget.acquire(restutil.RequestPriority.Medium), "Medium priority requests should use the reserved tokens")
+            self.assertAlmostEqual(1, budget.acquire(restutil.RequestPriority.Medium), msg="The medium priority request should wait for 1 token (the bucket has 1 token)")
+            self.assertAlmostEqual(6, budget.acquire(restutil.RequestPriority.Low), msg="The low priority request should wait for 6 tokens (the bucket is empty)")
+            self.assertEqual(0, budget.acquire(restutil.RequestPriority.High), "High priority requests should not wait for tokens")
+
+    @patch("time.sleep")
+    def test_throttling_should_not_delay_requests_with_higher_priority(self, _):
+        budget = restutil._RequestBudget()
+        with patch("azurelinuxagent.common.utils.restutil.time.time", return_value=1000.0):
+            budget._last_refill = 1000.0
+            budget.on_response(True, priority=restutil.RequestPriority.Low, retry_after=30)
+
+            self.assertEqual(restutil.WIRESERVER_REQUEST_BUDGET_MAX_RATE, budget.rate, "Throttled telemetry requests should not change the rate")
+            self.assertEqual(0, budget.acquire(restutil.RequestPriority.High), "High priority requests should not wait for the throttled telemetry requests")
+            self.assertEqual(0, budget.acquire(restutil.RequestPriority.Medium), "Medium priority requests should not wait for the throttled telemetry requests")
+            self.assertAlmostEqual(30, budget.acquire(restutil.RequestPriority.Low), msg="Telemetry requests should wait for the Retry-After delay")
+
+            budget.on_response(True, priority=restutil.RequestPriority.Medium, retry_after=10)
+            self.assertEqual(0, budget.acquire(restutil.RequestPriority.High), "High priority requests should not wait for the throttled medium priority requests")
+
+    @patch("time.sleep")
+    @patch("azurelinuxagent.common.utils.restutil._http_request")
+    def test_http_request_should_not_use_the_budget_when_the_wireserver_returns_forbidden(self, _http_request, _sleep):
+        _http_request.side_effect = [
+            MockHttpResponse(status=httpclient.FORBIDDEN),
+            MockHttpResponse(status=httpclient.OK)
+        ]
+
+        restutil.http_get("http://{0}/machine/?comp=goalstate".format(restutil.KNOWN_WIRESERVER_IP))
+
+        self.assertEqual(2, _http_request.call_count)
+        self.assertEqual([call(restutil.THROTTLE_DELAY_IN_SECONDS)], _sleep.call_args_list, "The request should have been delayed only by its own throttle delay")
+        self.assertEqual(restutil.WIRESERVER_REQUEST_BUDGET_MAX_RATE, restutil.get_wireserver_request_budget().rate, "The rate should not have changed")
+
+    def test_on_response_should_adapt_the_rate(self):
+        budget = restutil._RequestBudget(max_rate=8, min_rate=1, rate_increase=0.5)
+
+        for expected in [4, 2, 1, 1]:
+            budget.on_response(True)
+            self.assertEqual(expected, budget.rate)
+
+        for expected in [1.5, 2, 2.5]:
+            budget.on_response(False)
+            self.assertEqual(expected, budget.rate)
+
+
 class TestHttpOperations(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        restutil.close_http_connections()
+
+    def tearDown(self):
+        restutil.close_http_connections()
+        AgentTestCase.tearDown(self)
+
     def test_parse_url(self):
         test_uri = "http://abc.def/ghi#hash?jkl=mn"
         host, port, secure, rel_uri = restutil._parse_url(test_uri)  # pylint: disable=unused-variable
@@ -359,7 +535,7 @@ class TestHttpOperations(AgentTestCase):
         ])
         HTTPSConnection.assert_not_called()
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'keep-alive'})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEqual(None, resp) 
@@ -382,7 +558,7 @@ class TestHttpOperations(AgentTestCase):
             call("foo", 443, timeout=10)
         ])
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'keep-alive'})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEqual(None, resp) 
@@ -406,12 +582,130 @@ class TestHttpOperations(AgentTestCase):
         ])
         HTTPSConnection.assert_not_called()
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="http://foo:80/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="http://foo:80/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'keep-alive'})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEqual(None, resp) 
         self.assertEqual("TheResults", resp.read()) 
 
+    @staticmethod
+    def _create_keep_alive_connection_mock():
+        response = Mock(will_close=False, isclosed=Mock(return_value=True), read=Mock(return_value="TheResults"))
+        return MagicMock(getresponse=Mock(return_value=response), sock=MagicMock())
+
+    @patch("azurelinuxagent.common.utils.restutil.select.select", return_value=([], [], []))
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_reuse_keep_alive_connections(self, HTTPConnection, _):
+        mock_conn = self._create_keep_alive_connection_mock()
+        HTTPConnection.return_value = mock_conn
+
+        restutil._http_request("GET", "foo", "/bar", 10)
+        restutil._http_request("GET", "foo", "/baz", 10)
+
+        self.assertEqual(1, HTTPConnection.call_count, "The connection should have been reused")
+        self.assertEqual(2, mock_conn.request.call_count)
+
+        restutil._http_request("GET", "other", "/bar", 10)
+        self.assertEqual(2, HTTPConnection.call_count, "A new connection should have been created for a different host")
+
+    @patch("azurelinuxagent.common.utils.restutil.select.select", return_value=([], [], []))
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_not_reuse_connections_with_pending_responses(self, HTTPConnection, _):
+        mock_conn = self._create_keep_alive_connection_mock()
+        mock_conn.getresponse.return_value.isclosed.return_value = False
+        HTTPConnection.return_value = mock_conn
+
+        restutil._http_request("GET", "foo", "/bar", 10)
+        restutil._http_request("GET", "foo", "/bar", 10)
+
+        self.assertEqual(2, HTTPConnection.call_count, "The connection should not have been reused while its response was still being read")
+
+    @patch("azurelinuxagent.common.utils.restutil.select.select", return_value=([], [], []))
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_not_reuse_connections_closed_by_the_server(self, HTTPConnection, _):
+        mock_conn = self._create_keep_alive_connection_mock()
+        mock_conn.getresponse.return_value.will_close = True
+        HTTPConnection.return_value = mock_conn
+
+        restutil._http_request("GET", "foo", "/bar", 10)
+        restutil._http_request("GET", "foo", "/bar", 10)
+
+        self.assertEqual(2, HTTPConnection.call_count, "The connection should not have been reused after the server requested to close it")
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_not_reuse_idle_connections_with_pending_data(self, HTTPConnection):
+        mock_conn = self._create_keep_alive_connection_mock()
+        HTTPConnection.return_value = mock_conn
+
+        restutil._http_request("GET", "foo", "/bar", 10)
+        with patch("azurelinuxagent.common.utils.restutil.select.select", side_effect=lambda r, w, x, t: (r, w, x)):
+            restutil._http_request("GET", "foo", "/bar", 10)
+
+        self.assertEqual(2, HTTPConnection.call_count, "A new connection should have been created")
+        self.assertEqual(1, mock_conn.close.call_count, "The unhealthy connection should have been closed")
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_not_reuse_expired_connections(self, HTTPConnection):
+        HTTPConnection.return_value = self._create_keep_alive_connection_mock()
+
+        restutil._http_request("GET", "foo", "/bar", 10)
+        with patch("azurelinuxagent.common.utils.restutil.time.time", return_value=time.time() + restutil.HTTP_KEEP_ALIVE_IDLE_TIMEOUT_IN_SECONDS + 1):
+            restutil._http_request("GET", "foo", "/bar", 10)
+
+        self.assertEqual(2, HTTPConnection.call_count, "A new connection should have been created")
+
+    @patch("azurelinuxagent.common.utils.restutil.select.select", return_value=([], [], []))
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_reconnect_when_a_reused_connection_is_reset(self, HTTPConnection, _):
+        stale_conn = self._create_keep_alive_connection_mock()
+        new_conn = self._create_keep_alive_connection_mock()
+        HTTPConnection.side_effect = [stale_conn, new_conn]
+
+        restutil._http_request("GET", "foo", "/bar", 10)
+        stale_conn.request.side_effect = socket.error(errno.ECONNRESET, "Connection reset by peer")
+        resp = restutil._http_request("GET", "foo", "/bar", 10)
+
+        self.assertEqual("TheResults", resp.read())
+        self.assertEqual(2, HTTPConnection.call_count, "A new connection should have been created")
+        self.assertEqual(1, stale_conn.close.call_count, "The stale connection should have been closed")
+        self.assertEqual(1, new_conn.request.call_count)
+
+    @patch("azurelinuxagent.common.utils.restutil.select.select", return_value=([], [], []))
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_not_resend_the_request_when_a_reused_connection_times_out(self, HTTPConnection, _):
+        mock_conn = self._create_keep_alive_connection_mock()
+        HTTPConnection.return_value = mock_conn
+
+        restutil._http_request("POST", "foo", "/bar", 10, data="data")
+        mock_conn.getresponse.side_effect = socket.timeout("timed out")
+
+        self.assertRaises(socket.timeout, restutil._http_request, "POST", "foo", "/bar", 10, data="data")
+        self.assertEqual(1, HTTPConnection.call_count, "A new connection should not have been created")
+        self.assertEqual(2, mock_conn.request.call_count, "The request should not have been sent again")
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_not_retry_when_a_new_connection_is_reset(self, HTTPConnection):
+        mock_conn = self._create_keep_alive_connection_mock()
+        mock_conn.request.side_effect = IOError("Connection reset by peer")
+        HTTPConnection.return_value = mock_conn
+
+        self.assertRaises(IOError, restutil._http_request, "GET", "foo", "/bar", 10)
+        self.assertEqual(1, HTTPConnection.call_count)
+
+    @patch("azurelinuxagent.common.future.httpclient.HTTPConnection")
+    def test_http_request_should_close_connections_when_keep_alive_is_disabled(self, HTTPConnection):
+        mock_conn = self._create_keep_alive_connection_mock()
+        HTTPConnection.return_value = mock_conn
+
+        with patch("azurelinuxagent.common.conf.get_enable_http_keep_alive", return_value=False):
+            restutil._http_request("GET", "foo", "/bar", 10)
+            restutil._http_request("GET", "foo", "/bar", 10)
+
+        self.assertEqual(2, HTTPConnection.call_count, "Connections should not be reused")
+        mock_conn.request.assert_has_calls([
+            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+        ])
+
     @patch("azurelinuxagent.common.utils.restutil._get_http_proxy")
     @patch("time.sleep")
     @patch("azurelinuxagent.common.utils.restutil._http_request")
@@ -539,7 +833,7 @@ class TestHttpOperations(AgentTestCase):
             call("foo.bar", 23333, timeout=10)
         ])
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="https://foo:443/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="https://foo:443/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'keep-alive'})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEqual(None, resp) 
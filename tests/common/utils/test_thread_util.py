@@ -0,0 +1,78 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import threading
+
+from azurelinuxagent.common.utils.threadutil import run_concurrently
+from tests.lib.tools import AgentTestCase
+
+
+class TestThreadUtil(AgentTestCase):
+    def test_run_concurrently_should_return_the_results_in_order(self):
+        results = run_concurrently([lambda i=i: i * 10 for i in range(20)], 4)
+
+        self.assertEqual([i * 10 for i in range(20)], [r.result for r in results])
+        self.assertTrue(all(r.exception is None for r in results))
+
+    def test_run_concurrently_should_capture_exceptions(self):
+        def fail():
+            raise Exception("test failure")
+
+        results = run_concurrently([lambda: 1, fail, lambda: 3], 2)
+
+        self.assertEqual(1, results[0].result)
+        self.assertEqual("test failure", str(results[1].exception))
+        self.assertEqual(3, results[2].result)
+
+    def test_run_concurrently_should_not_exceed_max_workers(self):
+        lock = threading.Lock()
+        barrier = threading.Event()
+        state = {"running": 0, "max_running": 0}
+
+        def operation():
+            with lock:
+                state["running"] += 1
+                state["max_running"] = max(state["max_running"], state["running"])
+                if state["max_running"] == 3:
+                    barrier.set()
+            barrier.wait(5)
+            with lock:
+                state["running"] -= 1
+
+        run_concurrently([operation] * 10, 3)
+
+        self.assertEqual(3, state["max_running"])
+
+    def test_run_concurrently_should_use_the_calling_thread_when_max_workers_is_one(self):
+        results = run_concurrently([lambda: threading.current_thread().name] * 3, 1)
+
+        self.assertEqual([threading.current_thread().name] * 3, [r.result for r in results])
+
+    def test_run_concurrently_should_not_invoke_the_remaining_operations_after_an_error_when_stop_on_error_is_set(self):
+        invoked = []
+
+        def operation(i):
+            invoked.append(i)
+            if i == 1:
+                raise Exception("test failure")
+            return i
+
+        results = run_concurrently([lambda i=i: operation(i) for i in range(4)], 1, stop_on_error=True)
+
+        self.assertEqual([0, 1], invoked)
+        self.assertEqual(0, results[0].result)
+        self.assertEqual("test failure", str(results[1].exception))
+        self.assertEqual([None, None], results[2:], "The remaining operations should not have been invoked")
@@ -29,7 +29,8 @@ from collections import defaultdict
 from mock import patch, MagicMock
 
 from azurelinuxagent.common import conf
-from azurelinuxagent.common.event import EVENTS_DIRECTORY
+from azurelinuxagent.common.event import EVENTS_DIRECTORY, parse_event
+from azurelinuxagent.common.event_spool import get_event_spool
 from azurelinuxagent.common.exception import InvalidExtensionEventError, ServiceStoppedError
 from azurelinuxagent.common.protocol.util import ProtocolUtil
 from azurelinuxagent.common.telemetryevent import GuestAgentGenericLogsSchema, \
@@ -213,6 +214,18 @@ class TestExtensionTelemetryHandler(AgentTestCase, HttpRequestPredicates):
 
         return found
 
+    def test_it_should_append_the_events_to_the_event_spool_when_it_is_enabled(self):
+        with self._create_extension_telemetry_processor() as extension_telemetry_processor:
+            extensions_with_count = self._create_random_extension_events_dir_with_events(3, self._WELL_FORMED_FILES)
+
+            with patch("azurelinuxagent.common.conf.get_enable_event_spool", return_value=True):
+                extension_telemetry_processor.run()
+
+            self.assertEqual(0, len(extension_telemetry_processor.event_list), "The events should not have been enqueued directly")
+
+            spooled_events = [parse_event(record.data.decode("utf-8")) for record in get_event_spool().read()]
+            self._assert_handler_data_in_event_list(self._get_handlers_with_version(spooled_events), extensions_with_count)
+
     def test_it_should_not_capture_malformed_events(self):
         with self._create_extension_telemetry_processor() as extension_telemetry_processor:
             bad_name_ext_with_count = self._create_random_extension_events_dir_with_events(2, self._MALFORMED_FILES)
@@ -385,17 +398,52 @@ class TestExtensionTelemetryHandler(AgentTestCase, HttpRequestPredicates):
                 self._assert_invalid_extension_error_event_reported(mock_event, handler_name_with_count,
                                                                     error=InvalidExtensionEventError.OversizeEventError)
 
-    def test_it_should_skip_large_files_greater_than_max_file_size_and_report_event(self):
+    def test_it_should_process_only_the_first_part_of_files_greater_than_max_file_size_and_report_event(self):
         max_file_size = 10000
         no_of_extensions = 5
         with patch("azurelinuxagent.ga.collect_telemetry_events.add_log_event") as mock_event:
             with patch("azurelinuxagent.ga.collect_telemetry_events._ProcessExtensionEvents._EXTENSION_EVENT_FILE_MAX_SIZE",
                        max_file_size):
+                # the only event in the test file is not complete within the first max_file_size bytes
                 handler_name_with_count, _ = self._setup_and_assert_tests_for_max_sizes(no_of_extensions, expected_count=0)
 
-                pattern = r'Skipping file:\s*{0}/(?P<name>.+?)/{1}.+'.format(conf.get_ext_log_dir(), EVENTS_DIRECTORY)
+                pattern = r'Processed only the first .+ of file:\s*{0}/(?P<name>.+?)/{1}.+'.format(conf.get_ext_log_dir(), EVENTS_DIRECTORY)
                 self._assert_event_reported(mock_event, handler_name_with_count, pattern)
 
+    def test_it_should_process_the_events_at_the_start_of_files_greater_than_max_file_size(self):
+        event = json.loads(fileutil.read_file(os.path.join(self._WELL_FORMED_FILES, "9999999999.json")))[0]
+        event_size = len(json.dumps(event)) + 2
+
+        with self._create_extension_telemetry_processor() as extension_telemetry_processor:
+            handler_name = list(self._create_random_extension_events_dir_with_events(1, self._WELL_FORMED_FILES).keys())[0]
+            event_dir = os.path.join(conf.get_ext_log_dir(), handler_name, EVENTS_DIRECTORY)
+            for event_file in os.listdir(event_dir):
+                os.remove(os.path.join(event_dir, event_file))
+            fileutil.write_file(os.path.join(event_dir, "1591905451.json"), json.dumps([event] * 10))
+
+            with patch("azurelinuxagent.ga.collect_telemetry_events._ProcessExtensionEvents._EXTENSION_EVENT_FILE_MAX_SIZE", 3 * event_size):
+                extension_telemetry_processor.run()
+
+            telemetry_events = self._get_handlers_with_version(extension_telemetry_processor.event_list)
+            self._assert_handler_data_in_event_list(telemetry_events, {handler_name: 3})
+
+    def test_it_should_stop_reading_the_event_file_when_the_max_number_of_events_is_reached(self):
+        event = json.loads(fileutil.read_file(os.path.join(self._WELL_FORMED_FILES, "9999999999.json")))[0]
+
+        with self._create_extension_telemetry_processor() as extension_telemetry_processor:
+            handler_name = list(self._create_random_extension_events_dir_with_events(1, self._WELL_FORMED_FILES).keys())[0]
+            event_dir = os.path.join(conf.get_ext_log_dir(), handler_name, EVENTS_DIRECTORY)
+            for event_file in os.listdir(event_dir):
+                os.remove(os.path.join(event_dir, event_file))
+            # the end of the file is not valid JSON, but it should not be reached
+            fileutil.write_file(os.path.join(event_dir, "1591905451.json"), json.dumps([event] * 10)[:-1] + ", {{{")
+
+            with patch.object(extension_telemetry_processor, "_MAX_NUMBER_OF_EVENTS_PER_EXTENSION_PER_PERIOD", 5):
+                extension_telemetry_processor.run()
+
+            telemetry_events = self._get_handlers_with_version(extension_telemetry_processor.event_list)
+            self._assert_handler_data_in_event_list(telemetry_events, {handler_name: 5})
+
     def test_it_should_map_extension_event_json_correctly_to_telemetry_event(self):
 
         # EventName maps to HandlerName + '-' + Version from event file
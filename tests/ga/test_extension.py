@@ -24,6 +24,7 @@ import re
 import shutil
 import subprocess
 import tempfile
+import threading
 import time
 import unittest
 
@@ -598,6 +599,63 @@ class TestExtension_Deprecated(TestExtensionBase):
 
         self._assert_no_handler_status(protocol.report_vm_status)
 
+    def test_ext_handler_should_use_the_package_store_when_enabled(self, *args):
+        test_data = wire_protocol_data.WireProtocolData(wire_protocol_data.DATA_FILE)
+        exthandlers_handler, protocol = self._create_mock(test_data, *args)  # pylint: disable=no-value-for-parameter
+        handler_dir = os.path.join(self.tmp_dir, "OSTCExtensions.ExampleHandlerLinux-1.0.0")
+        objects_dir = os.path.join(self.tmp_dir, "ExtensionPackageStore", "objects")
+
+        with patch("azurelinuxagent.common.conf.get_enable_extension_package_store", return_value=True):
+            exthandlers_handler.run()
+            exthandlers_handler.report_ext_handlers_status()
+
+            self._assert_handler_status(protocol.report_vm_status, "Ready", 1, "1.0.0")
+            self.assertEqual(2, os.stat(os.path.join(handler_dir, "HandlerManifest.json")).st_nlink, "The handler files should be linked to the package store")
+
+            test_data.set_incarnation(2)
+            test_data.set_extensions_config_state(ExtensionRequestedState.Uninstall)
+            protocol.client.update_goal_state()
+            exthandlers_handler.run()
+
+            self.assertFalse(os.path.exists(handler_dir))
+            self.assertEqual([], [f for _, _, files in os.walk(objects_dir) for f in files], "The package store should have been cleaned up")
+
+    def test_it_should_prefetch_the_extension_packages_before_processing_the_extensions(self, *args):
+        test_data = wire_protocol_data.WireProtocolData(wire_protocol_data.DATA_FILE_MULTIPLE_EXT)
+        exthandlers_handler, protocol = self._create_mock(test_data, *args)  # pylint: disable=no-value-for-parameter
+        handler_names = [h.name for h in protocol.get_goal_state().extensions_goal_state.extensions]
+
+        packages_at_first_handler = []
+        original_handle_ext_handler = exthandlers_handler.handle_ext_handler
+
+        def handle_ext_handler(ext_handler_i, extension, goal_state_id):
+            if len(packages_at_first_handler) == 0:
+                packages_at_first_handler.extend(sorted(f for f in os.listdir(self.tmp_dir) if f.endswith(".zip")))
+            return original_handle_ext_handler(ext_handler_i, extension, goal_state_id)
+
+        with patch.object(exthandlers_handler, "handle_ext_handler", side_effect=handle_ext_handler):
+            exthandlers_handler.run()
+
+        self.assertEqual(sorted("{0}__1.0.0.zip".format(name) for name in handler_names), packages_at_first_handler,
+                         "All the packages should have been downloaded before processing the first extension")
+        self.assertEqual(len(handler_names), test_data.call_counts["manifest.xml"], "The manifests should have been downloaded only once")
+        self.assertEqual(len(handler_names), test_data.call_counts["ExampleHandlerLinux"], "The packages should have been downloaded only once")
+        self.assertEqual([], [f for f in os.listdir(self.tmp_dir) if f.endswith(".zip")], "The packages should have been deleted after expanding them")
+        for name in handler_names:
+            self.assertTrue(os.path.isdir(os.path.join(self.tmp_dir, "{0}-1.0.0".format(name))), "{0} was not installed".format(name))
+
+    def test_it_should_not_prefetch_the_extension_packages_when_the_prefetch_is_disabled(self, *args):
+        test_data = wire_protocol_data.WireProtocolData(wire_protocol_data.DATA_FILE)
+        exthandlers_handler, protocol = self._create_mock(test_data, *args)  # pylint: disable=no-value-for-parameter
+
+        with patch("azurelinuxagent.common.conf.get_extension_package_prefetch_concurrency", return_value=0):
+            with patch("azurelinuxagent.ga.exthandlers.ExtHandlerInstance.prefetch_package") as mock_prefetch_package:
+                exthandlers_handler.run()
+                exthandlers_handler.report_ext_handlers_status()
+
+        self.assertEqual(0, mock_prefetch_package.call_count, "The packages should not have been prefetched")
+        self._assert_handler_status(protocol.report_vm_status, "Ready", 1, "1.0.0")
+
     def test_it_should_only_download_extension_manifest_once_per_goal_state(self, *args):
 
         def _assert_handler_status_and_manifest_download_count(protocol, test_data, manifest_count):
@@ -3375,6 +3433,109 @@ class TestExtension(TestExtensionBase, HttpRequestPredicates):
                         # 1 expected call count for Enable command
                         assert_extensions_called(exthandlers_handler, expected_call_count=1)
 
+    def test_it_should_skip_unchanged_extensions_on_new_goal_states(self):
+        extension_calls = []
+        original_popen = subprocess.Popen
+
+        def mock_popen(*args, **kwargs):
+            if 'OSTCExtensions.ExampleHandlerLinux' in args[0]:
+                extension_calls.append(args[0])
+            return original_popen(*args, **kwargs)
+
+        def run_goal_state(incarnation, sequence_number):
+            protocol.mock_wire_data.set_incarnation(incarnation)
+            protocol.mock_wire_data.set_extensions_config_sequence_number(sequence_number)
+            protocol.client.update_goal_state()
+            del extension_calls[:]
+            with patch('subprocess.Popen', side_effect=mock_popen):
+                exthandlers_handler.run()
+            status = exthandlers_handler.report_ext_handlers_status().vmAgent.extensionHandlers[0]
+            return status.status, status.extension_status.status, status.extension_status.sequenceNumber
+
+        with patch("azurelinuxagent.common.conf.get_skip_unchanged_extensions", return_value=True):
+            with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+                protocol.report_vm_status = MagicMock()
+                exthandlers_handler = get_exthandlers_handler(protocol)
+
+                self.assertEqual(("Ready", "success", 0), run_goal_state(1, 0))
+                self.assertEqual(2, len(extension_calls), "The extension should have been installed and enabled: {0}".format(extension_calls))
+
+                settings_file = os.path.join(self.tmp_dir, "OSTCExtensions.ExampleHandlerLinux-1.0.0", "config", "0.settings")
+                os.utime(settings_file, (0, 0))
+
+                self.assertEqual(("Ready", "success", 0), run_goal_state(2, 0))
+                self.assertEqual(0, len(extension_calls), "The extension did not change, so it should not have been processed: {0}".format(extension_calls))
+                self.assertEqual(0, os.path.getmtime(settings_file), "The settings of the extension should not have been written")
+
+                self.assertEqual(("Ready", "success", 1), run_goal_state(3, 1))
+                self.assertEqual(1, len(extension_calls), "The settings changed, so the extension should have been enabled: {0}".format(extension_calls))
+
+    def test_it_should_not_skip_unchanged_extensions_that_failed(self):
+        with patch("azurelinuxagent.common.conf.get_skip_unchanged_extensions", return_value=True):
+            with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+                protocol.report_vm_status = MagicMock()
+                exthandlers_handler = get_exthandlers_handler(protocol)
+
+                _, fail_action = Actions.generate_unique_fail()
+                failing_extension = extension_emulator(enable_action=fail_action)
+                with enable_invocations(failing_extension) as invocation_record:
+                    exthandlers_handler.run()
+                    invocation_record.compare((failing_extension, ExtensionCommandNames.INSTALL), (failing_extension, ExtensionCommandNames.ENABLE))
+
+                protocol.mock_wire_data.set_incarnation(2)
+                protocol.client.update_goal_state()
+
+                extension = extension_emulator()
+                with enable_invocations(extension) as invocation_record:
+                    exthandlers_handler.run()
+                    invocation_record.compare((extension, ExtensionCommandNames.ENABLE))
+
+                exthandlers_handler.report_ext_handlers_status()
+                self._assert_handler_status(protocol.report_vm_status, "Ready", 1, "1.0.0")
+
+    def test_it_should_process_the_handlers_in_the_same_dependency_level_concurrently(self):
+        lock = threading.Lock()
+        started = []
+        all_started = threading.Event()
+        waits = []
+
+        def mock_handle_ext_handler(ext_handler_i, *_):
+            with lock:
+                started.append(ext_handler_i.ext_handler.name)
+                if len(started) == 4:
+                    all_started.set()
+            all_started.wait(5)
+            waits.append(all_started.is_set())
+            return True
+
+        with patch("azurelinuxagent.common.conf.get_extension_processing_concurrency", return_value=4):
+            with mock_wire_protocol(wire_protocol_data.DATA_FILE_MULTIPLE_EXT) as protocol:
+                exthandlers_handler = get_exthandlers_handler(protocol)
+                with patch("azurelinuxagent.ga.exthandlers.ExtHandlersHandler.handle_ext_handler", side_effect=mock_handle_ext_handler):
+                    exthandlers_handler.run()
+
+        self.assertEqual(5, len(started), "All the handlers should have been processed: {0}".format(started))
+        self.assertTrue(all(waits), "The handlers should have been processed concurrently")
+
+    def test_it_should_propagate_failures_to_the_next_dependency_levels_when_processing_extensions_concurrently(self):
+        processed = []
+
+        def mock_handle_ext_handler(ext_handler_i, *_):
+            processed.append(ext_handler_i.ext_handler.name)
+            return ext_handler_i.ext_handler.name != "OSTCExtensions.OtherExampleHandlerLinux"
+
+        with patch("azurelinuxagent.common.conf.get_extension_processing_concurrency", return_value=4):
+            with mock_wire_protocol(wire_protocol_data.DATA_FILE_EXT_SEQUENCING) as protocol:
+                exthandlers_handler = get_exthandlers_handler(protocol)
+                with patch("azurelinuxagent.ga.exthandlers.ExtHandlersHandler.handle_ext_handler", side_effect=mock_handle_ext_handler):
+                    exthandlers_handler.run()
+
+                status = exthandlers_handler.report_ext_handlers_status()
+
+        self.assertEqual(["OSTCExtensions.OtherExampleHandlerLinux"], processed, "The handler in the second level should not have been processed")
+        handler_status = next(h for h in status.vmAgent.extensionHandlers if h.name == "OSTCExtensions.ExampleHandlerLinux")
+        self.assertIn("Skipping processing of extensions since execution of dependent extension", handler_status.message)
+
     def test_it_should_process_extensions_appropriately_on_artifact_hold(self):
         with patch('time.sleep', side_effect=lambda _: mock_sleep(0.001)):
             with patch("azurelinuxagent.common.conf.get_enable_overprovisioning", return_value=True):
@@ -0,0 +1,99 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import os
+import shutil
+import zipfile
+
+from azurelinuxagent.ga.extension_package_store import ExtensionPackageStore, PACKAGE_STORE_DIRECTORY_NAME
+from tests.lib.tools import AgentTestCase, patch
+
+
+class TestExtensionPackageStore(AgentTestCase):
+    def _create_package(self, name, files):
+        path = os.path.join(self.tmp_dir, name)
+        zip_file = zipfile.ZipFile(path, "w")
+        try:
+            for member, content in files.items():
+                zip_file.writestr(member, content)
+        finally:
+            zip_file.close()
+        return path
+
+    @staticmethod
+    def _read(path):
+        with open(path, "rb") as file_:
+            return file_.read()
+
+    def test_extract_should_expand_the_package_using_hard_links_to_the_store(self):
+        package = self._create_package("Foo-1.0.zip", {"HandlerManifest.json": b"[]", "bin/enable.sh": b"echo enable"})
+        target = os.path.join(self.tmp_dir, "Foo-1.0")
+
+        ExtensionPackageStore().extract(package, target)
+
+        self.assertEqual(b"[]", self._read(os.path.join(target, "HandlerManifest.json")))
+        self.assertEqual(b"echo enable", self._read(os.path.join(target, "bin", "enable.sh")))
+        self.assertEqual(2, os.stat(os.path.join(target, "bin", "enable.sh")).st_nlink, "The file should be linked to the store")
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp_dir, PACKAGE_STORE_DIRECTORY_NAME)))
+
+    def test_extract_should_share_identical_files_across_packages(self):
+        v1 = self._create_package("Foo-1.0.zip", {"HandlerManifest.json": b"[1]", "bin/enable.sh": b"echo enable"})
+        v2 = self._create_package("Foo-2.0.zip", {"HandlerManifest.json": b"[2]", "bin/enable.sh": b"echo enable"})
+        target1 = os.path.join(self.tmp_dir, "Foo-1.0")
+        target2 = os.path.join(self.tmp_dir, "Foo-2.0")
+
+        store = ExtensionPackageStore()
+        store.extract(v1, target1)
+        store.extract(v2, target2)
+
+        self.assertEqual(os.stat(os.path.join(target1, "bin", "enable.sh")).st_ino, os.stat(os.path.join(target2, "bin", "enable.sh")).st_ino)
+        self.assertNotEqual(os.stat(os.path.join(target1, "HandlerManifest.json")).st_ino, os.stat(os.path.join(target2, "HandlerManifest.json")).st_ino)
+        self.assertEqual(3, os.stat(os.path.join(target1, "bin", "enable.sh")).st_nlink)
+
+    def test_extract_should_not_decompress_a_package_that_is_already_in_the_store(self):
+        package = self._create_package("Foo-1.0.zip", {"HandlerManifest.json": b"[]"})
+        store = ExtensionPackageStore()
+        store.extract(package, os.path.join(self.tmp_dir, "Foo-1.0"))
+        shutil.rmtree(os.path.join(self.tmp_dir, "Foo-1.0"))
+
+        with patch("azurelinuxagent.ga.extension_package_store.zipfile.ZipFile", side_effect=Exception("The package should not be decompressed")):
+            store.extract(package, os.path.join(self.tmp_dir, "Foo-1.0"))
+
+        self.assertEqual(b"[]", self._read(os.path.join(self.tmp_dir, "Foo-1.0", "HandlerManifest.json")))
+
+    def test_extract_should_not_write_outside_of_the_target_directory(self):
+        package = self._create_package("Foo-1.0.zip", {"../../evil.sh": b"evil", "/abs.sh": b"abs"})
+        target = os.path.join(self.tmp_dir, "Foo-1.0")
+
+        ExtensionPackageStore().extract(package, target)
+
+        self.assertEqual(sorted(["evil.sh", "abs.sh"]), sorted(os.listdir(target)))
+
+    def test_extract_should_copy_the_files_when_hard_links_are_not_supported(self):
+        package = self._create_package("Foo-1.0.zip", {"HandlerManifest.json": b"[]"})
+        target = os.path.join(self.tmp_dir, "Foo-1.0")
+
+        with patch("azurelinuxagent.ga.extension_package_store.os.link", side_effect=OSError(18, "Invalid cross-device link")):
+            ExtensionPackageStore().extract(package, target)
+
+        self.assertEqual(b"[]", self._read(os.path.join(target, "HandlerManifest.json")))
+        self.assertEqual(1, os.stat(os.path.join(target, "HandlerManifest.json")).st_nlink)
+
+    def test_collect_garbage_should_remove_only_the_objects_that_are_not_referenced(self):
+        v1 = self._create_package("Foo-1.0.zip", {"HandlerManifest.json": b"[1]", "bin/enable.sh": b"echo enable"})
+        v2 = self._create_package("Foo-2.0.zip", {"HandlerManifest.json": b"[2]", "bin/enable.sh": b"echo enable"})
+        target1 = os.path.join(self.tmp_dir, "Foo-1.0")
+        target2 = os.path.join(self.tmp_dir, "Foo-2.0")
+        store = ExtensionPackageStore()
+        store.extract(v1, target1)
+        store.extract(v2, target2)
+
+        self.assertEqual(0, store.collect_garbage(), "No objects should be removed while all the handlers exist")
+
+        shutil.rmtree(target1)
+        self.assertEqual(1, store.collect_garbage(), "Only the manifest of version 1.0 should have been removed")
+        self.assertEqual(2, os.stat(os.path.join(target2, "bin", "enable.sh")).st_nlink)
+
+        # the package was removed from the store, so it is decompressed again
+        store.extract(v1, target1)
+        self.assertEqual(b"[1]", self._read(os.path.join(target1, "HandlerManifest.json")))
+        self.assertEqual(3, os.stat(os.path.join(target2, "bin", "enable.sh")).st_nlink)
@@ -332,6 +332,43 @@ class TestExtHandlers(AgentTestCase):
                             self.assertEqual(ext_handler.status, heartbeat_with_message().get('status'),
                                              "Extension handler statuses don't match")
 
+    def test_collect_ext_status_should_parse_only_the_status_files_that_changed(self):
+        # 50 handlers with 10 multi-config extensions each
+        handlers = []
+        for i in range(50):
+            handler = Extension(name="Publisher.Handler{0}".format(i))
+            handler.version = "1.0.0"
+            handler.supports_multi_config = True
+            handler_i = ExtHandlerInstance(handler, WireProtocol("1.2.3.4"))
+            fileutil.mkdir(handler_i.get_status_dir())
+            for j in range(10):
+                extension = ExtensionSettings(name="extension{0}".format(j), sequenceNumber=3)
+                handler.settings.append(extension)
+                status = [{"status": {"status": "success", "code": 0, "substatus": [{"name": "sub{0}".format(k), "status": "success", "code": 0} for k in range(10)]}}]
+                fileutil.write_file(os.path.join(handler_i.get_status_dir(), "{0}.3.status".format(extension.name)), json.dumps(status))
+            handlers.append((handler, handler_i))
+
+        def collect_ext_status():
+            with patch("azurelinuxagent.ga.exthandlers.json.loads", wraps=json.loads) as mock_loads:
+                statuses = [handler_i.collect_ext_status(extension) for handler, handler_i in handlers for extension in handler.settings]
+            return statuses, mock_loads.call_count
+
+        statuses, parse_count = collect_ext_status()
+        self.assertEqual(500, parse_count, "All the status files should have been parsed on the first pass")
+        self.assertTrue(all(s.status == "success" and len(s.substatusList) == 10 for s in statuses))
+
+        statuses, parse_count = collect_ext_status()
+        self.assertEqual(0, parse_count, "No status files changed, none should have been parsed")
+        self.assertTrue(all(s.status == "success" and len(s.substatusList) == 10 for s in statuses))
+
+        handler, handler_i = handlers[7]
+        fileutil.write_file(os.path.join(handler_i.get_status_dir(), "extension2.3.status"), json.dumps([{"status": {"status": "error", "code": 1}}]))
+
+        statuses, parse_count = collect_ext_status()
+        self.assertEqual(1, parse_count, "Only the status file that changed should have been parsed")
+        self.assertEqual("error", statuses[7 * 10 + 2].status)
+        self.assertEqual(499, len([s for s in statuses if s.status == "success"]))
+
 class LaunchCommandTestCase(AgentTestCase):
     """
     Test cases for launch_command
@@ -431,48 +468,41 @@ with open("{2}", "w") as file:
 
 '''.format(stdout, stderr, signal_file))
 
-        # mock time.sleep to wait for the signal file (launch_command implements the time out using polling and sleep)
-        def sleep(seconds):
-            if not os.path.exists(signal_file):
-                sleep.original_sleep(seconds)
-        sleep.original_sleep = time.sleep
-
-        timeout = 60
+        # launch_command waits for the process to complete (or time out) without polling, so use a short timeout
+        timeout = 2
 
         start_time = time.time()
 
-        with patch("time.sleep", side_effect=sleep, autospec=True) as mock_sleep:  # pylint: disable=redefined-outer-name
-
-            with self.assertRaises(ExtensionError) as context_manager:
-                self.ext_handler_instance.launch_command(command, timeout=timeout, extension_error_code=extension_error_code)
+        with self.assertRaises(ExtensionError) as context_manager:
+            self.ext_handler_instance.launch_command(command, timeout=timeout, extension_error_code=extension_error_code)
 
-            # the command name and its output should be part of the message
-            message = str(context_manager.exception)
-            command_full_path = os.path.join(self.tmp_dir, command.lstrip(os.path.sep))
-            self.assertRegex(message, r"Timeout\(\d+\):\s+{0}\s+{1}".format(command_full_path, LaunchCommandTestCase._output_regex(stdout, stderr)))
+        # the command name and its output should be part of the message
+        message = str(context_manager.exception)
+        command_full_path = os.path.join(self.tmp_dir, command.lstrip(os.path.sep))
+        self.assertRegex(message, r"Timeout\(\d+\):\s+{0}\s+{1}".format(command_full_path, LaunchCommandTestCase._output_regex(stdout, stderr)))
 
-            # the exception code should be as specified in the call to launch_command
-            self.assertEqual(context_manager.exception.code, extension_error_code)
+        # the exception code should be as specified in the call to launch_command
+        self.assertEqual(context_manager.exception.code, extension_error_code)
 
-            # the timeout period should have elapsed
-            self.assertGreaterEqual(mock_sleep.call_count, timeout)
+        # the timeout period should have elapsed
+        self.assertGreaterEqual(time.time() - start_time, timeout)
 
-            # The command should have been terminated.
-            # The /proc file system may still include the process when we do this check so we try a few times after a short delay; note that we
-            # are mocking sleep, so we need to use the original implementation.
-            terminated = False
-            i = 0
-            while not terminated and i < 4:
-                if not LaunchCommandTestCase._find_process(command):
-                    terminated = True
-                else:
-                    sleep.original_sleep(0.25)
-                i += 1
+        # The command should have been terminated.
+        # The /proc file system may still include the process when we do this check so we try a few times after a short delay (note that
+        # time.sleep is mocked by this test class, so we use mock_sleep to wait for the actual delay).
+        terminated = False
+        i = 0
+        while not terminated and i < 4:
+            if not LaunchCommandTestCase._find_process(command):
+                terminated = True
+            else:
+                mock_sleep(0.25)
+            i += 1
 
-            self.assertTrue(terminated, "The command was not terminated")
+        self.assertTrue(terminated, "The command was not terminated")
 
         # as a check for the test itself, verify it completed in just a few seconds
-        self.assertLessEqual(time.time() - start_time, 5)
+        self.assertLessEqual(time.time() - start_time, timeout + 5)
 
     def test_it_should_raise_an_exception_when_the_command_fails(self):
         extension_error_code = 2345
@@ -0,0 +1,30 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import time
+
+from azurelinuxagent.ga import goal_state_polling
+from azurelinuxagent.ga.goal_state_polling import GoalStatePollingScheduler
+from tests.lib.tools import AgentTestCase, patch
+
+
+class TestGoalStatePollingScheduler(AgentTestCase):
+    def test_it_should_use_the_minimum_period_during_the_fast_polling_window(self):
+        scheduler = GoalStatePollingScheduler(max_period=30)
+
+        self.assertEqual([6, 6, 6], [scheduler.get_next_period(6) for _ in range(3)])
+
+    def test_it_should_back_off_up_to_the_maximum_period_when_the_goal_state_is_stable(self):
+        scheduler = GoalStatePollingScheduler(max_period=30)
+        scheduler.get_next_period(6)
+
+        with patch("azurelinuxagent.ga.goal_state_polling.time.time", return_value=time.time() + goal_state_polling.FAST_POLLING_DURATION_IN_SECONDS + 1):
+            self.assertEqual([12, 24, 30, 30], [scheduler.get_next_period(6) for _ in range(4)])
+
+            scheduler.on_goal_state_activity()
+            self.assertEqual(6, scheduler.get_next_period(6), "The period should go back to the minimum after a change in the goal state")
+
+    def test_it_should_not_back_off_when_the_maximum_period_is_smaller_than_the_minimum(self):
+        scheduler = GoalStatePollingScheduler(max_period=3)
+
+        with patch("azurelinuxagent.ga.goal_state_polling.time.time", return_value=time.time() + goal_state_polling.FAST_POLLING_DURATION_IN_SECONDS + 1):
+            self.assertEqual([6, 6, 6], [scheduler.get_next_period(6) for _ in range(3)])
@@ -0,0 +1,136 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the Apache License.
+import json
+import os
+
+from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.ga.handler_state_store import HandlerStateStore, HANDLER_STATE_JOURNAL_FILE_NAME
+from tests.lib.tools import AgentTestCase, patch
+
+
+class TestHandlerStateStore(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.state_dir = os.path.join(self.tmp_dir, "Foo-1.0", "config")
+        self.handler_state = os.path.join(self.state_dir, "HandlerState")
+        self.handler_status = os.path.join(self.state_dir, "HandlerStatus")
+        self.journal = os.path.join(self.tmp_dir, HANDLER_STATE_JOURNAL_FILE_NAME)
+
+    def test_set_should_create_the_state_file_and_its_directory(self):
+        store = HandlerStateStore()
+
+        store.set(self.handler_state, "Installed")
+
+        self.assertEqual("Installed", fileutil.read_file(self.handler_state))
+        self.assertEqual("Installed", store.get(self.handler_state))
+
+    def test_get_should_return_the_default_when_the_file_does_not_exist(self):
+        self.assertEqual("NotInstalled", HandlerStateStore().get(self.handler_state, "NotInstalled"))
+
+    def test_get_should_return_the_contents_of_files_modified_by_other_processes(self):
+        store = HandlerStateStore()
+        store.set(self.handler_state, "Installed")
+
+        fileutil.write_file(self.handler_state, "Enabled and modified")
+
+        self.assertEqual("Enabled and modified", store.get(self.handler_state))
+
+    def test_set_should_not_write_the_file_when_its_contents_do_not_change(self):
+        store = HandlerStateStore()
+        store.set(self.handler_state, "Enabled")
+
+        with patch("azurelinuxagent.common.utils.fileutil.write_file") as write_file:
+            store.set(self.handler_state, "Enabled")
+            self.assertEqual(0, write_file.call_count, "The unchanged state should not have been written")
+
+            store.set(self.handler_state, "Installed")
+            self.assertEqual(1, write_file.call_count, "The new state should have been written")
+
+    def test_changes_within_a_transaction_should_be_written_when_the_transaction_completes(self):
+        store = HandlerStateStore()
+
+        with patch("azurelinuxagent.ga.handler_state_store.os.fsync", wraps=os.fsync) as fsync:
+            with store.transaction():
+                store.set(self.handler_state, "Installed")
+                with store.transaction():
+                    store.set(self.handler_state, "Enabled")
+                    store.set(self.handler_status, '{"status": "Ready"}')
+                self.assertFalse(os.path.exists(self.handler_state), "The state should not be written before the outermost transaction completes")
+                self.assertEqual("Enabled", store.get(self.handler_state), "The pending state should be visible within the transaction")
+
+        self.assertEqual(1, fsync.call_count, "The journal should have been synced once per transaction")
+        self.assertEqual("Enabled", fileutil.read_file(self.handler_state))
+        self.assertEqual('{"status": "Ready"}', fileutil.read_file(self.handler_status))
+        self.assertFalse(os.path.exists(self.journal), "The journal should have been removed")
+
+    def test_changes_within_a_transaction_should_be_written_when_there_is_an_exception(self):
+        store = HandlerStateStore()
+
+        with self.assertRaises(Exception):
+            with store.transaction():
+                store.set(self.handler_state, "Enabled")
+                raise Exception("Error processing the goal state")
+
+        self.assertEqual("Enabled", fileutil.read_file(self.handler_state))
+
+    def test_discard_should_drop_the_pending_changes_for_a_directory(self):
+        store = HandlerStateStore()
+        other_state = os.path.join(self.tmp_dir, "Bar-1.0", "config", "HandlerState")
+
+        with store.transaction():
+            store.set(self.handler_state, "Enabled")
+            store.set(other_state, "Enabled")
+            store.discard(os.path.join(self.tmp_dir, "Foo-1.0"))
+
+        self.assertFalse(os.path.exists(self.handler_state), "The changes to the discarded directory should not have been written")
+        self.assertEqual("Enabled", fileutil.read_file(other_state))
+
+    def test_discard_should_drop_the_index_entries_for_a_directory(self):
+        store = HandlerStateStore()
+        other_state = os.path.join(self.tmp_dir, "Bar-1.0", "config", "HandlerState")
+        store.set(self.handler_state, "Enabled")
+        store.set(other_state, "Enabled")
+
+        store.discard(os.path.join(self.tmp_dir, "Foo-1.0"))
+
+        with patch("azurelinuxagent.common.utils.fileutil.read_file", wraps=fileutil.read_file) as read_file:
+            self.assertEqual("Enabled", store.get(other_state))
+            self.assertEqual(0, read_file.call_count, "The index entries of other directories should have been kept")
+            self.assertEqual("Enabled", store.get(self.handler_state))
+            self.assertEqual(1, read_file.call_count, "The state of the discarded directory should have been read from disk")
+
+    def test_recover_should_replay_the_changes_made_before_the_agent_stopped(self):
+        other_state = os.path.join(self.tmp_dir, "Bar-1.0", "config", "HandlerState")
+        store = HandlerStateStore()
+
+        # the agent stops while processing the goal state, after some handlers have been processed
+        transaction = store.transaction()
+        transaction.__enter__()  # pylint: disable=no-member
+        store.set(self.handler_state, "Installed")
+        store.set(other_state, "Enabled")
+        store.set(self.handler_state, "Enabled")
+        store.discard(os.path.join(self.tmp_dir, "Bar-1.0"))
+        self.assertFalse(os.path.exists(self.handler_state), "The state should not be written before the transaction completes")
+
+        HandlerStateStore().recover()
+        store._close_journal()  # pylint: disable=protected-access
+
+        self.assertEqual("Enabled", fileutil.read_file(self.handler_state), "The last state of the handler should have been recovered")
+        self.assertFalse(os.path.exists(other_state), "The changes to the discarded directory should not have been recovered")
+        self.assertFalse(os.path.exists(self.journal), "The journal should have been removed")
+
+    def test_recover_should_ignore_an_incomplete_record(self):
+        fileutil.write_file(self.journal, json.dumps([self.handler_state, "Enabled"]) + '\n["' + self.handler_status + '", "{\\"status')
+
+        HandlerStateStore().recover()
+
+        self.assertEqual("Enabled", fileutil.read_file(self.handler_state))
+        self.assertFalse(os.path.exists(self.handler_status), "The incomplete record should have been ignored")
+        self.assertFalse(os.path.exists(self.journal), "The journal should have been removed")
+
+    def test_recover_should_remove_an_invalid_journal(self):
+        fileutil.write_file(self.journal, "[[ truncated")
+
+        HandlerStateStore().recover()
+
+        self.assertFalse(os.path.exists(self.journal), "The journal should have been removed")
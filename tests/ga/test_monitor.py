@@ -27,11 +27,12 @@ from azurelinuxagent.common.event import EVENTS_DIRECTORY
 from azurelinuxagent.common.protocol.healthservice import HealthService
 from azurelinuxagent.common.protocol.util import ProtocolUtil
 from azurelinuxagent.common.protocol.wire import WireProtocol
+from azurelinuxagent.common.utils import restutil
 from azurelinuxagent.ga.cpucontroller import CpuControllerV1
 from azurelinuxagent.ga.memorycontroller import MemoryControllerV1
 from azurelinuxagent.ga.monitor import get_monitor_handler, PeriodicOperation, SendImdsHeartbeat, \
     ResetPeriodicLogMessages, SendHostPluginHeartbeat, PollResourceUsage, \
-    ReportNetworkErrors, ReportNetworkConfigurationChanges, PollSystemWideResourceUsage
+    ReportNetworkErrors, ReportNetworkConfigurationChanges, PollSystemWideResourceUsage, ReportHttpRequestStatistics
 from tests.lib.mock_wire_protocol import mock_wire_protocol, MockHttpResponse
 from tests.lib.http_request_predicates import HttpRequestPredicates
 from tests.lib.wire_protocol_data import DATA_FILE
@@ -77,6 +78,7 @@ class MonitorHandlerTestCase(AgentTestCase):
                                 expected_operations = [
                                     PollResourceUsage.__name__,
                                     PollSystemWideResourceUsage.__name__,
+                                    ReportHttpRequestStatistics.__name__,
                                     ReportNetworkErrors.__name__,
                                     ResetPeriodicLogMessages.__name__,
                                     SendHostPluginHeartbeat.__name__,
@@ -178,6 +180,30 @@ class ResetPeriodicLogMessagesOperationTestCase(AgentTestCase, HttpRequestPredic
         self.assertEqual(0, len(logger.DEFAULT_LOGGER.periodic_messages), "The monitor thread did not reset the periodic log messages")
 
 
+class ReportHttpRequestStatisticsOperationTestCase(AgentTestCase):
+    def test_it_should_report_the_http_request_statistics_as_metrics(self):
+        restutil.HttpRequestStatistics.reset()
+        for _ in range(10):
+            restutil.HttpRequestStatistics.record(restutil.HttpEndpoint.WireServer, restutil.HttpOperation.GoalState, 0.2, 0, response=MockHttpResponse(status=200))
+        restutil.HttpRequestStatistics.record(restutil.HttpEndpoint.WireServer, restutil.HttpOperation.GoalState, 3, 0, response=MockHttpResponse(status=429), is_retry=True)
+
+        with patch("azurelinuxagent.ga.monitor.report_metric") as report_metric:
+            ReportHttpRequestStatistics().run()
+
+        metrics = dict(((args[1], args[2]), args[3]) for args, _ in report_metric.call_args_list)
+        self.assertTrue(all(args[0] == ReportHttpRequestStatistics.CATEGORY for args, _ in report_metric.call_args_list))
+        self.assertEqual({
+            ("Requests", "WireServer/GoalState"): 11,
+            ("Errors", "WireServer/GoalState"): 1,
+            ("Retries", "WireServer/GoalState"): 1,
+            ("Throttled", "WireServer/GoalState"): 1,
+            ("Latency P50 (ms)", "WireServer/GoalState"): 250,
+            ("Latency P95 (ms)", "WireServer/GoalState"): 5000,
+            ("Latency P99 (ms)", "WireServer/GoalState"): 5000,
+        }, metrics)
+        self.assertEqual({}, restutil.HttpRequestStatistics.get(), "The statistics should have been reset after reporting them")
+
+
 @patch('azurelinuxagent.common.osutil.get_osutil')
 @patch('azurelinuxagent.common.protocol.util.get_protocol_util')
 @patch("azurelinuxagent.common.protocol.healthservice.HealthService._report")
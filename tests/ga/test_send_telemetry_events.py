@@ -26,10 +26,12 @@ from datetime import datetime, timedelta
 
 from mock import MagicMock, Mock, patch, PropertyMock
 
-from azurelinuxagent.common import logger
+from azurelinuxagent.common import conf, logger
 from azurelinuxagent.common.datacontract import get_properties
-from azurelinuxagent.common.event import WALAEventOperation, EVENTS_DIRECTORY
-from azurelinuxagent.common.exception import HttpError, ServiceStoppedError
+from azurelinuxagent.common.event import WALAEventOperation, EVENTS_DIRECTORY, TELEMETRY_EVENT_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID, \
+    TELEMETRY_LOG_EVENT_ID, TELEMETRY_LOG_PROVIDER_ID, TELEMETRY_METRICS_EVENT_ID
+from azurelinuxagent.common.event_spool import EVENT_SPOOL_DIRECTORY, EventSpool, SpoolPosition, get_event_spool
+from azurelinuxagent.common.exception import HttpError, ProtocolError, ServiceStoppedError
 from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.osutil.factory import get_osutil
 from azurelinuxagent.common.protocol.util import ProtocolUtil
@@ -40,7 +42,7 @@ from azurelinuxagent.common.utils import restutil, fileutil
 from azurelinuxagent.common.version import CURRENT_VERSION, DISTRO_NAME, DISTRO_VERSION, AGENT_VERSION, CURRENT_AGENT, \
     DISTRO_CODE_NAME
 from azurelinuxagent.ga.collect_telemetry_events import _CollectAndEnqueueEvents
-from azurelinuxagent.ga.send_telemetry_events import get_send_telemetry_events_handler
+from azurelinuxagent.ga.send_telemetry_events import get_send_telemetry_events_handler, _TelemetryEventQueue
 from tests.ga.test_monitor import random_generator
 from tests.lib.mock_wire_protocol import MockHttpResponse, mock_wire_protocol
 from tests.lib.http_request_predicates import HttpRequestPredicates
@@ -261,6 +263,155 @@ class TestSendTelemetryEventsHandler(AgentTestCase, HttpRequestPredicates):
             event_orders = re.findall(r'<Event id=\"(\d+)\"><!\[CDATA\[]]></Event>', event_body.decode('utf-8'))
             self.assertEqual(sorted(event_orders), event_orders, "Events not ordered correctly")
 
+    def test_it_should_commit_the_spooled_events_after_sending_them(self):
+        spool = get_event_spool()
+        spool.append(b"an event")
+        position = spool.read()[-1].position
+
+        with self._create_send_telemetry_events_handler() as telemetry_handler:
+            telemetry_handler.enqueue_event(TelemetryEvent(), spool_position=position)
+            TestSendTelemetryEventsHandler._stop_handler(telemetry_handler)
+
+            self.assertEqual(1, len(telemetry_handler.event_calls), "The event should have been sent")
+        self.assertEqual([], EventSpool(os.path.join(conf.get_lib_dir(), EVENT_SPOOL_DIRECTORY)).read(), "The event should have been committed")
+
+    def test_it_should_not_commit_the_spooled_events_when_they_are_not_sent(self):
+        spool = get_event_spool()
+        spool.append(b"an event")
+        position = spool.read()[-1].position
+
+        with self._create_send_telemetry_events_handler() as telemetry_handler:
+            with patch("azurelinuxagent.common.protocol.wire.WireClient._send_encoded_event", side_effect=ProtocolError("Failed to send events")):
+                telemetry_handler.enqueue_event(TelemetryEvent(), spool_position=position)
+                TestSendTelemetryEventsHandler._stop_handler(telemetry_handler)
+
+        self.assertEqual([b"an event"], [r.data for r in spool.read()], "The spool should have been rewound")
+        self.assertEqual([b"an event"], [r.data for r in EventSpool(os.path.join(conf.get_lib_dir(), EVENT_SPOOL_DIRECTORY)).read()], "The event should not have been committed")
+
+    def test_it_should_not_send_the_spooled_events_read_before_rewinding_the_spool(self):
+        spool = get_event_spool()
+        spool.append(b"an event")
+        stale_position = spool.read()[-1].position
+        spool.rewind()
+        position = spool.read()[-1].position
+
+        with self._create_send_telemetry_events_handler(start_thread=False) as telemetry_handler:
+            telemetry_handler.enqueue_event(TelemetryEvent(eventId=1), spool_position=stale_position)
+            telemetry_handler.enqueue_event(TelemetryEvent(eventId=2), spool_position=position)
+            telemetry_handler.start()
+            TestSendTelemetryEventsHandler._stop_handler(telemetry_handler)
+
+            self.assertEqual(1, len(telemetry_handler.event_calls), "The events should have been sent")
+            event_ids = re.findall(r'<Event id=\"(\d+)\">', telemetry_handler.event_calls[0][1].decode('utf-8'))
+            self.assertEqual(["2"], event_ids, "Only the event read after rewinding should have been sent")
+
+    def test_it_should_drop_the_spooled_events_that_fail_to_be_sent_repeatedly(self):
+        spool = get_event_spool()
+        spool.append(b"an event")
+
+        with self._create_send_telemetry_events_handler(start_thread=False) as telemetry_handler:
+            with patch("azurelinuxagent.ga.send_telemetry_events.SendTelemetryEventsHandler._MAX_SPOOLED_BATCH_FAILURES", 3):
+                with patch("azurelinuxagent.common.protocol.wire.WireClient._send_encoded_event", side_effect=ProtocolError("Failed to send events")):
+                    with patch("azurelinuxagent.ga.send_telemetry_events.add_event") as mock_add_event:
+                        for _ in range(3):
+                            records = spool.read()
+                            self.assertEqual([b"an event"], [r.data for r in records], "The event should have been read again")
+                            telemetry_handler.enqueue_event(TelemetryEvent(), spool_position=records[-1].position)
+                            telemetry_handler._send_events_in_queue()
+
+        self.assertEqual([], spool.read(), "The event should have been committed after the last failure")
+        self._assert_error_event_reported(mock_add_event, "dropping 1 events", operation=WALAEventOperation.DroppedTelemetryEvents)
+
+    @staticmethod
+    def _create_event(provider_id, event_id, message):
+        event = TelemetryEvent(event_id, provider_id)
+        event.parameters.append(TelemetryEventParam(GuestAgentExtensionEventsSchema.Message, message))
+        return event
+
+    def test_it_should_send_the_events_with_higher_priority_first(self):
+        log = self._create_event(TELEMETRY_LOG_PROVIDER_ID, TELEMETRY_LOG_EVENT_ID, "log")
+        metric = self._create_event(TELEMETRY_EVENT_PROVIDER_ID, TELEMETRY_METRICS_EVENT_ID, "metric")
+        agent_event = self._create_event(TELEMETRY_EVENT_PROVIDER_ID, TELEMETRY_EVENT_EVENT_ID, "agent event")
+
+        queue = _TelemetryEventQueue(max_memory=1024 ** 2)
+        for event in [log, metric, agent_event]:
+            queue.put(event, None)
+
+        self.assertEqual([agent_event, metric, log], [queue.get_nowait()[0] for _ in range(3)])
+        self.assertIsNone(queue.get_nowait(), "The queue should be empty")
+
+    def test_it_should_drop_the_oldest_events_with_the_lowest_priority_when_the_queue_is_full(self):
+        logs = [self._create_event(TELEMETRY_LOG_PROVIDER_ID, TELEMETRY_LOG_EVENT_ID, "log {0}".format(i)) for i in range(3)]
+        agent_events = [self._create_event(TELEMETRY_EVENT_PROVIDER_ID, TELEMETRY_EVENT_EVENT_ID, "event {0}".format(i)) for i in range(2)]
+
+        with patch("azurelinuxagent.ga.send_telemetry_events._get_event_size", return_value=10):
+            queue = _TelemetryEventQueue(max_memory=30)
+            for event in logs:
+                queue.put(event, None)
+            for event in agent_events:
+                queue.put(event, None)
+
+            self.assertEqual(agent_events + [logs[2]], [queue.get_nowait()[0] for _ in range(3)])
+            self.assertEqual([0, 0, 2], queue.get_and_reset_dropped_counts())
+
+            # when all the queued events have higher priority, the new event is dropped
+            metric = self._create_event(TELEMETRY_EVENT_PROVIDER_ID, TELEMETRY_METRICS_EVENT_ID, "metric")
+            for event in agent_events + [metric]:
+                queue.put(event, None)
+            queue.put(logs[0], None)
+
+            self.assertEqual(agent_events + [metric], [queue.get_nowait()[0] for _ in range(3)])
+            self.assertIsNone(queue.get_nowait(), "The queue should be empty")
+            self.assertEqual([0, 0, 1], queue.get_and_reset_dropped_counts())
+
+    def test_it_should_not_drop_spooled_events_when_the_queue_is_full(self):
+        spooled_logs = [self._create_event(TELEMETRY_LOG_PROVIDER_ID, TELEMETRY_LOG_EVENT_ID, "spooled log {0}".format(i)) for i in range(3)]
+        log = self._create_event(TELEMETRY_LOG_PROVIDER_ID, TELEMETRY_LOG_EVENT_ID, "log")
+        agent_events = [self._create_event(TELEMETRY_EVENT_PROVIDER_ID, TELEMETRY_EVENT_EVENT_ID, "event {0}".format(i)) for i in range(3)]
+        positions = [SpoolPosition(1, i) for i in range(3)]
+
+        with patch("azurelinuxagent.ga.send_telemetry_events._get_event_size", return_value=10):
+            queue = _TelemetryEventQueue(max_memory=40)
+            self.assertEqual([True, True, False], [queue.put(e, p) for e, p in zip(spooled_logs, positions)], "The spooled events should be limited to half of the queue")
+            self.assertTrue(queue.put(log, None))
+            for event in agent_events:
+                queue.put(event, None)
+
+            self.assertEqual(agent_events[1:] + spooled_logs[0:2], [queue.get_nowait()[0] for _ in range(4)], "Only the events that are not spooled should have been dropped")
+            self.assertIsNone(queue.get_nowait(), "The queue should be empty")
+            self.assertEqual([1, 0, 1], queue.get_and_reset_dropped_counts())
+
+    def test_it_should_stop_reading_the_event_spool_when_the_queue_is_full(self):
+        spool = get_event_spool()
+        for i in range(5):
+            spool.append(json.dumps(get_properties(self._create_event(TELEMETRY_LOG_PROVIDER_ID, TELEMETRY_LOG_EVENT_ID, "log {0}".format(i)))).encode("utf-8"))
+
+        with patch("azurelinuxagent.ga.send_telemetry_events._get_event_size", return_value=10):
+            with patch("azurelinuxagent.common.conf.get_max_telemetry_queue_memory", return_value=40):
+                with self._create_send_telemetry_events_handler(start_thread=False) as telemetry_handler:
+                    with patch("azurelinuxagent.ga.collect_telemetry_events._CollectAndEnqueueEvents._MAX_SPOOLED_EVENTS_PER_READ", 3):
+                        collector = _CollectAndEnqueueEvents(telemetry_handler)
+                        sent = []
+                        for _ in range(3):
+                            collector._process_spooled_events(Mock())
+                            with patch.object(telemetry_handler._protocol, "report_event", side_effect=lambda events: sent.extend(events) or True):
+                                telemetry_handler._send_events_in_queue()
+
+        self.assertEqual(["log {0}".format(i) for i in range(5)], [e.parameters[0].value for e in sent], "All the spooled events should have been sent once, in order")
+        self.assertEqual([], spool.read(), "All the spooled events should have been committed")
+
+    def test_it_should_report_the_dropped_events(self):
+        with patch("azurelinuxagent.ga.send_telemetry_events.add_event") as mock_add_event:
+            with patch("azurelinuxagent.ga.send_telemetry_events._get_event_size", return_value=10):
+                with patch("azurelinuxagent.common.conf.get_max_telemetry_queue_memory", return_value=10):
+                    with self._create_send_telemetry_events_handler(start_thread=False) as telemetry_handler:
+                        for i in range(3):
+                            telemetry_handler.enqueue_event(self._create_event(TELEMETRY_LOG_PROVIDER_ID, TELEMETRY_LOG_EVENT_ID, "log {0}".format(i)))
+                        telemetry_handler.start()
+                        TestSendTelemetryEventsHandler._stop_handler(telemetry_handler)
+
+            self._assert_error_event_reported(mock_add_event, "dropped events: Logs: 2", operation=WALAEventOperation.DroppedTelemetryEvents)
+
     def test_send_telemetry_events_should_report_event_if_wireserver_returns_http_error(self):
 
         test_str = "A test exception, Guid: {0}".format(str(uuid.uuid4()))
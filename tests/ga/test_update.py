@@ -10,9 +10,11 @@ import os
 import random
 import re
 import shutil
+import signal
 import stat
 import sys
 import tempfile
+import threading
 import time
 import unittest
 import uuid
@@ -42,7 +44,7 @@ from azurelinuxagent.ga.exthandlers import ExtHandlersHandler, ExtHandlerInstanc
 from azurelinuxagent.ga.update import  \
     get_update_handler, ORPHAN_POLL_INTERVAL, ORPHAN_WAIT_INTERVAL, \
     CHILD_LAUNCH_RESTART_MAX, CHILD_HEALTH_INTERVAL, GOAL_STATE_PERIOD_EXTENSIONS_DISABLED, UpdateHandler, \
-    READONLY_FILE_GLOBS, ExtensionsSummary
+    READONLY_FILE_GLOBS, ExtensionsSummary, HTTP_REQUEST_STATISTICS_FILE
 from tests.lib.mock_firewall_command import MockIpTables, MockFirewallCmd
 from tests.lib.mock_update_handler import mock_update_handler
 from tests.lib.mock_wire_protocol import mock_wire_protocol, MockHttpResponse
@@ -860,6 +862,11 @@ class TestUpdate(UpdateTestCase):
         self.assertFalse(self.update_handler.is_running)
         self.assertFalse(os.path.isfile(self.update_handler._sentinel_file_path()))
 
+    def test_shutdown_should_flush_the_goal_state_history(self):
+        with patch("azurelinuxagent.common.utils.archive.GoalStateHistoryWriter.flush") as flush:
+            self.update_handler._shutdown()
+        self.assertEqual(1, flush.call_count, "The goal state history should have been flushed")
+
     def test_shutdown_ignores_missing_sentinel_file(self):
         self.assertFalse(os.path.isfile(self.update_handler._sentinel_file_path()))
         self.update_handler._shutdown()
@@ -1311,6 +1318,16 @@ class UpdateHandlerRunTestCase(AgentTestCase):
         update_handler = self._test_run(emit_restart_event=Mock())
         self.assertEqual(1, update_handler._emit_restart_event.call_count)
 
+    def test_run_should_dump_the_http_request_statistics_on_sigusr2(self):
+        original_handler = signal.getsignal(signal.SIGUSR2)
+        try:
+            self._test_run()
+            os.kill(os.getpid(), signal.SIGUSR2)
+        finally:
+            signal.signal(signal.SIGUSR2, original_handler)
+
+        self.assertTrue(os.path.exists(os.path.join(conf.get_lib_dir(), HTTP_REQUEST_STATISTICS_FILE)), "The statistics were not written")
+
 
 class TestAgentUpgrade(UpdateTestCase):
 
@@ -2471,6 +2488,42 @@ class GoalStateIntervalTestCase(AgentTestCase):
                     self.assertEqual(goal_state_period, update_handler._goal_state_period, "Expected the regular goal state period when the goal state does not converge")
 
 
+    def test_update_handler_should_poll_using_the_goal_state_period_after_a_new_goal_state(self):
+        with _mock_exthandlers_handler([ExtensionStatusValue.success]) as exthandlers_handler:
+            update_handler = _create_update_handler()
+            # pretend that the goal state has been stable for a while and the polling period backed off
+            update_handler._goal_state_polling_scheduler._fast_polling_until = 0
+            update_handler._goal_state_polling_scheduler._period = 30
+            update_handler._process_goal_state(exthandlers_handler, Mock(), Mock())
+
+            with patch.object(update_handler._goal_state_refresh_requested, "wait") as wait:
+                update_handler._wait_for_next_iteration()
+
+            self.assertEqual(update_handler._goal_state_period, wait.call_args[0][0], "Expected the goal state period after a new goal state")
+
+    def test_wait_for_next_iteration_should_be_interrupted_by_sigusr1(self):
+        update_handler = get_update_handler()
+        original_handler = signal.getsignal(signal.SIGUSR1)
+        try:
+            update_handler._register_goal_state_refresh_handler()
+            update_handler._goal_state_period = 60
+            # the signal is delivered while waiting; the wait should end immediately
+            threading.Timer(0.1, lambda: os.kill(os.getpid(), signal.SIGUSR1)).start()
+            start_time = time.time()
+            update_handler._wait_for_next_iteration()
+            self.assertLess(time.time() - start_time, 30, "The wait should have been interrupted by the signal")
+            self.assertFalse(update_handler._goal_state_refresh_requested.wait(0), "The refresh request should have been consumed")
+
+            # a signal delivered while not waiting should make the next wait a no-op
+            os.kill(os.getpid(), signal.SIGUSR1)
+            start_time = time.time()
+            update_handler._wait_for_next_iteration()
+            self.assertLess(time.time() - start_time, 30, "The next iteration should have started immediately")
+            self.assertFalse(update_handler._goal_state_refresh_requested.wait(0), "The refresh request should have been consumed")
+        finally:
+            signal.signal(signal.SIGUSR1, original_handler)
+
+
 class ExtensionsSummaryTestCase(AgentTestCase):
     @staticmethod
     def _create_extensions_summary(extension_statuses):
@@ -90,7 +90,7 @@ def mock_update_handler(protocol,
                 with patch("azurelinuxagent.ga.remoteaccess.get_remote_access_handler", return_value=remote_access_handler):
                     with patch("azurelinuxagent.ga.update.conf.get_autoupdate_enabled", return_value=autoupdate_enabled):
                         with patch.object(UpdateHandler, "is_running", PropertyMock(side_effect=is_running)):
-                            with patch('azurelinuxagent.ga.update.time.sleep', side_effect=lambda _: mock_sleep(0.001)) as sleep:
+                            with patch('azurelinuxagent.ga.update.time.sleep', side_effect=lambda _: mock_sleep(0.001)):
                                 with patch('sys.exit', side_effect=lambda _: 0) as mock_exit:
                                     if not check_daemon_running:
                                         patch_object(UpdateHandler, "_check_daemon_running")
@@ -110,10 +110,15 @@ def mock_update_handler(protocol,
                                     def get_iterations():
                                         return iteration_count[0]
 
+                                    update_handler = get_update_handler()
+                                    # the main loop waits for the next iteration on this event
+                                    wait_patcher = patch.object(update_handler._goal_state_refresh_requested, "wait", side_effect=lambda _: mock_sleep(0.001))
+                                    wait = wait_patcher.start()
+                                    cleanup_functions.insert(0, wait_patcher.stop)
+
                                     def get_iterations_completed():
-                                        return sleep.call_count
+                                        return wait.call_count
 
-                                    update_handler = get_update_handler()
                                     update_handler.protocol_util.get_protocol = Mock(return_value=protocol)
                                     update_handler.get_exit_code = get_exit_code
                                     update_handler.get_iterations = get_iterations
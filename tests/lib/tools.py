@@ -35,7 +35,8 @@ import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.event as event
 import azurelinuxagent.common.logger as logger
 from azurelinuxagent.common.future import range  # pylint: disable=redefined-builtin
-from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.common.protocol import imds
+from azurelinuxagent.common.utils import filecache, fileutil, restutil
 from azurelinuxagent.common.version import PY_VERSION_MAJOR
 
 import tests
@@ -186,6 +187,10 @@ class AgentTestCase(unittest.TestCase):
         event.init_event_status(self.tmp_dir)
         event.init_event_logger(self.tmp_dir)
 
+        imds.clear_metadata_cache()
+        restutil.reset_wireserver_request_budget()
+        filecache.clear_parsed_file_cache()
+
     def tearDown(self):
         if not debug and self.tmp_dir is not None:
             shutil.rmtree(self.tmp_dir)
@@ -39,6 +39,7 @@ DVD.MountPoint = /mnt/cdrom/secure
 Debug.AgentCpuQuota = 50
 Debug.AgentCpuThrottledTimeThreshold = 120
 Debug.AgentMemoryQuota = 31457280
+Debug.ArtifactDownloadHedgeDelay = 5
 Debug.AutoUpdateHotfixFrequency = 14400
 Debug.AutoUpdateNormalFrequency = 86400
 Debug.CgroupCheckPeriod = 300
@@ -46,13 +47,23 @@ Debug.CgroupDisableOnProcessCheckFailure = True
 Debug.CgroupDisableOnQuotaCheckFailure = True
 Debug.CgroupLogMetrics = False
 Debug.EnableAgentMemoryUsageCheck = False
+Debug.EnableAsyncGoalStateHistory = False
 Debug.EnableCgroupV2ResourceLimiting = False
+Debug.EnableEventSpool = False
+Debug.EnableExtensionPackageStore = False
 Debug.EnableExtensionPolicy = True
 Debug.EnableFastTrack = True
 Debug.EnableGAVersioning = True
+Debug.EnableHttpKeepAlive = True
 Debug.EtpCollectionPeriod = 300
+Debug.ExtensionPackagePrefetchConcurrency = 4
+Debug.ExtensionProcessingConcurrency = 1
 Debug.FirewallRulesLogPeriod = 86400
 Debug.LogCollectorInitialDelay = 300
+Debug.MaxGoalStatePeriod = 30
+Debug.MaxTelemetryQueueMemory = 16777216
+Debug.SkipUnchangedExtensions = False
+Debug.StatusUploadHeartbeatPeriod = 60
 DetectScvmmEnv = False
 EnableOverProvisioning = True
 Extension.LogDir = /var/log/azure